@@ -11,6 +11,8 @@ from builtins import str
 # --movieLength = can specify the length of the output video (in seconds), then automatically
 #         calculate corresponding ips and fps based on the number of movie slices.
 # --skipComp = skip computing the metrics and generating plots, just use files from disk.
+# --nProcesses = the number of processes rendering frames, which are streamed to ffmpeg as they are made
+#         (or written to disk as png files, if ffmpeg is not available).
 #
 
 import os, argparse
@@ -134,13 +136,28 @@ def runSlices(opsimName, metadata, simdata, fields, bins, args, opsDb, verbose=F
     sliceformat = '%s0%dd' %('%', int(np.log10(len(movieslicer)))+1)
     # Get the telescope latitude info.
     lat_tele = Site(name='LSST').latitude_rad
-    # Run through the movie slicer slicePoints and generate plots at each point.
-    for i, ms in enumerate(movieslicer):
-        t = time.time()
-        slicenumber = sliceformat %(i)
-        if verbose:
-            print(slicenumber)
-        # Set up metrics.
+    # Set up the metrics and the opsim slicer once: the MovieBundleGroup then calculates the metric
+    # values for each (cumulative) frame in turn, adding only the new visits to the visit counts.
+    metricList, plotDictList = setupMetrics(opsimName, metadata, verbose=verbose)
+    opslicer = slicers.OpsimFieldSlicer(simDataFieldIdColName='opsimFieldId',
+                                        fieldIdColName='opsimFieldId')
+    # Set up metricBundles to combine metrics, plotdicts and slicer.
+    bundles = []
+    sqlconstraint = ''
+    for metric, plotDict in zip(metricList, plotDictList):
+        bundles.append(metricBundles.MetricBundle(metric, opslicer, constraint=sqlconstraint,
+                                                  metadata=metadata, runName=opsimName,
+                                                  plotDict=plotDict))
+    # Remove (default) stackers from bundles, because we've already run them above on the original data.
+    for mb in bundles:
+        mb.stackerList = []
+    moviegroup = metricBundles.MovieBundleGroup(bundles, movieslicer, verbose=verbose)
+    # Calculate horizon location.
+    horizonlon, horizonlat = addHorizon(lat_telescope=lat_tele)
+    frameInfo = {}
+
+    def setupFrame(i, ms):
+        # Update the time of the FilterColors metric, and the plot labels, for this frame.
         if args.movieStepsize != 0:
             tstep = args.movieStepsize
         else:
@@ -152,46 +169,46 @@ def runSlices(opsimName, metadata, simdata, fields, bins, args, opsDb, verbose=F
         # Opsim years are 365 days (not 365.25)
         years = int(times_from_start/365)
         days = times_from_start - years*365
-        plotlabel = 'Year %d Day %.4f' %(years, days)
-        # Set up metrics.
-        metricList, plotDictList = setupMetrics(opsimName, metadata, plotlabel=plotlabel,
-                                                t0=ms['slicePoint']['binRight'], tStep=tstep,
-                                                years=years, verbose=verbose)
-        # Identify the subset of simdata in the movieslicer 'data slice'
-        simdatasubset = simdata[ms['idxs']]
-        # Set up opsim slicer on subset of simdata provided by movieslicer
-        opslicer = slicers.OpsimFieldSlicer(simDataFieldIdColName='opsimFieldId',
-                                            fieldIdColName='opsimFieldId')
-        # Set up metricBundles to combine metrics, plotdicts and slicer.
-        bundles = []
-        sqlconstraint = ''
-        for metric, plotDict in zip(metricList, plotDictList):
-            bundles.append(metricBundles.MetricBundle(metric, opslicer, constraint=sqlconstraint,
-                                                      metadata=metadata, runName=opsimName,
-                                                      plotDict=plotDict))
-        # Remove (default) stackers from bundles, because we've already run them above on the original data.
-        for mb in bundles:
-            mb.stackerList = []
-        bundledict = metricBundles.makeBundlesDictFromList(bundles)
-        # Set up metricBundleGroup to handle metrics calculation + plotting
-        bg = metricBundles.MetricBundleGroup(bundledict, opsDb, outDir=args.outDir,
-                                             resultsDb=None, saveEarly=False)
-        # 'Hack' bundleGroup to just go ahead and run the metrics, without querying the database.
-        simData = simdatasubset
-        bg.fieldData = fields
-        bg.setCurrent(sqlconstraint)
-        bg.runCurrent(constraint = sqlconstraint, simData=simData)
-        # Plot data each metric, for this slice of the movie, adding slicenumber as a suffix for output plots.
+        frameInfo['plotlabel'] = 'Year %d Day %.4f' %(years, days)
+        _, framePlotDicts = setupMetrics(opsimName, metadata, plotlabel=frameInfo['plotlabel'],
+                                       years=years)
+        for mb, plotDict in zip(bundles, framePlotDicts):
+            mb.setPlotDict(plotDict)
+            if mb.metric.name == 'FilterColors':
+                mb.metric.t0 = ms['slicePoint']['binRight']
+                mb.metric.tStep = tstep
+
+    def frameData():
+        # Calculate the metric values for each frame, and collect what is needed to plot it.
+        t = time.time()
+        for i, ms in moviegroup.runFrames(simdata, fieldData=fields, setupFrame=setupFrame):
+            # Identify the subset of simdata in the movieslicer 'data slice'
+            simdatasubset = simdata[ms['idxs']]
+            obsnow = np.where(simdatasubset['observationStartMJD'] ==
+                              simdatasubset['observationStartMJD'].max())[0]
+            dt, t = dtime(t)
+            if verbose:
+                print('Ran slice %s of movieslicer in %f s' %(sliceformat %(i), dt))
+            yield {'plotlabel': frameInfo['plotlabel'],
+                   'metricValues': [mb.metricValues.copy() for mb in bundles],
+                   'plotDicts': [dict(mb.plotDict) for mb in bundles],
+                   'raCen': np.radians(np.mean(simdatasubset[obsnow]['observationStartLST'])),
+                   'moonRA': np.radians(np.mean(simdatasubset[obsnow]['moonRA'])),
+                   'moonDec': np.radians(np.mean(simdatasubset[obsnow]['moonDec'])),
+                   # Note that moonphase is 0-100 (translate to 0-1). 0=new.
+                   'moonPhase': np.mean(simdatasubset[obsnow]['moonPhase'])/100.}
+
+    def renderFrame(frame):
+        # Plot data each metric, for this slice of the movie.
         # Plotting here, rather than automatically via sliceMetric method because we're going to rotate the sky,
         #  and add extra legend info and figure text (for FilterColors metric).
         ph = plots.PlotHandler(outDir=args.outDir, figformat='png', dpi=72, thumbnail=False, savefig=False)
-        obsnow = np.where(simdatasubset['observationStartMJD'] ==
-                          simdatasubset['observationStartMJD'].max())[0]
-        raCen = np.radians(np.mean(simdatasubset[obsnow]['observationStartLST']))
-        # Calculate horizon location.
-        horizonlon, horizonlat = addHorizon(lat_telescope=lat_tele)
-        # Create the plot for each metric and save it (after some additional manipulation).
-        for mb in bundles:
+        raCen = frame['raCen']
+        figs = []
+        # Create the plot for each metric (after some additional manipulation).
+        for mb, metricValues, plotDict in zip(bundles, frame['metricValues'], frame['plotDicts']):
+            mb.metricValues = metricValues
+            mb.plotDict = plotDict
             ph.setMetricBundles([mb])
             fignum = ph.plot(plotFunc=plots.BaseSkyMap(), plotDicts={'raCen':raCen})
             fig = plt.figure(fignum)
@@ -202,20 +219,16 @@ def runSlices(opsimName, metadata, simdata, fields, bins, args, opsDb, verbose=F
             # For the FilterColors metric, add some extra items.
             if mb.metric.name == 'FilterColors':
                 # Add the time stamp info (plotlabel) with a fancybox.
-                plt.figtext(0.75, 0.9, '%s' %(plotlabel), bbox=dict(boxstyle='Round, pad=0.7',
-                                                                    fc='w', ec='k', alpha=0.5))
+                plt.figtext(0.75, 0.9, '%s' %(frame['plotlabel']), bbox=dict(boxstyle='Round, pad=0.7',
+                                                                             fc='w', ec='k', alpha=0.5))
                 # Add a legend for the filters.
                 filterstacker = stackers.FilterColorStacker()
                 for i, f in enumerate(['u', 'g', 'r', 'i', 'z', 'y']):
                     plt.figtext(0.92, 0.55 - i*0.035, f, color=filterstacker.filter_rgb_map[f])
                 # Add a moon.
-                moonRA = np.radians(np.mean(simdatasubset[obsnow]['moonRA']))
-                lon = -(moonRA - raCen - np.pi) % (np.pi*2) - np.pi
-                moonDec = np.radians(np.mean(simdatasubset[obsnow]['moonDec']))
-                # Note that moonphase is 0-100 (translate to 0-1). 0=new.
-                moonPhase = np.mean(simdatasubset[obsnow]['moonPhase'])/100.
-                alpha = np.max([moonPhase, 0.15])
-                circle = Circle((lon, moonDec), radius=0.05, color='k', alpha=alpha)
+                lon = -(frame['moonRA'] - raCen - np.pi) % (np.pi*2) - np.pi
+                alpha = np.max([frame['moonPhase'], 0.15])
+                circle = Circle((lon, frame['moonDec']), radius=0.05, color='k', alpha=alpha)
                 ax.add_patch(circle)
                 # Add some explanatory text.
                 ecliptic = Line2D([], [], color='r', label="Ecliptic plane")
@@ -228,13 +241,29 @@ def runSlices(opsimName, metadata, simdata, fields, bins, args, opsDb, verbose=F
                            ncol=3, frameon=False,
                     title = 'Aitoff plot showing HA/Dec of simulated survey pointings',
                            numpoints=1, fontsize='small')
-            # Save figure.
-            plt.savefig(os.path.join(args.outDir, mb.metric.name + '_' + slicenumber + '_SkyMap.png'),
-                        format='png', dpi=72)
-            plt.close('all')
-            dt, t = dtime(t)
-            if verbose:
-                print('Ran and plotted slice %s of movieslicer in %f s' %(slicenumber, dt))
+            figs.append(fig)
+        return figs
+
+    # Render the frames (across a pool of processes) and stream them into one movie for each metric.
+    setMovieRates(args, len(movieslicer))
+    movieslicer.streamMovie(frameData(), renderFrame, [mb.metric.name for mb in bundles], plotType='SkyMap',
+                            outDir=args.outDir, ips=args.ips, fps=args.fps, figsize=(8, 6), dpi=72,
+                            nProcesses=args.nProcesses, sliceformat=sliceformat)
+
+
+def setMovieRates(args, n_images):
+    # Set up ffmpeg parameters.
+    # If a movieLength was specified... set args.ips/fps.
+    if args.movieLength != 0.0:
+        #calculate images/second rate
+        args.ips = int(n_images/args.movieLength)
+        print("for a movie length of " + str(args.movieLength) + " IPS set to: ", args.ips)
+    if args.fps == 0:
+        warnings.warn('(FPS of 0) Setting fps equal to ips, up to a value of 30fps.')
+        if args.ips <= 30:
+            args.fps = args.ips
+        else:
+            args.fps = 30
 
 
 def stitchMovie(metricList, args):
@@ -249,18 +278,7 @@ def stitchMovie(metricList, args):
         n_images = len(plotfiles)
         if n_images == 0:
             raise Exception('No images found in %s with name like %s' %(args.outDir, outfileroot))
-        # Set up ffmpeg parameters.
-        # If a movieLength was specified... set args.ips/fps.
-        if args.movieLength != 0.0:
-            #calculate images/second rate
-            args.ips = int(n_images/args.movieLength)
-            print("for a movie length of " + str(args.movieLength) + " IPS set to: ", args.ips)
-        if args.fps == 0:
-            warnings.warn('(FPS of 0) Setting fps equal to ips, up to a value of 30fps.')
-            if args.ips <= 30:
-                args.fps = args.ips
-            else:
-                args.fps = 30
+        setMovieRates(args, n_images)
         # Create the movie.
         movieslicer.makeMovie(outfileroot, sliceformat, plotType='SkyMap', figformat='png',
                                 outDir=args.outDir, ips=args.ips, fps=args.fps)
@@ -286,6 +304,8 @@ if __name__ == '__main__':
                              "Will skip accordingly if fps is lower. Default 30.")
     parser.add_argument("--fps", type=float, default = 30,
                         help="The frames per second of the movie. Default 30.")
+    parser.add_argument("--nProcesses", type=int, default=1,
+                        help="The number of processes rendering the frames of the movie. Default 1.")
     parser.add_argument("--movieLength", type=float, default=0.0,
                         help="Enter the desired length of the movie in seconds. "
                         "If you do so, there is no need to enter images per second, it will be calculated.")
@@ -337,11 +357,12 @@ if __name__ == '__main__':
             # Update the first bin to be prior to the earliest opsim time.
             bins[0] = simdata['observationStartMJD'][0]
 
-        # Run the movie slicer (and at each step, setup opsim slicer and calculate metrics).
+        # Run the movie slicer (and at each step, calculate metrics), streaming the frames into the movies.
         runSlices(opsimName, metadata, simdata, fields, bins, args, oo, verbose=verbose)
 
-    # Need to set up the metrics to get their names, but don't need to have realistic arguments.
-    metricList, plotDictList = setupMetrics(opsimName, metadata)
-    stitchMovie(metricList, args)
+    else:
+        # Need to set up the metrics to get their names, but don't need to have realistic arguments.
+        metricList, plotDictList = setupMetrics(opsimName, metadata)
+        stitchMovie(metricList, args)
     end_t, start_t = dtime(start_t)
     print('Total time to create movie: ', end_t)
@@ -170,6 +170,8 @@ def glanceBatch(colmap=None, runName='opsim',
                                              degrees=colmap['raDecDeg'],
                                              dateCol=colmap['mjd'])
     stackerList.append(stacker)
+    filterCodeStacker = stackers.FilterCodeStacker(filterCol=colmap['filter'])
+    stackerList.append(filterCodeStacker)
 
     astrom_stats = [metrics.AreaSummaryMetric(decreasing=False, metricName='best18k'),
                     metrics.PercentileMetric(col='metricdata', percentile=90)]
@@ -191,6 +193,7 @@ def glanceBatch(colmap=None, runName='opsim',
                                         seeingCol=colmap['seeingGeom'])
     bundle = metricBundles.MetricBundle(metric, slicer, sql, plotFuncs=subsetPlots,
                                         displayDict=displayDict, plotDict=plotDict,
+                                        stackerList=[filterCodeStacker],
                                         summaryMetrics=astrom_stats)
     bundleList.append(bundle)
 
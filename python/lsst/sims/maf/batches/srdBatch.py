@@ -150,6 +150,8 @@ def astrometryBatch(colmap=None, runName='opsim',
     dcrStacker = stackers.DcrStacker(filterCol=colmap['filter'], altCol=colmap['alt'], degrees=degrees,
                                      raCol=raCol, decCol=decCol, lstCol=colmap['lst'],
                                      site='LSST', mjdCol=colmap['mjd'])
+    # Filter codes, used by the astrometry metrics to look up the star magnitude in each filter.
+    filterCodeStacker = stackers.FilterCodeStacker(filterCol=colmap['filter'])
 
     # Set up parallax metrics.
     slicer = slicers.HealpixSlicer(nside=nside, lonCol=raCol, latCol=decCol, latLonDeg=degrees)
@@ -169,7 +171,7 @@ def astrometryBatch(colmap=None, runName='opsim',
                                         seeingCol=colmap['seeingGeom'], filterCol=colmap['filter'],
                                         m5Col=colmap['fiveSigmaDepth'], normalize=False)
         bundle = mb.MetricBundle(metric, slicer, sql, metadata=metadata,
-                                 stackerList=[parallaxStacker, ditherStacker],
+                                 stackerList=[parallaxStacker, filterCodeStacker, ditherStacker],
                                  displayDict=displayDict, plotDict=plotDict,
                                  summaryMetrics=summary,
                                  plotFuncs=subsetPlots)
@@ -183,7 +185,7 @@ def astrometryBatch(colmap=None, runName='opsim',
                                         seeingCol=colmap['seeingGeom'], filterCol=colmap['filter'],
                                         m5Col=colmap['fiveSigmaDepth'], normalize=True)
         bundle = mb.MetricBundle(metric, slicer, sql, metadata=metadata,
-                                 stackerList=[parallaxStacker, ditherStacker],
+                                 stackerList=[parallaxStacker, filterCodeStacker, ditherStacker],
                                  displayDict=displayDict,
                                  summaryMetrics=standardSummary(),
                                  plotFuncs=subsetPlots)
@@ -196,7 +198,7 @@ def astrometryBatch(colmap=None, runName='opsim',
                                                 mjdCol=colmap['mjd'], filterCol=colmap['filter'],
                                                 seeingCol=colmap['seeingGeom'])
         bundle = mb.MetricBundle(metric, slicer, sql, metadata=metadata,
-                                 stackerList=[parallaxStacker, ditherStacker],
+                                 stackerList=[parallaxStacker, filterCodeStacker, ditherStacker],
                                  displayDict=displayDict, summaryMetrics=standardSummary(),
                                  plotFuncs=subsetPlots)
         bundleList.append(bundle)
@@ -209,7 +211,7 @@ def astrometryBatch(colmap=None, runName='opsim',
         caption = 'Correlation between parallax offset magnitude and hour angle for a r=%.1f star.' % (rmag)
         caption += ' (0 is good, near -1 or 1 is bad).'
         bundle = mb.MetricBundle(metric, slicer, sql, metadata=metadata,
-                                 stackerList=[dcrStacker, parallaxStacker, ditherStacker],
+                                 stackerList=[dcrStacker, parallaxStacker, filterCodeStacker, ditherStacker],
                                  displayDict=displayDict, summaryMetrics=standardSummary(),
                                  plotFuncs=subsetPlots)
         bundleList.append(bundle)
@@ -230,7 +232,7 @@ def astrometryBatch(colmap=None, runName='opsim',
                                             mjdCol=colmap['mjd'], filterCol=colmap['filter'],
                                             seeingCol=colmap['seeingGeom'], normalize=False)
         bundle = mb.MetricBundle(metric, slicer, sql, metadata=metadata,
-                                 stackerList=[ditherStacker],
+                                 stackerList=[filterCodeStacker, ditherStacker],
                                  displayDict=displayDict, plotDict=plotDict,
                                  summaryMetrics=summary,
                                  plotFuncs=subsetPlots)
@@ -243,7 +245,7 @@ def astrometryBatch(colmap=None, runName='opsim',
                                             mjdCol=colmap['mjd'], filterCol=colmap['filter'],
                                             seeingCol=colmap['seeingGeom'], normalize=True)
         bundle = mb.MetricBundle(metric, slicer, sql, metadata=metadata,
-                                 stackerList=[ditherStacker],
+                                 stackerList=[filterCodeStacker, ditherStacker],
                                  displayDict=displayDict, summaryMetrics=standardSummary(),
                                  plotFuncs=subsetPlots)
         bundleList.append(bundle)
@@ -74,8 +74,8 @@ def phaseGap(colmap=None, runName='opsim', nside=64, extraSql=None, extraMetadat
                            'caption': 'Maximum phase gap, given a period of %.2f days.' % period}
             metric = metrics.PhaseGapMetric(nPeriods=1, periodMin=period, periodMax=period, nVisitsMin=5,
                                             metricName='PhaseGap %.1f day' % period)
-            metric.reduceFuncs = {metric.reduceFuncs['reduceLargestGap']}
-            metric.reduceOrder = {0}
+            metric.reduceFuncs = {'LargestGap': metric.reduceFuncs['LargestGap']}
+            metric.reduceOrder = {'LargestGap': 0}
             bundle = mb.MetricBundle(metric, slicer, constraint=sql, metadata=md,
                                      displayDict=displayDict, summaryMetrics=standardStats,
                                      plotFuncs=subsetPlots)
@@ -14,7 +14,7 @@ import numpy as np
 
 Base = declarative_base()
 
-__all__ = ['MetricRow', 'DisplayRow', 'PlotRow', 'SummaryStatRow', 'ResultsDb']
+__all__ = ['MetricRow', 'DisplayRow', 'PlotRow', 'SummaryStatRow', 'ProfileRow', 'ResultsDb']
 
 class MetricRow(Base):
     """
@@ -97,6 +97,29 @@ class SummaryStatRow(Base):
         return "<SummaryStat(metricId='%d', summaryName='%s', summaryValue='%f')>" \
           %(self.metricId, self.summaryName, self.summaryValue)
 
+class ProfileRow(Base):
+    """
+    Define contents and format of the profiles table.
+
+    (Table to list the wall time, number of calls and peak memory of each stage of running MAF
+    (see utils.RunProfiler), linked to the relevant metrics in MetricList. Stages shared by many metrics,
+    such as the database query, have no metricId).
+    """
+    __tablename__ = "profiles"
+    profileId = Column(Integer, primary_key=True)
+    # Matches metricID in MetricList table.
+    metricId = Column(Integer, ForeignKey('metrics.metricId'))
+    stage = Column(String)
+    stageName = Column(String)
+    wallTime = Column(Float)
+    nCalls = Column(Integer)
+    peakMemory = Column(Float)
+    metric = relationship("MetricRow", backref=backref('profiles', order_by=profileId))
+    def __repr__(self):
+        return "<Profile(metricId='%s', stage='%s', stageName='%s', wallTime='%f', nCalls='%d', " \
+               "peakMemory='%f')>" \
+          %(self.metricId, self.stage, self.stageName, self.wallTime, self.nCalls, self.peakMemory)
+
 class ResultsDb(object):
     """The ResultsDb is a sqlite database containing information on the metrics run via MAF,
     the plots created, the display information (such as captions), and any summary statistics output.
@@ -246,20 +269,10 @@ class ResultsDb(object):
         self.session.add(plotinfo)
         self.session.commit()
 
-    def updateSummaryStat(self, metricId, summaryName, summaryValue):
-        """
-        Add a row to or update a row in the summary statistic table.
-
-        - metricId: the metric ID of this metric in the metrics table
-        - summaryName: the name of this summary statistic
-        - summaryValue: the value for this summary statistic
-
-        Most summary statistics will be a simple name (string) + value (float) pair.
-        For special summary statistics which must return multiple values, the base name
-        can be provided as 'name', together with a np recarray as 'value', where the
-        recarray also has 'name' and 'value' columns (and each name/value pair is then saved
-        as a summary statistic associated with this same metricId).
+    def _summaryStatRows(self, metricId, summaryName, summaryValue):
+        """Return the SummaryStatRows for a summary statistic (see updateSummaryStat).
         """
+        rows = []
         # Allow for special summary statistics which return data in a np structured array with
         #   'name' and 'value' columns.  (specificially needed for TableFraction summary statistic).
         if isinstance(summaryValue, np.ndarray):
@@ -270,22 +283,72 @@ class ResultsDb(object):
                         sSuffix = sSuffix.decode('utf-8')
                     else:
                         sSuffix = str(sSuffix)
-                    summarystat = SummaryStatRow(metricId=metricId,
-                                                 summaryName=summaryName + ' ' + sSuffix,
-                                                 summaryValue=value['value'])
-                    self.session.add(summarystat)
-                    self.session.commit()
+                    rows.append(SummaryStatRow(metricId=metricId,
+                                               summaryName=summaryName + ' ' + sSuffix,
+                                               summaryValue=value['value']))
             else:
                 warnings.warn('Warning! Cannot save non-conforming summary statistic.')
         # Most summary statistics will be simple floats.
         else:
             if isinstance(summaryValue, float) or isinstance(summaryValue, int):
-                summarystat = SummaryStatRow(metricId=metricId, summaryName=summaryName,
-                                             summaryValue=summaryValue)
-                self.session.add(summarystat)
-                self.session.commit()
+                rows.append(SummaryStatRow(metricId=metricId, summaryName=summaryName,
+                                           summaryValue=summaryValue))
             else:
                 warnings.warn('Warning! Cannot save summary statistic that is not a simple float or int')
+        return rows
+
+    def updateSummaryStat(self, metricId, summaryName, summaryValue):
+        """
+        Add a row to or update a row in the summary statistic table.
+
+        - metricId: the metric ID of this metric in the metrics table
+        - summaryName: the name of this summary statistic
+        - summaryValue: the value for this summary statistic
+
+        Most summary statistics will be a simple name (string) + value (float) pair.
+        For special summary statistics which must return multiple values, the base name
+        can be provided as 'name', together with a np recarray as 'value', where the
+        recarray also has 'name' and 'value' columns (and each name/value pair is then saved
+        as a summary statistic associated with this same metricId).
+        """
+        self.updateSummaryStats(metricId, {summaryName: summaryValue})
+
+    def updateSummaryStats(self, metricId, summaryValues):
+        """
+        Add rows for many summary statistics of one metric to the summary statistic table,
+        in a single transaction.
+
+        - metricId: the metric ID of this metric in the metrics table
+        - summaryValues: a dictionary of summary statistic values, keyed by summary statistic name
+          (each value as in updateSummaryStat)
+        """
+        rows = []
+        for summaryName, summaryValue in summaryValues.items():
+            rows += self._summaryStatRows(metricId, summaryName, summaryValue)
+        if len(rows) > 0:
+            self.session.add_all(rows)
+            self.session.commit()
+
+    def updateProfiles(self, profiles):
+        """
+        Add rows for the stages of a profiled run to the profiles table, in a single transaction.
+
+        - profiles: a list of dictionaries, each with the metricId (None for stages not belonging to
+          a single metric), stage, name, wallTime, nCalls and peakMemory of a stage (see utils.RunProfiler)
+
+        Replaces existing rows with the same metricId, stage and name.
+        """
+        rows = []
+        for p in profiles:
+            prev = self.session.query(ProfileRow).filter_by(metricId=p['metricId'], stage=p['stage'],
+                                                            stageName=str(p['name'])).all()
+            for row in prev:
+                self.session.delete(row)
+            rows.append(ProfileRow(metricId=p['metricId'], stage=p['stage'], stageName=str(p['name']),
+                                   wallTime=p['wallTime'], nCalls=p['nCalls'], peakMemory=p['peakMemory']))
+        if len(rows) > 0:
+            self.session.add_all(rows)
+            self.session.commit()
 
     def getMetricId(self, metricName, slicerName=None, metricMetadata=None, simDataName=None):
         """
@@ -361,6 +424,27 @@ class ResultsDb(object):
         summarystats = np.array(summarystats, dtype)
         return summarystats
 
+    def getProfiles(self, metricId=None):
+        """
+        Get the profiles of the stages of the run (optionally for metricId list), sorted by wall time.
+        Returns a numpy array of the profile information (with metricId -1 for the stages not
+        belonging to a single metric, which are only returned if metricId is None).
+        """
+        query = self.session.query(ProfileRow)
+        if metricId is not None:
+            if not hasattr(metricId, '__iter__'):
+                metricId = [metricId,]
+            query = query.filter(ProfileRow.metricId.in_(list(metricId)))
+        profiles = []
+        for p in query.order_by(ProfileRow.wallTime.desc()):
+            profiles.append((-1 if p.metricId is None else p.metricId, p.stage, p.stageName,
+                             p.wallTime, p.nCalls, p.peakMemory))
+        dtype = np.dtype([('metricId', int), ('stage', np.str_, self.slen),
+                          ('stageName', np.str_, self.slen), ('wallTime', float),
+                          ('nCalls', int), ('peakMemory', float)])
+        profiles = np.array(profiles, dtype)
+        return profiles
+
     def getPlotFiles(self, metricId=None):
         """
         Return the metricId, name, metadata, and all plot info (optionally for metricId list).
@@ -1,8 +1,9 @@
 import numpy as np
 import healpy as hp
 import os
-from lsst.sims.maf.utils import radec2pix
 from lsst.utils import getPackageDir
+from .mapDataCache import mapDataCache
+from .mapResampler import mapResampler
 
 
 __all__ = ['EBVhp']
@@ -22,26 +23,19 @@ def EBVhp(nside, ra=None,dec=None, pixels=None, interp=False):
     if (ra is None) & (dec is None) & (pixels is None):
         raise RuntimeError("Need to set ra,dec or pixels.")
 
-    # Load the map
-    if not hasattr(EBVhp, 'nside'):
-        EBVhp.nside = nside
+    # Load the map (once per process, for each nside)
+    ebvDataDir = getPackageDir('sims_maps')
+    filename = 'DustMaps/dust_nside_%i.npz' % nside
+    dustMap = mapDataCache.load(os.path.join(ebvDataDir, filename))['ebvMap']
 
-    if (not hasattr(EBVhp, 'dustmap')) | (EBVhp.nside != nside) :
-        EBVhp.nside = nside
-        ebvDataDir = getPackageDir('sims_maps')
-        filename = 'DustMaps/dust_nside_%i.npz'%EBVhp.nside
-        EBVhp.dustMap = np.load(os.path.join(ebvDataDir,filename))['ebvMap']
-
-    # If we are interpolating to arbitrary positions
-    if interp:
-        result = hp.get_interp_val(EBVhp.dustMap, np.pi/2. - dec , ra )
-    else:
+    if pixels is not None and not interp:
         # If we know the pixel indices we want
-        if pixels is not None:
-            result = EBVhp.dustMap[pixels]
-        # Look up
-        else:
-            pixels = radec2pix(EBVhp.nside,ra,dec)
-            result = EBVhp.dustMap[pixels]
+        result = dustMap[pixels]
+    else:
+        # Look up (or interpolate to) arbitrary positions, with the (cached) resampling table
+        table = mapResampler.table(nside, ra=ra, dec=dec, interp=interp)
+        result = table.apply(dustMap)
+        if np.ndim(ra) == 0:
+            result = result[0]
 
     return result
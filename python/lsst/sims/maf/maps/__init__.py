@@ -1,3 +1,5 @@
+from .mapDataCache import *
+from .mapResampler import *
 from .baseMap import *
 from .dustMap import *
 from .galCoordsMap import *
@@ -0,0 +1,150 @@
+import os
+import struct
+import time
+import zipfile
+import numpy as np
+
+__all__ = ['MapDataCache', 'mapDataCache']
+
+
+def _readNpyHeader(fp):
+    """Read the header of a .npy array from the open file fp.
+
+    Returns the shape, fortran_order and dtype of the array, or None if the format version is not known.
+    """
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(fp)
+    if version == (2, 0):
+        return np.lib.format.read_array_header_2_0(fp)
+    return None
+
+
+def _loadNpz(filename, mmap=True):
+    """Return a dictionary of the arrays in the npz file filename.
+
+    With mmap, the arrays which are stored uncompressed (as by np.savez) are memory-mapped directly
+    from the npz file, so they are only read from disk as they are used, and their pages are shared
+    by every process using the same map (including the processes of a Pool).
+    Compressed (or object) arrays are read into memory.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as fp:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                # The array data follows the zip local file header and the .npy header.
+                fp.seek(info.header_offset)
+                localHeader = fp.read(30)
+                nameLen, extraLen = struct.unpack('<HH', localHeader[26:30])
+                fp.seek(info.header_offset + 30 + nameLen + extraLen)
+                header = _readNpyHeader(fp)
+                if header is not None:
+                    shape, fortranOrder, dtype = header
+                    if not dtype.hasobject and np.prod(shape) > 0:
+                        arrays[name] = np.asarray(np.memmap(filename, dtype=dtype, mode='r', offset=fp.tell(),
+                                                            shape=shape, order='F' if fortranOrder else 'C'))
+                        continue
+            arrays[name] = np.load(zf.open(info.filename), allow_pickle=False)
+            arrays[name].flags.writeable = False
+    return arrays
+
+
+class MapDataCache(object):
+    """Process-wide cache of the map data files, and of the structures derived from them.
+
+    Every instance of a map (StellarDensityMap, TrilegalDensityMap, DustMap) used to read its
+    data file again, and build its derived structures (such as the KD-tree of the Trilegal
+    healpixels) again, each time it was run, i.e. once per MetricBundle using the map.
+    The maps load their data through this cache instead, so each file is read only once per process.
+    The arrays of the npz files are memory-mapped where possible, so they cost little until used,
+    and processes (forked workers in particular) share the same pages of memory.
+    The arrays returned are shared between all of the users of a map, and so are read-only.
+
+    The number of hits and misses, and the total time spent loading files and building derived
+    structures (loadTime, in seconds), are recorded; see stats.
+
+    Parameters
+    ----------
+    mmap : bool, opt
+        Memory-map the (uncompressed) arrays of the npz files, rather than reading them into memory.
+        Default True.
+    """
+    def __init__(self, mmap=True):
+        self.mmap = mmap
+        self._files = {}
+        self._derived = {}
+        self.hits = 0
+        self.misses = 0
+        self.loadTime = 0.
+
+    def load(self, filename):
+        """Return the arrays of the npz file filename, reading the file only if it is not already cached.
+
+        Parameters
+        ----------
+        filename : str
+            The npz file.
+
+        Returns
+        -------
+        dict of numpy.ndarray
+            The (read-only) arrays in the file, keyed by their names.
+        """
+        key = os.path.realpath(filename)
+        if key in self._files:
+            self.hits += 1
+            return self._files[key]
+        self.misses += 1
+        t0 = time.time()
+        self._files[key] = _loadNpz(filename, mmap=self.mmap)
+        self.loadTime += time.time() - t0
+        return self._files[key]
+
+    def derived(self, key, func):
+        """Return a structure derived from the map data (such as a KD-tree), calculating it with func
+        only if it is not already cached.
+
+        Parameters
+        ----------
+        key : hashable
+            The key identifying the structure, such as (filename, nside).
+        func : callable
+            Called with no arguments to calculate the structure.
+
+        Returns
+        -------
+        object
+            The structure returned by func, shared with other users of the cache.
+        """
+        if key in self._derived:
+            self.hits += 1
+            return self._derived[key]
+        self.misses += 1
+        t0 = time.time()
+        self._derived[key] = func()
+        self.loadTime += time.time() - t0
+        return self._derived[key]
+
+    def stats(self):
+        """Return a dictionary of the cache statistics: hits, misses, loadTime (seconds),
+        and the number of files and derived structures cached.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'loadTime': self.loadTime,
+                'nFiles': len(self._files), 'nDerived': len(self._derived)}
+
+    def clear(self):
+        """Remove all of the cached map data (and reset the statistics).
+        """
+        self._files.clear()
+        self._derived.clear()
+        self.hits = 0
+        self.misses = 0
+        self.loadTime = 0.
+
+    def __len__(self):
+        return len(self._files) + len(self._derived)
+
+
+# The cache shared by all of the maps.
+mapDataCache = MapDataCache()
@@ -0,0 +1,205 @@
+import os
+import hashlib
+import numpy as np
+import healpy as hp
+from lsst.sims.utils import _galacticFromEquatorial
+from .mapDataCache import mapDataCache
+
+__all__ = ['ResamplingTable', 'MapResampler', 'mapResampler']
+
+
+class ResamplingTable(object):
+    """The pixels (and weights) of a healpix map which give its values at a set of points.
+
+    Once the table has been calculated, the values of any map with the same healpix grid
+    (any column of a map, or all of its columns at once) at the points are found with a single gather
+    (nearest pixel) or a gather and weighted sum (interpolation).
+
+    Parameters
+    ----------
+    pixels : numpy.ndarray
+        The map pixels for each point: a 1-d array (the nearest pixel to each point) or a
+        2-d array (the pixels to interpolate between, shape (npoints, nweights)).
+    weights : numpy.ndarray, opt
+        The interpolation weights, with the same shape as pixels. Default None (nearest pixel).
+    """
+    def __init__(self, pixels, weights=None):
+        self.pixels = pixels
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def take(self, rows):
+        """Return the table for a subset of the points.
+        """
+        if self.weights is None:
+            return ResamplingTable(self.pixels[rows])
+        return ResamplingTable(self.pixels[rows], self.weights[rows])
+
+    def apply(self, mapValues):
+        """Return the values of the map mapValues at the points.
+
+        Parameters
+        ----------
+        mapValues : numpy.ndarray
+            The map, with the healpix pixels along the first axis (further axes, such as the
+            magnitude bins of a stellar density map, are carried along).
+
+        Returns
+        -------
+        numpy.ndarray
+            The map values at each point, shape (npoints,) + mapValues.shape[1:].
+        """
+        if self.weights is None:
+            return mapValues[self.pixels]
+        values = mapValues[self.pixels]
+        weights = self.weights.reshape(self.weights.shape + (1,) * (values.ndim - 2))
+        return np.sum(weights * values, axis=1)
+
+
+class MapResampler(object):
+    """Calculate (and cache) the ResamplingTables between healpix maps and the slicePoints of a slicer.
+
+    Looking up the map pixel of each slicePoint (with ang2pix, interpolation weights or a KD-tree)
+    every time a map is run repeats the same work for every map column and every MetricBundle.
+    The tables are calculated once for each combination of the map grid (nside, ordering and
+    coordinates), the interpolation option and the target (a healpix grid of given nside, or an
+    arbitrary set of ra/dec points), and kept in the process-wide mapDataCache. If cacheDir is set,
+    they are also saved there, so later processes load (memory-map) them rather than recalculating.
+
+    Parameters
+    ----------
+    cacheDir : str, opt
+        The directory where the tables are saved (and looked for). Default None, which keeps the
+        tables in memory only.
+    """
+    def __init__(self, cacheDir=None):
+        self.cacheDir = cacheDir
+
+    def _filename(self, key):
+        checksum = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cacheDir, 'resample_%s.npz' % checksum)
+
+    def _calcTable(self, sourceNside, ra, dec, nest, interp, galactic):
+        if galactic:
+            ra, dec = _galacticFromEquatorial(ra, dec)
+        theta = np.pi / 2.0 - np.asarray(dec)
+        phi = np.asarray(ra)
+        if interp:
+            pixels, weights = hp.get_interp_weights(sourceNside, theta, phi, nest=nest)
+            return ResamplingTable(np.ascontiguousarray(pixels.T), np.ascontiguousarray(weights.T))
+        return ResamplingTable(hp.ang2pix(sourceNside, theta, phi, nest=nest))
+
+    def _loadTable(self, key, ra, dec):
+        """Return the table for key, from cacheDir if it has been saved there, or calculated (and saved).
+        """
+        sourceNside, nest, interp, galactic = key[:4]
+        if self.cacheDir is None:
+            return self._calcTable(sourceNside, ra, dec, nest, interp, galactic)
+        filename = self._filename(key)
+        if os.path.isfile(filename):
+            data = mapDataCache.load(filename)
+            return ResamplingTable(data['pixels'], data.get('weights'))
+        table = self._calcTable(sourceNside, ra, dec, nest, interp, galactic)
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        # Write to a temporary file first, so other processes never see a partial table.
+        tmpfile = filename + '.%d.tmp' % os.getpid()
+        with open(tmpfile, 'wb') as f:
+            if table.weights is None:
+                np.savez(f, pixels=table.pixels)
+            else:
+                np.savez(f, pixels=table.pixels, weights=table.weights)
+        os.replace(tmpfile, filename)
+        return table
+
+    def table(self, sourceNside, ra=None, dec=None, targetNside=None, nest=False, interp=False,
+              galactic=False):
+        """Return the ResamplingTable from a healpix map onto a healpix grid (targetNside) or ra/dec points.
+
+        Parameters
+        ----------
+        sourceNside : int
+            The nside of the map.
+        ra : numpy.ndarray, opt
+            The RA of the points (radians). Used if targetNside is None.
+        dec : numpy.ndarray, opt
+            The Dec of the points (radians). Used if targetNside is None.
+        targetNside : int, opt
+            The nside of the (RING ordered) healpix grid to resample the map onto. Default None.
+        nest : bool, opt
+            The map is NESTED (True) or RING (False) ordered. Default False.
+        interp : bool, opt
+            Interpolate between the four nearest pixels (True), or use the nearest pixel (False).
+            Default False.
+        galactic : bool, opt
+            The map is in galactic coordinates (True) rather than equatorial (False). Default False.
+
+        Returns
+        -------
+        ResamplingTable
+            The table (shared with other users of the cache).
+        """
+        if targetNside is not None:
+            target = ('healpix', int(targetNside))
+            dec, ra = hp.pix2ang(targetNside, np.arange(hp.nside2npix(targetNside)))
+            dec = np.pi / 2.0 - dec
+        else:
+            if ra is None or dec is None:
+                raise ValueError('Need to set targetNside, or ra and dec.')
+            ra = np.ascontiguousarray(ra, dtype=float)
+            dec = np.ascontiguousarray(dec, dtype=float)
+            checksum = hashlib.sha1(ra.view(np.uint8))
+            checksum.update(dec.view(np.uint8))
+            target = ('points', checksum.hexdigest(), ra.size)
+        key = (int(sourceNside), bool(nest), bool(interp), bool(galactic), target)
+        return mapDataCache.derived(('resample',) + key, lambda: self._loadTable(key, ra, dec))
+
+    def tableForSlicePoints(self, sourceNside, slicePoints, nest=False, interp=False, galactic=False):
+        """Return the ResamplingTable from a healpix map onto the slicePoints of a slicer.
+
+        For healpix slicers, the table of the whole healpix grid is cached (and reused for any
+        slicer with the same nside); otherwise the table is for the slicePoint ra/dec values.
+        """
+        if 'nside' in slicePoints and slicePoints.get('sid') is not None:
+            table = self.table(sourceNside, targetNside=slicePoints['nside'], nest=nest, interp=interp,
+                               galactic=galactic)
+            return table.take(slicePoints['sid'])
+        return self.table(sourceNside, ra=slicePoints['ra'], dec=slicePoints['dec'], nest=nest,
+                          interp=interp, galactic=galactic)
+
+    def resample(self, mapValues, slicePoints, nest=False, interp=False, galactic=False):
+        """Return the values of a healpix map at the slicePoints of a slicer.
+
+        Parameters
+        ----------
+        mapValues : numpy.ndarray
+            The healpix map, with the pixels along the first axis.
+        slicePoints : dict
+            The slicePoints of the slicer (with ra and dec, in radians, and nside and sid for healpix slicers).
+        nest : bool, opt
+            The map is NESTED (True) or RING (False) ordered. Default False.
+        interp : bool, opt
+            Interpolate between the four nearest pixels (True), or use the nearest pixel (False).
+            Default False.
+        galactic : bool, opt
+            The map is in galactic coordinates (True) rather than equatorial (False). Default False.
+
+        Returns
+        -------
+        numpy.ndarray
+            The map values at each slicePoint.
+        """
+        sourceNside = hp.npix2nside(len(mapValues))
+        if ('nside' in slicePoints and slicePoints['nside'] == sourceNside and not nest and not galactic
+                and slicePoints.get('sid') is not None):
+            # The slicer uses the same healpix grid as the map.
+            return mapValues[slicePoints['sid']]
+        table = self.tableForSlicePoints(sourceNside, slicePoints, nest=nest, interp=interp, galactic=galactic)
+        return table.apply(mapValues)
+
+
+# The resampler shared by all of the maps. Set the MAF_RESAMPLING_CACHE environment variable
+# to a directory to keep the tables between processes.
+mapResampler = MapResampler(cacheDir=os.environ.get('MAF_RESAMPLING_CACHE'))
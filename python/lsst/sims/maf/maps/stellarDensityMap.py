@@ -2,8 +2,9 @@ import os
 import numpy as np
 import healpy as hp
 from lsst.utils import getPackageDir
-from lsst.sims.maf.utils import radec2pix
 from . import BaseMap
+from .mapDataCache import mapDataCache
+from .mapResampler import mapResampler
 
 __all__ = ['StellarDensityMap']
 
@@ -31,23 +32,16 @@ class StellarDensityMap(BaseMap):
 
     def _readMap(self):
         filename = 'starDensity_%s_%snside_64.npz' % (self.filtername, self.startype)
-        starMap = np.load(os.path.join(self.mapDir,filename))
-        self.starMap = starMap['starDensity'].copy()
-        self.starMapBins = starMap['bins'].copy()
+        starMap = mapDataCache.load(os.path.join(self.mapDir, filename))
+        self.starMap = starMap['starDensity']
+        self.starMapBins = starMap['bins']
         self.starmapNside = hp.npix2nside(np.size(self.starMap[:,0]))
 
     def run(self, slicePoints):
         self._readMap()
 
-        nsideMatch = False
-        if 'nside' in slicePoints:
-            if slicePoints['nside'] == self.starmapNside:
-                slicePoints[f'starLumFunc_{self.filtername}'] = self.starMap
-                nsideMatch = True
-        if not nsideMatch:
-            # Compute the healpix for each slicepoint on the nside=64 grid
-            indx = radec2pix(self.starmapNside, slicePoints['ra'], slicePoints['dec'])
-            slicePoints[f'starLumFunc_{self.filtername}'] = self.starMap[indx,:]
+        # The nearest healpix (on the nside=64 grid) for each slicepoint
+        slicePoints[f'starLumFunc_{self.filtername}'] = mapResampler.resample(self.starMap, slicePoints)
 
         slicePoints[f'starMapBins_{self.filtername}'] = self.starMapBins
         return slicePoints
@@ -2,8 +2,9 @@ import os
 import numpy as np
 import healpy as hp
 from lsst.utils import getPackageDir
-from lsst.sims.utils import _hpid2RaDec, _equatorialFromGalactic, _buildTree, _xyz_from_ra_dec
 from . import BaseMap
+from .mapDataCache import mapDataCache
+from .mapResampler import mapResampler
 
 __all__ = ['TrilegalDensityMap']
 
@@ -32,24 +33,18 @@ class TrilegalDensityMap(BaseMap):
             filename = 'TRIstarDensity_%s_nside_%i_ext.npz' % (self.filtername, self.nside)
         else:
             filename = 'TRIstarDensity_%s_nside_%i.npz' % (self.filtername, self.nside)
-        starMap = np.load(os.path.join(self.mapDir, filename))
-        self.starMap = starMap['starDensity'].copy()
-        self.starMapBins = starMap['bins'].copy()
+        filename = os.path.join(self.mapDir, filename)
+        starMap = mapDataCache.load(filename)
+        self.starMap = starMap['starDensity']
+        self.starMapBins = starMap['bins']
         self.starmapNside = hp.npix2nside(np.size(self.starMap[:, 0]))
-        # note, the trilegal maps are in galactic coordinates, and nested healpix.
-        gal_l, gal_b = _hpid2RaDec(self.nside, np.arange(hp.nside2npix(self.nside)), nest=True)
-
-        # Convert that to RA,dec. Then do nearest neighbor lookup.
-        ra, dec = _equatorialFromGalactic(gal_l, gal_b)
-        self.tree = _buildTree(ra, dec)
 
     def run(self, slicePoints):
         self._readMap()
 
-        x, y, z = _xyz_from_ra_dec(slicePoints['ra'], slicePoints['dec'])
-
-        dist, indices = self.tree.query(list(zip(x, y, z)))
+        # note, the trilegal maps are in galactic coordinates, and nested healpix.
+        starLumFunc = mapResampler.resample(self.starMap, slicePoints, nest=True, galactic=True)
 
-        slicePoints['starLumFunc_%s' % self.filtername] = self.starMap[indices, :]
+        slicePoints['starLumFunc_%s' % self.filtername] = starLumFunc
         slicePoints['starMapBins_%s' % self.filtername] = self.starMapBins
         return slicePoints
@@ -1,3 +1,4 @@
 from .metricBundle import *
 from .metricBundleGroup import *
+from .movieBundleGroup import *
 from .moMetricBundle import *
@@ -413,6 +413,105 @@ class MetricBundle(object):
         if resultsDb is not None:
             self.writeDb(resultsDb=resultsDb)
 
+    def writeState(self, outDir='.', **state):
+        """Write the state of an incremental calculation of the metric values to disk
+        (see MetricBundleGroup.runAll with incremental=True).
+
+        Parameters
+        ----------
+        outDir : Optional[str]
+            The output directory.
+        **state
+            The arrays to save, such as lastNight (the last night of visits included), nVisits
+            (the number of visits at each slicePoint) and states (the partial state of the metric
+            at each slicePoint).
+        """
+        np.savez(os.path.join(outDir, self.fileRoot + '_state.npz'), **state)
+
+    def readState(self, outDir='.'):
+        """Read the state of an incremental calculation of the metric values (see writeState).
+
+        Parameters
+        ----------
+        outDir : Optional[str]
+            The output directory.
+
+        Returns
+        -------
+        dict or None
+            The arrays saved by writeState, or None if there is no state file.
+        """
+        filename = os.path.join(outDir, self.fileRoot + '_state.npz')
+        if not os.path.isfile(filename):
+            return None
+        # Allowing pickles is required to restore metric values saved as objects.
+        restored = np.load(filename, allow_pickle=True)
+        return {key: restored[key] for key in restored.files}
+
+    def _shardFilename(self, outDir, shard, nShards):
+        return os.path.join(outDir, '%s_shard%dof%d.npz' % (self.fileRoot, shard, nShards))
+
+    def writeShard(self, shard, nShards, states=None, noVisits=None, outDir='.'):
+        """Write the partial states of the metric calculated from one shard of the visits
+        (see MetricBundleGroup.runShard), together with the slicer.
+
+        Parameters
+        ----------
+        shard : int
+            The shard of the visits (from 0 to nShards - 1).
+        nShards : int
+            The number of shards the visits were split into.
+        states : numpy.ndarray, opt
+            The partial state of the metric at each slicePoint. Default None, for a shard without visits.
+        noVisits : numpy.ndarray, opt
+            Boolean array which is True for the slicePoints without visits in this shard.
+        outDir : Optional[str]
+            The output directory.
+        """
+        filename = self._shardFilename(outDir, shard, nShards)
+        if states is None:
+            # Record that the shard was run, even though it had no visits.
+            np.savez(filename, empty=True)
+            return
+        mask = np.repeat(np.asarray(noVisits)[:, np.newaxis], states.shape[-1], axis=1)
+        self.slicer.writeData(filename, ma.MaskedArray(data=states, mask=mask),
+                              metricName=self.metric.name, simDataName=self.runName,
+                              constraint=self.constraint, metadata=self.metadata)
+
+    def readShard(self, shard, nShards, outDir='.'):
+        """Read the partial states of the metric calculated from one shard of the visits (see writeShard).
+
+        Parameters
+        ----------
+        shard : int
+            The shard of the visits (from 0 to nShards - 1).
+        nShards : int
+            The number of shards the visits were split into.
+        outDir : Optional[str]
+            The output directory.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, lsst.sims.maf.slicer
+            The partial states at each slicePoint, the boolean array which is True for the slicePoints
+            without visits, and the slicer. All three are None if the shard had no visits.
+
+        Raises
+        ------
+        IOError
+            If there is no file for this shard.
+        """
+        filename = self._shardFilename(outDir, shard, nShards)
+        if not os.path.isfile(filename):
+            raise IOError('No partial states found for shard %d of %d of %s (%s).'
+                          % (shard, nShards, self.fileRoot, filename))
+        with np.load(filename, allow_pickle=True) as restored:
+            if 'empty' in restored.files:
+                return None, None, None
+        tmpSlicer = slicers.BaseSlicer()
+        states, slicer, header = tmpSlicer.readData(filename)
+        return states.data, np.ma.getmaskarray(states)[:, 0], slicer
+
     def outputJSON(self):
         """Set up and call the baseSlicer outputJSON method, to output to IO string.
 
@@ -475,9 +574,23 @@ class MetricBundle(object):
         self.fileRoot = head.replace('.npz', '')
         self.setPlotFuncs(None)
 
+    def _summaryData(self, values):
+        """Wrap values as a structured array with a single 'metricdata' field, for the summary metrics.
+        """
+        values = np.ascontiguousarray(values).ravel()
+        if values.dtype.hasobject:
+            # Object arrays can't be viewed with a different dtype.
+            return np.array(list(zip(values)), dtype=[('metricdata', values.dtype)])
+        # A view, without copying the values.
+        return values.view(dtype=[('metricdata', values.dtype)])
+
     def computeSummaryStats(self, resultsDb=None):
         """Compute summary statistics on metricValues, using summaryMetrics (metricbundle list).
 
+        The summary metrics share the (structured array view of the) metric values and a SliceContext,
+        so statistics which need the values in sorted order (median, percentiles, AreaSummary ..)
+        only sort them once, and all of the summary values are written to the resultsDb together.
+
         Parameters
         ----------
         resultsDb : Optional[ResultsDb]
@@ -486,9 +599,10 @@ class MetricBundle(object):
         if self.summaryValues is None:
             self.summaryValues = {}
         if self.summaryMetrics is not None:
-            # Build array of metric values, to use for (most) summary statistics.
-            rarr_std = np.array(list(zip(self.metricValues.compressed())),
-                                dtype=[('metricdata', self.metricValues.dtype)])
+            # Arrays of metric values (and their SliceContexts), to use for the summary statistics:
+            # the unmasked values for most summary statistics, or all values filled with the maskVal.
+            summaryData = {}
+            newValues = {}
             for m in self.summaryMetrics:
                 # The summary metric colname should already be set to 'metricdata', but in case it's not:
                 m.colname = 'metricdata'
@@ -496,20 +610,27 @@ class MetricBundle(object):
                 if hasattr(m, 'maskVal'):
                     # summary metric requests to use the mask value, as specified by itself,
                     #  rather than skipping masked vals.
-                    rarr = np.array(list(zip(self.metricValues.filled(m.maskVal))),
-                                    dtype=[('metricdata', self.metricValues.dtype)])
+                    key = ('maskVal', str(m.maskVal))
                 else:
-                    rarr = rarr_std
+                    key = None
+                if key not in summaryData:
+                    if key is None:
+                        rarr = self._summaryData(self.metricValues.compressed())
+                    else:
+                        rarr = self._summaryData(self.metricValues.filled(m.maskVal))
+                    summaryData[key] = (rarr, {'sliceContext': metrics.SliceContext(rarr)})
+                rarr, slicePoint = summaryData[key]
                 if np.size(rarr) == 0:
                     summaryVal = self.slicer.badval
                 else:
-                    summaryVal = m.run(rarr)
+                    summaryVal = m.run(rarr, slicePoint)
                 self.summaryValues[summaryName] = summaryVal
-                # Add summary metric info to results database, if applicable.
-                if resultsDb:
-                    metricId = resultsDb.updateMetric(self.metric.name, self.slicer.slicerName,
-                                                      self.runName, self.constraint, self.metadata, None)
-                    resultsDb.updateSummaryStat(metricId, summaryName=summaryName, summaryValue=summaryVal)
+                newValues[summaryName] = summaryVal
+            # Add summary metric info to results database, if applicable.
+            if resultsDb:
+                metricId = resultsDb.updateMetric(self.metric.name, self.slicer.slicerName,
+                                                  self.runName, self.constraint, self.metadata, None)
+                resultsDb.updateSummaryStats(metricId, newValues)
 
     def reduceMetric(self, reduceFunc, reducePlotDict=None, reduceDisplayDict=None):
         """Run 'reduceFunc' (any function that operates on self.metricValues).
@@ -569,14 +690,23 @@ class MetricBundle(object):
         # And then update the newmetricBundle's display dictionary with any set
         # explicitly by reduceDisplayDict.
         newmetricBundle.setDisplayDict(reduceDisplayDict)
+        # Vector metric values (fixed-width float arrays) are masked where all of their values are masked.
+        mask = self.metricValues.mask
+        if self.metric.shape != 1:
+            mask = np.all(mask, axis=-1)
         # Set up new metricBundle's metricValues masked arrays, copying metricValue's mask.
         newmetricBundle.metricValues = ma.MaskedArray(data=np.empty(len(self.slicer), 'float'),
-                                                      mask=self.metricValues.mask,
+                                                      mask=mask,
                                                       fill_value=self.slicer.badval)
         # Fill the reduced metric data using the reduce function.
-        for i, (mVal, mMask) in enumerate(zip(self.metricValues.data, self.metricValues.mask)):
-            if not mMask:
-                newmetricBundle.metricValues.data[i] = reduceFunc(mVal)
+        if self.metric.vectorizedReduce:
+            # The reduce function is evaluated on all (unmasked) slicePoints at once.
+            good = np.where(~mask)[0]
+            if len(good) > 0:
+                newmetricBundle.metricValues.data[good] = reduceFunc(self.metricValues.data[good])
+        else:
+            for i in np.where(~mask)[0]:
+                newmetricBundle.metricValues.data[i] = reduceFunc(self.metricValues.data[i])
         return newmetricBundle
 
     def plot(self, plotHandler=None, plotFunc=None, outfileSuffix=None, savefig=False):
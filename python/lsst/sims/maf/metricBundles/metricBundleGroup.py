@@ -1,6 +1,8 @@
 from __future__ import print_function
 from builtins import object
 import os
+import time
+import multiprocessing
 import numpy as np
 import numpy.ma as ma
 import matplotlib.pyplot as plt
@@ -11,11 +13,37 @@ import lsst.sims.maf.utils as utils
 from lsst.sims.maf.plots import PlotHandler
 import lsst.sims.maf.maps as maps
 from lsst.sims.maf.stackers import BaseDitherStacker
+from lsst.sims.maf.metrics import SliceContext, TotalPowerMetric
+from lsst.sims.maf.slicers import AdaptiveHealpixSlicer
 from .metricBundle import MetricBundle, createEmptyMetricBundle
 import warnings
 
 __all__ = ['makeBundlesDictFromList', 'MetricBundleGroup']
 
+# The MetricBundleGroup running its shards in (forked) worker processes, and the visits (queried by the
+# parent process) of the constraint being run; see MetricBundleGroup.runSharded.
+_shardGroup = None
+_shardData = None
+
+
+def _runShard(args):
+    """Run one shard of the visits for _shardGroup, in a worker process."""
+    constraint, shard, nShards = args
+    _shardGroup.runShardCurrent(constraint, shard, nShards, simData=_shardData)
+
+
+class _SlicePointList(object):
+    """The slicePoint metadata of the slices sliceNums of slicer, looked up only as they are used."""
+    def __init__(self, slicer, sliceNums):
+        self.slicer = slicer
+        self.sliceNums = sliceNums
+
+    def __len__(self):
+        return len(self.sliceNums)
+
+    def __getitem__(self, i):
+        return self.slicer[self.sliceNums[i]]['slicePoint']
+
 
 def makeBundlesDictFromList(bundleList):
     """Utility to convert a list of MetricBundles into a dictionary, keyed by the fileRoot names.
@@ -78,9 +106,26 @@ class MetricBundleGroup(object):
         If False, metric values will only be saved after summary statistics are calculated.
     dbTable : str, opt
         The name of the table in the dbObj to query for data.
+    profile : bool, opt
+        If True, record the wall time and peak memory of each stage of the run (the database query,
+        stackers, slicer setup, reduce functions, summary statistics, writing and plotting of each
+        MetricBundle), and the total time and number of calls of each metric (see utils.RunProfiler).
+        The records are saved in the profiles table of the resultsDb (see writeProfile) and can be
+        reported with profileReport. Default False.
     """
+    # Columns which may hold the time of each visit (the first present is used to sort simData).
+    timeCols = ['observationStartMJD', 'expMJD']
+    # The maximum number of visits (summed over slicePoints) passed at once to metrics with a runBatch method.
+    batchSize = 5000000
+    # The number of processes used to calculate the angular power spectra needed by TotalPowerMetric
+    # summary statistics (for all bundles at once) before running the summary statistics.
+    # If 1, each power spectrum is calculated (and cached) when first needed.
+    powerSpectrumProcesses = 1
+    # The column holding the night of each visit, used by incremental runs.
+    nightCol = 'night'
+
     def __init__(self, bundleDict, dbObj, outDir='.', resultsDb=None, verbose=True,
-                 saveEarly=True, dbTable=None):
+                 saveEarly=True, dbTable=None, profile=False):
         """Set up the MetricBundleGroup.
         """
         if type(bundleDict) is list:
@@ -109,6 +154,7 @@ class MetricBundleGroup(object):
         if not isinstance(dbObj, db.Database):
             warnings.warn('Warning: dbObj should be an instantiated Database (or child) object.')
         self.dbObj = dbObj
+        self.timeCol = None
         # Set the table we're going to be querying.
         self.dbTable = dbTable
         if self.dbTable is None and self.dbObj is not None:
@@ -120,11 +166,90 @@ class MetricBundleGroup(object):
                 raise ValueError('resultsDb should be an ResultsDb object')
         self.resultsDb = resultsDb
 
+        # Incremental runs update the metric values saved by the previous run (see runAll).
+        self.incremental = False
+        self.states = {}
+        # The constraint of an incremental run whose query only included the nights after the saved states.
+        self.nightCutConstraint = None
+        # Sharded runs calculate partial states from one shard of the visits (see runShard).
+        self.shard = None
+        self.nShards = None
+
+        # Record the time and memory of each stage of the run, if profiling.
+        self.profiler = utils.RunProfiler() if profile else None
+
         # Dict to keep track of what's been run:
         self.hasRun = {}
         for bk in bundleDict:
             self.hasRun[bk] = False
 
+    def _stage(self, stage, name=None):
+        """Return a context manager recording the wall time and peak memory of a stage of the run
+        (if profiling).
+        """
+        if self.profiler is None:
+            return utils.noStage()
+        return self.profiler.stage(stage, name)
+
+    def _runMetric(self, b, dataSlice, slicePoint):
+        """Return the value of the metric of MetricBundle b for dataSlice (recording the time, if profiling).
+        """
+        if self.profiler is None:
+            return b.metric.run(dataSlice, slicePoint=slicePoint)
+        t0 = time.time()
+        value = b.metric.run(dataSlice, slicePoint=slicePoint)
+        self.profiler.addCall('metric', b.fileRoot, time.time() - t0)
+        return value
+
+    def _runMetricBatch(self, b, dataSlices, offsets, slicePoints):
+        """Return the values of the metric of MetricBundle b for many slicePoints at once (see
+        BaseMetric.runBatch), recording the time, if profiling.
+        """
+        if self.profiler is None:
+            return b.metric.runBatch(dataSlices, offsets, slicePoints=slicePoints)
+        t0 = time.time()
+        values = b.metric.runBatch(dataSlices, offsets, slicePoints=slicePoints)
+        self.profiler.addCall('metric', b.fileRoot, time.time() - t0, nCalls=len(offsets) - 1)
+        return values
+
+    def profileReport(self, format='text', sortBy='wallTime'):
+        """Return a report of the time and memory used by each stage of the run (if profiling).
+
+        Parameters
+        ----------
+        format : str, opt
+            'text' (a table) or 'json'. Default 'text'.
+        sortBy : str, opt
+            The column to sort the stages by: wallTime, nCalls, peakMemory, stage or name.
+            Default wallTime (the slowest stages first).
+
+        Returns
+        -------
+        str
+        """
+        if self.profiler is None:
+            raise ValueError('This MetricBundleGroup was not set up to profile its run (set profile=True).')
+        return self.profiler.report(format=format, sortBy=sortBy)
+
+    def writeProfile(self, filename=None, format='text'):
+        """Save the profile of the run in the profiles table of the resultsDb, linked to the metricId of
+        each MetricBundle (after the MetricBundles have been written to the resultsDb),
+        and optionally write the profile report to filename in outDir.
+
+        Parameters
+        ----------
+        filename : str, opt
+            The file (in outDir) to write the profile report to. Default None (no file).
+        format : str, opt
+            The format of the report file, 'text' or 'json'. Default 'text'.
+        """
+        if self.profiler is None:
+            return
+        if self.resultsDb is not None:
+            self.profiler.writeResultsDb(self.resultsDb, self.bundleDict.values())
+        if filename is not None:
+            self.profiler.writeReport(os.path.join(self.outDir, filename), format=format)
+
     def _checkCompatible(self, metricBundle1, metricBundle2):
         """Check if two MetricBundles are "compatible".
         Compatible indicates that the sql constraints, the slicers, and the maps are the same, and
@@ -221,7 +346,7 @@ class MetricBundleGroup(object):
         else:
             self.fieldData = None
 
-    def runAll(self, clearMemory=False, plotNow=False, plotKwargs=None):
+    def runAll(self, clearMemory=False, plotNow=False, plotKwargs=None, incremental=False):
         """Runs all the metricBundles in the metricBundleGroup, over all constraints.
 
         Calculates metric values, then runs reduce functions and summary statistics for
@@ -235,12 +360,21 @@ class MetricBundleGroup(object):
             If True, plots the metric values immediately after calculation.
         plotKwargs : bool, opt
             kwargs to pass to plotCurrent.
+        incremental : bool, opt
+            If True, update the metric values saved (in outDir) by the previous incremental run with
+            the visits from later nights, assuming visits are only ever added in new nights.
+            Mergeable metrics (see BaseMetric.isMergeable) only process the new visits; other metrics are
+            recalculated only at the slicePoints with new visits. The first incremental run calculates
+            the metric values from all of the visits, and saves the state for the next run.
+            The slicePoints must not depend on the visits (as they do for a OneDSlicer with bins
+            set from the data). Default False.
         """
         for constraint in self.constraints:
             # Set the 'currentBundleDict' which is a dictionary of the metricBundles which match this
             #  constraint.
             self.runCurrent(constraint, clearMemory=clearMemory,
-                            plotNow=plotNow, plotKwargs=plotKwargs)
+                            plotNow=plotNow, plotKwargs=plotKwargs, incremental=incremental)
+        self.writeProfile()
 
     def setCurrent(self, constraint):
         """Utility to set the currentBundleDict (i.e. a set of metricBundles with the same SQL constraint).
@@ -259,7 +393,8 @@ class MetricBundleGroup(object):
             if b.constraint == constraint:
                 self.currentBundleDict[k] = b
 
-    def runCurrent(self, constraint, simData=None, clearMemory=False, plotNow=False, plotKwargs=None):
+    def runCurrent(self, constraint, simData=None, clearMemory=False, plotNow=False, plotKwargs=None,
+                   incremental=False):
         """Run all the metricBundles which match this constraint in the metricBundleGroup.
 
         Calculates the metric values, then runs reduce functions and summary statistics for
@@ -279,24 +414,37 @@ class MetricBundleGroup(object):
            is to plot after metric values are calculated for all constraints).
         plotKwargs : kwargs, opt
            Plotting kwargs to pass to plotCurrent.
+        incremental : bool, opt
+           If True, update the metric values saved by the previous incremental run with the visits
+           from later nights (see runAll). Default False.
         """
         self.setCurrent(constraint)
+        self.incremental = incremental
 
         # Build list of all the columns needed from the database.
         self.dbCols = []
         for b in self.currentBundleDict.values():
             self.dbCols.extend(b.dbCols)
+        queryConstraint = constraint
+        if incremental:
+            self.dbCols.append(self.nightCol)
+            self.states = {k: b.readState(self.outDir) for k, b in self.currentBundleDict.items()}
+            queryConstraint = self._incrementalConstraint(constraint)
         self.dbCols = list(set(self.dbCols))
+        self.nightCutConstraint = None
 
         # Can pass simData directly (if had other method for getting data)
         if simData is not None:
             self.simData = simData
 
         else:
+            if queryConstraint != constraint:
+                self.nightCutConstraint = constraint
             self.simData = None
             # Query for the data.
             try:
-                self.getData(constraint)
+                with self._stage('query', queryConstraint):
+                    self.getData(queryConstraint)
             except UserWarning:
                 warnings.warn('No data matching constraint %s' % constraint)
                 metricsSkipped = []
@@ -305,14 +453,12 @@ class MetricBundleGroup(object):
                 warnings.warn(' This means skipping metrics %s' % metricsSkipped)
                 return
             except ValueError:
-                warnings.warn('One or more of the columns requested from the database was not available.' +
-                              ' Skipping constraint %s' % constraint)
-                metricsSkipped = []
-                for b in self.currentBundleDict.values():
-                    metricsSkipped.append("%s : %s : %s" % (b.metric.name, b.metadata, b.slicer.slicerName))
-                warnings.warn(' This means skipping metrics %s' % metricsSkipped)
+                self._warnSkipped(constraint)
                 return
 
+        # Put the visits in time order, so that the data in each slice is also time-ordered.
+        self._sortSimData()
+
         # Find compatible subsets of the MetricBundle dictionary,
         # which can be run/metrics calculated/ together.
         self._findCompatibleLists()
@@ -348,6 +494,258 @@ class MetricBundleGroup(object):
                 print('Deleted metricValues from memory.')
 
 
+    def runSharded(self, nShards, nProcesses=None, clearMemory=False, plotNow=False, plotKwargs=None):
+        """Run all the metricBundles in the metricBundleGroup, over all constraints, by splitting the
+        visits into nShards shards (by night) which are run in parallel, and then merging the results.
+
+        The visits of each constraint are queried once, in this process, and each shard is then run with
+        runShardCurrent in a pool of worker processes (which do not use the database connection).
+        The partial states they save (in outDir) are then merged with mergeShards. The metrics must all
+        be mergeable (see BaseMetric.isMergeable), and their slicePoints must not depend on the visits.
+        To run the shards on different machines instead, call runShard on each machine (with an outDir
+        they all share) and then mergeShards.
+
+        Parameters
+        ----------
+        nShards : int
+            The number of shards to split the visits into.
+        nProcesses : int, opt
+            The number of worker processes. Default None, which uses the number of cpus.
+            With a single process, the shards are run one after the other in this process.
+        clearMemory : bool, opt
+            If True, deletes metric values from memory after merging each constraint group.
+        plotNow : bool, opt
+            If True, plots the metric values immediately after they are merged.
+        plotKwargs : bool, opt
+            kwargs to pass to plotCurrent.
+        """
+        global _shardGroup, _shardData
+        if nProcesses is None:
+            nProcesses = multiprocessing.cpu_count()
+        nProcesses = min(nProcesses, nShards)
+        for constraint in self.constraints:
+            self._setShardCurrent(constraint)
+            try:
+                with self._stage('query', constraint):
+                    self.getData(constraint)
+            except UserWarning:
+                # No visits in any shard.
+                for shard in range(nShards):
+                    for b in self.currentBundleDict.values():
+                        b.writeShard(shard, nShards, outDir=self.outDir)
+                continue
+            except ValueError:
+                self._warnSkipped(constraint)
+                continue
+            simData = self.simData
+            if nProcesses > 1:
+                # Fork the workers, so they share this group (and its bundles and visits) without pickling.
+                _shardGroup = self
+                _shardData = simData
+                try:
+                    with multiprocessing.get_context('fork').Pool(nProcesses) as pool:
+                        pool.map(_runShard, [(constraint, shard, nShards) for shard in range(nShards)])
+                finally:
+                    _shardGroup = None
+                    _shardData = None
+            else:
+                for shard in range(nShards):
+                    self.runShardCurrent(constraint, shard, nShards, simData=simData)
+        self.mergeShards(nShards, clearMemory=clearMemory, plotNow=plotNow, plotKwargs=plotKwargs)
+
+    def runShard(self, shard, nShards):
+        """Calculate the partial states of the metrics, over all constraints, for one shard of the visits,
+        and save them (in outDir) for mergeShards.
+
+        The visits are split into shards by night (shard i holds the nights where night % nShards == i),
+        so that each shard can be queried from the database separately.
+
+        Parameters
+        ----------
+        shard : int
+            The shard to run (from 0 to nShards - 1).
+        nShards : int
+            The number of shards the visits are split into.
+        """
+        for constraint in self.constraints:
+            self.runShardCurrent(constraint, shard, nShards)
+
+    def runShardCurrent(self, constraint, shard, nShards, simData=None):
+        """Calculate the partial states of the metrics which match this constraint, for one shard of
+        the visits, and save them (in outDir) for mergeShardsCurrent.
+
+        Parameters
+        ----------
+        constraint : str
+           constraint to use to set the currently active metrics
+        shard : int
+            The shard to run (from 0 to nShards - 1).
+        nShards : int
+            The number of shards the visits are split into.
+        simData : numpy.ndarray, opt
+           If simData is not None, then the visits of this shard are taken from this numpy
+           structured array instead of querying the data from the dbObj.
+        """
+        if shard < 0 or shard >= nShards:
+            raise ValueError('shard must be between 0 and nShards - 1 (got %d of %d).' % (shard, nShards))
+        self._setShardCurrent(constraint)
+
+        if simData is not None:
+            self.simData = simData[simData[self.nightCol] % nShards == shard]
+        else:
+            self.simData = None
+            shardConstraint = self._addConstraint(constraint, '%s %% %d = %d'
+                                                  % (self.nightCol, nShards, shard))
+            try:
+                with self._stage('query', shardConstraint):
+                    self.getData(shardConstraint)
+            except UserWarning:
+                self.simData = None
+            except ValueError:
+                self._warnSkipped(constraint)
+                return
+        if self.simData is None or len(self.simData) == 0:
+            for b in self.currentBundleDict.values():
+                b.writeShard(shard, nShards, outDir=self.outDir)
+            return
+
+        self._sortSimData()
+        self._findCompatibleLists()
+        self.shard = shard
+        self.nShards = nShards
+        try:
+            for compatibleList in self.compatibleLists:
+                if self.verbose:
+                    print('Running shard %d of %d: ' % (shard, nShards), compatibleList)
+                self._runCompatible(compatibleList)
+        finally:
+            self.shard = None
+            self.nShards = None
+
+    def _setShardCurrent(self, constraint):
+        """Set the currentBundleDict for a sharded run of this constraint (checking that all of its
+        metrics are mergeable), and the columns needed from the database.
+        """
+        self.setCurrent(constraint)
+        notMergeable = [b.fileRoot for b in self.currentBundleDict.values() if not b.metric.isMergeable()]
+        if len(notMergeable) > 0:
+            raise ValueError('Cannot run metrics in shards, as they do not have mergeable partial states: %s'
+                             % (notMergeable))
+        self.dbCols = [self.nightCol]
+        for b in self.currentBundleDict.values():
+            self.dbCols.extend(b.dbCols)
+        self.dbCols = list(set(self.dbCols))
+
+    def _warnSkipped(self, constraint):
+        """Warn that the current metricBundles are skipped, as a column they need is not in the database.
+        """
+        warnings.warn('One or more of the columns requested from the database was not available.' +
+                      ' Skipping constraint %s' % constraint)
+        metricsSkipped = []
+        for b in self.currentBundleDict.values():
+            metricsSkipped.append("%s : %s : %s" % (b.metric.name, b.metadata, b.slicer.slicerName))
+        warnings.warn(' This means skipping metrics %s' % metricsSkipped)
+
+    def mergeShards(self, nShards, clearMemory=False, plotNow=False, plotKwargs=None):
+        """Merge the partial states saved by runShard for all nShards shards of the visits, over all
+        constraints, then run the reduce functions and summary statistics.
+
+        Parameters
+        ----------
+        nShards : int
+            The number of shards the visits were split into.
+        clearMemory : bool, opt
+            If True, deletes metric values from memory after merging each constraint group.
+        plotNow : bool, opt
+            If True, plots the metric values immediately after they are merged.
+        plotKwargs : bool, opt
+            kwargs to pass to plotCurrent.
+        """
+        for constraint in self.constraints:
+            self.mergeShardsCurrent(constraint, nShards, clearMemory=clearMemory,
+                                    plotNow=plotNow, plotKwargs=plotKwargs)
+
+    def mergeShardsCurrent(self, constraint, nShards, clearMemory=False, plotNow=False, plotKwargs=None):
+        """Merge the partial states saved by runShardCurrent for all nShards shards of the visits,
+        for the metricBundles which match this constraint, then run their reduce functions and
+        summary statistics.
+
+        The merged metric values are the same as those calculated by runCurrent from all of the visits.
+
+        Parameters
+        ----------
+        constraint : str
+           constraint to use to set the currently active metrics
+        nShards : int
+            The number of shards the visits were split into.
+        clearMemory : bool, opt
+           If True, metric values are deleted from memory after they are merged (and saved to disk).
+        plotNow : bool, opt
+           Plot immediately after merging the metric values.
+        plotKwargs : kwargs, opt
+           Plotting kwargs to pass to plotCurrent.
+        """
+        self.setCurrent(constraint)
+        merged = {}
+        for k, b in self.currentBundleDict.items():
+            try:
+                result = self._mergeShardStates(b, nShards)
+            except IOError as e:
+                warnings.warn('%s Skipping metric %s.' % (e, b.fileRoot))
+                continue
+            if result is None:
+                warnings.warn('No data matching constraint %s in any shard; skipping metric %s.'
+                              % (constraint, b.fileRoot))
+                continue
+            states, noVisits, b.slicer = result
+            b._setupMetricValues()
+            self._finalizeStates(b, states, noVisits)
+            self.hasRun[k] = True
+            merged[k] = b
+            if self.saveEarly:
+                b.write(outDir=self.outDir, resultsDb=self.resultsDb)
+            else:
+                b.writeDb(resultsDb=self.resultsDb)
+        self.currentBundleDict = merged
+        if self.verbose:
+            print('Merged %d shards. Running reduce methods and summary statistics.' % (nShards))
+        self.reduceCurrent()
+        self.summaryCurrent()
+        if plotNow:
+            if plotKwargs is None:
+                self.plotCurrent()
+            else:
+                self.plotCurrent(**plotKwargs)
+        if clearMemory:
+            for b in self.currentBundleDict.values():
+                b.metricValues = None
+
+    def _mergeShardStates(self, b, nShards):
+        """Read and merge the partial states of metricBundle b from all nShards shards.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray, lsst.sims.maf.slicer
+            The merged states, the boolean array which is True for slicePoints without visits in any
+            shard, and the slicer. None if no shard had visits.
+        """
+        states = None
+        for shard in range(nShards):
+            shardStates, shardNoVisits, shardSlicer = b.readShard(shard, nShards, outDir=self.outDir)
+            if shardStates is None:
+                continue
+            if states is None:
+                states, noVisits, slicer = shardStates, shardNoVisits, shardSlicer
+            elif shardStates.shape != states.shape:
+                raise ValueError('The slicePoints of shard %d of %s do not match the other shards.'
+                                 % (shard, b.fileRoot))
+            else:
+                states = b.metric.mergeStates(states, shardStates)
+                noVisits = noVisits & shardNoVisits
+        if states is None:
+            return None
+        return states, noVisits, slicer
+
     def getData(self, constraint):
         """Query the data from the database.
 
@@ -380,6 +778,89 @@ class MetricBundleGroup(object):
             self.fieldData = None
 
 
+    def _sortSimData(self):
+        """Sort simData by time (the first of timeCols present), if it is not already in time order.
+
+        The slicers then return the visits at each slicePoint in time order (see _timeOrderedIdxs),
+        which means metrics do not have to sort each dataSlice themselves.
+        """
+        self.timeCol = None
+        if self.simData is None or self.simData.dtype.names is None:
+            return
+        for col in self.timeCols:
+            if col in self.simData.dtype.names:
+                self.timeCol = col
+                break
+        if self.timeCol is None:
+            return
+        times = self.simData[self.timeCol]
+        if np.any(times[1:] < times[:-1]):
+            self.simData = self.simData[np.argsort(times, kind='mergesort')]
+
+    def _timeOrderedIdxs(self, idxs):
+        """Return the simData indexes for a slice (as an integer array) in increasing
+        (and so, after _sortSimData, time) order.
+        """
+        idxs = np.asarray(idxs)
+        if idxs.dtype == bool:
+            return np.flatnonzero(idxs)
+        idxs = idxs.astype(int, copy=False)
+        if self.timeCol is not None and idxs.size > 1 and np.any(idxs[1:] < idxs[:-1]):
+            idxs = np.sort(idxs)
+        return idxs
+
+    def _runBatch(self, batchBundles, sliceNums, sliceIdxs, slicePoints):
+        """Calculate the metric values for the metrics with a vectorized runBatch method,
+        for all of the slicePoints in sliceNums at once.
+        """
+        offsets = np.zeros(len(sliceIdxs) + 1, dtype=int)
+        np.cumsum([len(idxs) for idxs in sliceIdxs], out=offsets[1:])
+        dataSlices = self.simData[np.concatenate(sliceIdxs)]
+        for b in batchBundles:
+            values = self._runMetricBatch(b, dataSlices, offsets, slicePoints)
+            for i, value in zip(sliceNums, values):
+                b.metricValues.data[i] = value
+
+    def _runSliceOffsets(self, batchBundles, slicer, sliceNums, simIdxs, offsets):
+        """Calculate the metric values for the metrics with a vectorized runBatch method, for all of the
+        slicePoints in sliceNums at once, where the data in each slice is a contiguous range of simIdxs
+        (see BaseSlicer.sliceOffsets). Slices without data are masked.
+        """
+        starts = offsets[sliceNums]
+        lengths = offsets[np.asarray(sliceNums) + 1] - starts
+        empty = lengths == 0
+        for b in batchBundles:
+            b.metricValues.mask[sliceNums[empty]] = True
+        sliceNums = sliceNums[~empty]
+        starts = starts[~empty]
+        lengths = lengths[~empty]
+        sliceOffsets = utils.segmentOffsets(lengths)
+        # The positions in simIdxs of the data in each slice (one contiguous range after another).
+        positions = np.arange(sliceOffsets[-1]) + np.repeat(starts - sliceOffsets[:-1], lengths)
+        idxs = simIdxs[positions]
+        if self.timeCol is not None:
+            # As in _timeOrderedIdxs, the data in each slice in time order.
+            order = utils.segmentedArgsort(idxs, sliceOffsets)
+            if order is not None:
+                idxs = idxs[order]
+        # Calculate the values in batches of up to batchSize visits (and at least one slice).
+        first = 0
+        while first < len(sliceNums):
+            last = np.searchsorted(sliceOffsets, sliceOffsets[first] + self.batchSize, side='right') - 1
+            last = min(max(last, first + 1), len(sliceNums))
+            dataSlices = self.simData[idxs[sliceOffsets[first]:sliceOffsets[last]]]
+            batchOffsets = sliceOffsets[first:last + 1] - sliceOffsets[first]
+            batchNums = sliceNums[first:last]
+            slicePoints = _SlicePointList(slicer, batchNums)
+            for b in batchBundles:
+                values = self._runMetricBatch(b, dataSlices, batchOffsets, slicePoints)
+                if b.metricValues.dtype.name == 'object':
+                    for i, value in zip(batchNums, values):
+                        b.metricValues.data[i] = value
+                else:
+                    b.metricValues.data[batchNums] = values
+            first = last
+
     def _runCompatible(self, compatibleList):
         """Runs a set of 'compatible' metricbundles in the MetricBundleGroup dictionary,
         identified by 'compatibleList' keys.
@@ -421,21 +902,24 @@ class MetricBundleGroup(object):
             if isinstance(s, BaseDitherStacker):
                 ditherStackers.append(s)
         for stacker in ditherStackers:
-            self.simData = stacker.run(self.simData, override=True)
+            with self._stage('stacker', stacker.__class__.__name__):
+                self.simData = stacker.run(self.simData, override=True)
             uniqStackers.remove(stacker)
 
         for stacker in uniqStackers:
             # Note that stackers will clobber previously existing rows with the same name.
-            self.simData = stacker.run(self.simData, override=True)
+            with self._stage('stacker', stacker.__class__.__name__):
+                self.simData = stacker.run(self.simData, override=True)
 
         # Pull out one of the slicers to use as our 'slicer'.
         # This will be forced back into all of the metricBundles at the end (so that they track
         #  the same metadata such as the slicePoints, in case the same actual object wasn't used).
         slicer = list(bDict.values())[0].slicer
-        if (slicer.slicerName == 'OpsimFieldSlicer'):
-            slicer.setupSlicer(self.simData, self.fieldData, maps=uniqMaps)
-        else:
-            slicer.setupSlicer(self.simData, maps=uniqMaps)
+        with self._stage('slicer', slicer.slicerName):
+            if (slicer.slicerName == 'OpsimFieldSlicer'):
+                slicer.setupSlicer(self.simData, self.fieldData, maps=uniqMaps)
+            else:
+                slicer.setupSlicer(self.simData, maps=uniqMaps)
         # Copy the slicer (after setup) back into the individual metricBundles.
         if slicer.slicerName != 'HealpixSlicer' or slicer.slicerName != 'UniSlicer':
             for b in bDict.values():
@@ -445,6 +929,206 @@ class MetricBundleGroup(object):
         for b in bDict.values():
             b._setupMetricValues()
 
+        if self.shard is not None:
+            # Only save the partial states of this shard; they become metric values when merged.
+            self._runShardStates(slicer, bDict)
+            return
+        if self.incremental:
+            if self._dropMismatchedStates(slicer, bDict) and self.nightCutConstraint is not None:
+                # The query only included the nights after the saved states: query all of the visits
+                # and start this compatible set again.
+                with self._stage('query', self.nightCutConstraint):
+                    self.getData(self.nightCutConstraint)
+                self.nightCutConstraint = None
+                self._sortSimData()
+                self._runCompatible(compatibleList)
+                return
+            self._runIncremental(slicer, bDict)
+        elif isinstance(slicer, AdaptiveHealpixSlicer):
+            # Calculate the metric values at the coarse slicePoints, then where the slicer refines the grid.
+            sliceNums = slicer.startRefinement()
+            while len(sliceNums) > 0:
+                self._runSlicePoints(slicer, bDict, sliceNums)
+                sliceNums = slicer.refine([b.metricValues for b in bDict.values()])
+            for b in bDict.values():
+                slicer.expand(b.metricValues)
+            if self.verbose:
+                print('Evaluated metrics at %d of %d slicePoints (saving %d evaluations).'
+                      % (slicer.nEvaluated, slicer.nslice, slicer.nSaved))
+        else:
+            self._runSlicePoints(slicer, bDict, np.arange(slicer.nslice))
+
+        if self.profiler is not None:
+            # Record the peak memory after calculating the metrics.
+            for b in bDict.values():
+                self.profiler.add('metric', b.fileRoot, 0., nCalls=0)
+
+        # Save data to disk as we go, although this won't keep summary values, etc. (just failsafe).
+        for b in bDict.values():
+            with self._stage('write', b.fileRoot):
+                if self.saveEarly:
+                    b.write(outDir=self.outDir, resultsDb=self.resultsDb)
+                else:
+                    b.writeDb(resultsDb=self.resultsDb)
+
+    def _incrementalConstraint(self, constraint):
+        """Return the constraint for the visits needed by an incremental run of the current bundles.
+
+        Only the visits after the last night included in the saved states are needed, if all of the
+        current metrics are mergeable and have saved states; otherwise all of the visits are needed.
+        """
+        lastNights = []
+        for k, b in self.currentBundleDict.items():
+            if self.states[k] is None or not b.metric.isMergeable():
+                return constraint
+            lastNights.append(int(self.states[k]['lastNight']))
+        if len(lastNights) == 0:
+            return constraint
+        return self._addConstraint(constraint, '%s > %d' % (self.nightCol, min(lastNights)))
+
+    def _addConstraint(self, constraint, extra):
+        """Return the combination of constraint (which may be empty) and an extra constraint.
+        """
+        if constraint is None or constraint == '':
+            return extra
+        return '(%s) and %s' % (constraint, extra)
+
+    def _dropMismatchedStates(self, slicer, bDict):
+        """Discard the saved states of the metricBundles in bDict which do not match slicer (so their
+        metric values are recalculated from all of the visits).
+
+        Returns
+        -------
+        bool
+            True if any saved state was discarded.
+        """
+        dropped = False
+        for k, b in bDict.items():
+            saved = self.states.get(k)
+            if saved is not None and saved['nVisits'].size != slicer.nslice:
+                warnings.warn('Saved state for %s does not match its slicer; recalculating from all visits.'
+                              % (b.fileRoot))
+                self.states[k] = None
+                dropped = True
+        return dropped
+
+    def _runIncremental(self, slicer, bDict):
+        """Update the metric values of the metricBundles in bDict (a compatible set, sharing slicer)
+        with the visits after the last night included in their saved states, and save the new states.
+
+        Mergeable metrics merge the partial state of the new visits at each slicePoint into the saved
+        state. Other metrics are recalculated (from all of the visits) at the slicePoints with new visits,
+        and keep their saved values elsewhere. Bundles without a saved state use all of the visits.
+        """
+        nights = self.simData[self.nightCol]
+        lastNight = {}
+        nVisits = {}
+        states = {}
+        for k, b in bDict.items():
+            saved = self.states.get(k)
+            lastNight[k] = None if saved is None else int(saved['lastNight'])
+            nVisits[k] = np.zeros(slicer.nslice, int) if saved is None else saved['nVisits'].copy()
+            if b.metric.isMergeable():
+                if saved is None:
+                    states[k] = np.tile(b.metric.initState(), (slicer.nslice, 1))
+                else:
+                    states[k] = saved['states'].copy()
+            elif saved is None:
+                b.metricValues.mask[:] = True
+            else:
+                b.metricValues.data[:] = saved['metricValues']
+                b.metricValues.mask[:] = saved['mask']
+
+        nUpdated = 0
+        for i in range(slicer.nslice):
+            slice_i = slicer[i]
+            idxs = self._timeOrderedIdxs(slice_i['idxs'])
+            if len(idxs) == 0:
+                continue
+            # The data (and SliceContexts) at this slicePoint, for each last night (None for all visits).
+            dataSlices = {}
+            updated = False
+            for k, b in bDict.items():
+                newIdxs = idxs if lastNight[k] is None else idxs[nights[idxs] > lastNight[k]]
+                if len(newIdxs) == 0:
+                    continue
+                updated = True
+                nVisits[k][i] += len(newIdxs)
+                key = lastNight[k] if b.metric.isMergeable() else None
+                if key not in dataSlices:
+                    dataSlice = self.simData[newIdxs] if b.metric.isMergeable() else self.simData[idxs]
+                    dataSlices[key] = (dataSlice, SliceContext.share(dataSlice, slice_i['slicePoint'],
+                                                                     len(bDict)))
+                dataSlice, slicePoint = dataSlices[key]
+                if b.metric.isMergeable():
+                    states[k][i] = b.metric.updateState(states[k][i], dataSlice, slicePoint=slicePoint)
+                else:
+                    b.metricValues.data[i] = b.metric.run(dataSlice, slicePoint=slicePoint)
+                    b.metricValues.mask[i] = False
+            nUpdated += updated
+        if self.verbose:
+            print('Updated metric values at %d of %d slicePoints.' % (nUpdated, slicer.nslice))
+
+        for k, b in bDict.items():
+            if b.metric.isMergeable():
+                self._finalizeStates(b, states[k], nVisits[k] == 0)
+            else:
+                self._maskBadValues(b)
+            # Save the state for the next incremental run.
+            newLastNight = nights.max() if lastNight[k] is None else max(lastNight[k], nights.max())
+            state = {'lastNight': newLastNight, 'nVisits': nVisits[k]}
+            if b.metric.isMergeable():
+                state['states'] = states[k]
+            else:
+                state['metricValues'] = b.metricValues.data
+                state['mask'] = np.ma.getmaskarray(b.metricValues)
+            b.writeState(self.outDir, **state)
+
+    def _runShardStates(self, slicer, bDict):
+        """Calculate the partial states of the metrics of the metricBundles in bDict (a compatible set,
+        sharing slicer) at each slicePoint, from the visits of the current shard, and save them.
+        """
+        states = {k: np.tile(b.metric.initState(), (slicer.nslice, 1)) for k, b in bDict.items()}
+        noVisits = np.ones(slicer.nslice, dtype=bool)
+        for i in range(slicer.nslice):
+            slice_i = slicer[i]
+            idxs = self._timeOrderedIdxs(slice_i['idxs'])
+            if len(idxs) == 0:
+                continue
+            noVisits[i] = False
+            dataSlice = self.simData[idxs]
+            slicePoint = SliceContext.share(dataSlice, slice_i['slicePoint'], len(bDict))
+            for k, b in bDict.items():
+                states[k][i] = b.metric.calcState(dataSlice, slicePoint=slicePoint)
+        for k, b in bDict.items():
+            b.writeShard(self.shard, self.nShards, states=states[k], noVisits=noVisits, outDir=self.outDir)
+
+    def _finalizeStates(self, b, states, noVisits):
+        """Set the metric values of metricBundle b from the partial states of its metric at each slicePoint,
+        masking the slicePoints without visits (noVisits) and those where the metric value is bad.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            b.metricValues.data[:] = b.metric.finalizeState(states)
+        b.metricValues.mask[:] = False
+        b.metricValues.mask[noVisits] = True
+        self._maskBadValues(b)
+
+    def _maskBadValues(self, b):
+        """Mask the metric values of metricBundle b where the metric could not be computed
+        (according to the metric bad value).
+        """
+        if b.metricValues.dtype.name == 'object':
+            for ind, val in enumerate(b.metricValues.data):
+                if val is b.metric.badval:
+                    b.metricValues.mask[ind] = True
+        else:
+            b.metricValues.mask = np.where(b.metricValues.data == b.metric.badval,
+                                           True, b.metricValues.mask)
+
+    def _runSlicePoints(self, slicer, bDict, sliceNums):
+        """Calculate the metric values of the metricBundles in bDict (a compatible set, sharing slicer),
+        at the slicePoints sliceNums.
+        """
         # Set up an ordered dictionary to be the cache if needed:
         # (Currently using OrderedDict, it might be faster to use 2 regular Dicts instead)
         if slicer.cacheSize > 0:
@@ -452,18 +1136,48 @@ class MetricBundleGroup(object):
             cache = True
         else:
             cache = False
-        # Run through all slicepoints and calculate metrics.
-        for i, slice_i in enumerate(slicer):
-            slicedata = self.simData[slice_i['idxs']]
-            if len(slicedata) == 0:
+        # Metrics which can be vectorized over slicePoints are calculated for many slicePoints at once,
+        # in batches of up to batchSize visits.
+        batchBundles = [b for b in bDict.values() if b.metric.hasBatch()]
+        sliceBundles = [b for b in bDict.values() if not b.metric.hasBatch()]
+        sliceIndex = slicer.sliceOffsets() if len(batchBundles) > 0 else None
+        if sliceIndex is not None:
+            # The data in each slice is a contiguous range of one index array (as for the OneDSlicer),
+            # so these metrics are calculated for all of the slices at once.
+            self._runSliceOffsets(batchBundles, slicer, np.asarray(sliceNums), *sliceIndex)
+            batchBundles = []
+        batchSlices = []
+        batchIdxs = []
+        batchPoints = []
+        nBatch = 0
+        # Run through all slicepoints and calculate metrics (unless all of the metrics have been calculated).
+        for i in (sliceNums if len(batchBundles) + len(sliceBundles) > 0 else []):
+            slice_i = slicer[i]
+            idxs = self._timeOrderedIdxs(slice_i['idxs'])
+            if len(idxs) == 0:
                 # No data at this slicepoint. Mask data values.
                 for b in bDict.values():
                     b.metricValues.mask[i] = True
-            else:
-                # There is data! Should we use our data cache?
+                continue
+            if len(batchBundles) > 0:
+                batchSlices.append(i)
+                batchIdxs.append(idxs)
+                batchPoints.append(slice_i['slicePoint'])
+                nBatch += len(idxs)
+                if nBatch >= self.batchSize:
+                    self._runBatch(batchBundles, batchSlices, batchIdxs, batchPoints)
+                    batchSlices = []
+                    batchIdxs = []
+                    batchPoints = []
+                    nBatch = 0
+            if len(sliceBundles) > 0:
+                slicedata = self.simData[idxs]
+                # Share the quantities derived from the data between the metrics.
+                slicePoint = SliceContext.share(slicedata, slice_i['slicePoint'], len(sliceBundles))
+                # Should we use our data cache?
                 if cache:
                     # Make the data idxs hashable.
-                    cacheKey = frozenset(slice_i['idxs'])
+                    cacheKey = frozenset(idxs)
                     # If key exists, set flag to use it, otherwise add it
                     if cacheKey in cacheDict:
                         useCache = True
@@ -474,37 +1188,31 @@ class MetricBundleGroup(object):
                     else:
                         cacheDict[cacheKey] = i
                         useCache = False
-                    for b in bDict.values():
+                    for b in sliceBundles:
                         if useCache:
                             b.metricValues.data[i] = b.metricValues.data[cacheDict[cacheKey]]
                         else:
-                            b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+                            b.metricValues.data[i] = self._runMetric(b, slicedata, slicePoint)
                     # If we are above the cache size, drop the oldest element from the cache dict.
                     if len(cacheDict) > slicer.cacheSize:
                         del cacheDict[list(cacheDict.keys())[0]]
 
                 # Not using memoize, just calculate things normally
                 else:
-                    for b in bDict.values():
-                        b.metricValues.data[i] = b.metric.run(slicedata, slicePoint=slice_i['slicePoint'])
+                    for b in sliceBundles:
+                        b.metricValues.data[i] = self._runMetric(b, slicedata, slicePoint)
+        if len(batchSlices) > 0:
+            self._runBatch(batchBundles, batchSlices, batchIdxs, batchPoints)
         # Mask data where metrics could not be computed (according to metric bad value).
         for b in bDict.values():
             if b.metricValues.dtype.name == 'object':
-                for ind, val in enumerate(b.metricValues.data):
-                    if val is b.metric.badval:
+                for ind in sliceNums:
+                    if b.metricValues.data[ind] is b.metric.badval:
                         b.metricValues.mask[ind] = True
             else:
                 # For some reason, this doesn't work for dtype=object arrays.
-                b.metricValues.mask = np.where(b.metricValues.data == b.metric.badval,
-                                               True, b.metricValues.mask)
-
-        # Save data to disk as we go, although this won't keep summary values, etc. (just failsafe).
-        if self.saveEarly:
-            for b in bDict.values():
-                b.write(outDir=self.outDir, resultsDb=self.resultsDb)
-        else:
-            for b in bDict.values():
-                b.writeDb(resultsDb=self.resultsDb)
+                b.metricValues.mask[sliceNums] = np.where(b.metricValues.data[sliceNums] == b.metric.badval,
+                                                          True, b.metricValues.mask[sliceNums])
 
     def reduceAll(self, updateSummaries=True):
         """Run the reduce methods for all metrics in bundleDict.
@@ -539,16 +1247,18 @@ class MetricBundleGroup(object):
             if len(b.metric.reduceFuncs) > 0:
                 # Apply reduce functions, creating a new metricBundle in the process (new metric values).
                 for reduceFunc in b.metric.reduceFuncs.values():
-                    newmetricbundle = b.reduceMetric(reduceFunc)
+                    with self._stage('reduce', b.fileRoot):
+                        newmetricbundle = b.reduceMetric(reduceFunc)
                     # Add the new metricBundle to our metricBundleGroup dictionary.
                     name = newmetricbundle.metric.name
                     if name in self.bundleDict:
                         name = newmetricbundle.fileRoot
                     reduceBundleDict[name] = newmetricbundle
-                    if self.saveEarly:
-                        newmetricbundle.write(outDir=self.outDir, resultsDb=self.resultsDb)
-                    else:
-                        newmetricbundle.writeDb(resultsDb=self.resultsDb)
+                    with self._stage('write', newmetricbundle.fileRoot):
+                        if self.saveEarly:
+                            newmetricbundle.write(outDir=self.outDir, resultsDb=self.resultsDb)
+                        else:
+                            newmetricbundle.writeDb(resultsDb=self.resultsDb)
                 # Remove summaryMetrics from top level metricbundle if desired.
                 if updateSummaries:
                     b.summaryMetrics = []
@@ -567,11 +1277,33 @@ class MetricBundleGroup(object):
             self.setCurrent(constraint)
             self.summaryCurrent()
 
+    def _precomputePowerSpectra(self):
+        """Calculate the power spectra needed by the TotalPowerMetric summary statistics of the
+        current bundles, in a pool of powerSpectrumProcesses processes.
+
+        The power spectra are stored in utils.powerSpectrumCache, where the summary metrics
+        (and the HealpixPowerSpectrum plotter) will find them.
+        """
+        maps = {}
+        for b in self.currentBundleDict.values():
+            if b.summaryMetrics is None or b.metricValues is None:
+                continue
+            for m in b.summaryMetrics:
+                if isinstance(m, TotalPowerMetric):
+                    maps.setdefault(m.removeDipole, []).append(b.metricValues.filled(m.maskVal))
+        for removeDipole in maps:
+            utils.powerSpectrumCache.precompute(maps[removeDipole], removeDipole=removeDipole,
+                                                nProcesses=self.powerSpectrumProcesses)
+
     def summaryCurrent(self):
         """Run summary statistics on all the metricBundles in the currently active set of MetricBundles.
         """
+        if self.powerSpectrumProcesses > 1:
+            with self._stage('summary', 'powerSpectra'):
+                self._precomputePowerSpectra()
         for b in self.currentBundleDict.values():
-            b.computeSummaryStats(self.resultsDb)
+            with self._stage('summary', b.fileRoot):
+                b.computeSummaryStats(self.resultsDb)
 
     def plotAll(self, savefig=True, outfileSuffix=None, figformat='pdf', dpi=600, trimWhitespace=True,
                 thumbnail=True, closefigs=True):
@@ -607,6 +1339,7 @@ class MetricBundleGroup(object):
             self.setCurrent(constraint)
             self.plotCurrent(savefig=savefig, outfileSuffix=outfileSuffix, figformat=figformat, dpi=dpi,
                              trimWhitespace=trimWhitespace, thumbnail=thumbnail, closefigs=closefigs)
+        self.writeProfile()
 
     def plotCurrent(self, savefig=True, outfileSuffix=None, figformat='pdf', dpi=600, trimWhitespace=True,
                     thumbnail=True, closefigs=True):
@@ -637,14 +1370,15 @@ class MetricBundleGroup(object):
                                   trimWhitespace=trimWhitespace, thumbnail=thumbnail)
 
         for b in self.currentBundleDict.values():
-            try:
-                b.plot(plotHandler=plotHandler, outfileSuffix=outfileSuffix, savefig=savefig)
-            except ValueError as ve:
-                message = 'Plotting failed for metricBundle %s.' % (b.fileRoot)
-                message += ' Error message: %s' % (ve)
-                warnings.warn(message)
-            if closefigs:
-                plt.close('all')
+            with self._stage('plot', b.fileRoot):
+                try:
+                    b.plot(plotHandler=plotHandler, outfileSuffix=outfileSuffix, savefig=savefig)
+                except ValueError as ve:
+                    message = 'Plotting failed for metricBundle %s.' % (b.fileRoot)
+                    message += ' Error message: %s' % (ve)
+                    warnings.warn(message)
+                if closefigs:
+                    plt.close('all')
         if self.verbose:
             print('Plotting complete.')
 
@@ -666,7 +1400,8 @@ class MetricBundleGroup(object):
             else:
                 print('Saving metric bundles.')
         for b in self.currentBundleDict.values():
-            b.write(outDir=self.outDir, resultsDb=self.resultsDb)
+            with self._stage('write', b.fileRoot):
+                b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
     def readAll(self):
         """Attempt to read all MetricBundles from disk.
@@ -1,6 +1,7 @@
 from __future__ import print_function
 from builtins import object
 import os
+import time
 import warnings
 import numpy as np
 import numpy.ma as ma
@@ -12,6 +13,7 @@ from lsst.sims.maf.slicers import MoObjSlicer
 from lsst.sims.maf.stackers import BaseMoStacker, MoMagStacker
 from lsst.sims.maf.plots import PlotHandler
 from lsst.sims.maf.plots import MetricVsH
+from lsst.sims.maf.utils import RunProfiler, noStage
 
 from .metricBundle import MetricBundle
 
@@ -227,7 +229,24 @@ class MoMetricBundle(MetricBundle):
 
 
 class MoMetricBundleGroup(object):
-    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True):
+    """Calculate the metric values (and child metric values and summary statistics) for a group of
+    MoMetricBundles, which all use the same MoObjSlicer.
+
+    Parameters
+    ----------
+    bundleDict : dict of MoMetricBundles
+        The MoMetricBundles to calculate.
+    outDir : str, opt
+        Directory to save the metric results. Default is the current directory.
+    resultsDb : ResultsDb, opt
+        A results database, which saves information about the metrics calculated. Default None.
+    verbose : bool, opt
+        Flag to turn on/off verbose feedback. Default True.
+    profile : bool, opt
+        If True, record the wall time and peak memory of each stage of the run (as for the
+        MetricBundleGroup; see profileReport and writeProfile). Default False.
+    """
+    def __init__(self, bundleDict, outDir='.', resultsDb=None, verbose=True, profile=False):
         self.verbose = verbose
         self.bundleDict = bundleDict
         self.outDir = outDir
@@ -241,6 +260,55 @@ class MoMetricBundleGroup(object):
                 raise ValueError('Currently, the slicers for the MoMetricBundleGroup must be equal,'
                                  ' using the same observations and Hvals.')
         self.constraints = list(set([b.constraint for b in bundleDict.values()]))
+        # Record the time and memory of each stage of the run, if profiling.
+        self.profiler = RunProfiler() if profile else None
+
+    def _stage(self, stage, name=None):
+        """Return a context manager recording the wall time and peak memory of a stage of the run
+        (if profiling).
+        """
+        if self.profiler is None:
+            return noStage()
+        return self.profiler.stage(stage, name)
+
+    def _allBundles(self):
+        """Return all of the MoMetricBundles, including the child bundles.
+        """
+        bundles = []
+        for b in self.bundleDict.values():
+            bundles.append(b)
+            bundles.extend(b.childBundles.values())
+        return bundles
+
+    def profileReport(self, format='text', sortBy='wallTime'):
+        """Return a report of the time and memory used by each stage of the run (if profiling).
+
+        Parameters
+        ----------
+        format : str, opt
+            'text' (a table) or 'json'. Default 'text'.
+        sortBy : str, opt
+            The column to sort the stages by: wallTime, nCalls, peakMemory, stage or name.
+            Default wallTime (the slowest stages first).
+
+        Returns
+        -------
+        str
+        """
+        if self.profiler is None:
+            raise ValueError('This MoMetricBundleGroup was not set up to profile its run (set profile=True).')
+        return self.profiler.report(format=format, sortBy=sortBy)
+
+    def writeProfile(self, filename=None, format='text'):
+        """Save the profile of the run in the profiles table of the resultsDb, and optionally write the
+        profile report to filename in outDir (see MetricBundleGroup.writeProfile).
+        """
+        if self.profiler is None:
+            return
+        if self.resultsDb is not None:
+            self.profiler.writeResultsDb(self.resultsDb, self._allBundles())
+        if filename is not None:
+            self.profiler.writeReport(os.path.join(self.outDir, filename), format=format)
 
     def _checkCompatible(self, metricBundle1, metricBundle2):
         """Check if two MetricBundles are "compatible".
@@ -333,7 +401,8 @@ class MoMetricBundleGroup(object):
             return
         # Identify the observations which are relevant for this constraint.
         # This sets slicer.obs (valid for all H values).
-        self.slicer.subsetObs(constraint)
+        with self._stage('slicer', constraint):
+            self.slicer.subsetObs(constraint)
         # Identify the sets of these metricBundles can be run at the same time (also have the same stackers).
         compatibleLists = self._findCompatible(keysMatchingConstraint)
 
@@ -381,7 +450,8 @@ class MoMetricBundleGroup(object):
             b._setupMetricValues()
             for cb in b.childBundles.values():
                 cb._setupMetricValues()
-        # Calculate the metric values.
+        # Calculate the metric values (recording the time of each stacker and metric, if profiling).
+        profile = self.profiler is not None
         for i, slicePoint in enumerate(self.slicer):
             ssoObs = slicePoint['obs']
             for j, Hval in enumerate(slicePoint['Hvals']):
@@ -389,7 +459,11 @@ class MoMetricBundleGroup(object):
                 with warnings.catch_warnings():
                     warnings.simplefilter('ignore')
                     for s in uniqStackers:
+                        if profile:
+                            t0 = time.time()
                         ssoObs = s.run(ssoObs, slicePoint['orbit']['H'], Hval)
+                        if profile:
+                            self.profiler.addCall('stacker', s.__class__.__name__, time.time() - t0)
                 # Run all the parent metrics.
                 for k in compatibleList:
                     b = self.bundleDict[k]
@@ -401,7 +475,11 @@ class MoMetricBundleGroup(object):
                     # Otherwise, calculate the metric value for the parent, and then child.
                     else:
                         # Calculate for the parent.
+                        if profile:
+                            t0 = time.time()
                         mVal = b.metric.run(ssoObs, slicePoint['orbit'], Hval)
+                        if profile:
+                            self.profiler.addCall('metric', b.fileRoot, time.time() - t0)
                         # Mask if the parent metric returned a bad value.
                         if mVal == b.metric.badval:
                             b.metricValues.mask[i][j] = True
@@ -411,20 +489,35 @@ class MoMetricBundleGroup(object):
                         else:
                             b.metricValues.data[i][j] = mVal
                             for cb in b.childBundles.values():
+                                if profile:
+                                    t0 = time.time()
                                 childVal = cb.metric.run(ssoObs, slicePoint['orbit'], Hval, mVal)
+                                if profile:
+                                    self.profiler.addCall('metric', cb.fileRoot, time.time() - t0)
                                 if childVal == cb.metric.badval:
                                     cb.metricValues.mask[i][j] = True
                                 else:
                                     cb.metricValues.data[i][j] = childVal
+        if profile:
+            # Record the peak memory after calculating the metrics.
+            for s in uniqStackers:
+                self.profiler.add('stacker', s.__class__.__name__, 0., nCalls=0)
+            for k in compatibleList:
+                for b in [self.bundleDict[k]] + list(self.bundleDict[k].childBundles.values()):
+                    self.profiler.add('metric', b.fileRoot, 0., nCalls=0)
         for k in compatibleList:
             b = self.bundleDict[k]
-            b.computeSummaryStats(self.resultsDb)
+            with self._stage('summary', b.fileRoot):
+                b.computeSummaryStats(self.resultsDb)
             for cB in b.childBundles.values():
-                cB.computeSummaryStats(self.resultsDb)
+                with self._stage('summary', cB.fileRoot):
+                    cB.computeSummaryStats(self.resultsDb)
                 # Write to disk.
-                cB.write(outDir=self.outDir, resultsDb=self.resultsDb)
+                with self._stage('write', cB.fileRoot):
+                    cB.write(outDir=self.outDir, resultsDb=self.resultsDb)
             # Write to disk.
-            b.write(outDir=self.outDir, resultsDb=self.resultsDb)
+            with self._stage('write', b.fileRoot):
+                b.write(outDir=self.outDir, resultsDb=self.resultsDb)
 
     def runAll(self):
         """
@@ -434,6 +527,7 @@ class MoMetricBundleGroup(object):
             self.runConstraint(constraint)
         if self.verbose:
             print('Calculated and saved all metrics.')
+        self.writeProfile()
 
     def plotAll(self, savefig=True, outfileSuffix=None, figformat='pdf', dpi=600, thumbnail=True,
                 closefigs=True):
@@ -443,13 +537,15 @@ class MoMetricBundleGroup(object):
         plotHandler = PlotHandler(outDir=self.outDir, resultsDb=self.resultsDb,
                                   savefig=savefig, figformat=figformat, dpi=dpi, thumbnail=thumbnail)
         for b in self.bundleDict.values():
-            try:
-                b.plot(plotHandler=plotHandler, outfileSuffix=outfileSuffix, savefig=savefig)
-            except ValueError as ve:
-                message = 'Plotting failed for metricBundle %s.' % (b.fileRoot)
-                message += ' Error message: %s' % (ve.message)
-                warnings.warn(message)
-            if closefigs:
-                plt.close('all')
+            with self._stage('plot', b.fileRoot):
+                try:
+                    b.plot(plotHandler=plotHandler, outfileSuffix=outfileSuffix, savefig=savefig)
+                except ValueError as ve:
+                    message = 'Plotting failed for metricBundle %s.' % (b.fileRoot)
+                    message += ' Error message: %s' % (ve.message)
+                    warnings.warn(message)
+                if closefigs:
+                    plt.close('all')
         if self.verbose:
             print('Plotting all metrics.')
+        self.writeProfile()
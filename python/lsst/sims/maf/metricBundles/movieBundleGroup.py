@@ -0,0 +1,186 @@
+from __future__ import print_function
+from builtins import object
+import numpy as np
+
+from lsst.sims.maf.metrics import SliceContext
+
+__all__ = ['MovieBundleGroup']
+
+
+class MovieBundleGroup(object):
+    """Calculate the metric values of a set of MetricBundles for each frame of a cumulative movie.
+
+    The frames are the slicePoints of a (cumulative) MovieSlicer: frame i holds all of the visits up to
+    the end of movie bin i. Rather than setting up the (spatial) slicer of the MetricBundles again and
+    recalculating the metrics from the whole history for every frame, the spatial slicer is set up once
+    (on all of the visits), and the frames are calculated in order: mergeable metrics
+    (see BaseMetric.isMergeable, such as the Count and CountSubset metrics) add only the visits new in
+    each frame to their running partial state at each slicePoint, so a movie costs about as much as a
+    single calculation of these metrics. Other metrics (such as the FilterColors metric, whose values
+    depend on the time of the frame) are recalculated from all of the visits up to each frame.
+
+    For the whole movie, this holds the index of the visits at each slicePoint (ordered by frame),
+    and the frame of each: about one (small) integer of each type per (visit, slicePoint) pair,
+    typically 6 bytes, similar to the index a slicer keeps of the visits at each slicePoint.
+    The new visits of each frame are found from these as the frame is calculated.
+
+    Parameters
+    ----------
+    bundleDict : dict or list of MetricBundles
+        The MetricBundles to calculate for each frame. These must all use the same (spatial) slicer,
+        and have no constraint beyond the data passed to runFrames.
+    movieSlicer : MovieSlicer
+        The cumulative MovieSlicer which sets the frames, already set up on the data passed to runFrames.
+    verbose : bool, opt
+        Flag to turn on/off verbose feedback. Default False.
+    """
+    def __init__(self, bundleDict, movieSlicer, verbose=False):
+        if not isinstance(bundleDict, dict):
+            bundleDict = {i: b for i, b in enumerate(bundleDict)}
+        self.bundleDict = bundleDict
+        if not movieSlicer.cumulative:
+            raise ValueError('The MovieBundleGroup needs a cumulative MovieSlicer.')
+        self.movieSlicer = movieSlicer
+        slicers = [b.slicer for b in self.bundleDict.values()]
+        for slicer in slicers[1:]:
+            if slicer != slicers[0]:
+                raise ValueError('The MetricBundles of a MovieBundleGroup must all use the same slicer.')
+        self.slicer = slicers[0]
+        self.verbose = verbose
+        self.simData = None
+
+    def _setupFrames(self, simData, fieldData=None):
+        """Set up the spatial slicer on all of the visits, and find the frame where each visit
+        first appears at each slicePoint.
+        """
+        stackers = []
+        for b in self.bundleDict.values():
+            for stacker in b.stackerList:
+                if stacker not in stackers:
+                    stackers.append(stacker)
+        for stacker in stackers:
+            simData = stacker.run(simData, override=True)
+        self.simData = simData
+        maps = []
+        for b in self.bundleDict.values():
+            for m in b.mapsList:
+                if m not in maps:
+                    maps.append(m)
+        if self.slicer.slicerName == 'OpsimFieldSlicer':
+            self.slicer.setupSlicer(simData, fieldData, maps=maps)
+        else:
+            self.slicer.setupSlicer(simData, maps=maps)
+        for b in self.bundleDict.values():
+            b.slicer = self.slicer
+            b._setupMetricValues()
+            b.metricValues.mask[:] = True
+
+        # The frame of each visit: the MovieSlicer adds the visits in the order of simIdxs,
+        # with left[i+1] visits in frame i.
+        rank = np.empty(len(simData), int)
+        rank[self.movieSlicer.simIdxs] = np.arange(len(simData))
+        frameOfVisit = np.searchsorted(self.movieSlicer.left[1:], rank, side='right')
+        # The visits of each slicePoint, ordered by frame then visit index, concatenated over the
+        # slicePoints, with the frame of each (in the smallest integer types which hold them).
+        visitType = np.min_scalar_type(max(len(simData) - 1, 0))
+        frameType = np.min_scalar_type(self.movieSlicer.nslice)
+        visits = []
+        self._slicePoints = []
+        for i in range(self.slicer.nslice):
+            slice_i = self.slicer[i]
+            self._slicePoints.append(slice_i['slicePoint'])
+            idxs = np.asarray(slice_i['idxs'])
+            if idxs.dtype == bool:
+                idxs = np.flatnonzero(idxs)
+            idxs = idxs.astype(visitType)
+            visits.append(idxs[np.lexsort((idxs, frameOfVisit[idxs]))])
+        self._sliceStarts = np.concatenate([[0], np.cumsum([len(v) for v in visits], dtype=int)])
+        self._sliceVisits = np.concatenate(visits) if len(visits) > 0 else np.zeros(0, visitType)
+        del visits
+        self._sliceFrames = frameOfVisit[self._sliceVisits].astype(frameType)
+
+    def _maskBadValues(self, b, sliceNums):
+        """Mask the metric values of metricBundle b at sliceNums where the metric value is bad.
+        """
+        if b.metricValues.dtype.name == 'object':
+            for ind in sliceNums:
+                if b.metricValues.data[ind] is b.metric.badval:
+                    b.metricValues.mask[ind] = True
+        else:
+            b.metricValues.mask[sliceNums] = np.where(b.metricValues.data[sliceNums] == b.metric.badval,
+                                                      True, b.metricValues.mask[sliceNums])
+
+    def _sliceData(self, idxs, i, nMetrics):
+        """Return the dataSlice of visits idxs and the metadata of slicePoint i (with the SliceContext shared
+        by the nMetrics metrics to run on it).
+        """
+        dataSlice = self.simData[idxs]
+        return dataSlice, SliceContext.share(dataSlice, self._slicePoints[i], nMetrics)
+
+    def runFrames(self, simData, fieldData=None, setupFrame=None):
+        """Calculate the metric values for each frame of the movie, in order.
+
+        This is a generator: after the metric values of all of the MetricBundles (their metricValues)
+        have been updated for a frame, it yields the frame number and the MovieSlicer slice (with the
+        idxs of the visits up to this frame and the frame's slicePoint), so the frame can be plotted.
+
+        Parameters
+        ----------
+        simData : numpy.ndarray
+            The visits (the same data used to set up the MovieSlicer).
+        fieldData : numpy.ndarray, opt
+            The field data, if the spatial slicer is an OpsimFieldSlicer.
+        setupFrame : callable, opt
+            A function called with the frame number and MovieSlicer slice before the metric values of
+            each frame are calculated, to update any parameters of the metrics which depend on the frame
+            (such as the time, t0, of the FilterColors metric). Default None.
+
+        Yields
+        ------
+        int, dict
+            The frame number and the MovieSlicer slice for this frame.
+        """
+        self._setupFrames(simData, fieldData=fieldData)
+        mergeable = {k: b for k, b in self.bundleDict.items() if b.metric.isMergeable()}
+        others = {k: b for k, b in self.bundleDict.items() if not b.metric.isMergeable()}
+        states = {k: np.tile(b.metric.initState(), (self.slicer.nslice, 1)) for k, b in mergeable.items()}
+        nVisits = np.zeros(self.slicer.nslice, int)
+        starts, ends = self._sliceStarts[:-1], self._sliceStarts[1:]
+        for frame in range(self.movieSlicer.nslice):
+            movieSlice = self.movieSlicer[frame]
+            if setupFrame is not None:
+                setupFrame(frame, movieSlice)
+            # The slicePoints whose next visit (after those of the previous frames) is in this frame.
+            first = starts + nVisits
+            pending = np.flatnonzero(first < ends)
+            touched = pending[self._sliceFrames[first[pending]] == frame]
+            for i in touched:
+                start, end = first[i], ends[i]
+                nNew = np.searchsorted(self._sliceFrames[start:end], frame, side='right')
+                nVisits[i] += nNew
+                if len(mergeable) > 0:
+                    dataSlice, slicePoint = self._sliceData(self._sliceVisits[start:start + nNew], i,
+                                                            len(mergeable))
+                    for k, b in mergeable.items():
+                        states[k][i] = b.metric.updateState(states[k][i], dataSlice, slicePoint=slicePoint)
+            for k, b in mergeable.items():
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    b.metricValues.data[touched] = b.metric.finalizeState(states[k][touched])
+                b.metricValues.mask[touched] = False
+                self._maskBadValues(b, touched)
+            if len(others) > 0:
+                # Recalculate these metrics from all of the visits so far, at every slicePoint with visits.
+                observed = np.flatnonzero(nVisits)
+                for i in observed:
+                    start = self._sliceStarts[i]
+                    dataSlice, slicePoint = self._sliceData(self._sliceVisits[start:start + nVisits[i]], i,
+                                                            len(others))
+                    for b in others.values():
+                        b.metricValues.data[i] = b.metric.run(dataSlice, slicePoint=slicePoint)
+                        b.metricValues.mask[i] = False
+                for b in others.values():
+                    self._maskBadValues(b, observed)
+            if self.verbose:
+                print('Calculated frame %d of %d (%d slicePoints with new visits).'
+                      % (frame, self.movieSlicer.nslice, len(touched)))
+            yield frame, movieSlice
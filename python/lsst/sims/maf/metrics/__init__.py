@@ -1,3 +1,4 @@
+from .sliceContext import *
 from .baseMetric import *
 from .simpleMetrics import *
 from .summaryMetrics import *
@@ -45,10 +45,15 @@ class AreaSummaryMetric(BaseMetric):
         pix_area = hp.nside2pixarea(nside, degrees=True)
         n_pix_needed = int(np.ceil(self.area/pix_area))
 
+        # Use the sorted values from the shared SliceContext, if there is one.
+        sliceContext = self.getSliceContext(dataSlice, slicePoint, create=False)
+        if sliceContext is None:
+            data = np.sort(dataSlice[self.col])
+        else:
+            data = sliceContext.sortedValues(self.col)
         # Only use the finite data
-        data = dataSlice[self.col][np.isfinite(dataSlice[self.col].astype(float))]
-        order = np.argsort(data)
+        data = data[np.isfinite(data.astype(float))]
         if self.decreasing:
-            order = order[::-1]
-        result = self.reduce_func(data[order][0:n_pix_needed])
+            data = data[::-1]
+        result = self.reduce_func(data[0:n_pix_needed])
         return result
@@ -14,6 +14,7 @@ import inspect
 from lsst.sims.maf.stackers.getColInfo import ColInfo
 from future.utils import with_metaclass
 import warnings
+from .sliceContext import SliceContext
 
 __all__ = ['MetricRegistry', 'BaseMetric']
 
@@ -124,6 +125,13 @@ class BaseMetric(with_metaclass(MetricRegistry, object)):
     """
     colRegistry = ColRegistry()
     colInfo = ColInfo()
+    # The length of the partial state of metrics which can be calculated from partial states
+    # (see calcState); None for metrics which can only be calculated from all of the visits at once.
+    stateSize = None
+    # If True, the MetricBundle calls the reduce functions once, with the metric values at all of the
+    # (unmasked) slicePoints; otherwise (the default) each reduce function is called with the metric value
+    # at each slicePoint in turn.
+    vectorizedReduce = False
 
     def __init__(self, col=None, metricName=None, maps=None, units=None,
                  metricDtype=None, badval=-666, maskVal=None):
@@ -176,6 +184,35 @@ class BaseMetric(with_metaclass(MetricRegistry, object)):
         # Default to only return one metric value per slice
         self.shape = 1
 
+    def getSliceContext(self, dataSlice, slicePoint=None, create=True):
+        """Return the SliceContext holding the derived quantities (sorted order, nights, seasons ..)
+        for this dataSlice.
+
+        When run within a MetricBundleGroup, the same SliceContext is shared by all metrics at a slicePoint;
+        otherwise (or if the dataSlice has been modified by this metric) a new SliceContext is created.
+
+        Parameters
+        ----------
+        dataSlice : numpy.NDarray
+           Values passed to metric by the slicer.
+        slicePoint : Dict, opt
+           Dictionary of slicePoint metadata passed to each metric.
+        create : bool, opt
+           If False, return None (rather than a new SliceContext) when no SliceContext is shared.
+           Default True.
+
+        Returns
+        -------
+        SliceContext
+        """
+        if isinstance(slicePoint, dict):
+            context = slicePoint.get('sliceContext')
+            if context is not None and context.dataSlice is dataSlice:
+                return context
+        if not create:
+            return None
+        return SliceContext(dataSlice, slicePoint)
+
     def run(self, dataSlice, slicePoint=None):
         """Calculate metric values.
 
@@ -194,3 +231,108 @@ class BaseMetric(with_metaclass(MetricRegistry, object)):
             The metric value at each slicePoint.
         """
         raise NotImplementedError('Please implement your metric calculation.')
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        """Calculate metric values for many slicePoints at once.
+
+        Metrics which can be vectorized over slicePoints override this method (see hasBatch);
+        by default, run is called for each slicePoint in turn.
+
+        Parameters
+        ----------
+        dataSlices : numpy.NDarray
+           The data for all of the slicePoints, one after another: the data for slicePoint i is
+           dataSlices[offsets[i]:offsets[i+1]].
+        offsets : numpy.ndarray
+           The offsets of the data for each slicePoint in dataSlices (one more than the number of slicePoints).
+        slicePoints : list of Dict, opt
+           The slicePoint metadata for each slicePoint. Default None.
+
+        Returns
+        -------
+        list
+            The metric value at each slicePoint.
+        """
+        values = []
+        for i in range(len(offsets) - 1):
+            slicePoint = None if slicePoints is None else slicePoints[i]
+            values.append(self.run(dataSlices[offsets[i]:offsets[i + 1]], slicePoint=slicePoint))
+        return values
+
+    def _definedIn(self, name):
+        """Return the class (in the method resolution order of this metric) which defines name.
+        """
+        for cls in type(self).__mro__:
+            if name in vars(cls):
+                return cls
+
+    def hasBatch(self):
+        """Return True if this metric has a vectorized runBatch method (consistent with its run method).
+        """
+        batchClass = self._definedIn('runBatch')
+        return batchClass is not BaseMetric and batchClass is self._definedIn('run')
+
+    def isMergeable(self):
+        """Return True if this metric can be calculated by merging partial states
+        (and its calcState method is consistent with its run method).
+
+        The partial state of a mergeable metric summarizes a set of visits (such as the visits at a
+        slicePoint in one night) in a fixed-length array of stateSize values, so that the metric value
+        for the combination of two sets of visits can be calculated from their two states:
+        state = initState(), then state = updateState(state, dataSlice) for each new set of visits
+        (or state = mergeStates(state, otherState)), and finally finalizeState(state) gives the same
+        value as run on all of the visits.
+        """
+        if self.stateSize is None:
+            return False
+        return issubclass(self._definedIn('calcState'), self._definedIn('run'))
+
+    def initState(self):
+        """Return the partial state for no visits.
+        """
+        return np.zeros(self.stateSize, dtype=float)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        """Calculate the partial state for the visits in dataSlice.
+
+        Parameters
+        ----------
+        dataSlice : numpy.NDarray
+           Values passed to metric by the slicer, which the metric will use to calculate its state.
+        slicePoint : Dict
+           Dictionary of slicePoint metadata passed to each metric.
+
+        Returns
+        -------
+        numpy.ndarray
+            The partial state (of length stateSize).
+        """
+        raise NotImplementedError('Metric %s does not have partial states.' % (self.name))
+
+    def updateState(self, state, dataSlice, slicePoint=None):
+        """Return the partial state after adding the visits in dataSlice to state.
+        """
+        return self.mergeStates(state, self.calcState(dataSlice, slicePoint=slicePoint))
+
+    def mergeStates(self, state1, state2):
+        """Merge two partial states (by default, by adding them).
+
+        States may have extra leading dimensions (such as one state for each slicePoint), so this
+        and finalizeState operate along the last axis.
+        """
+        return state1 + state2
+
+    def finalizeState(self, state):
+        """Calculate the metric value from the partial state.
+
+        Parameters
+        ----------
+        state : numpy.ndarray
+           The partial state, or states (with the values of each state along the last axis).
+
+        Returns
+        -------
+        float or numpy.ndarray
+            The metric value (for each state).
+        """
+        raise NotImplementedError('Metric %s does not have partial states.' % (self.name))
@@ -1,5 +1,7 @@
 import numpy as np
 from .baseMetric import BaseMetric
+from lsst.sims.maf.utils import (segmentOffsets, segmentIds, segmentedArgsort, segmentedSort, segmentedDiff,
+                                 segmentedCount, segmentedReduce, runLengths)
 
 __all__ = ['TemplateExistsMetric', 'UniformityMetric',
            'RapidRevisitUniformityMetric', 'RapidRevisitMetric','NRevisitsMetric', 'IntraNightGapsMetric',
@@ -167,7 +169,7 @@ class RapidRevisitUniformityMetric(BaseMetric):
            The uniformity measurement of the visits within time interval dTmin to dTmax.
         """
         # Calculate consecutive visit time intervals
-        dtimes = np.diff(np.sort(dataSlice[self.mjdCol]))
+        dtimes = self.getSliceContext(dataSlice, slicePoint).diffs(self.mjdCol)
         # Identify dtimes within interval from dTmin/dTmax.
         good = np.where((dtimes >= self.dTmin) & (dtimes <= self.dTmax))[0]
         # If there are not enough visits in this time range, return bad value.
@@ -196,14 +198,17 @@ class RapidRevisitMetric(BaseMetric):
         super().__init__(col=self.mjdCol, metricName=metricName, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        dtimes = np.diff(np.sort(dataSlice[self.mjdCol]))
-        N1 = len(np.where((dtimes >= self.dTmin) & (dtimes <= self.dTpairs))[0])
-        N2 = len(np.where((dtimes >= self.dTmin) & (dtimes <= self.dTmax))[0])
-        if (N1 >= self.minN1) and (N2 >= self.minN2):
-            val = 1
-        else:
-            val = 0
-        return val
+        times = self.getSliceContext(dataSlice, slicePoint).sortedValues(self.mjdCol)
+        return self._rapidRevisit(times, np.array([0, times.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return self._rapidRevisit(segmentedSort(dataSlices[self.mjdCol], offsets), offsets)
+
+    def _rapidRevisit(self, times, offsets):
+        dtimes, dOffsets = segmentedDiff(times, offsets)
+        N1 = segmentedCount((dtimes >= self.dTmin) & (dtimes <= self.dTpairs), dOffsets)
+        N2 = segmentedCount((dtimes >= self.dTmin) & (dtimes <= self.dTmax), dOffsets)
+        return np.where((N1 >= self.minN1) & (N2 >= self.minN2), 1, 0)
 
 
 class NRevisitsMetric(BaseMetric):
@@ -246,10 +251,17 @@ class NRevisitsMetric(BaseMetric):
         float
            Either the total number of consecutive visits within dT or the fraction compared to overall visits.
         """
-        dtimes = np.diff(np.sort(dataSlice[self.mjdCol]))
-        nFastRevisits = np.size(np.where(dtimes <= self.dT)[0])
+        times = self.getSliceContext(dataSlice, slicePoint).sortedValues(self.mjdCol)
+        return self._nRevisits(times, np.array([0, times.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return self._nRevisits(segmentedSort(dataSlices[self.mjdCol], offsets), offsets)
+
+    def _nRevisits(self, times, offsets):
+        dtimes, dOffsets = segmentedDiff(times, offsets)
+        nFastRevisits = segmentedCount(dtimes <= self.dT, dOffsets)
         if self.normed:
-            nFastRevisits = nFastRevisits / float(np.size(dataSlice[self.mjdCol]))
+            nFastRevisits = nFastRevisits / np.diff(offsets).astype(float)
         return nFastRevisits
 
 
@@ -288,16 +300,22 @@ class IntraNightGapsMetric(BaseMetric):
         float
            The (reduceFunc) value of the gap, in hours.
         """
-        dataSlice.sort(order=self.mjdCol)
-        dt = np.diff(dataSlice[self.mjdCol])
-        dn = np.diff(dataSlice[self.nightCol])
+        data = self.getSliceContext(dataSlice, slicePoint).sortedData(self.mjdCol)
+        return self._intraNightGaps(data, np.array([0, data.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        order = segmentedArgsort(dataSlices[self.mjdCol], offsets)
+        if order is not None:
+            dataSlices = dataSlices[order]
+        return self._intraNightGaps(dataSlices, offsets)
 
-        good = np.where(dn == 0)
-        if np.size(good[0]) == 0:
-            result = self.badval
-        else:
-            result = self.reduceFunc(dt[good]) * 24
-        return result
+    def _intraNightGaps(self, data, offsets):
+        dt, dOffsets = segmentedDiff(data[self.mjdCol], offsets)
+        dn = segmentedDiff(data[self.nightCol], offsets)[0]
+        good = (dn == 0)
+        ngood = segmentedCount(good, dOffsets)
+        result = segmentedReduce(dt[good], segmentOffsets(ngood), self.reduceFunc) * 24
+        return np.where(ngood == 0, self.badval, result)
 
 
 class InterNightGapsMetric(BaseMetric):
@@ -333,17 +351,27 @@ class InterNightGapsMetric(BaseMetric):
         float
             The (reduceFunc) of the gap between consecutive nights of observations, in days.
         """
-        dataSlice.sort(order=self.mjdCol)
-        unights = np.unique(dataSlice[self.nightCol])
-        if np.size(unights) < 2:
-            result = self.badval
-        else:
-            # Find the first and last observation of each night
-            firstOfNight = np.searchsorted(dataSlice[self.nightCol], unights)
-            lastOfNight = np.searchsorted(dataSlice[self.nightCol], unights, side='right') - 1
-            diff = dataSlice[self.mjdCol][firstOfNight[1:]] - dataSlice[self.mjdCol][lastOfNight[:-1]]
-            result = self.reduceFunc(diff)
-        return result
+        data = self.getSliceContext(dataSlice, slicePoint).sortedData(self.mjdCol)
+        return self._interNightGaps(data, np.array([0, data.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        order = segmentedArgsort(dataSlices[self.mjdCol], offsets)
+        if order is not None:
+            dataSlices = dataSlices[order]
+        return self._interNightGaps(dataSlices, offsets)
+
+    def _interNightGaps(self, data, offsets):
+        # Find the first and last observation of each night
+        runOffsets, nightOffsets = runLengths(data[self.nightCol], offsets)
+        firstOfNight = data[self.mjdCol][runOffsets[:-1]]
+        lastOfNight = data[self.mjdCol][runOffsets[1:] - 1]
+        # Gaps between the last visit in one night and the first visit in the next (within each segment).
+        ids = segmentIds(nightOffsets)
+        sameSegment = (ids[1:] == ids[:-1])
+        diff = (firstOfNight[1:] - lastOfNight[:-1])[sameSegment]
+        nNights = np.diff(nightOffsets)
+        result = segmentedReduce(diff, segmentOffsets(np.maximum(nNights - 1, 0)), self.reduceFunc)
+        return np.where(nNights < 2, self.badval, result)
 
 
 class VisitGapMetric(BaseMetric):
@@ -383,10 +411,15 @@ class VisitGapMetric(BaseMetric):
         float
            The (reduceFunc) of the time between consecutive observations, in hours.
         """
-        dataSlice.sort(order=self.mjdCol)
-        diff = np.diff(dataSlice[self.mjdCol])
-        result = self.reduceFunc(diff) * 24.
-        return result
+        times = self.getSliceContext(dataSlice, slicePoint).sortedValues(self.mjdCol)
+        return self._visitGap(times, np.array([0, times.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return self._visitGap(segmentedSort(dataSlices[self.mjdCol], offsets), offsets)
+
+    def _visitGap(self, times, offsets):
+        diff, diffOffsets = segmentedDiff(times, offsets)
+        return segmentedReduce(diff, diffOffsets, self.reduceFunc) * 24.
 
 class SeasonLengthMetric(BaseMetric):
     """
@@ -427,25 +460,16 @@ class SeasonLengthMetric(BaseMetric):
         float
            The (reduceFunc) of the length of each season, in days.
         """
-        dataSlice.sort(order=self.mjdCol)
-        # SlicePoints ra/dec are always in radians - convert to HOURS for this (b/c time)
-        objRA = np.degrees(slicePoint['ra']) / 15.0
-        # objRA=0 on autumnal equinox.
-        # autumnal equinox 2014 happened on Sept 23 --> Equinox MJD
-        # Use 365.25 for the length of a year here, because we're dealing with real seasons.
-        daysSinceEquinox = 0.5*objRA*(365.25/12.0)  # 0.5 to go from RA to month; 365.25/12.0 months to days
-        firstSeasonBegan = self.Equinox + daysSinceEquinox - 0.5*365.25   # in MJD
-        # Now we can compute the number of years since the first season
-        # began, and so assign a global integer season number:
-        globalSeason = np.floor((dataSlice[self.mjdCol] - firstSeasonBegan)/365.25)
-        # Subtract off season number of first observation:
-        seasons = globalSeason - np.min(globalSeason)
+        sliceContext = self.getSliceContext(dataSlice, slicePoint)
+        # Season number of each visit (in time order), from the slicePoint RA.
+        mjds = sliceContext.sortedValues(self.mjdCol)
+        seasons = sliceContext.seasons(self.mjdCol, equinox=self.Equinox)
         # Get the unique seasons, so that we can separate each one
         season_list = np.unique(seasons)
         # Find the first and last observation of each season.
         firstOfSeason= np.searchsorted(seasons, season_list)
         lastOfSeason = np.searchsorted(seasons, season_list, side='right') - 1
 
-        seasonlength = dataSlice[self.mjdCol][lastOfSeason] - dataSlice[self.mjdCol][firstOfSeason]
+        seasonlength = mjds[lastOfSeason] - mjds[firstOfSeason]
         result = self.reduceFunc(seasonlength)
         return result
\ No newline at end of file
@@ -2,6 +2,7 @@ import numpy as np
 from .baseMetric import BaseMetric
 import lsst.sims.maf.utils as mafUtils
 import lsst.sims.utils as utils
+from lsst.sims.maf.stackers import FilterCodeStacker
 from scipy.optimize import curve_fit
 from builtins import str
 
@@ -9,6 +10,38 @@ __all__ = ['ParallaxMetric', 'ProperMotionMetric', 'RadiusObsMetric',
            'ParallaxCoverageMetric', 'ParallaxDcrDegenMetric']
 
 
+def _magLookup(SedTemplate, rmag):
+    """Return the magnitudes of the fiducial star, as a dictionary keyed by filter name and as an array
+    indexed by filter code (see FilterCodeStacker). The last element of the array (code -1, for any
+    other filter) is inf, giving zero SNR.
+    """
+    filters = FilterCodeStacker.filterNames
+    if SedTemplate == 'flat':
+        mags = {}
+        for f in filters:
+            mags[f] = rmag
+    else:
+        mags = utils.stellarMags(SedTemplate, rmag=rmag)
+    magLookup = np.array([mags[f] for f in filters] + [np.inf])
+    return mags, magLookup
+
+
+def _filterCodes(dataSlice, filterCodeCol, filterCol):
+    """Return the filter code of each visit, using the FilterCodeStacker column if present.
+    """
+    if filterCodeCol in dataSlice.dtype.names:
+        return dataSlice[filterCodeCol]
+    return FilterCodeStacker.filterCodes(dataSlice[filterCol])
+
+
+def _segmentSums(values, offsets):
+    """Sum values within each segment (or over all values, if offsets is None).
+    """
+    if offsets is None:
+        return np.sum(values)
+    return mafUtils.segmentedReduce(values, offsets, np.sum)
+
+
 class ParallaxMetric(BaseMetric):
     """Calculate the uncertainty in a parallax measurement given a series of observations.
 
@@ -22,6 +55,10 @@ class ParallaxMetric(BaseMetric):
         The default column name for m5 information in the input data. Default fiveSigmaDepth.
     filterCol : str, opt
         The column name for the filter information. Default filter.
+    filterCodeCol : str, opt
+        The column name for the filter codes (see FilterCodeStacker), used instead of
+        filterCol when present in the data (e.g. if the FilterCodeStacker has been run).
+        Default filterCode.
     seeingCol : str, opt
         The column name for the seeing information. Since the astrometry errors are based on the physical
         size of the PSF, this should be the FWHM of the physical psf. Default seeingFwhmGeom.
@@ -42,7 +79,7 @@ class ParallaxMetric(BaseMetric):
     def __init__(self, metricName='parallax', m5Col='fiveSigmaDepth',
                  filterCol='filter', seeingCol='seeingFwhmGeom', rmag=20.,
                  SedTemplate='flat', badval=-666,
-                 atm_err=0.01, normalize=False, **kwargs):
+                 atm_err=0.01, normalize=False, filterCodeCol='filterCode', **kwargs):
         Cols = [m5Col, filterCol, seeingCol, 'ra_pi_amp', 'dec_pi_amp']
         if normalize:
             units = 'ratio'
@@ -54,13 +91,8 @@ class ParallaxMetric(BaseMetric):
         self.m5Col = m5Col
         self.seeingCol = seeingCol
         self.filterCol = filterCol
-        filters = ['u', 'g', 'r', 'i', 'z', 'y']
-        self.mags = {}
-        if SedTemplate == 'flat':
-            for f in filters:
-                self.mags[f] = rmag
-        else:
-            self.mags = utils.stellarMags(SedTemplate, rmag=rmag)
+        self.filterCodeCol = filterCodeCol
+        self.mags, self.magLookup = _magLookup(SedTemplate, rmag)
         self.atm_err = atm_err
         self.normalize = normalize
         self.comment = 'Estimated uncertainty in parallax measurement ' \
@@ -78,35 +110,38 @@ class ParallaxMetric(BaseMetric):
             self.comment += 'months apart). Values closer to 1 indicate more optimal ' \
                             'scheduling for parallax measurement.'
 
-    def _final_sigma(self, position_errors, ra_pi_amp, dec_pi_amp):
+    def _final_sigma(self, position_errors, ra_pi_amp, dec_pi_amp, offsets=None):
         """Assume parallax in RA and DEC are fit independently, then combined.
-        All inputs assumed to be arcsec """
+        All inputs assumed to be arcsec.
+        If offsets is given, the sigma for each segment of the inputs (each slicePoint) is returned."""
         sigma_A = position_errors/ra_pi_amp
         sigma_B = position_errors/dec_pi_amp
-        sigma_ra = np.sqrt(1./np.sum(1./sigma_A**2))
-        sigma_dec = np.sqrt(1./np.sum(1./sigma_B**2))
+        sigma_ra = np.sqrt(1./_segmentSums(1./sigma_A**2, offsets))
+        sigma_dec = np.sqrt(1./_segmentSums(1./sigma_B**2, offsets))
         # Combine RA and Dec uncertainties, convert to mas
         sigma = np.sqrt(1./(1./sigma_ra**2+1./sigma_dec**2))*1e3
         return sigma
 
-    def run(self, dataslice, slicePoint=None):
-        filters = np.unique(dataslice[self.filterCol])
-        if hasattr(filters[0], 'decode'):
-            filters = [str(f.decode('utf-8')) for f in filters]
-        snr = np.zeros(len(dataslice), dtype='float')
-        # compute SNR for all observations
-        for filt in filters:
-            good = np.where(dataslice[self.filterCol] == filt)
-            snr[good] = mafUtils.m52snr(self.mags[str(filt)], dataslice[self.m5Col][good])
-        position_errors = np.sqrt(mafUtils.astrom_precision(dataslice[self.seeingCol],
+    def _sigma(self, data, offsets=None):
+        # Compute SNR for all observations, looking up the star magnitude by filter code.
+        snr = mafUtils.m52snr(self.magLookup[_filterCodes(data, self.filterCodeCol, self.filterCol)],
+                              data[self.m5Col])
+        position_errors = np.sqrt(mafUtils.astrom_precision(data[self.seeingCol],
                                                             snr)**2+self.atm_err**2)
-        sigma = self._final_sigma(position_errors, dataslice['ra_pi_amp'], dataslice['dec_pi_amp'])
+        sigma = self._final_sigma(position_errors, data['ra_pi_amp'], data['dec_pi_amp'], offsets)
         if self.normalize:
             # Leave the dec parallax as zero since one can't have ra and dec maximized at the same time.
-            sigma = self._final_sigma(position_errors,
-                                      dataslice['ra_pi_amp']*0+1., dataslice['dec_pi_amp']*0)/sigma
+            with np.errstate(divide='ignore'):
+                sigma = self._final_sigma(position_errors, data['ra_pi_amp']*0+1.,
+                                          data['dec_pi_amp']*0, offsets)/sigma
         return sigma
 
+    def run(self, dataslice, slicePoint=None):
+        return self._sigma(dataslice)
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return list(self._sigma(dataSlices, offsets))
+
 
 class ProperMotionMetric(BaseMetric):
     """Calculate the uncertainty in the returned proper motion.
@@ -123,6 +158,10 @@ class ProperMotionMetric(BaseMetric):
         The column name for the exposure time. Default observationStartMJD.
     filterCol : str, opt
         The column name for the filter information. Default filter.
+    filterCodeCol : str, opt
+        The column name for the filter codes (see FilterCodeStacker), used instead of
+        filterCol when present in the data (e.g. if the FilterCodeStacker has been run).
+        Default filterCode.
     seeingCol : str, opt
         The column name for the seeing information. Since the astrometry errors are based on the physical
         size of the PSF, this should be the FWHM of the physical psf. Default seeingFwhmGeom.
@@ -147,7 +186,7 @@ class ProperMotionMetric(BaseMetric):
                  filterCol='filter', seeingCol='seeingFwhmGeom', rmag=20.,
                  SedTemplate='flat', badval= -666,
                  atm_err=0.01, normalize=False,
-                 baseline=10., **kwargs):
+                 baseline=10., filterCodeCol='filterCode', **kwargs):
         cols = [m5Col, mjdCol, filterCol, seeingCol]
         if normalize:
             units = 'ratio'
@@ -159,13 +198,9 @@ class ProperMotionMetric(BaseMetric):
         self.mjdCol = mjdCol
         self.seeingCol = seeingCol
         self.m5Col = m5Col
-        filters = ['u', 'g', 'r', 'i', 'z', 'y']
-        self.mags = {}
-        if SedTemplate == 'flat':
-            for f in filters:
-                self.mags[f] = rmag
-        else:
-            self.mags = utils.stellarMags(SedTemplate, rmag=rmag)
+        self.filterCol = filterCol
+        self.filterCodeCol = filterCodeCol
+        self.mags, self.magLookup = _magLookup(SedTemplate, rmag)
         self.atm_err = atm_err
         self.normalize = normalize
         self.baseline = baseline
@@ -183,33 +218,64 @@ class ProperMotionMetric(BaseMetric):
             self.comment += 'obtained on the first and last days of the survey). '
             self.comment += 'Values closer to 1 indicate more optimal scheduling.'
 
+    def _sigma_slope(self, x, sigma_y, offsets):
+        """Calculate the uncertainty in fitting a line (see lsst.sims.maf.utils.sigma_slope),
+        for each segment of x and sigma_y.
+        """
+        w = 1./sigma_y**2
+        sumW = _segmentSums(w, offsets)
+        denom = sumW*_segmentSums(w*x**2, offsets) - _segmentSums(w*x, offsets)**2
+        result = np.zeros(len(sumW), float) + np.nan
+        good = denom > 0
+        result[good] = np.sqrt(sumW[good]/denom[good])
+        return result
+
+    def _goodPrecision(self, data, ids, nSegments):
+        """Find the visits in filters with at least two visits (in each segment, if ids is given)
+        and their astrometric precision.
+        """
+        codes = _filterCodes(data, self.filterCodeCol, self.filterCol)
+        # Count the visits in each (segment, filter) with a single bincount; code -1 becomes 0.
+        nCodes = len(self.magLookup)
+        key = codes + 1 if ids is None else ids*nCodes + codes + 1
+        nInFilter = np.bincount(key, minlength=nSegments*nCodes)
+        good = np.where(nInFilter[key] >= 2)[0]
+        snr = mafUtils.m52snr(self.magLookup[codes[good]], data[self.m5Col][good])
+        precis = mafUtils.astrom_precision(data[self.seeingCol][good], snr)
+        precis = np.sqrt(precis**2 + self.atm_err**2)
+        return good, precis
+
     def run(self, dataslice, slicePoint=None):
-        filters = np.unique(dataslice['filter'])
-        filters = [str(f) for f in filters]
-        precis = np.zeros(dataslice.size, dtype='float')
-        for f in filters:
-            observations = np.where(dataslice['filter'] == f)
-            if np.size(observations[0]) < 2:
-                precis[observations] = self.badval
-            else:
-                snr = mafUtils.m52snr(self.mags[f],
-                                      dataslice[self.m5Col][observations])
-                precis[observations] = mafUtils.astrom_precision(
-                    dataslice[self.seeingCol][observations], snr)
-                precis[observations] = np.sqrt(precis[observations]**2 + self.atm_err**2)
-        good = np.where(precis != self.badval)
-        result = mafUtils.sigma_slope(dataslice[self.mjdCol][good], precis[good])
+        good, precis = self._goodPrecision(dataslice, None, 1)
+        result = mafUtils.sigma_slope(dataslice[self.mjdCol][good], precis)
         result = result*365.25*1e3  # Convert to mas/yr
-        if (self.normalize) & (good[0].size > 0):
+        if (self.normalize) & (good.size > 0):
             new_dates = dataslice[self.mjdCol][good]*0
             nDates = new_dates.size
             new_dates[nDates//2:] = self.baseline*365.25
-            result = (mafUtils.sigma_slope(new_dates, precis[good])*365.25*1e3)/result
+            result = (mafUtils.sigma_slope(new_dates, precis)*365.25*1e3)/result
         # Observations that are very close together can still fail
         if np.isnan(result):
             result = self.badval
         return result
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        nSegments = len(offsets) - 1
+        ids = mafUtils.segmentIds(offsets)
+        good, precis = self._goodPrecision(dataSlices, ids, nSegments)
+        goodIds = ids[good]
+        goodOffsets = mafUtils.segmentOffsets(np.bincount(goodIds, minlength=nSegments))
+        result = self._sigma_slope(dataSlices[self.mjdCol][good], precis, goodOffsets)
+        result = result*365.25*1e3  # Convert to mas/yr
+        if self.normalize:
+            # Put the second half of the (good) visits at each slicePoint at the end of the baseline.
+            rank = np.arange(good.size) - goodOffsets[goodIds]
+            nDates = np.diff(goodOffsets)[goodIds]
+            new_dates = np.where(rank >= nDates//2, self.baseline*365.25, 0.)
+            result = (self._sigma_slope(new_dates, precis, goodOffsets)*365.25*1e3)/result
+        result[np.isnan(result)] = self.badval
+        return list(result)
+
 
 class ParallaxCoverageMetric(BaseMetric):
     """
@@ -235,6 +301,10 @@ class ParallaxCoverageMetric(BaseMetric):
         Column name for exposure time dates. Default observationStartMJD.
     filterCol: str, opt
         Column name for filter. Default filter.
+    filterCodeCol: str, opt
+        Column name for the filter codes (see FilterCodeStacker), used instead of
+        filterCol when present in the data (e.g. if the FilterCodeStacker has been run).
+        Default filterCode.
     seeingCol: str, opt
         Column name for seeing (assumed FWHM). Default seeingFwhmGeom.
     rmag: float, opt
@@ -264,7 +334,7 @@ class ParallaxCoverageMetric(BaseMetric):
     def __init__(self, metricName='ParallaxCoverageMetric', m5Col='fiveSigmaDepth',
                  mjdCol='observationStartMJD', filterCol='filter', seeingCol='seeingFwhmGeom',
                  rmag=20., SedTemplate='flat',
-                 atm_err=0.01, thetaRange=0., snrLimit=5, **kwargs):
+                 atm_err=0.01, thetaRange=0., snrLimit=5, filterCodeCol='filterCode', **kwargs):
         cols = ['ra_pi_amp', 'dec_pi_amp', m5Col, mjdCol, filterCol, seeingCol]
         units = 'ratio'
         super(ParallaxCoverageMetric, self).__init__(cols,
@@ -273,19 +343,14 @@ class ParallaxCoverageMetric(BaseMetric):
         self.m5Col = m5Col
         self.seeingCol = seeingCol
         self.filterCol = filterCol
+        self.filterCodeCol = filterCodeCol
         self.mjdCol = mjdCol
 
         # Demand the range of theta values
         self.thetaRange = thetaRange
         self.snrLimit = snrLimit
 
-        filters = ['u', 'g', 'r', 'i', 'z', 'y']
-        self.mags = {}
-        if SedTemplate == 'flat':
-            for f in filters:
-                self.mags[f] = rmag
-        else:
-            self.mags = utils.stellarMags(SedTemplate, rmag=rmag)
+        self.mags, self.magLookup = _magLookup(SedTemplate, rmag)
         self.atm_err = atm_err
         caption = "Parallax factor coverage for an r=%.2f star (0 is bad, 0.5-1 is good). " % (rmag)
         caption += "One expects the parallax factor coverage to vary because stars on the ecliptic "
@@ -321,18 +386,16 @@ class ParallaxCoverageMetric(BaseMetric):
         aveRad = np.average(radius, weights=weights)
         return aveRad
 
+    def _snr(self, dataSlice):
+        # Compute SNR for all observations, looking up the star magnitude by filter code.
+        codes = _filterCodes(dataSlice, self.filterCodeCol, self.filterCol)
+        return mafUtils.m52snr(self.magLookup[codes], dataSlice[self.m5Col])
+
     def run(self, dataSlice, slicePoint=None):
         if np.size(dataSlice) < 2:
             return self.badval
 
-        filters = np.unique(dataSlice[self.filterCol])
-        filters = [str(f) for f in filters]
-        snr = np.zeros(len(dataSlice), dtype='float')
-        # compute SNR for all observations
-        for filt in filters:
-            inFilt = np.where(dataSlice[self.filterCol] == filt)
-            snr[inFilt] = mafUtils.m52snr(self.mags[str(filt)], dataSlice[self.m5Col][inFilt])
-
+        snr = self._snr(dataSlice)
         weights = self._computeWeights(dataSlice, snr)
         aveR = self._weightedR(dataSlice['ra_pi_amp'], dataSlice['dec_pi_amp'], weights)
         if self.thetaRange > 0:
@@ -342,6 +405,25 @@ class ParallaxCoverageMetric(BaseMetric):
         result = aveR*thetaCheck
         return result
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        ids = mafUtils.segmentIds(offsets)
+        snr = self._snr(dataSlices)
+        weights = self._computeWeights(dataSlices, snr)
+        sumWeights = mafUtils.segmentedReduce(weights, offsets, np.sum)
+        # Weighted mean radius from the weighted mean position, at all slicePoints at once.
+        coords = []
+        for col in ['ra_pi_amp', 'dec_pi_amp']:
+            mean = mafUtils.segmentedReduce(weights*dataSlices[col], offsets, np.sum)/sumWeights
+            coords.append(dataSlices[col] - mean[ids])
+        radius = np.sqrt(coords[0]**2+coords[1]**2)
+        result = mafUtils.segmentedReduce(weights*radius, offsets, np.sum)/sumWeights
+        if self.thetaRange > 0:
+            for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+                if end - start >= 2:
+                    result[i] *= self._thetaCheck(dataSlices['ra_pi_amp'][start:end],
+                                                  dataSlices['dec_pi_amp'][start:end], snr[start:end])
+        return [self.badval if n < 2 else r for n, r in zip(np.diff(offsets), result)]
+
 
 class ParallaxDcrDegenMetric(BaseMetric):
     """Use the full parallax and DCR displacement vectors to find if they are degenerate.
@@ -356,6 +438,10 @@ class ParallaxDcrDegenMetric(BaseMetric):
         Default 'fiveSigmaDepth'
     filterCol : str
         Default 'filter'
+    filterCodeCol : str
+        The column with the filter codes (see FilterCodeStacker), used instead of
+        filterCol when present in the data (e.g. if the FilterCodeStacker has been run).
+        Default 'filterCode'
     atm_err : float
         Minimum error in photometry centroids introduced by the atmosphere (arcseconds). Default 0.01.
     rmag : float
@@ -377,24 +463,20 @@ class ParallaxDcrDegenMetric(BaseMetric):
     """
     def __init__(self, metricName='ParallaxDcrDegenMetric', seeingCol='seeingFwhmGeom',
                  m5Col='fiveSigmaDepth', atm_err=0.01, rmag=20., SedTemplate='flat',
-                 filterCol='filter', tol=0.05, **kwargs):
+                 filterCol='filter', tol=0.05, filterCodeCol='filterCode', **kwargs):
         self.m5Col = m5Col
         self.seeingCol = seeingCol
         self.filterCol = filterCol
+        self.filterCodeCol = filterCodeCol
         self.tol = tol
         units = 'Correlation'
         # just put all the columns that all the stackers will need here?
         cols = ['ra_pi_amp', 'dec_pi_amp', 'ra_dcr_amp', 'dec_dcr_amp',
-                seeingCol, m5Col]
+                seeingCol, m5Col, filterCol]
         super(ParallaxDcrDegenMetric, self).__init__(cols, metricName=metricName, units=units,
                                                      **kwargs)
-        self.filters = ['u', 'g', 'r', 'i', 'z', 'y']
-        self.mags = {}
-        if SedTemplate == 'flat':
-            for f in self.filters:
-                self.mags[f] = rmag
-        else:
-            self.mags = utils.stellarMags(SedTemplate, rmag=rmag)
+        self.filters = FilterCodeStacker.filterNames
+        self.mags, self.magLookup = _magLookup(SedTemplate, rmag)
         self.atm_err = atm_err
 
     def _positions(self, x, a, b):
@@ -415,11 +497,9 @@ class ParallaxDcrDegenMetric(BaseMetric):
         #  considering the astrometric noise. If we can figure out that we just added them together
         # (i.e. the curve_fit result is [a=1, b=1] for the function _positions above)
         # then we should be able to disentangle the parallax and DCR offsets when fitting 'for real'.
-        # compute SNR for all observations
-        snr = np.zeros(len(dataSlice), dtype='float')
-        for filt in self.filters:
-            inFilt = np.where(dataSlice[self.filterCol] == filt)
-            snr[inFilt] = mafUtils.m52snr(self.mags[filt], dataSlice[self.m5Col][inFilt])
+        # compute SNR for all observations (zero for any filter other than ugrizy)
+        codes = _filterCodes(dataSlice, self.filterCodeCol, self.filterCol)
+        snr = mafUtils.m52snr(self.magLookup[codes], dataSlice[self.m5Col])
         # Compute the centroiding uncertainties
         # Note that these centroiding uncertainties depend on the physical size of the PSF, thus
         # we are using seeingFwhmGeom for these metrics, not seeingFwhmEff.
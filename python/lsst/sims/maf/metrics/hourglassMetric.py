@@ -1,32 +1,34 @@
 from builtins import zip
 import numpy as np
 from .baseMetric import BaseMetric
-from lsst.sims.utils import Site
+from lsst.sims.maf.utils import Almanac
 
 __all__ = ['HourglassMetric']
 
 
-def nearestVal(A, val):
-    return A[np.argmin(np.abs(np.array(A)-val))]
-
-
 class HourglassMetric(BaseMetric):
-    """Plot the filters used as a function of time. Must be used with the Hourglass Slicer."""
+    """Plot the filters used as a function of time. Must be used with the Hourglass Slicer.
+
+    The times of midnight and twilight come from a precomputed Almanac
+    (see lsst.sims.maf.utils.Almanac), also cached on disk in almanacDir if it is set.
+    """
 
     def __init__(self, telescope='LSST', mjdCol='observationStartMJD', filterCol='filter',
-                 nightCol='night', **kwargs):
+                 nightCol='night', almanacDir=None, **kwargs):
         self.mjdCol = mjdCol
         self.filterCol = filterCol
         self.nightCol = nightCol
         cols = [self.mjdCol, self.filterCol, self.nightCol]
         super(HourglassMetric, self).__init__(col=cols, metricDtype='object', **kwargs)
-        self.telescope = Site(name=telescope)
+        self.telescope = telescope
+        self.almanacDir = almanacDir
 
     def run(self, dataSlice, slicePoint=None):
 
-        import ephem
         dataSlice.sort(order=self.mjdCol)
         unights, uindx = np.unique(dataSlice[self.nightCol], return_index=True)
+        almanac = Almanac.get(site=self.telescope, mjdStart=dataSlice[self.mjdCol].min() - 1,
+                              mjdEnd=dataSlice[self.mjdCol].max() + 1, cacheDir=self.almanacDir)
 
         names = ['mjd', 'midnight', 'moonPer', 'twi6_rise', 'twi6_set', 'twi12_rise',
                  'twi12_set', 'twi18_rise', 'twi18_set']
@@ -34,42 +36,12 @@ class HourglassMetric(BaseMetric):
         pernight = np.zeros(len(unights), dtype=list(zip(names, types)))
 
         pernight['mjd'] = dataSlice[self.mjdCol][uindx]
-
-        left = np.searchsorted(dataSlice[self.nightCol], unights)
-
-        lsstObs = ephem.Observer()
-        lsstObs.lat = self.telescope.latitude_rad
-        lsstObs.lon = self.telescope.longitude_rad
-        lsstObs.elevation = self.telescope.height
-        horizons = ['-6', '-12', '-18']
-        key = ['twi6', 'twi12', 'twi18']
-
-        obsList = []
-        S = ephem.Sun()
-        moon = ephem.Moon()
-        for h in horizons:
-            obs = ephem.Observer()
-            obs.lat, obs.lon, obs.elevation = self.telescope.latitude_rad, self.telescope.longitude_rad, \
-                                              self.telescope.height
-            obs.horizon = h
-            obsList.append(obs)
-
-        # Convert ...pyephem uses 1899 as it's zero-day, and MJD has Nov 17 1858 as zero-day.
-        doff = ephem.Date(0)-ephem.Date('1858/11/17')
-
-        for i, mjd in enumerate(pernight['mjd']):
-            mjd = mjd-doff
-
-            pernight['midnight'][i] = nearestVal([lsstObs.previous_antitransit(S, start=mjd),
-                                                  lsstObs.next_antitransit(S, start=mjd)], mjd) + doff
-            moon.compute(mjd)
-            pernight['moonPer'][i] = moon.phase
-            for j, obs in enumerate(obsList):
-                pernight[key[j]+'_rise'][i] = obs.next_rising(S, start=pernight['midnight'][i]-doff,
-                                                              use_center=True) + doff
-
-                pernight[key[j]+'_set'][i] = obs.previous_setting(S, start=pernight['midnight'][i]-doff,
-                                                                  use_center=True) + doff
+        nights = almanac.getNights(pernight['mjd'])
+        pernight['midnight'] = nights['midnight']
+        pernight['moonPer'] = almanac.moonPhase(pernight['mjd'])
+        for key in ['twi6', 'twi12', 'twi18']:
+            pernight[key + '_rise'] = nights[key + '_rise']
+            pernight[key + '_set'] = nights[key + '_set']
 
         # Define the breakpoints as where either the filter changes OR
         # there's more than a 2 minute gap in observing
@@ -87,9 +59,6 @@ class HourglassMetric(BaseMetric):
         perfilter = np.zeros((good.size), dtype=list(zip(names, types)))
         perfilter['mjd'] = dataSlice[self.mjdCol][good]
         perfilter['filter'] = dataSlice[self.filterCol][good]
-        for i, mjd in enumerate(perfilter['mjd']):
-            mjd = mjd - doff
-            perfilter['midnight'][i] = nearestVal([lsstObs.previous_antitransit(S, start=mjd),
-                                                   lsstObs.next_antitransit(S, start=mjd)], mjd)+doff
+        perfilter['midnight'] = almanac.nearestMidnight(perfilter['mjd'])
 
         return {'pernight': pernight, 'perfilter': perfilter}
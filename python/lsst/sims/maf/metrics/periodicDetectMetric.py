@@ -2,7 +2,7 @@ import numpy as np
 from .baseMetric import BaseMetric
 from lsst.sims.maf.utils import m52snr
 import lsst.sims.utils as utils
-import scipy
+import scipy.stats
 
 __all__ = ['PeriodicDetectMetric']
 
@@ -17,7 +17,7 @@ class PeriodicDetectMetric(BaseMetric):
 
     period : float (2) or array
         The period of the star (days). Can be a single value, or an array. If an array, amplitude and starMag
-        should be arrays of equal length.
+        should be single values or arrays of equal length (a ValueError is raised otherwise).
     amplitude : floar (0.1)
         The amplitude of the stellar variablility (mags).
     starMag : float (20.)
@@ -26,6 +26,9 @@ class PeriodicDetectMetric(BaseMetric):
         The value to use to compare to the p-value when deciding if we can reject the null hypothesis.
     SedTemplate : str ('F')
         The stellar SED template to use to generate realistic colors (default is an F star, so RR Lyrae-like)
+    maxArraySize : int (1000000)
+        The maximum number of light curve points (period-amplitude-mag combinations x visits) calculated at once.
+        Large grids of periods are evaluated in chunks, to bound the memory used.
 
     Returns
     -------
@@ -35,30 +38,48 @@ class PeriodicDetectMetric(BaseMetric):
     """
     def __init__(self, mjdCol='observationStartMJD', periods=2., amplitudes=0.1, m5Col='fiveSigmaDepth',
                  metricName='PeriodicDetectMetric', filterCol='filter', starMags=20, sig_level=0.05, 
-                 SedTemplate='F', **kwargs):
+                 SedTemplate='F', maxArraySize=1000000, **kwargs):
 
         self.mjdCol = mjdCol
         self.m5Col = m5Col
         self.filterCol = filterCol
-        if np.size(periods) == 1:
-            self.periods = [periods]
-            # Using the same magnitude for all filters. Could expand to fit the mean in each filter.
-            self.starMags = [starMags]
-            self.amplitudes = [amplitudes]
-        else:
-            self.periods = periods
-            self.starMags = starMags
-            self.amplitudes = amplitudes
+        # Using the same magnitude for all filters. Could expand to fit the mean in each filter.
+        self.periods, self.starMags, self.amplitudes = [np.atleast_1d(np.array(x, dtype=float)) for x in
+                                                        np.broadcast_arrays(periods, starMags, amplitudes)]
         self.sig_level = sig_level
         self.SedTemplate = SedTemplate
+        # Maximum number of (period, visit) light curve points calculated at once.
+        self.maxArraySize = maxArraySize
+        # The stellar magnitudes only depend on the template and r mag, so calculate them once.
+        # magTable[i, j] is the magnitude of star i in filter filterNames[j].
+        stellarMags = {}
+        for starMag in np.unique(self.starMags):
+            stellarMags[starMag] = utils.stellarMags(self.SedTemplate, rmag=starMag)
+        self.filterNames = sorted(stellarMags[self.starMags[0]].keys())
+        self.filterIndex = dict([(f, i) for i, f in enumerate(self.filterNames)])
+        self.magTable = np.array([[stellarMags[starMag][f] for f in self.filterNames]
+                                  for starMag in self.starMags])
 
         super(PeriodicDetectMetric, self).__init__([mjdCol, m5Col, filterCol], metricName=metricName,
-                                                   units='N Detected (0, %i)' % np.size(periods), **kwargs)
+                                                   units='N Detected (0, %i)' % self.periods.size, **kwargs)
+
+    def _chiSq(self, times, m5, filtIdx, onehot, mags, periods, amplitudes):
+        """Return the chi-squared of the best-fit constant (per filter) for each period/amplitude/mag
+        combination, evaluating all light curves (combinations x visits) at once.
+        """
+        lc = amplitudes[:, np.newaxis]*np.sin(times*(np.pi*2)/periods[:, np.newaxis]) + mags[:, filtIdx]
+        snr = m52snr(lc, m5)
+        delta_m = 2.5*np.log10(1.+1./snr)
+        weights = 1./(delta_m**2)
+        # Weighted mean of each light curve within each filter.
+        weighted_mean = np.dot(weights*lc, onehot)/np.dot(weights, onehot)
+        return np.sum((lc - weighted_mean[:, filtIdx])**2*weights, axis=1)
 
     def run(self, dataSlice, slicePoint=None):
         result = 0
         n_pts = np.size(dataSlice[self.mjdCol])
-        n_filt = np.size(np.unique(dataSlice[self.filterCol]))
+        u_filters, filtIdx = np.unique(dataSlice[self.filterCol], return_inverse=True)
+        n_filt = np.size(u_filters)
 
         # If we had a correct model with phase, amplitude, period, mean_mags, then chi_squared/DoF would be ~1 with 3+n_filt free parameters.
         # The mean is one free parameter
@@ -66,30 +87,25 @@ class PeriodicDetectMetric(BaseMetric):
         p2 = 3.+n_filt
         chi_sq_2 = 1.*(n_pts-p2)
 
-        u_filters = np.unique(dataSlice[self.filterCol])
-
         if n_pts > p2:
-            for period, starMag, amplitude in zip(self.periods, self.starMags, self.amplitudes):
-                chi_sq_1 = 0
-                mags = utils.stellarMags(self.SedTemplate, rmag=starMag)
-                for filtername in u_filters:
-                    in_filt = np.where(dataSlice[self.filterCol] == filtername)[0]
-                    lc = amplitude*np.sin(dataSlice[self.mjdCol][in_filt]*(np.pi*2)/period) + mags[filtername]
-                    snr = m52snr(lc, dataSlice[self.m5Col][in_filt])
-                    delta_m = 2.5*np.log10(1.+1./snr)
-                    weights = 1./(delta_m**2)
-                    weighted_mean = np.sum(weights*lc)/np.sum(weights)
-                    chi_sq_1 += np.sum(((lc - weighted_mean)**2/delta_m**2))
-                # Yes, I'm fitting magnitudes rather than flux. At least I feel kinda bad about it.
-                # F-test for nested models Regression problems:  https://en.wikipedia.org/wiki/F-test
-                f_numerator = (chi_sq_1 - chi_sq_2)/(p2-p1)
-                f_denom = 1.  # This is just reduced chi-squared for the more complicated model, so should be 1.
-                f_val = f_numerator/f_denom
-                # Has DoF (p2-p1, n-p2)
-                # https://stackoverflow.com/questions/21494141/how-do-i-do-a-f-test-in-python/21503346
-                p_value = scipy.stats.f.sf(f_val, p2-p1, n_pts-p2)
-                if np.isfinite(p_value):
-                    if p_value < self.sig_level:
-                        result += 1
+            filtIdx = filtIdx.ravel()
+            # Filter-index lookups: the star magnitudes in the filters present, and the visits in each filter.
+            mags = self.magTable[:, [self.filterIndex[f] for f in u_filters]]
+            onehot = (filtIdx[:, np.newaxis] == np.arange(n_filt)).astype(float)
+            times = dataSlice[self.mjdCol]
+            m5 = dataSlice[self.m5Col]
+            chunk = max(self.maxArraySize // n_pts, 1)
+            chi_sq_1 = np.concatenate([self._chiSq(times, m5, filtIdx, onehot, mags[i:i + chunk],
+                                                   self.periods[i:i + chunk], self.amplitudes[i:i + chunk])
+                                       for i in range(0, self.periods.size, chunk)])
+            # Yes, I'm fitting magnitudes rather than flux. At least I feel kinda bad about it.
+            # F-test for nested models Regression problems:  https://en.wikipedia.org/wiki/F-test
+            f_numerator = (chi_sq_1 - chi_sq_2)/(p2-p1)
+            f_denom = 1.  # This is just reduced chi-squared for the more complicated model, so should be 1.
+            f_val = f_numerator/f_denom
+            # Has DoF (p2-p1, n-p2)
+            # https://stackoverflow.com/questions/21494141/how-do-i-do-a-f-test-in-python/21503346
+            p_value = scipy.stats.f.sf(f_val, p2-p1, n_pts-p2)
+            result = int(np.sum(np.isfinite(p_value) & (p_value < self.sig_level)))
 
         return result
@@ -7,9 +7,17 @@ __all__ = ['PhaseGapMetric', 'PeriodicQualityMetric']
 class PhaseGapMetric(BaseMetric):
     """
     Measure the maximum gap in phase coverage for observations of periodic variables.
+
+    The metric value at each slicePoint is the largest phase gap for each of the nPeriods trial periods
+    (self.periods); this is a float, or (for nPeriods > 1) a fixed-width float array, so the metric values
+    for all slicePoints are stored as a single float array. The reduce functions are evaluated for all
+    slicePoints at once (vectorizedReduce): they take the metric values at many slicePoints, and return
+    the reduced value at each of them.
     """
+    vectorizedReduce = True
+
     def __init__(self, col='observationStartMJD', nPeriods=5, periodMin=3., periodMax=35., nVisitsMin=3,
-                 metricName='Phase Gap', **kwargs):
+                 maxArraySize=1000000, metricName='Phase Gap', **kwargs):
         """
         Construct an instance of a PhaseGapMetric class
 
@@ -18,67 +26,71 @@ class PhaseGapMetric(BaseMetric):
         :param periodMin: Minimum period to test (days)
         :param periodMax: Maximimum period to test (days)
         :param nVistisMin: minimum number of visits necessary before looking for the phase gap
+        :param maxArraySize: maximum number of phases (periods x visits) calculated at once;
+                             dense period grids are evaluated in chunks of periods to bound memory use.
         """
         self.periodMin = periodMin
         self.periodMax = periodMax
         self.nPeriods = nPeriods
         self.nVisitsMin = nVisitsMin
-        super(PhaseGapMetric, self).__init__(col, metricName=metricName, units='Fraction, 0-1', **kwargs)
+        self.maxArraySize = maxArraySize
+        # Create 'nPeriods' evenly spaced periods within range of min to max.
+        periods = np.arange(self.nPeriods, dtype=float)
+        self.periods = periods/max(self.nPeriods - 1, 1)*(self.periodMax-self.periodMin)+self.periodMin
+        super(PhaseGapMetric, self).__init__(col, metricName=metricName, units='Fraction, 0-1',
+                                             metricDtype='float', **kwargs)
+        self.shape = self.nPeriods
+
+    def _maxGaps(self, times, periods):
+        """Return the largest gap in phase coverage for each period.
+        """
+        # Phases for all periods at once (periods x visits), sorted along the visits.
+        phases = (times % periods[:, np.newaxis])/periods[:, np.newaxis]
+        phases.sort(axis=1)
+        maxGap = np.diff(phases, axis=1).max(axis=1, initial=0)
+        # Include the gap between the last and the first phase.
+        return np.maximum(maxGap, 1.0 - phases[:, -1] + phases[:, 0])
 
     def run(self, dataSlice, slicePoint=None):
         """
         Run the PhaseGapMetric.
         :param dataSlice: Data for this slice.
         :param slicePoint: Metadata for the slice (Optional as not used here).
-        :return: a dictionary of the periods used here and the corresponding largest gaps.
+        :return: the largest phase gap for each of the periods in self.periods (a float, if nPeriods is 1).
         """
-        if len(dataSlice) < self.nVisitsMin:
+        if len(dataSlice) < max(self.nVisitsMin, 1):
             return self.badval
-        # Create 'nPeriods' evenly spaced periods within range of min to max.
-        step = (self.periodMax-self.periodMin)/self.nPeriods
-        if step == 0:
-            periods = np.array([self.periodMin])
-        else:
-            periods = np.arange(self.nPeriods)
-            periods = periods/np.max(periods)*(self.periodMax-self.periodMin)+self.periodMin
-        maxGap = np.zeros(self.nPeriods, float)
-
-        for i, period in enumerate(periods):
-            # For each period, calculate the phases.
-            phases = (dataSlice[self.colname] % period)/period
-            phases = np.sort(phases)
-            # Find the largest gap in coverage.
-            gaps = np.diff(phases)
-            start_to_end = np.array([1.0 - phases[-1] + phases[0]], float)
-            gaps = np.concatenate([gaps, start_to_end])
-            maxGap[i] = np.max(gaps)
-
-        return {'periods':periods, 'maxGaps':maxGap}
+        times = dataSlice[self.colname]
+        chunk = max(self.maxArraySize // len(times), 1)
+        maxGap = np.concatenate([self._maxGaps(times, self.periods[i:i + chunk])
+                                 for i in range(0, self.nPeriods, chunk)])
+        if self.shape == 1:
+            return maxGap[0]
+        return maxGap
 
     def reduceMeanGap(self, metricVal):
         """
         At each slicepoint, return the mean gap value.
         """
-        return np.mean(metricVal['maxGaps'])
+        return np.mean(np.reshape(metricVal, (-1, self.nPeriods)), axis=1)
 
     def reduceMedianGap(self, metricVal):
         """
         At each slicepoint, return the median gap value.
         """
-        return np.median(metricVal['maxGaps'])
+        return np.median(np.reshape(metricVal, (-1, self.nPeriods)), axis=1)
 
     def reduceWorstPeriod(self, metricVal):
         """
         At each slicepoint, return the period with the largest phase gap.
         """
-        worstP = metricVal['periods'][np.where(metricVal['maxGaps'] == metricVal['maxGaps'].max())]
-        return worstP
+        return self.periods[np.argmax(np.reshape(metricVal, (-1, self.nPeriods)), axis=1)]
 
     def reduceLargestGap(self, metricVal):
         """
         At each slicepoint, return the largest phase gap value.
         """
-        return np.max(metricVal['maxGaps'])
+        return np.max(np.reshape(metricVal, (-1, self.nPeriods)), axis=1)
 
 
 #  To fit a periodic source well, you need to cover the full phase, and fit the amplitude.
@@ -89,10 +101,11 @@ class PeriodicQualityMetric(BaseMetric):
         self.m5Col = m5Col
         self.period = period
         self.starMag = starMag
+        self.phases = np.arange(0, np.pi, np.pi/8.)
         super(PeriodicQualityMetric, self).__init__([mjdCol, m5Col], metricName=metricName,
                                                     units='Fraction, 0-1', **kwargs)
 
-    def _calc_phase(self, dataSlice):
+    def _calc_phase(self, dataSlice, snr):
         """1 is perfectly balanced phase coverage, 0 is no effective coverage.
         """
         angles = dataSlice[self.mjdCol] % self.period
@@ -100,25 +113,25 @@ class PeriodicQualityMetric(BaseMetric):
         x = np.cos(angles)
         y = np.sin(angles)
 
-        snr = m52snr(self.starMag, dataSlice[self.m5Col])
         x_ave = np.average(x, weights=snr)
         y_ave = np.average(y, weights=snr)
 
         vector_off = np.sqrt(x_ave**2+y_ave**2)
         return 1.-vector_off
 
-    def _calc_amp(self, dataSlice):
+    def _calc_amp(self, dataSlice, snr):
         """Fractional SNR on the amplitude, testing for a variety of possible phases
         """
-        phases = np.arange(0, np.pi, np.pi/8.)
-        snr = m52snr(self.starMag, dataSlice[self.m5Col])
-        amp_snrs = np.sin(dataSlice[self.mjdCol]/self.period*2*np.pi + phases[:, np.newaxis])*snr
-        amp_snr = np.min(np.sqrt(np.sum(amp_snrs**2, axis=1)))
+        # All trial phases at once (phases x visits).
+        amp_snrs = np.sin(dataSlice[self.mjdCol]/self.period*2*np.pi + self.phases[:, np.newaxis])*snr
+        amp_snr = np.sqrt(np.min(np.einsum('ij,ij->i', amp_snrs, amp_snrs)))
 
-        max_snr = np.sqrt(np.sum(snr**2))
+        max_snr = np.sqrt(np.dot(snr, snr))
         return amp_snr/max_snr
 
     def run(self, dataSlice, slicePoint=None):
-        amplitude_fraction = self._calc_amp(dataSlice)
-        phase_fraction = self._calc_phase(dataSlice)
+        # The SNR of each visit is shared by the amplitude and phase calculations.
+        snr = m52snr(self.starMag, dataSlice[self.m5Col])
+        amplitude_fraction = self._calc_amp(dataSlice, snr)
+        phase_fraction = self._calc_phase(dataSlice, snr)
         return amplitude_fraction * phase_fraction
@@ -1,5 +1,6 @@
 import numpy as np
 from .baseMetric import BaseMetric
+from lsst.sims.maf.utils import segmentIds, segmentedCount, segmentedReduce, segmentedPercentile
 
 # A collection of commonly used simple metrics, operating on a single column and returning a float.
 
@@ -13,6 +14,16 @@ __all__ = ['PassMetric', 'Coaddm5Metric', 'MaxMetric', 'AbsMaxMetric', 'MeanMetr
 twopi = 2.0*np.pi
 
 
+def _sortedIfShared(metric, dataSlice, slicePoint):
+    """Return the values of metric.colname, taken from the shared SliceContext (sorted once, for all metrics)
+    if there is one. Order statistics (median, percentiles) are much faster to compute on sorted values.
+    """
+    sliceContext = metric.getSliceContext(dataSlice, slicePoint, create=False)
+    if sliceContext is None:
+        return dataSlice[metric.colname]
+    return sliceContext.sortedValues(metric.colname)
+
+
 class PassMetric(BaseMetric):
     """
     Just pass the entire array through
@@ -28,6 +39,9 @@ class PassMetric(BaseMetric):
 class Coaddm5Metric(BaseMetric):
     """Calculate the coadded m5 value at this gridpoint.
     """
+    # The partial state is the sum of the fluxes.
+    stateSize = 1
+
     def __init__(self, m5Col='fiveSigmaDepth', metricName='CoaddM5', **kwargs):
         """Instantiate metric.
 
@@ -37,35 +51,105 @@ class Coaddm5Metric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return 1.25 * np.log10(np.sum(10.**(.8*dataSlice[self.colname])))
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return 1.25 * np.log10(segmentedReduce(10.**(.8*dataSlices[self.colname]), offsets, np.sum))
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.sum(10.**(.8*dataSlice[self.colname]))])
+
+    def finalizeState(self, state):
+        return 1.25 * np.log10(state[..., 0])
+
 class MaxMetric(BaseMetric):
     """Calculate the maximum of a simData column slice.
     """
+    stateSize = 1
+
     def run(self, dataSlice, slicePoint=None):
         return np.max(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(dataSlices[self.colname], offsets, np.max)
+
+    def initState(self):
+        return np.array([-np.inf])
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.max(dataSlice[self.colname])], dtype=float)
+
+    def mergeStates(self, state1, state2):
+        return np.maximum(state1, state2)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 class AbsMaxMetric(BaseMetric):
     """Calculate the max of the absolute value of a simData column slice.
     """
+    stateSize = 1
+
     def run(self, dataSlice, slicePoint=None):
         return np.max(np.abs(dataSlice[self.colname]))
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(np.abs(dataSlices[self.colname]), offsets, np.max)
+
+    def initState(self):
+        return np.array([-np.inf])
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.max(np.abs(dataSlice[self.colname]))], dtype=float)
+
+    def mergeStates(self, state1, state2):
+        return np.maximum(state1, state2)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 class MeanMetric(BaseMetric):
     """Calculate the mean of a simData column slice.
     """
+    # The partial state is the sum of the values and the number of values.
+    stateSize = 2
+
     def run(self, dataSlice, slicePoint=None):
         return np.mean(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(dataSlices[self.colname], offsets, np.mean)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.sum(dataSlice[self.colname]), dataSlice[self.colname].size], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0] / state[..., 1]
+
 class AbsMeanMetric(BaseMetric):
     """Calculate the mean of the absolute value of a simData column slice.
     """
+    # The partial state is the sum of the absolute values and the number of values.
+    stateSize = 2
+
     def run(self, dataSlice, slicePoint=None):
         return np.mean(np.abs(dataSlice[self.colname]))
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(np.abs(dataSlices[self.colname]), offsets, np.mean)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.sum(np.abs(dataSlice[self.colname])), dataSlice[self.colname].size], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0] / state[..., 1]
+
 class MedianMetric(BaseMetric):
     """Calculate the median of a simData column slice.
     """
     def run(self, dataSlice, slicePoint=None):
-        return np.median(dataSlice[self.colname])
+        return np.median(_sortedIfShared(self, dataSlice, slicePoint))
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(dataSlices[self.colname], offsets, np.median)
 
 class AbsMedianMetric(BaseMetric):
     """Calculate the median of the absolute value of a simData column slice.
@@ -73,30 +157,110 @@ class AbsMedianMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return np.median(np.abs(dataSlice[self.colname]))
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(np.abs(dataSlices[self.colname]), offsets, np.median)
+
 class MinMetric(BaseMetric):
     """Calculate the minimum of a simData column slice.
     """
+    stateSize = 1
+
     def run(self, dataSlice, slicePoint=None):
         return np.min(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(dataSlices[self.colname], offsets, np.min)
+
+    def initState(self):
+        return np.array([np.inf])
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.min(dataSlice[self.colname])], dtype=float)
+
+    def mergeStates(self, state1, state2):
+        return np.minimum(state1, state2)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 class FullRangeMetric(BaseMetric):
     """Calculate the range of a simData column slice.
     """
+    # The partial state is the maximum and the minimum value.
+    stateSize = 2
+
     def run(self, dataSlice, slicePoint=None):
         return np.max(dataSlice[self.colname])-np.min(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        values = dataSlices[self.colname]
+        return segmentedReduce(values, offsets, np.max) - segmentedReduce(values, offsets, np.min)
+
+    def initState(self):
+        return np.array([-np.inf, np.inf])
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.max(dataSlice[self.colname]), np.min(dataSlice[self.colname])], dtype=float)
+
+    def mergeStates(self, state1, state2):
+        return np.stack([np.maximum(state1[..., 0], state2[..., 0]),
+                         np.minimum(state1[..., 1], state2[..., 1])], axis=-1)
+
+    def finalizeState(self, state):
+        return state[..., 0] - state[..., 1]
+
 class RmsMetric(BaseMetric):
     """Calculate the standard deviation of a simData column slice.
     """
+    # The partial state is the number of values, their mean and the sum of their squared
+    # deviations from the mean, which merge without the loss of precision of summing squares.
+    stateSize = 3
+
     def run(self, dataSlice, slicePoint=None):
         return np.std(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        # Sum the squared deviations from the mean of each segment (rather than the squared values).
+        values = dataSlices[self.colname]
+        means = segmentedReduce(values, offsets, np.mean)
+        deviations = values - means[segmentIds(offsets)]
+        return np.sqrt(segmentedReduce(deviations**2, offsets, np.mean))
+
+    def calcState(self, dataSlice, slicePoint=None):
+        values = dataSlice[self.colname]
+        mean = np.mean(values)
+        return np.array([values.size, mean, np.sum((values - mean)**2)], dtype=float)
+
+    def mergeStates(self, state1, state2):
+        n1 = state1[..., 0]
+        n2 = state2[..., 0]
+        n = n1 + n2
+        nSafe = np.where(n > 0, n, 1)
+        delta = state2[..., 1] - state1[..., 1]
+        mean = state1[..., 1] + delta * n2 / nSafe
+        m2 = state1[..., 2] + state2[..., 2] + delta**2 * n1 * n2 / nSafe
+        return np.stack([n, mean, m2], axis=-1)
+
+    def finalizeState(self, state):
+        return np.sqrt(state[..., 2] / state[..., 0])
+
 class SumMetric(BaseMetric):
     """Calculate the sum of a simData column slice.
     """
+    stateSize = 1
+
     def run(self, dataSlice, slicePoint=None):
         return np.sum(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedReduce(dataSlices[self.colname], offsets, np.sum)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.sum(dataSlice[self.colname])], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 class CountUniqueMetric(BaseMetric):
     """Return the number of unique values.
     """
@@ -113,6 +277,8 @@ class UniqueRatioMetric(BaseMetric):
 
 class CountMetric(BaseMetric):
     """Count the length of a simData column slice. """
+    stateSize = 1
+
     def __init__(self, col=None, **kwargs):
         super(CountMetric, self).__init__(col=col, **kwargs)
         self.metricDtype = 'int'
@@ -120,10 +286,21 @@ class CountMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return len(dataSlice[self.colname])
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return np.diff(offsets)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([len(dataSlice[self.colname])], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 
 class CountExplimMetric(BaseMetric):
     """Count the number of x second visits.  Useful for rejecting very short exposures
     and counting 60s exposures as 2 visits."""
+    stateSize = 1
+
     def __init__(self, col=None, minExp=20., expectedExp=30., expCol='visitExposureTime', **kwargs):
         self.minExp = minExp
         self.expectedExp = expectedExp
@@ -137,9 +314,17 @@ class CountExplimMetric(BaseMetric):
         nv = np.round(nv)
         return int(np.sum(nv))
 
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([self.run(dataSlice)], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 class CountRatioMetric(BaseMetric):
     """Count the length of a simData column slice, then divide by 'normVal'. 
     """
+    stateSize = 1
+
     def __init__(self, col=None, normVal=1., metricName=None, **kwargs):
         self.normVal = float(normVal)
         if metricName is None:
@@ -149,9 +334,20 @@ class CountRatioMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         return len(dataSlice[self.colname])/self.normVal
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return np.diff(offsets) / self.normVal
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([len(dataSlice[self.colname])], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0] / self.normVal
+
 class CountSubsetMetric(BaseMetric):
     """Count the length of a simData column slice which matches 'subset'. 
     """
+    stateSize = 1
+
     def __init__(self, col=None, subset=None, **kwargs):
         super(CountSubsetMetric, self).__init__(col=col, **kwargs)
         self.metricDtype = 'int'
@@ -162,15 +358,29 @@ class CountSubsetMetric(BaseMetric):
         count = len(np.where(dataSlice[self.colname] == self.subset)[0])
         return count
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedCount(dataSlices[self.colname] == self.subset, offsets)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.count_nonzero(dataSlice[self.colname] == self.subset)], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0]
+
 class RobustRmsMetric(BaseMetric):
     """Use the inter-quartile range of the data to estimate the RMS.  
     Robust since this calculation does not include outliers in the distribution.
     """
     def run(self, dataSlice, slicePoint=None):
-        iqr = np.percentile(dataSlice[self.colname],75)-np.percentile(dataSlice[self.colname],25)
+        values = _sortedIfShared(self, dataSlice, slicePoint)
+        iqr = np.percentile(values,75)-np.percentile(values,25)
         rms = iqr/1.349 #approximation
         return rms
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        quartiles = segmentedPercentile(dataSlices[self.colname], offsets, [25, 75])
+        return (quartiles[:, 1] - quartiles[:, 0]) / 1.349
+
 class MaxPercentMetric(BaseMetric):
     """Return the percent of the data which has the maximum value.
     """
@@ -191,15 +401,30 @@ class AbsMaxPercentMetric(BaseMetric):
 class BinaryMetric(BaseMetric):
     """Return 1 if there is data. 
     """
+    # The partial state is the number of visits.
+    stateSize = 1
+
     def run(self, dataSlice, slicePoint=None):
         if dataSlice.size > 0:
             return 1
         else:
             return self.badval
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return np.where(np.diff(offsets) > 0, 1, self.badval)
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([dataSlice.size], dtype=float)
+
+    def finalizeState(self, state):
+        return np.where(state[..., 0] > 0, 1, self.badval)
+
 class FracAboveMetric(BaseMetric):
     """Find the fraction of data values above a given value.
     """
+    # The partial state is the number of values above the cutoff and the number of values.
+    stateSize = 2
+
     def __init__(self, col=None, cutoff=0.5, scale=1, metricName=None, **kwargs):
         # Col could just get passed in bundle with kwargs, but by explicitly pulling it out
         #  first, we support use cases where class instantiated without explicit 'col=').
@@ -214,9 +439,23 @@ class FracAboveMetric(BaseMetric):
         fracAbove = fracAbove * self.scale
         return fracAbove
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        nAbove = segmentedCount(dataSlices[self.colname] >= self.cutoff, offsets)
+        return nAbove / np.diff(offsets).astype(float) * self.scale
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.count_nonzero(dataSlice[self.colname] >= self.cutoff),
+                         np.size(dataSlice[self.colname])], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0] / state[..., 1] * self.scale
+
 class FracBelowMetric(BaseMetric):
     """Find the fraction of data values below a given value.
     """
+    # The partial state is the number of values below the cutoff and the number of values.
+    stateSize = 2
+
     def __init__(self, col=None, cutoff=0.5, scale=1, metricName=None, **kwargs):
         if metricName is None:
             metricName = 'FracBelow %.2f %s' %(cutoff, col)
@@ -229,6 +468,17 @@ class FracBelowMetric(BaseMetric):
         fracBelow = fracBelow * self.scale
         return fracBelow
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        nBelow = segmentedCount(dataSlices[self.colname] <= self.cutoff, offsets)
+        return nBelow / np.diff(offsets).astype(float) * self.scale
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return np.array([np.count_nonzero(dataSlice[self.colname] <= self.cutoff),
+                         np.size(dataSlice[self.colname])], dtype=float)
+
+    def finalizeState(self, state):
+        return state[..., 0] / state[..., 1] * self.scale
+
 class PercentileMetric(BaseMetric):
     """Find the value of a column at a given percentile.
     """
@@ -238,9 +488,12 @@ class PercentileMetric(BaseMetric):
         super(PercentileMetric, self).__init__(col=col, metricName=metricName, **kwargs)
         self.percentile = percentile
     def run(self, dataSlice, slicePoint=None):
-        pval = np.percentile(dataSlice[self.colname], self.percentile)
+        pval = np.percentile(_sortedIfShared(self, dataSlice, slicePoint), self.percentile)
         return pval
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return segmentedPercentile(dataSlices[self.colname], offsets, self.percentile)
+
 class NoutliersNsigmaMetric(BaseMetric):
     """Calculate the # of visits less than nSigma below the mean (nSigma<0) or
     more than nSigma above the mean of 'col'.
@@ -0,0 +1,160 @@
+import numpy as np
+
+__all__ = ['SliceContext']
+
+# The autumnal equinox in 2014 (MJD), when the sun is at RA=0.
+EQUINOX_MJD = 2456923.5 - 2400000.5
+
+
+class SliceContext(object):
+    """Lazily computed, memoized quantities derived from the data at a single slicePoint.
+
+    Many metrics run on the same dataSlice repeat the same preprocessing (sorting the visits in time,
+    finding the unique nights, splitting the visits by filter, assigning visits to seasons).
+    The MetricBundleGroup creates one SliceContext per slicePoint (see share) and passes it to every metric
+    in the slicePoint dictionary (under the key 'sliceContext'), so that each quantity is only
+    calculated once per slicePoint. Metrics retrieve it with BaseMetric.getSliceContext.
+
+    The arrays returned are shared between metrics, and so must be treated as read-only.
+
+    Parameters
+    ----------
+    dataSlice : numpy.ndarray
+        The structured array of visits at this slicePoint.
+    slicePoint : dict, opt
+        The slicePoint metadata (ra/dec, etc.). Default None.
+    """
+    def __init__(self, dataSlice, slicePoint=None):
+        self.dataSlice = dataSlice
+        self.slicePoint = slicePoint
+        self._cache = {}
+
+    @classmethod
+    def share(cls, dataSlice, slicePoint, nMetrics):
+        """Return the slicePoint to pass to the nMetrics metrics which will run on dataSlice.
+
+        If more than one metric will run, this is a copy of slicePoint with a new SliceContext
+        (under 'sliceContext'); for a single metric it is slicePoint itself, as there is nothing to share
+        (the metric creates its own SliceContext, if it needs one).
+        """
+        if nMetrics < 2:
+            return slicePoint
+        shared = dict(slicePoint) if slicePoint is not None else {}
+        shared['sliceContext'] = cls(dataSlice, slicePoint)
+        return shared
+
+    def _memo(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def isSorted(self, col):
+        """Return True if the dataSlice is already in (non-decreasing) order of col.
+        """
+        def _isSorted():
+            values = self.dataSlice[col]
+            return bool(values.size < 2 or np.all(values[1:] >= values[:-1]))
+        return self._memo(('isSorted', col), _isSorted)
+
+    def order(self, col):
+        """Return the indexes which (stably) sort the dataSlice by col.
+        """
+        def _order():
+            if self.isSorted(col):
+                return np.arange(self.dataSlice.size)
+            return np.argsort(self.dataSlice[col], kind='mergesort')
+        return self._memo(('order', col), _order)
+
+    def sortedData(self, col):
+        """Return the dataSlice sorted by col (the dataSlice itself, if it is already sorted).
+        """
+        def _sortedData():
+            if self.isSorted(col):
+                return self.dataSlice
+            return self.dataSlice[self.order(col)]
+        return self._memo(('sortedData', col), _sortedData)
+
+    def sortedValues(self, col):
+        """Return the values of col, sorted.
+        """
+        def _sortedValues():
+            if self.isSorted(col) or ('sortedData', col) in self._cache:
+                return self.sortedData(col)[col]
+            # Sorting the values alone is much faster than sorting the whole dataSlice.
+            return np.sort(self.dataSlice[col], kind='mergesort')
+        return self._memo(('sortedValues', col), _sortedValues)
+
+    def diffs(self, col):
+        """Return the differences between consecutive (sorted) values of col, such as the time between visits.
+        """
+        return self._memo(('diffs', col), lambda: np.diff(self.sortedValues(col)))
+
+    def uniqueNights(self, nightCol='night'):
+        """Return the unique nights and where each night's visits lie in sortedData(nightCol).
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray
+            The unique (sorted) night values, and the offsets of the first visit of each night in
+            sortedData(nightCol). The offsets array has one extra element (the number of visits),
+            so the visits of night i are sortedData(nightCol)[offsets[i]:offsets[i+1]].
+        """
+        def _uniqueNights():
+            nights = self.sortedValues(nightCol)
+            if nights.size == 0:
+                return nights, np.zeros(1, int)
+            starts = np.concatenate([[0], np.where(nights[1:] != nights[:-1])[0] + 1])
+            return nights[starts], np.concatenate([starts, [nights.size]])
+        return self._memo(('uniqueNights', nightCol), _uniqueNights)
+
+    def visitsPerNight(self, nightCol='night'):
+        """Return the number of visits in each of the uniqueNights.
+        """
+        return self._memo(('visitsPerNight', nightCol), lambda: np.diff(self.uniqueNights(nightCol)[1]))
+
+    def filterGroups(self, filterCol='filter'):
+        """Return a dictionary of the indexes (into the dataSlice, in increasing order) of the visits
+        in each filter.
+        """
+        def _filterGroups():
+            filters = self.dataSlice[filterCol]
+            order = np.argsort(filters, kind='mergesort')
+            ufilters, starts = np.unique(filters[order], return_index=True)
+            groups = np.split(order, starts[1:])
+            return dict(zip(ufilters, groups))
+        return self._memo(('filterGroups', filterCol), _filterGroups)
+
+    def seasons(self, mjdCol='observationStartMJD', ra=None, equinox=EQUINOX_MJD):
+        """Return the season of each visit in sortedData(mjdCol),
+        counting from 0 for the first season observed.
+
+        Seasons are a year long, and the boundaries fall when the sun is opposite the slicePoint RA
+        (i.e. six months after the sun passes through the slicePoint RA).
+
+        Parameters
+        ----------
+        mjdCol : str, opt
+            The column with the times of the visits. Default observationStartMJD.
+        ra : float, opt
+            The RA (in radians) used to set the season boundaries. Default None, which uses
+            the slicePoint 'ra'.
+        equinox : float, opt
+            The MJD of an autumnal equinox, when the sun is at RA=0. Default EQUINOX_MJD (2014).
+
+        Returns
+        -------
+        numpy.ndarray
+            The (integer) season of each visit in sortedData(mjdCol).
+        """
+        if ra is None:
+            ra = self.slicePoint['ra']
+
+        def _seasons():
+            # RA in hours, then 0.5 to go from RA to month; 365.25/12.0 months to days.
+            daysSinceEquinox = 0.5 * (np.degrees(ra) / 15.0) * (365.25 / 12.0)
+            firstSeasonBegan = equinox + daysSinceEquinox - 0.5 * 365.25
+            globalSeason = np.floor((self.sortedValues(mjdCol) - firstSeasonBegan) / 365.25).astype(int)
+            if globalSeason.size == 0:
+                return globalSeason
+            return globalSeason - globalSeason[0]
+        return self._memo(('seasons', mjdCol, float(ra), float(equinox)), _seasons)
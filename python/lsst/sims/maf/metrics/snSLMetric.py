@@ -103,7 +103,7 @@ class SNSLMetric(metrics.BaseMetric):
         number of SL time delay supernovae
 
         """
-        dataSlice.sort(order=self.mjdCol)
+        dataSlice = self.getSliceContext(dataSlice, slicePoint).sortedData(self.mjdCol)
         # get the pixel area
         area = hp.nside2pixarea(slicePoint['nside'], degrees=True)
 
@@ -179,7 +179,7 @@ class SNSLMetric(metrics.BaseMetric):
         if 'season' in obs.dtype.names:
             return obs, obs['season']
 
-        obs.sort(order=self.mjdCol)
+        obs = self.getSliceContext(obs).sortedData(self.mjdCol)
         season = np.zeros(obs.size, dtype=int)
 
         if len(obs) == 1:
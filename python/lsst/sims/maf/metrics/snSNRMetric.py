@@ -1,6 +1,5 @@
 import numpy as np
 import matplotlib.pylab as plt
-import numpy.lib.recfunctions as rf
 import yaml
 from scipy import interpolate
 import lsst.sims.maf.metrics as metrics
@@ -9,6 +8,39 @@ from collections import Iterable
 import time
 
 
+def segmentedArange(starts, stops, steps, return_counts=False):
+    """
+    Concatenation of np.arange(start, stop, step) for each (start, stop, step), without a Python loop
+
+    Parameters
+    ---------------
+    starts : array(float)
+      start values
+    stops : array(float)
+      stop values (excluded)
+    steps : float or array(float)
+      steps
+    return_counts : bool, opt
+      return also the number of values of each arange
+      Default : False
+
+    Returns
+    -----------
+    array of the values (and array of the number of values of each arange)
+    """
+    starts = np.asarray(starts, dtype=float)
+    steps = np.broadcast_to(np.asarray(steps, dtype=float), starts.shape)
+    counts = np.maximum(np.ceil((np.asarray(stops, dtype=float)-starts)/steps), 0).astype(int)
+    # like np.arange, step by the difference between the first two values
+    deltas = (starts+steps)-starts
+    offsets = np.cumsum(counts)-counts
+    i = np.arange(np.sum(counts))-np.repeat(offsets, counts)
+    values = np.repeat(starts, counts)+i*np.repeat(deltas, counts)
+    if return_counts:
+        return values, counts
+    return values
+
+
 class SNSNRMetric(metrics.BaseMetric):
 
     """
@@ -92,11 +124,11 @@ class SNSNRMetric(metrics.BaseMetric):
 
         """
         time_ref = time.time()
+        dataSlice = self.getSliceContext(dataSlice, slicePoint).sortedData(self.mjdCol)
         goodFilters = np.in1d(dataSlice['filter'], self.filterNames)
         dataSlice = dataSlice[goodFilters]
         if dataSlice.size == 0:
             return None
-        dataSlice.sort(order=self.mjdCol)
 
         if self.season != -1:
             seasons = self.season
@@ -206,22 +238,15 @@ class SNSNRMetric(metrics.BaseMetric):
         band = np.unique(dataSlice[self.filterCol])[0]
 
         # Define MJDs to consider for metric estimation
-        # basically: step of one day between MJDmin and MJDmax
-        dates = None
-
-        for val in self.info_season:
-            if dates is None:
-                dates = np.arange(
-                    val['MJD_min']+self.shift, val['MJD_max']+1., 1.)
-            else:
-                dates = np.concatenate(
-                    (dates, np.arange(val['MJD_min']+self.shift, val['MJD_max']+1., 1.)))
+        # basically: step of one day between MJDmin and MJDmax (of each season, all at once)
+        dates = segmentedArange(self.info_season['MJD_min']+self.shift,
+                                self.info_season['MJD_max']+1., 1.)
 
         # SN  DayMax: dates-shift where shift is chosen in the input yaml file
         T0_lc = dates-self.shift
 
         # for these DayMax, estimate the phases of LC points corresponding to the current dataSlice MJDs
-
+        # (a (T0 x visit) array)
         time_for_lc = -T0_lc[:, None]+mjds
 
         phase = time_for_lc/(1.+self.z)  # phases of LC points
@@ -229,32 +254,32 @@ class SNSNRMetric(metrics.BaseMetric):
         phase_max = self.shift/(1.+self.z)
         flag = (phase >= self.min_rf_phase) & (phase <= phase_max)
 
-        # tile m5, MJDs, and seasons to estimate all fluxes and SNR at once
-        m5_vals = np.tile(dataSlice[self.m5Col], (len(time_for_lc), 1))
-        season_vals = np.tile(dataSlice[self.seasonCol], (len(time_for_lc), 1))
+        # m5 is the same for every T0: it is broadcast against the T0 axis rather than tiled
+        m5_vals = dataSlice[self.m5Col]
 
         # estimate fluxes and snr in SNR function
-        fluxes_tot, snr = self.snr(
-            time_for_lc, m5_vals, flag, season_vals, T0_lc)
+        fluxes_tot, snr_tab = self.snr(time_for_lc, m5_vals, flag, T0_lc)
 
         # now save the results in a record array
-        _, idx = np.unique(snr['season'], return_inverse=True)
+        _, idx = np.unique(snr_tab['season'], return_inverse=True)
         infos = self.info_season[idx]
 
         vars_info = ['cadence', 'season_length', 'MJD_min']
-        snr = rf.append_fields(
-            snr, vars_info, [infos[name] for name in vars_info])
-        snr = rf.append_fields(snr, 'DayMax', T0_lc)
-        snr = rf.append_fields(snr, 'MJD', dates)
-        snr = rf.append_fields(snr, 'm5_eff', np.mean(
-            np.ma.array(m5_vals, mask=~flag), axis=1))
-        global_info = [(fieldRA, fieldDec, band, m5,
-                        Nvisits, exptime)]*len(snr)
-        names = ['fieldRA', 'fieldDec', 'band',
-                 'm5', 'Nvisits', 'ExposureTime']
-        global_info = np.rec.fromrecords(global_info, names=names)
-        snr = rf.append_fields(
-            snr, names, [global_info[name] for name in names])
+        names = ['fieldRA', 'fieldDec', 'band', 'm5', 'Nvisits', 'ExposureTime']
+        dtype = snr_tab.dtype.descr + [(name, 'f8') for name in vars_info + ['DayMax', 'MJD', 'm5_eff']]
+        dtype += [(name, 'U%d' % len(band) if name == 'band' else 'f8') for name in names]
+        snr = np.zeros(len(snr_tab), dtype=dtype)
+        for name in snr_tab.dtype.names:
+            snr[name] = snr_tab[name]
+        for name in vars_info:
+            snr[name] = infos[name]
+        snr['DayMax'] = T0_lc
+        snr['MJD'] = dates
+        nflag = np.sum(flag, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            snr['m5_eff'] = np.where(nflag > 0, np.sum(m5_vals*flag, axis=1)/nflag, np.nan)
+        for name, val in zip(names, [fieldRA, fieldDec, band, m5, Nvisits, exptime]):
+            snr[name] = val
 
         if output_q is not None:
             output_q.put({j: snr})
@@ -298,19 +323,18 @@ class SNSNRMetric(metrics.BaseMetric):
 
         return info_season
 
-    def snr(self, time_lc, m5_vals, flag, season_vals, T0_lc):
+    def snr(self, time_lc, m5_vals, flag, T0_lc):
         """
         Estimate SNR vs time
 
         Parameters
         -----------
-        time_lc :
-        m5_vals : list(float)
-           five-sigme depth values
+        time_lc : array(float)
+           times of the LC points from each T0 (T0 x visit)
+        m5_vals : array(float)
+           five-sigme depth values (of each visit, or T0 x visit)
         flag : array(bool)
           flag to be applied (example: selection from phase cut)
-        season_vals : array(float)
-          season values
         T0_lc : array(float)
            array of T0 for supernovae
 
@@ -323,46 +347,23 @@ class SNSNRMetric(metrics.BaseMetric):
           season (float) : season num.
         """
 
-        seasons = np.ma.array(season_vals, mask=~flag)
-
         fluxes_tot = {}
-        snr_tab = None
+        snr_seasons = []
 
         for ib, name in enumerate(self.names_ref):
             fluxes = self.lim_sn.fluxes[ib](time_lc)
-            if name not in fluxes_tot.keys():
-                fluxes_tot[name] = fluxes
-            else:
-                fluxes_tot[name] = np.concatenate((fluxes_tot[name], fluxes))
+            fluxes_tot[name] = fluxes
 
             flux_5sigma = self.lim_sn.mag_to_flux[ib](m5_vals)
             snr = fluxes**2/flux_5sigma**2
-            snr_season = 5.*np.sqrt(np.sum(snr*flag, axis=1))
-
-            if snr_tab is None:
-                snr_tab = np.asarray(np.copy(snr_season), dtype=[
-                    ('SNR_'+name, 'f8')])
-            else:
-                snr_tab = rf.append_fields(
-                    snr_tab, 'SNR_'+name, np.copy(snr_season))
-            """    
-            snr_tab = rf.append_fields(
-                snr_tab, 'season', np.mean(seasons, axis=1))
-          """
-            snr_tab = rf.append_fields(
-                snr_tab, 'season', self.get_season(T0_lc))
-
-        # check if any masked value remaining
-        # this would correspond to case where no obs point has been selected
-        # ie no points with phase in [phase_min,phase_max]
-        # this happens when internight gaps are large (typically larger than shift)
-        idmask = np.where(snr_tab.mask)
-        if len(idmask) > 0:
-            tofill = np.copy(snr_tab['season'])
-            season_recover = self.get_season(
-                T0_lc[np.where(snr_tab.mask)])
-            tofill[idmask] = season_recover
-            snr_tab = np.ma.filled(snr_tab, fill_value=tofill)
+            snr_seasons.append(5.*np.sqrt(np.sum(snr*flag, axis=1)))
+
+        snr_tab = np.zeros(len(T0_lc), dtype=[('SNR_'+name, 'f8') for name in self.names_ref] +
+                           [('season', 'f8')])
+        for name, snr_season in zip(self.names_ref, snr_seasons):
+            snr_tab['SNR_'+name] = snr_season
+        # T0 values outside of every season (which should not happen) get a NaN season
+        snr_tab['season'] = np.ma.filled(self.get_season(T0_lc), np.nan)
 
         return fluxes_tot, snr_tab
 
@@ -451,37 +452,20 @@ class SNSNRMetric(metrics.BaseMetric):
         fieldDec = np.mean(slice_sel[self.DecCol])
         Tvisit = 30.
 
-        fake_obs = None
+        # The fake observations of each season (only a few seasons, so a loop is cheap).
+        fake_obs = []
         for val in self.info_season:
-            cadence = val['cadence']
-            mjd_min = val['MJD_min']
-            mjd_max = val['MJD_max']
-            season_length = val['season_length']
-            Nvisits = val['Nvisits']
-            m5 = val['m5']
-
-            # build the configuration file
-
-            config_fake = {}
-            config_fake['Ra'] = fieldRA
-            config_fake['Dec'] = fieldDec
-            config_fake['bands'] = [band]
-            config_fake['Cadence'] = [cadence]
-            config_fake['MJD_min'] = [mjd_min]
-            config_fake['season_length'] = season_length
-            config_fake['Nvisits'] = [Nvisits]
-            m5_nocoadd = m5-1.25*np.log10(float(Nvisits)*Tvisit/30.)
-            config_fake['m5'] = [m5_nocoadd]
-            config_fake['seasons'] = [val['season']]
-            config_fake['Exposure_Time'] = [30.]
-            config_fake['shift_days'] = 0.
-            fake_obs_season = GenerateFakeObservations(
-                config_fake).Observations
-            if fake_obs is None:
-                fake_obs = fake_obs_season
-            else:
-                fake_obs = np.concatenate((fake_obs, fake_obs_season))
-        return fake_obs
+            m5_nocoadd = val['m5']-1.25*np.log10(float(val['Nvisits'])*Tvisit/30.)
+            config_fake = {'Ra': fieldRA, 'Dec': fieldDec, 'bands': [band], 'Cadence': [val['cadence']],
+                           'MJD_min': [val['MJD_min']], 'season_length': val['season_length'],
+                           'Nvisits': [val['Nvisits']], 'm5': [m5_nocoadd], 'seasons': [val['season']],
+                           'Exposure_Time': [30.], 'shift_days': 0.}
+            fake_obs.append(GenerateFakeObservations(config_fake, mjdCol=self.mjdCol, RaCol=self.RaCol,
+                                                     DecCol=self.DecCol, filterCol=self.filterCol,
+                                                     m5Col=self.m5Col, exptimeCol=self.exptimeCol,
+                                                     nexpCol=self.nexpCol,
+                                                     seasonCol=self.seasonCol).Observations)
+        return np.concatenate(fake_obs)
 
     def plot(self, snr_obs, snr_fakes):
         """ Plot SNR vs time
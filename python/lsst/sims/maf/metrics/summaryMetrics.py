@@ -1,6 +1,7 @@
 import numpy as np
 import healpy as hp
 from scipy import interpolate
+from lsst.sims.maf.utils import calcPowerSpectrum
 from .baseMetric import BaseMetric
 
 # A collection of metrics which are primarily intended to be used as summary statistics.
@@ -217,11 +218,9 @@ class TotalPowerMetric(BaseMetric):
         super(TotalPowerMetric, self).__init__(col=col, maskVal=maskVal, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        # Calculate the power spectrum.
-        if self.removeDipole:
-            cl = hp.anafast(hp.remove_dipole(dataSlice[self.colname], verbose=False))
-        else:
-            cl = hp.anafast(dataSlice[self.colname])
+        # Calculate the power spectrum (or find it in the cache, shared with other TotalPowerMetrics
+        # and the HealpixPowerSpectrum plotter).
+        cl = calcPowerSpectrum(dataSlice[self.colname], removeDipole=self.removeDipole)
         ell = np.arange(np.size(cl))
         condition = np.where((ell <= self.lmax) & (ell >= self.lmin))[0]
         totalpower = np.sum(cl[condition]*(2*ell[condition]+1))
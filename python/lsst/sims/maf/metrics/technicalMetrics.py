@@ -138,6 +138,9 @@ class TeffMetric(BaseMetric):
     """
     Effective time equivalent for a given set of visits.
     """
+    # The partial state is the sum of the visits' flux ratios to the fiducial depth, and the number of visits.
+    stateSize = 2
+
     def __init__(self, m5Col='fiveSigmaDepth', filterCol='filter', metricName='tEff',
                  fiducialDepth=None, teffBase=30.0, normed=False, **kwargs):
         self.m5Col = m5Col
@@ -180,6 +183,19 @@ class TeffMetric(BaseMetric):
             teff = teff / (self.teffBase*dataSlice[self.m5Col].size)
         return teff
 
+    def calcState(self, dataSlice, slicePoint=None):
+        teff = 0.0
+        for f in np.unique(dataSlice[self.filterCol]):
+            match = np.where(dataSlice[self.filterCol] == f)[0]
+            teff += (10.0**(0.8*(dataSlice[self.m5Col][match] - self.depth[f]))).sum()
+        return np.array([teff, dataSlice[self.m5Col].size], dtype=float)
+
+    def finalizeState(self, state):
+        teff = state[..., 0] * self.teffBase
+        if self.normed:
+            teff = teff / (self.teffBase*state[..., 1])
+        return teff
+
 
 class OpenShutterFractionMetric(BaseMetric):
     """
@@ -1,5 +1,7 @@
 import numpy as np
 from .baseMetric import BaseMetric
+from lsst.sims.maf.utils import (segmentedSort, segmentedDiff, segmentedHistogram, segmentedPairHistogram,
+                                 segmentedReduce, runLengths)
 
 __all__ = ['TgapsMetric', 'NightgapsMetric', 'NVisitsPerNightMetric', 'MaxGapMetric']
 
@@ -40,16 +42,20 @@ class TgapsMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         if dataSlice.size < 2:
             return self.badval
-        times = np.sort(dataSlice[self.timesCol])
+        times = self.getSliceContext(dataSlice, slicePoint).sortedValues(self.timesCol)
+        return self._histogramGaps(times, np.array([0, times.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        times = segmentedSort(dataSlices[self.timesCol], offsets)
+        result = self._histogramGaps(times, offsets)
+        return [self.badval if n < 2 else r for n, r in zip(np.diff(offsets), result)]
+
+    def _histogramGaps(self, times, offsets):
+        """Histogram the gaps between the (sorted) times in each segment."""
         if self.allGaps:
-            allDiffs = []
-            for i in np.arange(1,times.size,1):
-                allDiffs.append((times-np.roll(times,i))[i:])
-            dts = np.concatenate(allDiffs)
-        else:
-            dts = np.diff(times)
-        result, bins = np.histogram(dts, self.bins)
-        return result
+            return segmentedPairHistogram(times, offsets, self.bins)
+        dts, dtOffsets = segmentedDiff(times, offsets)
+        return segmentedHistogram(dts, dtOffsets, self.bins)
 
 
 class NightgapsMetric(BaseMetric):
@@ -89,16 +95,21 @@ class NightgapsMetric(BaseMetric):
     def run(self, dataSlice, slicePoint=None):
         if dataSlice.size < 2:
             return self.badval
-        nights = np.sort(np.unique(dataSlice[self.nightCol]))
+        nights = self.getSliceContext(dataSlice, slicePoint).uniqueNights(self.nightCol)[0]
+        return self._histogramGaps(nights, np.array([0, nights.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        nights = segmentedSort(dataSlices[self.nightCol], offsets)
+        runOffsets, nightOffsets = runLengths(nights, offsets)
+        result = self._histogramGaps(nights[runOffsets[:-1]], nightOffsets)
+        return [self.badval if n < 2 else r for n, r in zip(np.diff(offsets), result)]
+
+    def _histogramGaps(self, nights, offsets):
+        """Histogram the gaps between the (sorted, unique) nights in each segment."""
         if self.allGaps:
-            allDiffs = []
-            for i in np.arange(1, nights.size,1):
-                allDiffs.append((nights-np.roll(nights,i))[i:])
-            dnights = np.concatenate(allDiffs)
-        else:
-            dnights = np.diff(nights)
-        result, bins = np.histogram(dnights, self.bins)
-        return result
+            return segmentedPairHistogram(nights, offsets, self.bins)
+        dnights, dOffsets = segmentedDiff(nights, offsets)
+        return segmentedHistogram(dnights, dOffsets, self.bins)
 
 
 class NVisitsPerNightMetric(BaseMetric):
@@ -127,9 +138,13 @@ class NVisitsPerNightMetric(BaseMetric):
                                                     units=units, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        n, counts = np.unique(dataSlice[self.nightCol], return_counts=True)
-        result, bins = np.histogram(counts, self.bins)
-        return result
+        counts = self.getSliceContext(dataSlice, slicePoint).visitsPerNight(self.nightCol)
+        return segmentedHistogram(counts, np.array([0, counts.size]), self.bins)[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        nights = segmentedSort(dataSlices[self.nightCol], offsets)
+        runOffsets, nightOffsets = runLengths(nights, offsets)
+        return list(segmentedHistogram(np.diff(runOffsets), nightOffsets, self.bins))
 
 
 class MaxGapMetric(BaseMetric):
@@ -143,10 +158,15 @@ class MaxGapMetric(BaseMetric):
         super(MaxGapMetric, self).__init__(col=[self.mjdCol], units=units, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        gaps = np.diff(np.sort(dataSlice[self.mjdCol]))
+        gaps = self.getSliceContext(dataSlice, slicePoint).diffs(self.mjdCol)
         if np.size(gaps) > 0:
             result = np.max(gaps)
         else:
             result = self.badval
         return result
 
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        times = segmentedSort(dataSlices[self.mjdCol], offsets)
+        gaps, gapOffsets = segmentedDiff(times, offsets)
+        return segmentedReduce(gaps, gapOffsets, np.max, emptyValue=self.badval)
+
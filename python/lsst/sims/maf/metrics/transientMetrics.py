@@ -1,4 +1,3 @@
-from builtins import zip
 import numpy as np
 from .baseMetric import BaseMetric
 
@@ -102,7 +101,7 @@ class TransientMetric(BaseMetric):
         Parameters
         ----------
         time : numpy.ndarray
-            The times of the observations.
+            The times of the observations. May be 2-d (phase shifts x observations).
         filters : numpy.ndarray
             The filters of the observations.
 
@@ -111,15 +110,13 @@ class TransientMetric(BaseMetric):
         numpy.ndarray
             The magnitudes of the object at each time, in each filter.
         """
-        lcMags = np.zeros(time.size, dtype=float)
-        rise = np.where(time <= self.peakTime)
-        lcMags[rise] += self.riseSlope * time[rise] - self.riseSlope * self.peakTime
-        decline = np.where(time > self.peakTime)
-        lcMags[decline] += self.declineSlope * (time[decline] - self.peakTime)
+        lcMags = np.where(time <= self.peakTime,
+                          self.riseSlope * time - self.riseSlope * self.peakTime,
+                          self.declineSlope * (time - self.peakTime))
+        peaks = np.zeros(np.shape(filters), dtype=float)
         for key in self.peaks:
-            fMatch = np.where(filters == key)
-            lcMags[fMatch] += self.peaks[key]
-        return lcMags
+            peaks[filters == key] = self.peaks[key]
+        return lcMags + peaks
 
     def run(self, dataSlice, slicePoint=None):
         """"
@@ -137,82 +134,84 @@ class TransientMetric(BaseMetric):
         float
             The total number of transients that could be detected.
         """
-        # Total number of transients that could go off back-to-back
+        tshifts = np.arange(self.nPhaseCheck) * self.transDuration / float(self.nPhaseCheck)
+        nShifts = tshifts.size
+        # The light curves which could go off within the survey, for each phase shift: light curve k
+        # of a shift starts at surveyStart + k * transDuration - tshift. With a phase shift, the first
+        # light curve started before the survey, so it is not counted. With countMethod 'full', only
+        # the light curves which end within the survey are counted; with 'partialLC', all of those
+        # which start within it. The same light curves are counted in nTransMax and nDetected,
+        # so the fraction detected is at most 1.
+        nLcSurvey = (self.surveyDuration * 365.25 + tshifts) / self.transDuration
+        lcFirst = np.where(tshifts != 0, 1, 0)
         if self.countMethod == 'partialLC':
-            _nTransMax = np.ceil(self.surveyDuration / (self.transDuration / 365.25))
+            lcLast = np.ceil(nLcSurvey - 1e-9).astype(int) - 1
         else:
-            _nTransMax = np.floor(self.surveyDuration / (self.transDuration / 365.25))
-        tshifts = np.arange(self.nPhaseCheck) * self.transDuration / float(self.nPhaseCheck)
-        nDetected = 0
-        nTransMax = 0
-        for tshift in tshifts:
-            # Compute the total number of back-to-back transients are possible to detect
-            # given the survey duration and the transient duration.
-            nTransMax += _nTransMax
-            if tshift != 0:
-                nTransMax -= 1
-            if self.surveyStart is None:
-                surveyStart = dataSlice[self.mjdCol].min()
-            time = (dataSlice[self.mjdCol] - surveyStart + tshift) % self.transDuration
-
-            # Which lightcurve does each point belong to
-            lcNumber = np.floor((dataSlice[self.mjdCol] - surveyStart) / self.transDuration)
-
-            lcMags = self.lightCurve(time, dataSlice[self.filterCol])
-
-            # How many criteria needs to be passed
-            detectThresh = 0
-
-            # Flag points that are above the SNR limit
-            detected = np.zeros(dataSlice.size, dtype=int)
-            detected[np.where(lcMags < dataSlice[self.m5Col] + self.detectM5Plus)] += 1
+            lcLast = np.floor(nLcSurvey + 1e-9).astype(int) - 1
+        nTransMax = np.sum(np.maximum(lcLast - lcFirst + 1, 0))
+        if nTransMax == 0:
+            return self.badval
+
+        # Sort by time once; all phase shifts are then evaluated together as (shift x visit) arrays.
+        dataSlice = dataSlice[np.argsort(dataSlice[self.mjdCol], kind='mergesort')]
+        mjds = dataSlice[self.mjdCol]
+        filters = dataSlice[self.filterCol]
+        if self.surveyStart is None:
+            surveyStart = mjds.min()
+        else:
+            surveyStart = self.surveyStart
+        shifted = mjds - surveyStart + tshifts[:, np.newaxis]
+        time = shifted % self.transDuration
+
+        # Which lightcurve does each point belong to, for each phase shift.
+        lcNumber = np.floor(shifted / self.transDuration).astype(np.int64)
+        lcMin = lcNumber.min() if lcNumber.size > 0 else 0
+        nK = lcNumber.max() - lcMin + 1 if lcNumber.size > 0 else 1
+        # Index of each (shift, lightcurve) pair, for grouped operations.
+        shiftIndx = np.repeat(np.arange(nShifts), mjds.size)
+        groups, groupIndx = np.unique(shiftIndx * nK + (lcNumber.ravel() - lcMin), return_inverse=True)
+        groupIndx = groupIndx.ravel()
+        nGroups = groups.size
+        # Only the light curves within the survey (see above) are counted.
+        groupShift = groups // nK
+        groupLc = groups % nK + lcMin
+        countable = (groupLc >= lcFirst[groupShift]) & (groupLc <= lcLast[groupShift])
+
+        lcMags = self.lightCurve(time, filters)
+
+        # How many criteria needs to be passed
+        detectThresh = 0
+
+        # Flag points that are above the SNR limit
+        detected = (lcMags < dataSlice[self.m5Col] + self.detectM5Plus).astype(int)
+        detectThresh += 1
+
+        # If we demand points on the rise
+        if self.nPrePeak > 0:
             detectThresh += 1
-
-            # If we demand points on the rise
-            if self.nPrePeak > 0:
-                detectThresh += 1
-                ord = np.argsort(dataSlice[self.mjdCol])
-                dataSlice = dataSlice[ord]
-                detected = detected[ord]
-                lcNumber = lcNumber[ord]
-                time = time[ord]
-                ulcNumber = np.unique(lcNumber)
-                left = np.searchsorted(lcNumber, ulcNumber)
-                right = np.searchsorted(lcNumber, ulcNumber, side='right')
-                # Note here I'm using np.searchsorted to basically do a 'group by'
-                # might be clearer to use scipy.ndimage.measurements.find_objects or pandas, but
-                # this numpy function is known for being efficient.
-                for le, ri in zip(left, right):
-                    # Number of points where there are a detection
-                    good = np.where(time[le:ri] < self.peakTime)
-                    nd = np.sum(detected[le:ri][good])
-                    if nd >= self.nPrePeak:
-                        detected[le:ri] += 1
-
-            # Check if we need multiple points per light curve or multiple filters
-            if (self.nPerLC > 1) | (self.nFilters > 1):
-                # make sure things are sorted by time
-                ord = np.argsort(dataSlice[self.mjdCol])
-                dataSlice = dataSlice[ord]
-                detected = detected[ord]
-                lcNumber = lcNumber[ord]
-                time = time[ord]
-                ulcNumber = np.unique(lcNumber)
-                left = np.searchsorted(lcNumber, ulcNumber)
-                right = np.searchsorted(lcNumber, ulcNumber, side='right')
-                detectThresh += self.nFilters
-
-                for le, ri in zip(left, right):
-                    points = np.where(detected[le:ri] > 0)
-                    ufilters = np.unique(dataSlice[self.filterCol][le:ri][points])
-                    phaseSections = np.floor(time[le:ri][points] / self.transDuration * self.nPerLC)
-                    for filtName in ufilters:
-                        good = np.where(dataSlice[self.filterCol][le:ri][points] == filtName)
-                        if np.size(np.unique(phaseSections[good])) >= self.nPerLC:
-                            detected[le:ri] += 1
-
-            # Find the unique number of light curves that passed the required number of conditions
-            nDetected += np.size(np.unique(lcNumber[np.where(detected >= detectThresh)]))
+            nd = np.bincount(groupIndx, weights=(detected * (time < self.peakTime)).ravel(),
+                             minlength=nGroups)
+            detected += (nd >= self.nPrePeak)[groupIndx].reshape(detected.shape)
+
+        # Check if we need multiple points per light curve or multiple filters
+        if (self.nPerLC > 1) | (self.nFilters > 1):
+            detectThresh += self.nFilters
+            ufilters, filtIndx = np.unique(filters, return_inverse=True)
+            nFilt = ufilters.size
+            phaseSections = np.floor(time / self.transDuration * self.nPerLC).astype(int)
+            nSections = self.nPerLC + 1
+            points = (detected > 0).ravel()
+            # Unique (shift, lightcurve, filter, phase section) combinations among the points.
+            filtGroup = groupIndx * nFilt + np.tile(filtIndx.ravel(), nShifts)
+            sections = np.unique(filtGroup[points] * nSections + phaseSections.ravel()[points])
+            nSectionsSeen = np.bincount(sections // nSections, minlength=nGroups * nFilt)
+            # Add one for each filter which sampled enough sections of the light curve.
+            nGoodFilters = (nSectionsSeen >= self.nPerLC).reshape(nGroups, nFilt).sum(axis=1)
+            detected += nGoodFilters[groupIndx].reshape(detected.shape)
+
+        # Find the unique number of light curves that passed the required number of conditions
+        nPassed = np.bincount(groupIndx, weights=(detected >= detectThresh).ravel(), minlength=nGroups)
+        nDetected = np.sum((nPassed > 0) & countable)
 
         # Rather than keeping a single "detected" variable, maybe make a mask for each criteria, then
         # reduce functions like: reduce_singleDetect, reduce_NDetect, reduce_PerLC, reduce_perFilter.
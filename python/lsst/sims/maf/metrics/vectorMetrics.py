@@ -26,15 +26,32 @@ class HistogramMetric(VectorMetric):
         self.col=col
         super(HistogramMetric,self).__init__(col=col, bins=bins, binCol=binCol, units=units,
                                               metricDtype=metricDtype,**kwargs)
+        # The partial state is the sum of the values and the number of values in each bin.
+        if self.statistic in ('count', 'sum', 'mean'):
+            self.stateSize = 2 * self.shape
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
         result, binEdges,binNumber = stats.binned_statistic(dataSlice[self.binCol],
                                                             dataSlice[self.col],
                                                             bins=self.bins,
                                                             statistic=self.statistic)
         return result
 
+    def calcState(self, dataSlice, slicePoint=None):
+        sums = np.histogram(dataSlice[self.binCol], bins=self.bins, weights=dataSlice[self.col])[0]
+        counts = np.histogram(dataSlice[self.binCol], bins=self.bins)[0]
+        return np.concatenate([sums, counts]).astype(float)
+
+    def finalizeState(self, state):
+        sums = state[..., :self.shape]
+        counts = state[..., self.shape:]
+        if self.statistic == 'count':
+            return counts
+        if self.statistic == 'sum':
+            return sums
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
 class AccumulateMetric(VectorMetric):
     """
     Calculate the accumulated stat
@@ -45,28 +62,58 @@ class AccumulateMetric(VectorMetric):
         super(AccumulateMetric,self).__init__(col=col,binCol=binCol, bins=bins,
                                               metricDtype=metricDtype,**kwargs)
         self.col=col
+        # The partial state is the function applied to the values in each bin (where the first bin
+        # also includes all of the earlier visits), followed by the number of visits in each bin.
+        if self.function.identity is not None:
+            self.stateSize = 2 * self.shape
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = self.getSliceContext(dataSlice, slicePoint).sortedData(self.binCol)
 
         result = self.function.accumulate(dataSlice[self.col])
+        # The number of visits up to the end of each bin.
         indices = np.searchsorted(dataSlice[self.binCol], self.bins[1:], side='right')
-        indices[np.where(indices >= np.size(result))] = np.size(result)-1
-        result = result[indices]
+        result = result[np.maximum(indices - 1, 0)]
         result[np.where(indices == 0)] = self.badval
         return result
 
+    def _binState(self, dataSlice, values, function):
+        """Return function applied to the values in each bin (the first bin including all of the
+        earlier visits), followed by the number of visits in each bin.
+        """
+        binIdx = np.searchsorted(self.bins[1:], dataSlice[self.binCol], side='left')
+        reduced = np.zeros(self.shape + 1, dtype=float) + function.identity
+        function.at(reduced, binIdx, values)
+        counts = np.bincount(binIdx, minlength=self.shape + 1)
+        return np.concatenate([reduced[:self.shape], counts[:self.shape]])
+
+    def _accumulateState(self, state, function):
+        """Return the accumulated values and number of visits up to the end of each bin.
+        """
+        result = function.accumulate(state[..., :self.shape], axis=-1)
+        nVisits = np.cumsum(state[..., self.shape:], axis=-1)
+        return result, nVisits
+
+    def calcState(self, dataSlice, slicePoint=None):
+        return self._binState(dataSlice, dataSlice[self.col], self.function)
+
+    def finalizeState(self, state):
+        result, nVisits = self._accumulateState(state, self.function)
+        return np.where(nVisits == 0, self.badval, result)
+
 class AccumulateCountMetric(AccumulateMetric):
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = self.getSliceContext(dataSlice, slicePoint).sortedData(self.binCol)
         toCount = np.ones(dataSlice.size, dtype=int)
         result = self.function.accumulate(toCount)
         indices = np.searchsorted(dataSlice[self.binCol], self.bins[1:], side='right')
-        indices[np.where(indices >= np.size(result))] = np.size(result)-1
-        result = result[indices]
+        result = result[np.maximum(indices - 1, 0)]
         result[np.where(indices == 0)] = self.badval
         return result
 
+    def calcState(self, dataSlice, slicePoint=None):
+        return self._binState(dataSlice, np.ones(dataSlice.size), self.function)
+
 class HistogramM5Metric(HistogramMetric):
     """
     Calculate the coadded depth for each bin (e.g., per night).
@@ -78,9 +125,9 @@ class HistogramM5Metric(HistogramMetric):
                                                metricName=metricName,
                                                units=units,**kwargs)
         self.m5Col=m5Col
+        self.stateSize = self.shape
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
         flux = 10.**(.8*dataSlice[self.m5Col])
         result, binEdges,binNumber = stats.binned_statistic(dataSlice[self.binCol],
                                                             flux,
@@ -91,6 +138,15 @@ class HistogramM5Metric(HistogramMetric):
         result[noFlux] = self.badval
         return result
 
+    def calcState(self, dataSlice, slicePoint=None):
+        # The partial state is the sum of the fluxes in each bin.
+        flux = 10.**(.8*dataSlice[self.m5Col])
+        return np.histogram(dataSlice[self.binCol], bins=self.bins, weights=flux)[0]
+
+    def finalizeState(self, state):
+        with np.errstate(divide='ignore'):
+            return np.where(state == 0, self.badval, 1.25*np.log10(state))
+
 class AccumulateM5Metric(AccumulateMetric):
     def __init__(self, bins=None, binCol='night', m5Col='fiveSigmaDepth',
                 metricName='AccumulateM5Metric',**kwargs):
@@ -100,17 +156,24 @@ class AccumulateM5Metric(AccumulateMetric):
 
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = self.getSliceContext(dataSlice, slicePoint).sortedData(self.binCol)
         flux = 10.**(.8*dataSlice[self.m5Col])
 
         result = np.add.accumulate(flux)
         indices = np.searchsorted(dataSlice[self.binCol], self.bins[1:], side='right')
-        indices[np.where(indices >= np.size(result))] = np.size(result)-1
-        result = result[indices]
+        result = result[np.maximum(indices - 1, 0)]
         result = 1.25*np.log10(result)
         result[np.where(indices == 0)] = self.badval
         return result
 
+    def calcState(self, dataSlice, slicePoint=None):
+        return self._binState(dataSlice, 10.**(.8*dataSlice[self.m5Col]), np.add)
+
+    def finalizeState(self, state):
+        result, nVisits = self._accumulateState(state, np.add)
+        with np.errstate(divide='ignore'):
+            return np.where(nVisits == 0, self.badval, 1.25*np.log10(result))
+
 
 class AccumulateUniformityMetric(AccumulateMetric):
     """
@@ -125,9 +188,11 @@ class AccumulateUniformityMetric(AccumulateMetric):
         super(AccumulateUniformityMetric,self).__init__(bins=bins, binCol=binCol,col=expMJDCol,
                                                         metricName=metricName,units=units,**kwargs)
         self.surveyLength = surveyLength
+        # The partial state is the number of visits in each bin, followed by the total number of visits.
+        self.stateSize = self.shape + 1
 
     def run(self, dataSlice, slicePoint=None):
-        dataSlice.sort(order=self.binCol)
+        dataSlice = self.getSliceContext(dataSlice, slicePoint).sortedData(self.binCol)
         if dataSlice.size == 1:
             return np.ones(self.bins.size-1, dtype=float)
 
@@ -139,3 +204,16 @@ class AccumulateUniformityMetric(AccumulateMetric):
         D_max = np.maximum.accumulate(D_max)
         result = D_max/expectedPerNight.max()
         return result
+
+    def calcState(self, dataSlice, slicePoint=None):
+        visitsPerNight = np.histogram(dataSlice[self.binCol], bins=self.bins)[0]
+        return np.concatenate([visitsPerNight, [dataSlice.size]]).astype(float)
+
+    def finalizeState(self, state):
+        nVisits = state[..., -1:]
+        visitsPerNight = np.add.accumulate(state[..., :-1], axis=-1)
+        expectedPerNight = np.arange(0.,self.bins.size-1)/(self.bins.size-2) * nVisits
+        D_max = np.maximum.accumulate(np.abs(visitsPerNight-expectedPerNight), axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = D_max/nVisits
+        return np.where(nVisits == 1, 1., result)
@@ -1,4 +1,3 @@
-from builtins import zip
 # Example of more complex metric
 # Takes multiple columns of data (although 'night' could be calculable from 'expmjd')
 # Returns variable length array of data
@@ -6,6 +5,8 @@ from builtins import zip
 
 import numpy as np
 from .baseMetric import BaseMetric
+from lsst.sims.maf.utils import (segmentOffsets, segmentIds, segmentedSort, segmentedDiff, segmentedCount,
+                                 runLengths, windowCounts)
 
 __all__ = ['VisitGroupsMetric', 'PairFractionMetric']
 
@@ -34,29 +35,20 @@ class PairFractionMetric(BaseMetric):
         super(PairFractionMetric, self).__init__(col=[mjdCol], metricName=metricName, units=units, **kwargs)
 
     def run(self, dataSlice, slicePoint=None):
-        nobs = np.size(dataSlice[self.mjdCol])
-        times = np.sort(dataSlice[self.mjdCol])
+        times = self.getSliceContext(dataSlice, slicePoint).sortedValues(self.mjdCol)
+        return self._pairFraction(times, np.array([0, times.size]))[0]
 
-        # Check which ones have a forard match
-        t_plus = times + self.maxGap
-        t_minus = times + self.minGap
-        ind1 = np.searchsorted(times, t_plus)
-        ind2 = np.searchsorted(times, t_minus)
-        # If ind1 and ind2 are the same, there is no pairable image for that exposure
-        diff1 = ind1 - ind2
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        return self._pairFraction(segmentedSort(dataSlices[self.mjdCol], offsets), offsets)
 
+    def _pairFraction(self, times, offsets):
+        # Check which ones have a forward match
+        forward = windowCounts(times, offsets, self.minGap, self.maxGap)
         # Check which have a back match
-        t_plus = times - self.maxGap
-        t_minus = times - self.minGap
-        ind1 = np.searchsorted(times, t_plus)
-        ind2 = np.searchsorted(times, t_minus)
-
-        diff2 = ind1 - ind2
-
+        backward = windowCounts(times, offsets, -self.maxGap, -self.minGap)
         # The exposure has a pair ahead or behind
-        is_paired = np.where((diff1 != 0) | (diff2 != 0))[0]
-        result = np.size(is_paired)/float(nobs)
-        return result
+        nPaired = segmentedCount((forward != 0) | (backward != 0), offsets)
+        return nPaired / np.diff(offsets).astype(float)
 
 
 class VisitGroupsMetric(BaseMetric):
@@ -122,52 +114,62 @@ class VisitGroupsMetric(BaseMetric):
         than deltaTmin, the two would be counted as 1.5 visits together (if only 1 and 2 existed,
         then there would be 0 visits as none would be within the qualifying time interval).
         """
-        uniquenights = np.unique(dataSlice[self.nights])
-        nights = []
-        visitNum = []
-        # Find the nights with visits within deltaTmin/max of one another and count the number of visits
-        for n in uniquenights:
-            condition = (dataSlice[self.nights] == n)
-            times = np.sort(dataSlice[self.times][condition])
-            nvisits = 0
-            ntooclose = 0
-            # Calculate difference between each visit and time of previous visit (tnext- tnow)
-            timediff = np.diff(times)
-            timegood = np.where((timediff <= self.deltaTmax) & (timediff >= self.deltaTmin), True, False)
-            timetooclose = np.where(timediff < self.deltaTmin, True, False)
-            if len(timegood)>1:
-                # Count visits for all but last index in timediff
-                for tg1, ttc1, tg2, ttc2 in zip(timegood[:-1], timetooclose[:-1], timegood[1:], timetooclose[1:]):
-                    if tg1:
-                        nvisits += 1
-                        if not tg2:
-                            nvisits += 1
-                    if ttc1:
-                        ntooclose += 1
-                        if not tg2 and not ttc2:
-                            ntooclose += 1
-                # Take care of last timediff
-                if timegood[-1]:
-                    nvisits += 2 #close out visit sequence
-                if timetooclose[-1]:
-                    ntooclose += 1
-                    if not timegood[-2] and not timetooclose[-2]:
-                        ntooclose += 1
+        order = np.lexsort((dataSlice[self.times], dataSlice[self.nights]))
+        return self._visitGroups(dataSlice[order], np.array([0, dataSlice.size]))[0]
+
+    def runBatch(self, dataSlices, offsets, slicePoints=None):
+        order = np.lexsort((dataSlices[self.times], dataSlices[self.nights], segmentIds(offsets)))
+        return self._visitGroups(dataSlices[order], offsets)
+
+    def _visitGroups(self, data, offsets):
+        """Count the visits in each night for data sorted by night and time within each segment."""
+        # Split each segment into nights.
+        runOffsets, nightOffsets = runLengths(data[self.nights], offsets)
+        # Calculate difference between each visit and time of previous visit (tnext- tnow), within each night
+        timediff, diffOffsets = segmentedDiff(data[self.times], runOffsets)
+        timegood = (timediff <= self.deltaTmax) & (timediff >= self.deltaTmin)
+        timetooclose = timediff < self.deltaTmin
+        nightOfDiff = segmentIds(diffOffsets)
+        ndiffs = np.diff(diffOffsets)
+        isLast = np.zeros(timediff.size, dtype=bool)
+        isLast[diffOffsets[1:][ndiffs > 0] - 1] = True
+        # The timegood/timetooclose values for the next (and, for the last, the previous) gap in the night.
+        nextGood = np.zeros(timediff.size, dtype=bool)
+        nextGood[:-1] = timegood[1:]
+        nextGood[isLast] = False
+        nextClose = np.zeros(timediff.size, dtype=bool)
+        nextClose[:-1] = timetooclose[1:]
+        nextClose[isLast] = False
+        prevGood = np.zeros(timediff.size, dtype=bool)
+        prevGood[1:] = timegood[:-1]
+        prevClose = np.zeros(timediff.size, dtype=bool)
+        prevClose[1:] = timetooclose[:-1]
+        # Count a visit for each good gap, plus one more to close out each visit sequence.
+        nvisits = timegood * (1 + ~nextGood)
+        # Count half a visit for each gap which is too short, plus one more if it ends a visit sequence.
+        # (nights with only two visits do not count short gaps).
+        ntooclose = np.where(isLast, timetooclose * (1 + (~prevGood & ~prevClose)),
+                             timetooclose * (1 + (~nextGood & ~nextClose)))
+        ntooclose[ndiffs[nightOfDiff] < 2] = 0
+        nvisits = np.bincount(nightOfDiff, weights=nvisits, minlength=ndiffs.size)
+        ntooclose = np.bincount(nightOfDiff, weights=ntooclose, minlength=ndiffs.size)
+        # Count up all visits for each night.
+        visitNum = nvisits + ntooclose / 2.0
+        nights = data[self.nights][runOffsets[:-1]]
+        # Keep only the nights with visits.
+        keep = nvisits > 0
+        nightSegment = segmentIds(nightOffsets)[keep]
+        visitNum = visitNum[keep]
+        nights = nights[keep]
+        keptOffsets = segmentOffsets(np.bincount(nightSegment, minlength=len(offsets) - 1))
+        metricvals = []
+        for i in range(len(offsets) - 1):
+            if keptOffsets[i] == keptOffsets[i + 1]:
+                metricvals.append(self.badval)
             else:
-                if timegood:
-                    nvisits += 2
-            # Count up all visits for night.
-            if nvisits > 0:
-                nvisits = nvisits + ntooclose/2.0
-                visitNum.append(nvisits)
-                nights.append(n)
-        # Convert to numpy arrays.
-        visitNum = np.array(visitNum)
-        nights = np.array(nights)
-        metricval = {'visits':visitNum, 'nights':nights}
-        if len(visitNum) == 0:
-            return self.badval
-        return metricval
+                metricvals.append({'visits': visitNum[keptOffsets[i]:keptOffsets[i + 1]],
+                                   'nights': nights[keptOffsets[i]:keptOffsets[i + 1]]})
+        return metricvals
 
     def reduceMedian(self, metricval):
         """Reduce to median number of visits per night."""
@@ -1,4 +1,5 @@
 from builtins import zip
+import copy
 import numbers
 import numpy as np
 import warnings
@@ -12,7 +13,7 @@ import matplotlib as mpl
 from matplotlib.patches import Ellipse
 from matplotlib.collections import PatchCollection
 
-from lsst.sims.maf.utils import optimalBins, percentileClipping
+from lsst.sims.maf.utils import optimalBins, percentileClipping, calcPowerSpectrum
 from .plotHandler import BasePlotter, applyZPNorm
 
 from lsst.sims.utils import _equatorialFromGalactic, _healbin
@@ -20,7 +21,7 @@ from .perceptual_rainbow import makePRCmap
 perceptual_rainbow = makePRCmap()
 import numpy.ma as ma
 
-__all__ = ['setColorLims', 'setColorMap', 'HealpixSkyMap', 'HealpixPowerSpectrum',
+__all__ = ['setColorLims', 'setColorMap', 'mollweideLookup', 'HealpixSkyMap', 'HealpixPowerSpectrum',
            'HealpixHistogram', 'OpsimHistogram', 'BaseHistogram',
            'BaseSkyMap', 'HealpixSDSSSkyMap', 'LambertSkyMap']
 
@@ -69,9 +70,62 @@ def setColorMap(plotDict):
     return cmap
 
 
+# The (image pixel -> healpix) lookups of the Mollweide projections used by HealpixSkyMap,
+# shared by all of its sky maps.
+_mollweideLookups = {}
+
+
+def mollweideLookup(nside, rot=None, coord=None, flip='astro', xsize=800, nest=False):
+    """Return the healpix pixel shown at each pixel of the image of a healpy Mollweide projection.
+
+    Projecting a healpix map (as healpy's mollview does) finds the healpix pixel under each image pixel
+    again for every map. The lookup depends only on nside, nest and the projection (its rotation,
+    coordinate system, flip and image size), so it is calculated once per process for each of these
+    and cached, and projecting a map is then a single gather.
+
+    Parameters
+    ----------
+    nside : int
+        The nside of the healpix maps to project.
+    rot : sequence, opt
+        The rotation of the projection, as for hp.mollview. Default None.
+    coord : str or sequence, opt
+        The coordinate system(s), as for hp.mollview. Default None.
+    flip : str, opt
+        The flip convention ('astro' or 'geo'), as for hp.mollview. Default 'astro'.
+    xsize : int, opt
+        The width of the image, as for hp.mollview. Default 800.
+    nest : bool, opt
+        The maps are NESTED (True) or RING (False) ordered. Default False.
+
+    Returns
+    -------
+    numpy.ndarray
+        The healpix pixel at each image pixel (-1 outside the projection). This array is shared,
+        and so must be treated as read-only.
+    """
+    key = (nside, nest, None if rot is None else tuple(np.ravel(rot)),
+           None if coord is None else tuple(coord), flip, xsize)
+    if key not in _mollweideLookups:
+        proj = hp.projector.MollweideProj(rot=rot, coord=coord, flipconv=flip, xsize=xsize)
+        x, y = proj.ij2xy()
+        inside = ~np.ma.getmaskarray(x)
+        vec = proj.xy2vec(np.asarray(x[inside]), np.asarray(y[inside]))
+        vec = hp.Rotator(rot=None, coord=proj.mkcoord(coord)).I(vec)
+        lookup = np.zeros(x.shape, int) - 1
+        lookup[inside] = hp.vec2pix(nside, vec[0], vec[1], vec[2], nest=nest)
+        lookup.flags.writeable = False
+        _mollweideLookups[key] = lookup
+    return _mollweideLookups[key]
+
+
 class HealpixSkyMap(BasePlotter):
     """
     Generate a sky map of healpix metric values using healpy's mollweide view.
+
+    The projection from the image pixels to the healpix pixels is cached (see mollweideLookup), so the
+    many sky maps of a run with the same nside, rot, flip and coord are drawn with a single gather each,
+    rather than with hp.mollview. Set useProjectionCache to False to use hp.mollview.
     """
     def __init__(self):
         super(HealpixSkyMap, self).__init__()
@@ -87,6 +141,7 @@ class HealpixSkyMap(BasePlotter):
         # {'rot': (90, 90, 90), 'flip': 'geo'}
         self.healpy_visufunc = hp.mollview
         self.healpy_visufunc_params = {}
+        self.useProjectionCache = True
         self.ax = None
         self.im = None
 
@@ -161,7 +216,12 @@ class HealpixSkyMap(BasePlotter):
                            'fig':fig.number,
                            'notext': notext}
         visufunc_params.update(self.healpy_visufunc_params)
-        self.healpy_visufunc(metricValue.filled(slicer.badval), **visufunc_params)
+        fastParams = set(['xsize', 'nest', 'badcolor', 'bgcolor', 'format'])
+        if (self.useProjectionCache and self.healpy_visufunc is hp.mollview and
+                fastParams.issuperset(self.healpy_visufunc_params)):
+            self._mollview(metricValue.filled(slicer.badval), badval=slicer.badval, **visufunc_params)
+        else:
+            self.healpy_visufunc(metricValue.filled(slicer.badval), **visufunc_params)
         
         # Add a graticule (grid) over the globe.
         hp.graticule(dpar=30, dmer=30, verbose=False)
@@ -192,7 +252,47 @@ class HealpixSkyMap(BasePlotter):
             cb.solids.set_edgecolor("face")
         return fig.number
 
-    
+    def _mollview(self, mapValues, fig=None, sub=111, rot=None, coord=None, flip='astro', xsize=800,
+                  nest=False, title='', min=None, max=None, cmap=None, norm=None, badcolor='gray',
+                  bgcolor='white', format='%g', notext=False, cbar=False, badval=hp.UNSEEN):
+        """Draw mapValues as hp.mollview(cbar=False) does, using the cached projection (mollweideLookup).
+        """
+        fig = plt.figure(fig)
+        # Place the axes in the subplot, as hp.mollview does.
+        if hasattr(sub, '__len__'):
+            nrows, ncols, idx = sub
+        else:
+            nrows, ncols, idx = sub // 100, (sub % 100) // 10, (sub % 10)
+        c, r = (idx - 1) % ncols, (idx - 1) // ncols
+        margins = (0.01, 0.0, 0.0, 0.02)
+        extent = (c * 1.0 / ncols + margins[0], 1.0 - (r + 1) * 1.0 / nrows + margins[1],
+                  1.0 / ncols - margins[2] - margins[0], 1.0 / nrows - margins[3] - margins[1])
+        ax = hp.projaxes.HpxMollweideAxes(fig, extent, coord=coord, rot=rot, format=format, flipconv=flip)
+        fig.add_axes(ax)
+        ax.proj.set_proj_plane_info(xsize=xsize)
+        lookup = mollweideLookup(hp.npix2nside(len(mapValues)), rot=rot, coord=coord, flip=flip, xsize=xsize,
+                                 nest=nest)
+        img = np.zeros(lookup.shape) - np.inf
+        inside = lookup >= 0
+        img[inside] = mapValues[lookup[inside]]
+        good = inside & (img != badval) & np.isfinite(img)
+        if min is None:
+            min = img[good].min() if good.any() else 0.0
+        if max is None:
+            max = img[good].max() if good.any() else 0.0
+        cm, nn = hp.projaxes.get_color_table(min, max, img[good], cmap=cmap, norm=norm,
+                                             badcolor=badcolor, bgcolor=bgcolor)
+        ax.imshow(np.ma.masked_values(img, badval), extent=ax.proj.get_extent(), cmap=cm, norm=nn,
+                  interpolation='nearest', origin='lower')
+        ax.set_xlim(-2.01, 2.01)
+        ax.set_ylim(-1.01, 1.01)
+        ax.set_title(title)
+        if not notext and ax.proj.coordsysstr:
+            ax.text(0.86, 0.05, ax.proj.coordsysstr, fontsize='large', fontweight='bold',
+                    transform=ax.transAxes)
+        fig.sca(ax)
+
+
 class HealpixPowerSpectrum(BasePlotter):
     def __init__(self):
         self.plotType = 'PowerSpectrum'
@@ -216,10 +316,9 @@ class HealpixPowerSpectrum(BasePlotter):
         # If the mask is True everywhere (no data), just plot zeros
         if False not in metricValue.mask:
             return None
-        if plotDict['removeDipole']:
-            cl = hp.anafast(hp.remove_dipole(metricValue.filled(slicer.badval)), lmax=plotDict['maxl'])
-        else:
-            cl = hp.anafast(metricValue.filled(slicer.badval), lmax=plotDict['maxl'])
+        # The power spectrum is usually already cached, from the TotalPowerMetric summary statistics.
+        cl = calcPowerSpectrum(metricValue.filled(slicer.badval), removeDipole=plotDict['removeDipole'],
+                               lmax=plotDict['maxl'])
         ell = np.arange(np.size(cl))
         if plotDict['removeDipole']:
             condition = (ell > 1)
@@ -415,6 +514,13 @@ class BaseHistogram(BasePlotter):
 
 
 class BaseSkyMap(BasePlotter):
+    """
+    Generate a sky map of the metric values of a generic spatial slicer, with an ellipse at each slicePoint.
+
+    With many slicePoints (more than plotDict['rasterMinPoints'], or if plotDict['raster'] is True),
+    the ellipses are drawn into a single image (with a resolution of plotDict['rasterDpi'], default the
+    figure dpi) rather than as one patch each. Set plotDict['raster'] to False to always use patches.
+    """
     def __init__(self):
         self.plotType = 'SkyMap'
         self.objectPlotter = False  # unless 'metricIsColor' is true..
@@ -422,7 +528,8 @@ class BaseSkyMap(BasePlotter):
         self.defaultPlotDict.update(baseDefaultPlotDict)
         self.defaultPlotDict.update({'projection': 'aitoff', 'radius': np.radians(1.75), 'alpha': 1.0,
                                      'plotMask': False, 'metricIsColor': False, 'cbar': True,
-                                     'raCen': 0.0, 'mwZone': True, 'bgcolor': 'gray'})
+                                     'raCen': 0.0, 'mwZone': True, 'bgcolor': 'gray',
+                                     'raster': None, 'rasterMinPoints': 2000, 'rasterDpi': None})
 
     def _plot_tissot_ellipse(self, lon, lat, radius, ax=None, **kwargs):
         """Plot Tissot Ellipse/Tissot Indicatrix
@@ -455,6 +562,83 @@ class BaseSkyMap(BasePlotter):
             ellipses.append(el)
         return ellipses
 
+    def _rasterize_ellipses(self, lon, lat, radius, values, ax, dpi=None, maxSteps=64):
+        """Splat the Tissot ellipses of all of the points into an image covering the axes.
+
+        Each point covers the same ellipse (in lon/lat) as its _plot_tissot_ellipse patch: the footprint
+        is sampled with a grid of points (fine enough that there are no gaps between the samples
+        at the resolution of the axes), all of the samples are projected at once, and the value of each
+        point is written into the image pixels its samples fall in. Later points are drawn over earlier
+        ones, as with the patches.
+
+        Parameters
+        ----------
+        lon : numpy.ndarray
+            longitude-like of ellipse centers (radians)
+        lat : numpy.ndarray
+            latitude-like of ellipse centers (radians)
+        radius : float
+            radius of ellipses (radians)
+        values : numpy.ndarray
+            The value of each point (or its RGBA color, with shape (npoints, 4)).
+        ax : Axes object
+            matplotlib axes instance the image will cover.
+        dpi : float, opt
+            The resolution of the image. Default None (the figure dpi).
+        maxSteps : int, opt
+            The maximum number of samples across each footprint. Default 64.
+
+        Returns
+        -------
+        numpy.ndarray
+            The image (in axes coordinates, with origin lower left), NaN where there are no points.
+        """
+        bbox = ax.get_window_extent()
+        dpiScale = 1.0 if dpi is None else dpi / ax.figure.dpi
+        nx = max(int(np.ceil(bbox.width * dpiScale)), 1)
+        ny = max(int(np.ceil(bbox.height * dpiScale)), 1)
+        # Data coordinates to image pixels.
+        toPixels = ax.transData + ax.transAxes.inverted()
+        scale = np.array([nx, ny])
+
+        def project(l, b):
+            return toPixels.transform(np.column_stack([l.ravel(), b.ravel()])) * scale
+
+        # The size of each footprint in image pixels sets the sampling of its stencil;
+        # the points are grouped by the number of samples (a power of 2) across their footprint.
+        halfWidth = radius / np.maximum(np.cos(lat), 1e-3)
+        center = project(lon, lat)
+        top = np.clip(lat + radius, -np.pi / 2, np.pi / 2)
+        extent = np.maximum(np.abs(project(lon + halfWidth, lat) - center).max(axis=1),
+                            np.abs(project(lon, top) - center).max(axis=1))
+        extent = np.where(np.isfinite(extent), extent, 1.0)
+        nSteps = 2 ** np.ceil(np.log2(np.clip(4 * extent, 1, maxSteps))).astype(int)
+        image = np.full((ny, nx) + values.shape[1:], np.nan)
+        drawn = np.zeros((ny, nx), int) - 1
+        for steps in np.unique(nSteps):
+            points = np.where(nSteps == steps)[0]
+            u, v = np.meshgrid(np.linspace(-1, 1, steps + 1), np.linspace(-1, 1, steps + 1))
+            inDisk = u ** 2 + v ** 2 <= 1
+            u = u[inDisk]
+            v = v[inDisk]
+            # All of the samples of these points, and the image pixels they fall in.
+            sampleLon = lon[points, np.newaxis] + u * halfWidth[points, np.newaxis]
+            sampleLat = np.clip(lat[points, np.newaxis] + v * radius, -np.pi / 2, np.pi / 2)
+            pixels = np.floor(project(sampleLon, sampleLat))
+            good = np.all(np.isfinite(pixels), axis=1)
+            good &= (pixels[:, 0] >= 0) & (pixels[:, 0] < nx) & (pixels[:, 1] >= 0) & (pixels[:, 1] < ny)
+            ix = pixels[good, 0].astype(int)
+            iy = pixels[good, 1].astype(int)
+            point = np.repeat(points, len(u))[good]
+            # Later points are drawn over earlier ones (in any group).
+            order = np.argsort(point, kind='mergesort')
+            ix, iy, point = ix[order], iy[order], point[order]
+            later = point > drawn[iy, ix]
+            drawn[iy[later], ix[later]] = point[later]
+        filled = drawn >= 0
+        image[filled] = values[drawn[filled]]
+        return image
+
     def _plot_ecliptic(self, raCen=0, ax=None):
         """
         Plot a red line at location of ecliptic.
@@ -508,29 +692,53 @@ class BaseSkyMap(BasePlotter):
         # Set up valid datapoints and colormin/max values.
         if plotDict['plotMask']:
             # Plot all data points.
-            mask = np.ones(len(metricValue), dtype='bool')
+            good = np.ones(len(metricValue), dtype='bool')
         else:
             # Only plot points which are not masked. Flip numpy ma mask where 'False' == 'good'.
-            good = ~metricValue.mask
+            good = ~np.ma.getmaskarray(metricValue)
 
-        # Add ellipses at RA/Dec locations - but don't add colors yet.
         lon = -(slicer.slicePoints['ra'][good] - plotDict['raCen'] - np.pi) % (np.pi * 2) - np.pi
-        ellipses = self._plot_tissot_ellipse(lon, slicer.slicePoints['dec'][good],
-                                             plotDict['radius'], rasterized=True, ax=ax)
+        lat = slicer.slicePoints['dec'][good]
+        # Draw the points as a single image (rather than one patch per point) if there are many of them.
+        raster = plotDict['raster']
+        if raster is None:
+            raster = len(lon) > plotDict['rasterMinPoints']
         if plotDict['metricIsColor']:
-            current = None
-            for ellipse, mVal in zip(ellipses, metricValue.data[good]):
-                if mVal[3] > 1:
+            if raster:
+                mVals = np.array([np.asarray(mVal, dtype=float)[:4] for mVal in metricValue.data[good]])
+                mVals = mVals.reshape(-1, 4)
+                highlight = mVals[:, 3] > 1
+                image = self._rasterize_ellipses(lon[~highlight], lat[~highlight], plotDict['radius'],
+                                                 mVals[~highlight], ax, dpi=plotDict['rasterDpi'])
+                # Areas without points (NaN) are transparent. Keep the aspect of the projection
+                # (imshow would otherwise set the axes aspect).
+                ax.imshow(np.nan_to_num(image), origin='lower', extent=(0, 1, 0, 1), transform=ax.transAxes,
+                          aspect=ax.get_aspect(), interpolation='nearest', clip_path=ax.patch)
+                # The (few) highlighted points (alpha > 1) are drawn on top as patches, opaque with
+                # a black edge.
+                ellipses = self._plot_tissot_ellipse(lon[highlight], lat[highlight], plotDict['radius'],
+                                                     rasterized=True, ax=ax)
+                for ellipse, mVal in zip(ellipses, mVals[highlight]):
                     ellipse.set_alpha(1.0)
-                    ellipse.set_facecolor((mVal[0], mVal[1], mVal[2]))
+                    ellipse.set_facecolor(mVal[:3])
                     ellipse.set_edgecolor('k')
-                    current = ellipse
-                else:
-                    ellipse.set_alpha(mVal[3])
-                    ellipse.set_color((mVal[0], mVal[1], mVal[2]))
-                ax.add_patch(ellipse)
-            if current:
-                ax.add_patch(current)
+                    ax.add_patch(ellipse)
+            else:
+                # Add ellipses at RA/Dec locations - but don't add colors yet.
+                ellipses = self._plot_tissot_ellipse(lon, lat, plotDict['radius'], rasterized=True, ax=ax)
+                current = None
+                for ellipse, mVal in zip(ellipses, metricValue.data[good]):
+                    if mVal[3] > 1:
+                        ellipse.set_alpha(1.0)
+                        ellipse.set_facecolor((mVal[0], mVal[1], mVal[2]))
+                        ellipse.set_edgecolor('k')
+                        current = ellipse
+                    else:
+                        ellipse.set_alpha(mVal[3])
+                        ellipse.set_color((mVal[0], mVal[1], mVal[2]))
+                    ax.add_patch(ellipse)
+                if current:
+                    ax.add_patch(current)
         else:
             # Determine color min/max values. metricValue.compressed = non-masked points.
             clims = setColorLims(metricValue, plotDict)
@@ -543,19 +751,31 @@ class BaseSkyMap(BasePlotter):
                         plotDict['logScale'] = False
                 else:
                     plotDict['logScale'] = False
+            norml = None
             if plotDict['logScale']:
                 # Move min/max values to things that can be marked on the colorbar.
                 #clims[0] = 10 ** (int(np.log10(clims[0])))
                 #clims[1] = 10 ** (int(np.log10(clims[1])))
                 norml = colors.LogNorm()
-                p = PatchCollection(ellipses, cmap=plotDict['cmap'], alpha=plotDict['alpha'],
-                                    linewidth=0, edgecolor=None, norm=norml, rasterized=True)
+            if raster:
+                image = self._rasterize_ellipses(lon, lat, plotDict['radius'],
+                                                 np.asarray(metricValue.data[good], dtype=float), ax,
+                                                 dpi=plotDict['rasterDpi'])
+                # Areas without points show the background color, as they do with the patches.
+                cmap = copy.copy(plt.get_cmap(plotDict['cmap']))
+                cmap.set_bad(alpha=0)
+                # Keep the aspect of the projection (imshow would otherwise set the axes aspect).
+                p = ax.imshow(np.ma.masked_invalid(image), origin='lower', extent=(0, 1, 0, 1),
+                              transform=ax.transAxes, aspect=ax.get_aspect(), interpolation='nearest',
+                              cmap=cmap, norm=norml, alpha=plotDict['alpha'], clip_path=ax.patch)
             else:
+                # Add ellipses at RA/Dec locations - but don't add colors yet.
+                ellipses = self._plot_tissot_ellipse(lon, lat, plotDict['radius'], rasterized=True, ax=ax)
                 p = PatchCollection(ellipses, cmap=plotDict['cmap'], alpha=plotDict['alpha'],
-                                    linewidth=0, edgecolor=None, rasterized=True)
-            p.set_array(metricValue.data[good])
+                                    linewidth=0, edgecolor=None, norm=norml, rasterized=True)
+                p.set_array(metricValue.data[good])
+                ax.add_collection(p)
             p.set_clim(clims)
-            ax.add_collection(p)
             # Add color bar (with optional setting of limits)
             if plotDict['cbar']:
                 cb = plt.colorbar(p, aspect=25, extendrect=True, orientation='horizontal',
@@ -1,4 +1,5 @@
 from .baseSlicer import *
+from .binnedIndex import *
 from .uniSlicer import *
 from .oneDSlicer import *
 from .nDSlicer import *
@@ -6,6 +7,7 @@ from .movieSlicer import *
 from .hourglassSlicer import *
 from .baseSpatialSlicer import *
 from .healpixSlicer import *
+from .adaptiveHealpixSlicer import *
 from .healpixSubsetSlicer import *
 from .opsimFieldSlicer import *
 from .healpixSDSSSlicer import *
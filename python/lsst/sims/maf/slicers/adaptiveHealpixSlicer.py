@@ -0,0 +1,213 @@
+"""A healpix slicer which calculates metric values at a coarse resolution, refining only where needed."""
+
+import numpy as np
+import healpy as hp
+
+from .healpixSlicer import HealpixSlicer
+
+
+__all__ = ['AdaptiveHealpixSlicer']
+
+
+class AdaptiveHealpixSlicer(HealpixSlicer):
+    """
+    A healpix slicer which evaluates the metrics on a coarse healpix grid, and then recursively
+    subdivides (in the NESTED scheme) only the healpixels where the metric values vary.
+
+    The metrics are first evaluated at nside=minNside. A healpixel is subdivided into its
+    four children (which are then evaluated at the next nside) if the metric value of any of its
+    neighbours differs from its own value by more than tolerance, or if it lies on the edge
+    of the footprint (it has data and a neighbour does not, or vice versa).
+    This continues until nside reaches the (maximum) nside of the slicer.
+    Healpixels which were not subdivided take the value of their (coarser) parent, so the final
+    metric values are a standard (RING ordered) healpix map at nside, which can be plotted and
+    summarized just like the results of the HealpixSlicer.
+
+    Each coarse healpixel is evaluated at the slicePoint (at nside) containing its center, so
+    all of the metric evaluations use the normal slicePoint metadata (and maps).
+    Features smaller than a healpixel at minNside can be missed if they fall between the
+    slicePoints evaluated, so minNside should resolve the footprint and the expected structure.
+    The number of slicePoints evaluated (and saved) is recorded in nEvaluated (and nSaved).
+
+    Parameters
+    ----------
+    nside : int, optional
+        The (maximum) nside parameter of the healpix grid. Must be a power of 2. Default 128.
+    minNside : int, optional
+        The nside of the coarsest healpix grid, where the metrics are first evaluated.
+        Must be a power of 2, and no larger than nside. Default 32.
+    tolerance : float, optional
+        A healpixel is subdivided if the metric value of one of its neighbours differs by more
+        than tolerance. Default 0.05.
+    relative : boolean, optional
+        If True, tolerance is relative to the (larger absolute) value of the two healpixels compared.
+        If False, tolerance is an absolute difference. Default True.
+    lonCol : str, optional
+        Name of the longitude (RA equivalent) column to use from the input data.
+        Default fieldRA
+    latCol : str, optional
+        Name of the latitude (Dec equivalent) column to use from the input data.
+        Default fieldDec
+    latLonDeg : boolean, optional
+        Flag indicating whether the lat and lon values in the input data are in
+        degrees (True) or radians (False).
+        Default True.
+    verbose : boolean, optional
+        Flag to indicate whether or not to write additional information to stdout during runtime.
+        Default True.
+    badval : float, optional
+        Bad value flag, relevant for plotting. Default the hp.UNSEEN value. This should not be changed.
+    useCache : boolean
+        Flag allowing the user to indicate whether or not to cache (and reuse) metric results
+        calculated with the same set of simulated data pointings. Default True.
+    leafsize : int, optional
+        Leafsize value for kdtree. Default 100.
+    radius : float, optional
+        Radius for matching in the kdtree. Equivalent to the radius of the FOV. Degrees.
+        Default 1.75.
+    useCamera : boolean, optional
+        Flag to indicate whether to use the LSST camera footprint or not.
+        Default False.
+    rotSkyPosColName : str, optional
+        Name of the rotSkyPos column in the input  data. Only used if useCamera is True.
+        Default rotSkyPos.
+    mjdColName : str, optional
+        Name of the exposure time column. Only used if useCamera is True.
+        Default observationStartMJD.
+    chipNames : array-like, optional
+        List of chips to accept, if useCamera is True.
+        Default 'all' - this uses all chips in the camera.
+    """
+    def __init__(self, nside=128, minNside=32, tolerance=0.05, relative=True, lonCol='fieldRA',
+                 latCol='fieldDec', latLonDeg=True, verbose=True, badval=hp.UNSEEN,
+                 useCache=True, leafsize=100, radius=1.75,
+                 useCamera=False, rotSkyPosColName='rotSkyPos',
+                 mjdColName='observationStartMJD', chipNames='all'):
+        """Instantiate and set up the adaptive healpix slicer object."""
+        super().__init__(nside=nside, lonCol=lonCol, latCol=latCol, latLonDeg=latLonDeg,
+                         verbose=verbose, badval=badval, useCache=useCache, leafsize=leafsize,
+                         radius=radius, useCamera=useCamera, rotSkyPosColName=rotSkyPosColName,
+                         mjdColName=mjdColName, chipNames=chipNames)
+        if not(hp.isnsideok(minNside)) or minNside > self.nside:
+            raise ValueError('minNside must be a power of 2, no larger than nside.')
+        self.minNside = int(minNside)
+        self.tolerance = tolerance
+        self.relative = relative
+        self.slicer_init.update({'minNside': minNside, 'tolerance': tolerance, 'relative': relative})
+        self.nEvaluated = None
+        self.nSaved = None
+
+    def __eq__(self, otherSlicer):
+        """Evaluate if two slicers are equivalent."""
+        result = False
+        if isinstance(otherSlicer, AdaptiveHealpixSlicer):
+            if (otherSlicer.minNside == self.minNside and otherSlicer.tolerance == self.tolerance and
+                    otherSlicer.relative == self.relative):
+                result = super().__eq__(otherSlicer)
+        return result
+
+    def _representatives(self, nside, pixels):
+        """Return the slicePoints (the RING healpixels at self.nside) containing the centers
+        of the NESTED healpixels pixels at nside.
+        """
+        lat, lon = hp.pix2ang(nside, pixels, nest=True)
+        return hp.ang2pix(self.nside, lat, lon)
+
+    def _newSlicePoints(self, slicePoints):
+        """Return the slicePoints which have not been evaluated yet (and record them as evaluated).
+        """
+        slicePoints = np.unique(slicePoints)
+        slicePoints = slicePoints[~self._evaluated[slicePoints]]
+        self._evaluated[slicePoints] = True
+        self.nEvaluated = int(self._evaluated.sum())
+        self.nSaved = self.nslice - self.nEvaluated
+        return slicePoints
+
+    def startRefinement(self):
+        """Start a new adaptive evaluation, at nside=minNside.
+
+        Returns
+        -------
+        numpy.ndarray
+            The slicePoints where the metrics should be evaluated first.
+        """
+        self._levelNside = self.minNside
+        self._active = np.arange(hp.nside2npix(self.minNside))
+        # For each (NESTED) healpixel at the current level, the slicePoint which provides its value.
+        self._source = self._representatives(self.minNside, self._active)
+        self._evaluated = np.zeros(self.nslice, dtype=bool)
+        return self._newSlicePoints(self._source)
+
+    def _varies(self, metricValues, neighbours, valid):
+        """Return a mask which is True for the active healpixels whose metric values differ from those
+        of their neighbours (by more than tolerance), or which lie on the edge of the footprint.
+        """
+        data = metricValues.data[self._source]
+        mask = np.ma.getmaskarray(metricValues)[self._source]
+        if mask.ndim > 1:
+            mask = np.all(mask.reshape(mask.shape[0], -1), axis=1)
+        neighbours = np.where(valid, neighbours, 0)
+        activeMask = mask[self._active]
+        neighbourMask = mask[neighbours]
+        varies = np.any(valid & (neighbourMask != activeMask), axis=0)
+        if data.dtype.kind not in 'biuf':
+            # Values which can't be compared: subdivide every healpixel with data.
+            return varies | ~activeMask
+        activeData = data[self._active].astype(float)
+        neighbourData = data[neighbours].astype(float)
+        diff = np.abs(neighbourData - activeData)
+        if self.relative:
+            scale = np.maximum(np.abs(neighbourData), np.abs(activeData))
+            diff = np.where(scale > 0, diff / np.where(scale > 0, scale, 1), 0)
+        if diff.ndim > 2:
+            diff = diff.reshape(diff.shape[0], diff.shape[1], -1).max(axis=-1)
+        bothGood = valid & ~neighbourMask & ~activeMask
+        return varies | np.any(bothGood & (diff > self.tolerance), axis=0)
+
+    def refine(self, metricValuesList):
+        """Subdivide the healpixels of the current level where the metric values vary.
+
+        Parameters
+        ----------
+        metricValuesList : list of numpy.ma.MaskedArray
+            The metric values (at all slicePoints, evaluated at the slicePoints returned so far)
+            of the metrics being calculated.
+
+        Returns
+        -------
+        numpy.ndarray
+            The slicePoints where the metrics should be evaluated next. This is empty when the
+            refinement is complete.
+        """
+        if self._levelNside >= self.nside or len(self._active) == 0:
+            return np.array([], dtype=int)
+        neighbours = hp.get_all_neighbours(self._levelNside, self._active, nest=True)
+        valid = neighbours >= 0
+        subdivide = np.zeros(len(self._active), dtype=bool)
+        for metricValues in metricValuesList:
+            subdivide |= self._varies(metricValues, neighbours, valid)
+        # The children of the subdivided healpixels (in the NESTED scheme) at the next level;
+        # the other healpixels keep the value of their parent.
+        children = (4 * self._active[subdivide][:, np.newaxis] + np.arange(4)).ravel()
+        self._levelNside *= 2
+        self._source = np.repeat(self._source, 4)
+        self._source[children] = self._representatives(self._levelNside, children)
+        self._active = children
+        return self._newSlicePoints(self._source[children])
+
+    def expand(self, metricValues):
+        """Fill in the metric values (in place) at the slicePoints which were not evaluated,
+        from the value of the (coarser) healpixel containing them.
+
+        Parameters
+        ----------
+        metricValues : numpy.ma.MaskedArray
+            The metric values, evaluated at the slicePoints returned by startRefinement and refine.
+        """
+        # Bring the sources of the final level up to full resolution, then reorder from NESTED to RING.
+        source = np.repeat(self._source, (self.nside // self._levelNside) ** 2)
+        source = source[hp.ring2nest(self.nside, np.arange(self.nslice))]
+        # But keep the values calculated at every slicePoint which was evaluated.
+        source = np.where(self._evaluated, np.arange(self.nslice), source)
+        metricValues.data[:] = metricValues.data[source]
+        metricValues.mask = np.ma.getmaskarray(metricValues)[source]
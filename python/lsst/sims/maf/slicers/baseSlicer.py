@@ -148,6 +148,19 @@ class BaseSlicer(with_metaclass(SlicerRegistry, object)):
     def __getitem__(self, islice):
         return self._sliceSimData(islice)
 
+    def sliceOffsets(self):
+        """Return the indexes of the data in all of the slices at once, for slicers where the data in
+        each slice is a contiguous range of a single array of indexes (such as the OneDSlicer).
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray or None
+            The indexes of the data (simIdxs) and the offsets of each slice in simIdxs: the data in
+            slice i are simIdxs[offsets[i]:offsets[i+1]]. None if the slices are not contiguous ranges
+            (the default), in which case the data must be sliced one slicePoint at a time.
+        """
+        return None
+
     def __eq__(self, otherSlicer):
         """
         Evaluate if two slicers are equivalent.
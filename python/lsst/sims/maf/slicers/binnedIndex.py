@@ -0,0 +1,55 @@
+import numpy as np
+
+__all__ = ['binIndex', 'csrIndex']
+
+
+def binIndex(values, bins):
+    """Return the bin of each value, for the bins of the OneDSlicer and NDSlicer.
+
+    Bin i holds the values bins[i] <= value < bins[i+1], except that the last bin holds all of the
+    values >= bins[-2] (the slicers count the data beyond the last bin edge in the last bin).
+    Values below bins[0] are in no bin (-1).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values to bin.
+    bins : numpy.ndarray
+        The (sorted) bin edges.
+
+    Returns
+    -------
+    numpy.ndarray
+        The bin of each value (-1 if the value is in no bin).
+    """
+    return np.searchsorted(bins[:-1], values, 'right') - 1
+
+
+def csrIndex(binIdxs, nbins, order=None):
+    """Group the indexes of the data by bin (in compressed sparse row form).
+
+    Parameters
+    ----------
+    binIdxs : numpy.ndarray
+        The bin of each data point (-1 if the data point is in no bin).
+    nbins : int
+        The number of bins.
+    order : numpy.ndarray, opt
+        The indexes which sort the data in order of binIdxs (such as those which sort the data on the
+        column being binned). Default None, which sorts on binIdxs (stably, so the data in each bin
+        stay in their original order).
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The indexes of the data points in bins (simIdxs), and the offsets of each bin in simIdxs:
+        the data points in bin i are simIdxs[offsets[i]:offsets[i+1]].
+    """
+    binIdxs = np.asarray(binIdxs)
+    if order is None:
+        order = np.argsort(binIdxs, kind='mergesort')
+    counts = np.bincount(binIdxs[binIdxs >= 0], minlength=nbins)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    # The data points in no bin (-1) sort first.
+    simIdxs = order[len(order) - offsets[-1]:]
+    return simIdxs, offsets
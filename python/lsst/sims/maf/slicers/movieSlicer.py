@@ -2,11 +2,15 @@ from __future__ import print_function
 from builtins import str
 # cumulative one dimensional movie slicer
 import os
+import shutil
 import warnings
 import subprocess
+import multiprocessing
+from collections import deque
 from subprocess import CalledProcessError
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from functools import wraps
 
 from lsst.sims.maf.utils import percentileClipping, optimalBins
@@ -15,6 +19,43 @@ from .baseSlicer import BaseSlicer
 
 __all__ = ['MovieSlicer']
 
+# The function rendering the frames of the movie being streamed, with the figure size and dpi,
+# shared with the (forked) worker processes; see MovieSlicer.streamMovie.
+_frameRenderer = None
+
+
+def _renderFrame(frame):
+    """Render one frame (with _frameRenderer), returning the RGB image of each of its figures.
+    """
+    renderFrame, figsize, dpi = _frameRenderer
+    figs = renderFrame(frame)
+    if not isinstance(figs, (list, tuple)):
+        figs = [figs]
+    images = []
+    for fig in figs:
+        # Draw every frame on an Agg canvas of the same size, so the frames can be streamed to ffmpeg.
+        fig.set_size_inches(figsize)
+        fig.set_dpi(dpi)
+        canvas = FigureCanvasAgg(fig)
+        canvas.draw()
+        images.append(np.asarray(canvas.buffer_rgba())[:, :, :3].copy())
+        plt.close(fig)
+    return images
+
+
+def _imapBounded(pool, func, items, window):
+    """Return func(item) for each of items, in order, like pool.imap, but with at most window items
+    sent to the workers (and not yet returned) at a time, so that items is consumed lazily.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+
 class MovieSlicer(BaseSlicer):
     """movie Slicer."""
     def __init__(self, sliceColName=None, sliceColUnits=None,
@@ -50,6 +91,7 @@ class MovieSlicer(BaseSlicer):
                 raise Exception('Could not find ffmpeg on the system, so will not be able to create movie.'
                                 ' Use forceNoFfmpeg=True to override this error and create individual images.')
         super(MovieSlicer, self).__init__(verbose=verbose, badval=badval)
+        self.forceNoFfmpeg = forceNoFfmpeg
         self.sliceColName = sliceColName
         self.columnsNeeded = [sliceColName]
         self.bins = bins
@@ -171,3 +213,107 @@ class MovieSlicer(BaseSlicer):
         print('converting to animated gif with:')
         print(' '.join(callList))
         p2 = subprocess.check_call(callList)
+
+    def streamMovie(self, frames, renderFrame, outfileroot, plotType, outDir='Output', ips=10.0, fps=10.0,
+                    figsize=(8, 6), dpi=72, nProcesses=1, sliceformat=None):
+        """
+        Render the frames of one or more movies (in parallel) and stream them, in order, to ffmpeg.
+
+        Unlike makeMovie, this does not need every frame to be written to disk as an image first:
+        each frame is drawn on an Agg canvas of a fixed size and piped to a single ffmpeg process per
+        movie, which writes both the mp4 and the thumbnail gif from the same decoded stream.
+        If ffmpeg is not available (or forceNoFfmpeg was set), the frames are written as numbered png
+        files instead (named as makeMovie expects, so the movie can be made later).
+
+        Parameters
+        ----------
+        frames : iterable
+            The information needed to render each frame, in order (such as the metric values of each
+            frame). When nProcesses > 1, each item is sent to a worker process, so must be picklable.
+            This is consumed as the frames are rendered (at most two frames per process ahead of the
+            movie), so may be a generator calculating each frame when needed.
+        renderFrame : callable
+            Function taking an item of frames and returning the matplotlib figure of the frame (or a list
+            of figures, one for each movie in outfileroot). The worker processes are forked, so this
+            does not need to be picklable.
+        outfileroot : str or list of str
+            The root of the output filenames of the movie (or movies).
+        plotType : str
+            The plot type, also used in the output filenames.
+        outDir : str, opt
+            The output directory. Default 'Output'.
+        ips : float, opt
+            The number of images (frames) per second. Default 10.
+        fps : float, opt
+            The frames per second of the output movie. Default 10.
+        figsize : tuple, opt
+            The size (in inches) of every frame. Default (8, 6).
+        dpi : int, opt
+            The dots per inch of every frame. Default 72.
+        nProcesses : int, opt
+            The number of processes rendering frames. Default 1 (render in this process).
+        sliceformat : str, opt
+            The format of the frame number in the filenames of the frame images, if ffmpeg is not
+            available. Default None, which uses enough digits for the number of slices.
+        """
+        global _frameRenderer
+        if not os.path.isdir(outDir):
+            raise Exception('Cannot find output directory %s for the movie.' %(outDir))
+        if isinstance(outfileroot, str):
+            outfileroot = [outfileroot]
+        if sliceformat is None:
+            sliceformat = '%s0%dd' %('%', int(np.log10(max(self.nslice, 1)))+1)
+        useFfmpeg = not self.forceNoFfmpeg and shutil.which('ffmpeg') is not None
+        if not useFfmpeg and not self.forceNoFfmpeg:
+            warnings.warn('Could not find ffmpeg; writing the individual frames to %s instead.' %(outDir))
+        encoders = [None] * len(outfileroot)
+        _frameRenderer = (renderFrame, figsize, dpi)
+        pool = None
+        try:
+            if nProcesses > 1:
+                # Fork the workers, so they share renderFrame (and whatever it uses) without pickling.
+                pool = multiprocessing.get_context('fork').Pool(nProcesses)
+                images = _imapBounded(pool, _renderFrame, frames, 2 * nProcesses)
+            else:
+                images = map(_renderFrame, frames)
+            for i, frameImages in enumerate(images):
+                for j, image in enumerate(frameImages):
+                    if not useFfmpeg:
+                        plt.imsave(os.path.join(outDir, '%s_%s_%s.png'
+                                                %(outfileroot[j], sliceformat %(i), plotType)), image)
+                        continue
+                    if encoders[j] is None:
+                        encoders[j] = self._startEncoder(outfileroot[j], plotType, outDir, ips, fps,
+                                                         image.shape[1], image.shape[0])
+                    encoders[j].stdin.write(image.tobytes())
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            _frameRenderer = None
+            if pool is not None:
+                pool.terminate()
+            for encoder in encoders:
+                if encoder is not None:
+                    encoder.stdin.close()
+                    encoder.wait()
+        for encoder in encoders:
+            if encoder is not None and encoder.returncode != 0:
+                raise CalledProcessError(encoder.returncode, encoder.args)
+
+    def _startEncoder(self, outfileroot, plotType, outDir, ips, fps, width, height):
+        """
+        Start an ffmpeg process encoding raw RGB frames (from its stdin) into an mp4 movie
+        and a thumbnail gif (its first 10 seconds, 320 pixels wide).
+        """
+        movieRoot = os.path.join(outDir, '%s_%s_%s_%s' %(outfileroot, plotType, str(ips), str(fps)))
+        callList = ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                    '-s', '%dx%d' %(width, height), '-r', str(ips), '-i', '-',
+                    # The mp4 (yuv420p needs even dimensions).
+                    '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-r', str(fps), '-pix_fmt', 'yuv420p',
+                    '-crf', '18', '-preset', 'slower', movieRoot + '.mp4',
+                    # The thumbnail gif.
+                    '-vf', 'scale=%s:%s' %(str(320), str(-1)), '-t', str(10), '-r', str(10), movieRoot + '.gif']
+        print('Streaming frames to ffmpeg with:')
+        print(' '.join(callList))
+        return subprocess.Popen(callList, stdin=subprocess.PIPE)
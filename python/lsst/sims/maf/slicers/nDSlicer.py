@@ -12,6 +12,7 @@ from functools import wraps
 
 from lsst.sims.maf.plots.ndPlotters import TwoDSubsetData, OneDSubsetData
 from .baseSlicer import BaseSlicer
+from .binnedIndex import binIndex, csrIndex
 
 __all__ = ['NDSlicer']
 
@@ -61,6 +62,7 @@ class NDSlicer(BaseSlicer):
                 self.bins.append(np.sort(bl))
         # Count how many bins we have total (not counting last 'RHS' bin values, as in oneDSlicer).
         self.nslice = (np.array(list(map(len, self.bins)))-1).prod()
+        self.shape = self.nslice
         # Set up slice metadata.
         self.slicePoints['sid'] = np.arange(self.nslice)
         # Including multi-D 'leftmost' bin values
@@ -81,34 +83,30 @@ class NDSlicer(BaseSlicer):
             self.slicePoints['binIdxs'].append(bidx)
         # Add metadata from maps.
         self._runMaps(maps)
-        # Set up indexing for data slicing.
-        self.simIdxs = []
-        self.lefts = []
-        for sliceColName, bins in zip(self.sliceColList, self.bins):
-            simIdxs = np.argsort(simData[sliceColName])
-            simFieldsSorted = np.sort(simData[sliceColName])
-            # "left" values are location where simdata == bin value
-            left = np.searchsorted(simFieldsSorted, bins[:-1], 'left')
-            left = np.concatenate((left, np.array([len(simIdxs),])))
-            # Add these calculated values into the class lists of simIdxs and lefts.
-            self.simIdxs.append(simIdxs)
-            self.lefts.append(left)
+        # Set up indexing for data slicing: find the (flattened) bin of each visit, then group the
+        # visits by bin, so the visits in slicePoint i are simIdxs[left[i]:left[i+1]].
+        binShape = tuple(len(b) - 1 for b in self.bins)
+        binIdxs = [binIndex(simData[col], bins) for col, bins in zip(self.sliceColList, self.bins)]
+        inBins = np.all([b >= 0 for b in binIdxs], axis=0)
+        flatIdxs = np.zeros(len(simData), int) - 1
+        flatIdxs[inBins] = np.ravel_multi_index([b[inBins] for b in binIdxs], binShape)
+        self.simIdxs, self.left = csrIndex(flatIdxs, self.nslice)
+
         @wraps (self._sliceSimData)
         def _sliceSimData(islice):
             """Slice simData to return relevant indexes for slicepoint."""
-            # Identify relevant pointings in each dimension.
-            simIdxsList = []
-            # Translate islice into indexes in each bin dimension
-            binIdxs = self.slicePoints['binIdxs'][islice]
-            for d, i in zip(list(range(self.nD)), binIdxs):
-                simIdxsList.append(set(self.simIdxs[d][self.lefts[d][i]:self.lefts[d][i+1]]))
-            idxs = list(set.intersection(*simIdxsList))
+            idxs = self.simIdxs[self.left[islice]:self.left[islice+1]]
             return {'idxs':idxs,
                     'slicePoint':{'sid':islice,
                                   'binLeft':self.slicePoints['bins'][islice],
                                   'binIdx':self.slicePoints['binIdxs'][islice]}}
         setattr(self, '_sliceSimData', _sliceSimData)
 
+    def sliceOffsets(self):
+        """Return the indexes of the data in all of the bins (simIdxs), and the offsets of each bin in simIdxs.
+        """
+        return self.simIdxs, self.left
+
     def __eq__(self, otherSlicer):
         """Evaluate if grids are equivalent."""
         if isinstance(otherSlicer, NDSlicer):
@@ -8,6 +8,7 @@ from lsst.sims.maf.stackers import ColInfo
 from lsst.sims.maf.plots.onedPlotters import OneDBinnedData
 
 from .baseSlicer import BaseSlicer
+from .binnedIndex import binIndex, csrIndex
 
 __all__ = ['OneDSlicer']
 
@@ -95,12 +96,10 @@ class OneDSlicer(BaseSlicer):
         self.slicePoints['bins'] = self.bins
         # Add metadata from map if needed.
         self._runMaps(maps)
-        # Set up data slicing.
-        self.simIdxs = np.argsort(simData[self.sliceColName])
-        simFieldsSorted = np.sort(simData[self.sliceColName])
-        # "left" values are location where simdata == bin value
-        self.left = np.searchsorted(simFieldsSorted, self.bins[:-1], 'left')
-        self.left = np.concatenate((self.left, np.array([len(self.simIdxs),])))
+        # Set up data slicing: the visits sorted on sliceCol (so in order of bin), and the
+        # "left" offsets of each bin, so the visits in bin i are simIdxs[left[i]:left[i+1]].
+        binIdxs = binIndex(simData[self.sliceColName], self.bins)
+        self.simIdxs, self.left = csrIndex(binIdxs, self.nslice, order=np.argsort(simData[self.sliceColName]))
         # Set up _sliceSimData method for this class.
         @wraps(self._sliceSimData)
         def _sliceSimData(islice):
@@ -110,6 +109,11 @@ class OneDSlicer(BaseSlicer):
                     'slicePoint':{'sid':islice, 'binLeft':self.bins[islice]}}
         setattr(self, '_sliceSimData', _sliceSimData)
 
+    def sliceOffsets(self):
+        """Return the indexes of the data in all of the bins (simIdxs), and the offsets of each bin in simIdxs.
+        """
+        return self.simIdxs, self.left
+
     def __eq__(self, otherSlicer):
         """Evaluate if slicers are equivalent."""
         result = False
@@ -5,7 +5,10 @@ from lsst.sims.utils import _galacticFromEquatorial, calcLmstLast
 from .baseStacker import BaseStacker
 from .ditherStackers import wrapRA
 
-__all__ = ['mjd2djd', 'raDec2AltAz', 'GalacticStacker', 'EclipticStacker']
+__all__ = ['mjd2djd', 'raDec2AltAz', 'SiteCoordinates', 'GalacticStacker', 'EclipticStacker']
+
+# Ratio of sidereal to solar time; LST advances by this many hours per (solar) hour.
+SIDEREAL_RATE = 1.00273790935
 
 
 def mjd2djd(mjd):
@@ -55,26 +58,197 @@ def raDec2AltAz(ra, dec, lat, lon, mjd, altonly=False):
     lmst, last = calcLmstLast(mjd, lon)
     lmst = lmst / 12. * np.pi  # convert to rad
     ha = lmst - ra
+    return _altAzFromHa(ha, dec, lat, altonly=altonly)
+
+
+def _altAzFromHa(ha, dec, lat, altonly=False):
+    """Convert hour angle/Dec (and telescope site latitude) to alt/az.
+
+    All inputs in radians; ha, dec and lat must be broadcastable against each other.
+    """
     sindec = np.sin(dec)
     sinlat = np.sin(lat)
     coslat = np.cos(lat)
     sinalt = sindec * sinlat + np.cos(dec) * coslat * np.cos(ha)
     # make sure sinalt is in the expected range.
-    sinalt = np.where(sinalt < -1, -1, sinalt)
-    sinalt = np.where(sinalt > 1, 1, sinalt)
+    sinalt = np.clip(sinalt, -1, 1)
     alt = np.arcsin(sinalt)
     if altonly:
         az = None
     else:
         cosaz = (sindec-np.sin(alt)*sinlat)/(np.cos(alt)*coslat)
-        cosaz = np.where(cosaz < -1, -1, cosaz)
-        cosaz = np.where(cosaz > 1, 1, cosaz)
+        cosaz = np.clip(cosaz, -1, 1)
         az = np.arccos(cosaz)
-        signflip = np.where(np.sin(ha) > 0)
-        az[signflip] = 2.*np.pi-az[signflip]
+        az = np.where(np.sin(ha) > 0, 2.*np.pi-az, az)
     return alt, az
 
 
+class SiteCoordinates(object):
+    """Sidereal time, hour angle, alt/az and airmass for a set of visits, evaluated at one or more sites
+    and time offsets.
+
+    The local sidereal time at Greenwich is calculated once per unique MJD in the dataset, and
+    the LST at any other site longitude and time offset is derived from it. Quantities are
+    evaluated as broadcast (visits x sites x offsets) arrays, in chunks of visits so that the
+    memory used is bounded by maxElements.
+
+    This uses the same simple equations as raDec2AltAz (ignoring aberation, precession, nutation, etc.).
+
+    Parameters
+    ----------
+    mjd : numpy.ndarray
+        The MJD of each visit.
+    maxElements : int, opt
+        The maximum number of (visit x site x offset) elements to evaluate at once. Default 5e6.
+    """
+    _cache = None
+
+    def __init__(self, mjd, maxElements=5000000):
+        self.mjd = np.array(mjd, dtype=float, ndmin=1)
+        self.maxElements = int(maxElements)
+        umjd, inverse = np.unique(self.mjd, return_inverse=True)
+        gmst, gast = calcLmstLast(umjd, 0.)
+        # Greenwich mean sidereal time (hours) for each visit.
+        self.gmst = gmst[inverse]
+
+    @classmethod
+    def fromMjd(cls, mjd, maxElements=5000000):
+        """Return a SiteCoordinates object for mjd, reusing the last one calculated if mjd is unchanged.
+
+        Parameters
+        ----------
+        mjd : numpy.ndarray
+            The MJD of each visit.
+        maxElements : int, opt
+            The maximum number of (visit x site x offset) elements to evaluate at once. Default 5e6.
+
+        Returns
+        -------
+        SiteCoordinates
+        """
+        cached = cls._cache
+        mjd = np.array(mjd, dtype=float, ndmin=1)
+        if cached is None or not np.array_equal(cached.mjd, mjd):
+            cached = cls(mjd, maxElements=maxElements)
+            cls._cache = cached
+        cached.maxElements = int(maxElements)
+        return cached
+
+    def _chunks(self, nPerVisit):
+        """Yield slices over the visits, such that each chunk has at most maxElements elements.
+        """
+        step = max(1, self.maxElements // max(1, nPerVisit))
+        for start in range(0, len(self.mjd), step):
+            yield slice(start, min(start + step, len(self.mjd)))
+
+    def lmst(self, lon=0., offsets=0., visits=slice(None)):
+        """Local mean sidereal time, in radians.
+
+        Parameters
+        ----------
+        lon : float or numpy.ndarray
+            Longitude(s) of the sites, in radians.
+        offsets : float or numpy.ndarray
+            Time offset(s) from the visit MJD, in days.
+        visits : slice or numpy.ndarray, opt
+            The subset of visits to evaluate. Default all.
+
+        Returns
+        -------
+        numpy.ndarray
+            LMST with shape (nvisits, nsites, noffsets).
+        """
+        lon = np.array(lon, dtype=float, ndmin=1)
+        offsets = np.array(offsets, dtype=float, ndmin=1)
+        lmst = (self.gmst[visits][:, np.newaxis, np.newaxis] + np.degrees(lon)[np.newaxis, :, np.newaxis] / 15. +
+                offsets[np.newaxis, np.newaxis, :] * 24. * SIDEREAL_RATE)
+        return np.remainder(lmst, 24.) / 12. * np.pi
+
+    def hourAngle(self, ra, lon=0., offsets=0., visits=slice(None)):
+        """Hour angle of each visit, in radians (wrapped to -pi to pi).
+
+        Parameters
+        ----------
+        ra : numpy.ndarray
+            RA of each visit (in the subset 'visits'), in radians.
+        lon : float or numpy.ndarray
+            Longitude(s) of the sites, in radians.
+        offsets : float or numpy.ndarray
+            Time offset(s) from the visit MJD, in days.
+        visits : slice or numpy.ndarray, opt
+            The subset of visits to evaluate. Default all.
+
+        Returns
+        -------
+        numpy.ndarray
+            Hour angle with shape (nvisits, nsites, noffsets).
+        """
+        ha = self.lmst(lon, offsets, visits) - np.asarray(ra)[:, np.newaxis, np.newaxis]
+        return np.remainder(ha + np.pi, 2. * np.pi) - np.pi
+
+    def iterAltAz(self, ra, dec, lat, lon, offsets=0., altonly=False):
+        """Iterate over chunks of visits, yielding the alt/az at each site and time offset.
+
+        Parameters
+        ----------
+        ra : numpy.ndarray
+            RA of each visit, in radians.
+        dec : numpy.ndarray
+            Dec of each visit, in radians.
+        lat : float or numpy.ndarray
+            Latitude(s) of the sites, in radians.
+        lon : float or numpy.ndarray
+            Longitude(s) of the sites, in radians. Must be the same length as lat.
+        offsets : float or numpy.ndarray
+            Time offset(s) from the visit MJD, in days.
+        altonly : bool, opt
+            Calculate altitude only.
+
+        Yields
+        ------
+        slice, numpy.ndarray, numpy.ndarray or None
+            The slice of visits in this chunk, then alt and az (radians) with shape
+            (nvisits in chunk, nsites, noffsets).
+        """
+        ra = np.asarray(ra)
+        dec = np.asarray(dec)
+        lat = np.array(lat, dtype=float, ndmin=1)
+        lon = np.array(lon, dtype=float, ndmin=1)
+        offsets = np.array(offsets, dtype=float, ndmin=1)
+        for visits in self._chunks(len(lon) * len(offsets)):
+            ha = self.hourAngle(ra[visits], lon, offsets, visits)
+            alt, az = _altAzFromHa(ha, dec[visits][:, np.newaxis, np.newaxis],
+                                   lat[np.newaxis, :, np.newaxis], altonly=altonly)
+            yield visits, alt, az
+
+    def altAz(self, ra, dec, lat, lon, offsets=0., altonly=False):
+        """Alt/az of each visit at each site and time offset.
+
+        Parameters are as for iterAltAz.
+
+        Returns
+        -------
+        numpy.ndarray, numpy.ndarray or None
+            Alt and az (radians) with shape (nvisits, nsites, noffsets).
+        """
+        alts = []
+        azs = []
+        for visits, alt, az in self.iterAltAz(ra, dec, lat, lon, offsets=offsets, altonly=altonly):
+            alts.append(alt)
+            azs.append(az)
+        alt = np.concatenate(alts)
+        az = None if altonly else np.concatenate(azs)
+        return alt, az
+
+    @staticmethod
+    def airmass(alt):
+        """Plane-parallel airmass (1/cos(zenith distance)) for altitude alt (radians).
+
+        Returns negative values for targets below the horizon.
+        """
+        return 1. / np.sin(alt)
+
+
 class GalacticStacker(BaseStacker):
     """Add the galactic coordinates of each RA/Dec pointing: gall, galb
 
@@ -7,7 +7,7 @@ from lsst.sims.survey.fields import FieldsDatabase
 from .baseStacker import BaseStacker
 
 __all__ = ['NormAirmassStacker', 'ParallaxFactorStacker', 'HourAngleStacker',
-           'FilterColorStacker', 'ZenithDistStacker', 'ParallacticAngleStacker',
+           'FilterColorStacker', 'FilterCodeStacker', 'ZenithDistStacker', 'ParallacticAngleStacker',
            'SeasonStacker', 'DcrStacker', 'FiveSigmaStacker', 'OpSimFieldStacker']
 
 # Original stackers by Peter Yoachim (yoachim@uw.edu)
@@ -370,6 +370,42 @@ class FilterColorStacker(BaseStacker):
         return simData
 
 
+class FilterCodeStacker(BaseStacker):
+    """Translate filters ('u', 'g', 'r' ..) into small integer codes.
+
+    The code is the index of the filter in filterNames (u=0, g=1, .. y=5), or -1 for any other filter,
+    so that per-filter quantities can be looked up with a single array index
+    (e.g. mags[simData['filterCode']]) rather than by matching filter names.
+    """
+    colsAdded = ['filterCode']
+    filterNames = ['u', 'g', 'r', 'i', 'z', 'y']
+
+    def __init__(self, filterCol='filter'):
+        self.filterCol = filterCol
+        self.units = ['']
+        self.colsReq = [self.filterCol]
+        self.colsAddedDtypes = [int]
+
+    @classmethod
+    def filterCodes(cls, filters):
+        """Return the filter code of each of filters (str or bytes filter names).
+        """
+        uFilters, inverse = np.unique(filters, return_inverse=True)
+        codes = np.zeros(len(uFilters), dtype=int)
+        for i, f in enumerate(uFilters):
+            if hasattr(f, 'decode'):
+                f = f.decode('utf-8')
+            codes[i] = cls.filterNames.index(f) if f in cls.filterNames else -1
+        return codes[inverse.ravel()]
+
+    def _run(self, simData, cols_present=False):
+        if cols_present:
+            # Column already present in data; assume it is correct and does not need recalculating.
+            return simData
+        simData['filterCode'] = self.filterCodes(simData[self.filterCol])
+        return simData
+
+
 class SeasonStacker(BaseStacker):
     """Add an integer label to show which season a given visit is in.
 
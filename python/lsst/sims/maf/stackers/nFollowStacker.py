@@ -1,7 +1,7 @@
 from builtins import zip
 import numpy as np
 from .baseStacker import BaseStacker
-from .coordStackers import raDec2AltAz
+from .coordStackers import SiteCoordinates
 
 __all__ = ['findTelescopes', 'NFollowStacker']
 
@@ -145,19 +145,14 @@ class NFollowStacker(BaseStacker):
         else:
             ra = simData[self.raCol]
             dec = simData[self.decCol]
-        for obs in self.telescopes:
-            obsGotIt = np.zeros(len(simData[self.raCol]), int)
-            obsLon = np.radians(obs['lon'])
-            obsLat = np.radians(obs['lat'])
-            for step in self.timeSteps:
-                alt, az = raDec2AltAz(ra, dec, obsLon, obsLat,
-                                      simData[self.mjdCol] + step / 24.0,
-                                      altonly=True)
-                airmass = 1. / (np.cos(np.pi / 2. - alt))
-                followed = np.where((airmass <= self.airmassLimit) & (airmass >= 1.))
-                # If the observatory got an observation, save this into obsGotIt.
-                # obsGotIt will be 1 if ANY of the times got an observation.
-                obsGotIt[followed] = 1
-            # If an observatory got an observation, count it in nObservatories.
-            simData['nObservatories'] += obsGotIt
+        # Evaluate all telescopes and time steps at once (in chunks of visits).
+        coords = SiteCoordinates.fromMjd(simData[self.mjdCol])
+        obsLat = np.radians(self.telescopes['lat'])
+        obsLon = np.radians(self.telescopes['lon'])
+        offsets = np.asarray(self.timeSteps, dtype=float) / 24.0
+        for visits, alt, az in coords.iterAltAz(ra, dec, obsLat, obsLon, offsets, altonly=True):
+            airmass = coords.airmass(alt)
+            followed = (airmass <= self.airmassLimit) & (airmass >= 1.)
+            # An observatory counts if ANY of the times got an observation.
+            simData['nObservatories'][visits] = np.any(followed, axis=2).sum(axis=1)
         return simData
@@ -1,6 +1,5 @@
 from lsst.sims.maf.stackers import BaseStacker
 import numpy as np
-import numpy.lib.recfunctions as rf
 
 __all__ = ['CoaddStacker']
 
@@ -9,16 +8,24 @@ class CoaddStacker(BaseStacker):
     """
     Stacker to estimate m5 "coadded" per band and par night
 
+    Visits are grouped by (RA, Dec, filter, night); RA and Dec are quantized to a grid of
+    size raDecTol, so that visits to the same field (within the tolerance) share a group key.
+    All groups are identified with a single sort of the data, and the per-group values
+    are computed with segmented (reduceat-style) operations.
+
     Parameters
     ----------
     list : str, opt
         Name of the columns used.
         Default : 'observationStartMJD', 'fieldRA', 'fieldDec','filter','fiveSigmaDepth','visitExposureTime','night','observationId', 'numExposures','visitTime'
+    raDecTol : float, opt
+        Size of the grid used to quantize RA and Dec when identifying visits to the same field.
+        Default 1e-5 (in the units of RaCol/DecCol).
 
     """
     colsAdded = ['coadd']
 
-    def __init__(self, mjdCol='observationStartMJD', RaCol='fieldRA', DecCol='fieldDec', m5Col='fiveSigmaDepth', nightcol='night', filterCol='filter', nightCol='night', numExposuresCol='numExposures', visitTimeCol='visitTime', visitExposureTimeCol='visitExposureTime'):
+    def __init__(self, mjdCol='observationStartMJD', RaCol='fieldRA', DecCol='fieldDec', m5Col='fiveSigmaDepth', nightcol='night', filterCol='filter', nightCol='night', numExposuresCol='numExposures', visitTimeCol='visitTime', visitExposureTimeCol='visitExposureTime', raDecTol=1.e-5):
         self.colsReq = [mjdCol, RaCol, DecCol, m5Col, filterCol, nightCol,
                         numExposuresCol, visitTimeCol, visitExposureTimeCol]
         self.RaCol = RaCol
@@ -29,6 +36,7 @@ class CoaddStacker(BaseStacker):
         self.numExposuresCol = numExposuresCol
         self.visitTimeCol = visitTimeCol
         self.visitExposureTimeCol = visitExposureTimeCol
+        self.raDecTol = raDecTol
 
         self.units = ['int']
 
@@ -55,55 +63,52 @@ class CoaddStacker(BaseStacker):
             # Column already present in data; assume it is correct and does not need recalculating.
             return simData
         self.dtype = simData.dtype
-        r = []
-        for ra, dec, band in np.unique(simData[[self.RaCol, self.DecCol, self.filterCol]]):
-            idx = np.abs(simData[self.RaCol]-ra) < 1.e-5
-            idx &= np.abs(simData[self.DecCol]-dec) < 1.e-5
-            idx &= simData[self.filterCol] == band
-
-            sel = simData[idx]
-            for night in np.unique(sel[self.nightCol]):
-                idxb = sel[self.nightCol] == night
-                r.append(tuple(self.fill(sel[idxb])))
-
-        myarray = np.array(r, dtype=self.dtype)
+        # Build exact integer group keys and sort once (ra, then dec, filter and night).
+        raKey = np.round(simData[self.RaCol] / self.raDecTol).astype(np.int64)
+        decKey = np.round(simData[self.DecCol] / self.raDecTol).astype(np.int64)
+        order = np.lexsort((simData[self.nightCol], simData[self.filterCol], decKey, raKey))
+        data = simData[order]
+        raKey = raKey[order]
+        decKey = decKey[order]
+        # Identify the start of each (ra, dec, filter, night) group.
+        newGroup = np.ones(len(data), dtype=bool)
+        newGroup[1:] = ((raKey[1:] != raKey[:-1]) | (decKey[1:] != decKey[:-1]) |
+                        (data[self.filterCol][1:] != data[self.filterCol][:-1]) |
+                        (data[self.nightCol][1:] != data[self.nightCol][:-1]))
+        starts = np.where(newGroup)[0]
+        groupId = np.cumsum(newGroup) - 1
+        counts = np.diff(np.append(starts, len(data)))
+
+        myarray = np.empty(len(starts), dtype=self.dtype)
+        for colname in self.dtype.names:
+            if colname == 'coadd':
+                myarray[colname] = 1
+            elif colname == self.m5Col:
+                myarray[colname] = self._m5_coadd_grouped(data[colname], starts)
+            elif colname in [self.numExposuresCol, self.visitTimeCol, self.visitExposureTimeCol]:
+                myarray[colname] = np.add.reduceat(data[colname], starts)
+            elif colname == self.filterCol or data[colname].dtype.kind not in 'biuf':
+                myarray[colname] = data[colname][starts]
+            else:
+                myarray[colname] = self._median_grouped(data[colname], groupId, starts, counts)
         return myarray
 
-    def fill(self, tab):
+    def _median_grouped(self, values, groupId, starts, counts):
+        """Median of values within each (contiguous) group, from a single sort.
         """
-        Estimation of new fields (m5 "coadded" values, ...) 
-
-        Parameters
-        ---------------
-        tab : array of (initial) data
-
-
-        Returns
-        -----------
-        tuple with modified field values:
-         - m5Col: "coadded" m5
-        - numExposuresCol: sum of  numExposuresCol
-        - visitTimeCol: sum of visitTimeCol
-        - visitExposureTimeCol: sum of visitExposureTimeCol
-        - all other input fields except band (Ra, Dec, night) : median(field)
+        values = np.asarray(values, dtype=float)
+        svalues = values[np.lexsort((values, groupId))]
+        lo = starts + (counts - 1) // 2
+        hi = starts + counts // 2
+        return 0.5 * (svalues[lo] + svalues[hi])
+
+    def _m5_coadd_grouped(self, m5, starts):
+        """Coadded m5 within each (contiguous) group; see m5_coadd.
         """
-
-        r = []
-
-        for colname in self.dtype.names:
-            if colname not in [self.m5Col, self.numExposuresCol, self.visitTimeCol, self.visitExposureTimeCol, self.filterCol]:
-                if colname == 'coadd':
-                    r.append(1)
-                else:
-                    r.append(np.median(tab[colname]))
-            if colname == self.m5Col:
-                r.append(self.m5_coadd(tab[self.m5Col]))
-            if colname in [self.numExposuresCol, self.visitTimeCol, self.visitExposureTimeCol]:
-                r.append(np.sum(tab[colname]))
-            if colname == self.filterCol:
-                r.append(np.unique(tab[self.filterCol])[0])
-
-        return r
+        # 1/sigma**2 = 25 * 10**(0.8*m5), with sigma = 10**(-0.4*m5)/5.
+        invVar = np.add.reduceat(25. * 10**(0.8 * m5), starts)
+        flux_tot = 5. / np.sqrt(invVar)
+        return -2.5 * np.log10(flux_tot)
 
     def m5_coadd(self, m5):
         """
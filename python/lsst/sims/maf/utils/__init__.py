@@ -3,3 +3,7 @@ from .getDateVersion import *
 from .outputUtils import *
 from .opsimUtils import *
 from .astrometryUtils import *
+from .almanac import *
+from .segmentedKernels import *
+from .powerSpectrum import *
+from .runProfiler import *
@@ -0,0 +1,204 @@
+"""Precomputed per-night sun and moon event times (an 'almanac') for an observatory site. """
+from __future__ import print_function
+import os
+import warnings
+import numpy as np
+import ephem
+from lsst.sims.utils import Site
+
+__all__ = ['Almanac']
+
+
+class Almanac(object):
+    """Per-night sun and moon event times for a site, precomputed once over a range of MJDs.
+
+    For each night (identified by local solar midnight) the table contains
+    the times of sunset/sunrise and -6, -12, -18 degree twilight, plus the moon phase at midnight.
+    The table is computed with pyephem, and (if cacheDir is set) saved to a small file in cacheDir keyed by
+    the site and the date range, so that subsequent uses (in this or any other process) only need to read it.
+    Lookups by MJD are vectorized.
+
+    Use Almanac.get to retrieve an almanac covering a given MJD range, reusing any already in memory
+    (or on disk, with cacheDir).
+
+    Parameters
+    ----------
+    site : str, opt
+        Name of the observatory site (see lsst.sims.utils.Site). Default 'LSST'.
+    mjdStart : float, opt
+        The first MJD covered by the almanac.
+    mjdEnd : float, opt
+        The last MJD covered by the almanac.
+    cacheDir : str, opt
+        Directory in which to save (or from which to read) the almanac table.
+        Default None, which keeps the table in memory only (nothing is written to disk).
+    """
+    # Twilight horizons (in degrees) and the names they are given in the table.
+    horizons = {'sun': '0', 'twi6': '-6', 'twi12': '-12', 'twi18': '-18'}
+    # Block size (days) used to align the MJD range of almanacs retrieved through Almanac.get.
+    blockSize = 100
+    _almanacs = {}
+
+    def __init__(self, site='LSST', mjdStart=59853, mjdEnd=59853+3653, cacheDir=None):
+        self.siteName = site
+        self.site = Site(name=site)
+        self.mjdStart = mjdStart
+        self.mjdEnd = mjdEnd
+        self.cacheDir = cacheDir
+        self.table = None
+        if self.cacheDir:
+            self.table = self._readTable()
+        if self.table is None:
+            self.table = self._calcTable()
+            if self.cacheDir:
+                self._writeTable()
+        self.midnight = self.table['midnight']
+
+    @classmethod
+    def get(cls, site='LSST', mjdStart=59853, mjdEnd=59853+3653, cacheDir=None):
+        """Return an Almanac for site covering (at least) mjdStart to mjdEnd.
+
+        Almanacs are kept in memory (per process, per site and cacheDir) and reused if they already cover
+        the requested range.
+        New almanacs are created over a range aligned to blockSize days, so that they can be reused
+        for similar date ranges (including from disk).
+
+        Parameters
+        ----------
+        site : str, opt
+            Name of the observatory site (see lsst.sims.utils.Site). Default 'LSST'.
+        mjdStart : float, opt
+            The first MJD that must be covered.
+        mjdEnd : float, opt
+            The last MJD that must be covered.
+        cacheDir : str, opt
+            Directory for the almanac table files (see Almanac). Default None (memory only).
+
+        Returns
+        -------
+        Almanac
+        """
+        key = (site, cacheDir)
+        for almanac in cls._almanacs.get(key, []):
+            if almanac.mjdStart <= mjdStart and almanac.mjdEnd >= mjdEnd:
+                return almanac
+        start = np.floor(mjdStart / cls.blockSize) * cls.blockSize
+        end = np.ceil(mjdEnd / cls.blockSize) * cls.blockSize
+        if end <= start:
+            end = start + cls.blockSize
+        almanac = cls(site=site, mjdStart=int(start), mjdEnd=int(end), cacheDir=cacheDir)
+        cls._almanacs.setdefault(key, []).append(almanac)
+        return almanac
+
+    def _filename(self):
+        return os.path.join(self.cacheDir, 'almanac_%s_%d_%d.npz' % (self.siteName.replace(' ', '_'),
+                                                                    self.mjdStart, self.mjdEnd))
+
+    def _readTable(self):
+        filename = self._filename()
+        if not os.path.isfile(filename):
+            return None
+        with np.load(filename) as data:
+            table = data['almanac']
+            # Check the site matches (in case the site definition changed).
+            if not np.allclose(data['site'], [self.site.latitude_rad, self.site.longitude_rad,
+                                              self.site.height]):
+                return None
+        return table
+
+    def _writeTable(self):
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            np.savez(self._filename(), almanac=self.table,
+                     site=np.array([self.site.latitude_rad, self.site.longitude_rad, self.site.height]))
+        except (IOError, OSError) as e:
+            warnings.warn('Could not save almanac to %s: %s' % (self.cacheDir, e))
+
+    def _calcTable(self):
+        """Calculate the sun/moon event times for each night between mjdStart and mjdEnd (with pyephem).
+        """
+        # Convert ...pyephem uses 1899 as it's zero-day, and MJD has Nov 17 1858 as zero-day.
+        doff = ephem.Date(0) - ephem.Date('1858/11/17')
+        obsDict = {}
+        for key, horizon in self.horizons.items():
+            obs = ephem.Observer()
+            obs.lat, obs.lon, obs.elevation = self.site.latitude_rad, self.site.longitude_rad, \
+                self.site.height
+            obs.horizon = horizon
+            obsDict[key] = obs
+        sun = ephem.Sun()
+        moon = ephem.Moon()
+        # Find each local solar midnight (sun antitransit) covering the range.
+        obs = obsDict['sun']
+        midnights = []
+        midnight = obs.previous_antitransit(sun, start=self.mjdStart - doff)
+        while midnight + doff <= self.mjdEnd + 1:
+            midnights.append(float(midnight))
+            midnight = obs.next_antitransit(sun, start=midnight + 0.5)
+        names = ['midnight', 'moonPhase']
+        for key in self.horizons:
+            names += [key + '_set', key + '_rise']
+        table = np.zeros(len(midnights), dtype=list(zip(names, [float] * len(names))))
+        for i, midnight in enumerate(midnights):
+            table['midnight'][i] = midnight + doff
+            moon.compute(midnight)
+            table['moonPhase'][i] = moon.phase
+            for key, obs in obsDict.items():
+                try:
+                    table[key + '_set'][i] = obs.previous_setting(sun, start=midnight, use_center=True) + doff
+                    table[key + '_rise'][i] = obs.next_rising(sun, start=midnight, use_center=True) + doff
+                except (ephem.AlwaysUpError, ephem.NeverUpError):
+                    table[key + '_set'][i] = np.nan
+                    table[key + '_rise'][i] = np.nan
+        return table
+
+    def nightIndex(self, mjd):
+        """Find the index in the almanac table of the night nearest to each MJD (nearest midnight).
+
+        Parameters
+        ----------
+        mjd : float or numpy.ndarray
+            The MJD values.
+
+        Returns
+        -------
+        numpy.ndarray
+            The indexes into the almanac table.
+        """
+        mjd = np.asarray(mjd)
+        idx = np.clip(np.searchsorted(self.midnight, mjd), 1, len(self.midnight) - 1)
+        left = self.midnight[idx - 1]
+        right = self.midnight[idx]
+        idx = np.where(np.abs(mjd - left) <= np.abs(right - mjd), idx - 1, idx)
+        return idx
+
+    def getNights(self, mjd):
+        """Return the almanac rows for the nights nearest to each MJD.
+
+        Parameters
+        ----------
+        mjd : float or numpy.ndarray
+            The MJD values.
+
+        Returns
+        -------
+        numpy.ndarray
+            The almanac table rows (with columns midnight, moonPhase, sun/twi6/twi12/twi18 _set and _rise).
+        """
+        return self.table[self.nightIndex(mjd)]
+
+    def nearestMidnight(self, mjd):
+        """Return the MJD of the local solar midnight nearest to each MJD.
+        """
+        return self.midnight[self.nightIndex(mjd)]
+
+    def moonPhase(self, mjd):
+        """Return the moon phase (percent illuminated) at each MJD, interpolated from the nightly values.
+        """
+        return np.interp(mjd, self.midnight, self.table['moonPhase'])
+
+    def sunsets(self, horizon='sun'):
+        """Return the MJD of every sunset (or twilight, for horizon 'twi6', 'twi12', 'twi18') in the almanac.
+        """
+        return self.table[horizon + '_set']
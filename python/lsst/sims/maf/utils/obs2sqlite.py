@@ -1,12 +1,11 @@
 import numpy as np
-import pandas as pd
 from lsst.sims.skybrightness import SkyModel
 import lsst.sims.skybrightness_pre as sb
 from lsst.sims.utils import raDec2Hpid, m5_flat_sed, Site, _approx_RaDec2AltAz
 import healpy as hp
+import multiprocessing
 import sqlite3
-import ephem
-import sys
+from .almanac import Almanac
 
 __all__ = ['mjd2night', 'obs2sqlite']
 
@@ -27,45 +26,20 @@ class mjd2night(object):
 class mjd2night_sunset(object):
     """Convert MJD to 'night' after calculating actual times of sunsets. (deprecated?)"""
     def __init__(self, mjd_start=59853.035):
-        self.site = Site(name='LSST')
-        self.obs = ephem.Observer()
-        self.obs.lat = self.site.latitude_rad
-        self.obs.lon = self.site.longitude_rad
-        self.obs.elevation = self.site.height
         self.mjd = mjd_start
-        self.sun = ephem.Sun()
         self.generate_sunsets()
 
     def generate_sunsets(self, nyears=13, day_pad=50):
         """
-        Generate the sunrise times for LSST so we can label nights by MJD
-        """
-
-        # Set observatory horizon to zero
-        doff = ephem.Date(0)-ephem.Date('1858/11/17')
-
-        self.obs.horizon = 0.
+        Generate the sunset times for LSST so we can label nights by MJD
 
+        The sunset times come from the (cached) Almanac.
+        """
         # Swipe dates to match sims_skybrightness_pre365
         mjd_start = self.mjd
         mjd_end = np.arange(mjd_start, mjd_start+365.25*nyears+day_pad+366, 366).max()
-        step = 0.25
-        mjds = np.arange(mjd_start, mjd_end+step, step)
-        setting = mjds*0.
-
-        # Stupid Dublin Julian Date
-        djds = mjds - doff
-        sun = ephem.Sun()
-
-        for i, (mjd, djd) in enumerate(zip(mjds, djds)):
-            sun.compute(djd)
-            setting[i] = self.obs.previous_setting(sun, start=djd, use_center=True)
-        setting = setting + doff
-
-        # zomg, round off crazy floating point precision issues
-        setting_rough = np.round(setting*100.)
-        u, indx = np.unique(setting_rough, return_index=True)
-        self.setting_sun_mjds = setting[indx]
+        almanac = Almanac.get(site='LSST', mjdStart=mjd_start, mjdEnd=mjd_end)
+        self.setting_sun_mjds = almanac.sunsets()
         left = np.searchsorted(self.setting_sun_mjds, mjd_start)
         self.setting_sun_mjds = self.setting_sun_mjds[left:]
 
@@ -76,8 +50,88 @@ class mjd2night_sunset(object):
         return np.searchsorted(self.setting_sun_mjds, mjd)
 
 
+def _preSkyNodes(sm, mjds, hpids, filterIdx, filterNames, mjd_step):
+    """Calculate the sky brightness and sun/moon altitudes of observations (in MJD order) from SkyModelPre.
+
+    Rather than asking SkyModelPre for each observation in turn, the full sky maps and the sun/moon
+    positions are fetched once for each node of a grid in MJD (spaced by mjd_step), and the values of
+    all of the observations between two nodes are interpolated (linearly in MJD) from the maps at
+    these nodes with a single gather.
+    Returns the skybrightness, sunAlt and moonAlt (radians) of each observation.
+    """
+    nodes = np.floor(mjds / mjd_step).astype(int)
+    unodes, starts = np.unique(nodes, return_index=True)
+    ends = np.concatenate([starts[1:], [len(mjds)]])
+    skybrightness = np.zeros(len(mjds), float)
+    sunAlt = np.zeros(len(mjds), float)
+    moonAlt = np.zeros(len(mjds), float)
+    cache = {}
+
+    def nodeValues(node):
+        if node not in cache:
+            mjd = node * mjd_step
+            mags = sm.returnMags(mjd)
+            sunMoon = sm.returnSunMoon(mjd)
+            cache[node] = (np.array([mags[f] for f in filterNames]),
+                           sunMoon['sunAlt'], sunMoon['moonAlt'])
+        return cache[node]
+
+    for node, start, end in zip(unodes, starts, ends):
+        # Only the maps of this node and the next are needed from here on.
+        for old in [k for k in cache if k < node]:
+            del cache[old]
+        mags0, sun0, moon0 = nodeValues(node)
+        mags1, sun1, moon1 = nodeValues(node + 1)
+        w = (mjds[start:end] - node * mjd_step) / mjd_step
+        sky0 = mags0[filterIdx[start:end], hpids[start:end]]
+        sky1 = mags1[filterIdx[start:end], hpids[start:end]]
+        skybrightness[start:end] = np.where((sky0 == hp.UNSEEN) | (sky1 == hp.UNSEEN), hp.UNSEEN,
+                                            (1. - w) * sky0 + w * sky1)
+        sunAlt[start:end] = (1. - w) * sun0 + w * sun1
+        moonAlt[start:end] = (1. - w) * moon0 + w * moon1
+    return skybrightness, sunAlt, moonAlt
+
+
+# The arguments of _preSkyNodes shared with the worker processes (inherited on fork).
+_preSkyArgs = None
+
+
+def _preSkyChunk(chunk):
+    """Run _preSkyNodes on the observations chunk[0]:chunk[1], with a SkyModelPre for this process."""
+    start, end = chunk
+    mjds, hpids, filterIdx, filterNames, mjd_step = _preSkyArgs
+    sm = sb.SkyModelPre(preload=False)
+    return _preSkyNodes(sm, mjds[start:end], hpids[start:end], filterIdx[start:end], filterNames, mjd_step)
+
+
+def _writeObservations(observations, outfile, chunk_size=100000):
+    """Write the observations to the observations table of the sqlite file outfile, chunk_size rows at a time.
+
+    The table has an (indexed) "index" column with the row number, followed by the columns of
+    observations: the filter as TEXT and all of the other columns as REAL.
+    """
+    names = observations.dtype.names
+    conn = sqlite3.connect(outfile)
+    columns = ', '.join(['"index" INTEGER'] + ['%s %s' % (name, 'TEXT' if name == 'filter' else 'REAL')
+                                                for name in names])
+    conn.execute('CREATE TABLE observations (%s)' % columns)
+    conn.execute('CREATE INDEX ix_observations_index ON observations ("index")')
+    insert = 'INSERT INTO observations VALUES (%s)' % ', '.join(['?'] * (len(names) + 1))
+    for start in range(0, observations.size, chunk_size):
+        chunk = observations[start:start + chunk_size]
+        rows = [np.arange(start, start + len(chunk)).tolist()]
+        for name in names:
+            if name == 'filter':
+                rows.append(np.char.decode(chunk[name]).tolist())
+            else:
+                rows.append(chunk[name].tolist())
+        conn.executemany(insert, zip(*rows))
+    conn.commit()
+    conn.close()
+
+
 def obs2sqlite(observations_in, location='LSST', outfile='observations.sqlite', slewtime_limit=5.,
-               full_sky=False, radians=True):
+               full_sky=False, radians=True, mjd_step=5./60./24., n_processes=1, chunk_size=100000):
     """
     Utility to take an array of observations and dump it to a sqlite file, filling in useful columns along the way.
 
@@ -89,6 +143,16 @@ def obs2sqlite(observations_in, location='LSST', outfile='observations.sqlite',
         exptime : the exposure time in seconds
     slewtime_limit : float
         Consider all slewtimes larger than this to be closed-dome time not part of a slew.
+    full_sky : bool
+        Calculate the sky brightness with SkyModel (for each group of observations at the same MJD),
+        rather than interpolating the pre-computed SkyModelPre sky maps.
+    mjd_step : float
+        The spacing (days) of the MJD nodes where the pre-computed sky maps (and sun/moon altitudes)
+        are fetched; the values for the observations between two nodes are interpolated. Default 5 minutes.
+    n_processes : int
+        The number of processes to split the pre-computed sky brightness calculation across. Default 1.
+    chunk_size : int
+        The number of observations written to the sqlite file at a time. Default 100000.
     """
 
     # Set the location to be LSST
@@ -157,30 +221,48 @@ def obs2sqlite(observations_in, location='LSST', outfile='observations.sqlite',
 
     # Sky Brightness
     if 'skybrightness' not in in_cols:
+        filters = np.char.decode(observations['filter'].astype('S1'))
         if full_sky:
             sm = SkyModel(mags=True)
-            for i, obs in enumerate(observations):
-                sm.setRaDecMjd(obs['ra'], obs['dec'], obs['mjd'], degrees=True)
-                observations['skybrightness'][i] = sm.returnMags()[obs['filter']]
+            # Calculate the sky at all of the pointings at each MJD at once.
+            umjds, starts = np.unique(observations['mjd'], return_index=True)
+            ends = np.concatenate([starts[1:], [n_obs]])
+            for mjd, start, end in zip(umjds, starts, ends):
+                sm.setRaDecMjd(observations['ra'][start:end], observations['dec'][start:end], mjd,
+                               degrees=True)
+                mags = sm.returnMags()
+                for fn in np.unique(filters[start:end]):
+                    match = np.where(filters[start:end] == fn)[0]
+                    observations['skybrightness'][start + match] = np.atleast_1d(mags[fn])[match]
         else:
             # Let's try using the pre-computed sky brighntesses
             sm = sb.SkyModelPre(preload=False)
             full = sm.returnMags(observations['mjd'][0])
             nside = hp.npix2nside(full['r'].size)
-            imax = float(np.size(observations))
-            for i, obs in enumerate(observations):
-                indx = raDec2Hpid(nside, obs['ra'], obs['dec'])
-                observations['skybrightness'][i] = sm.returnMags(obs['mjd'], indx=[indx])[obs['filter']]
-                sunMoon = sm.returnSunMoon(obs['mjd'])
-                observations['sunAlt'][i] = sunMoon['sunAlt']
-                observations['moonAlt'][i] = sunMoon['moonAlt']
-                progress = i/imax*100
-                text = "\rprogress = %.2f%%"%progress
-                sys.stdout.write(text)
-                sys.stdout.flush()
-            observations['sunAlt'] = np.degrees(observations['sunAlt'])
-            observations['moonAlt'] = np.degrees(observations['moonAlt'])
-
+            hpids = raDec2Hpid(nside, observations['ra'], observations['dec'])
+            filterNames, filterIdx = np.unique(filters, return_inverse=True)
+            mjds = observations['mjd']
+            if n_processes > 1:
+                # Split the observations into chunks at node boundaries, one chunk per process.
+                nodes = np.floor(mjds / mjd_step).astype(int)
+                even = np.linspace(0, n_obs, n_processes + 1).astype(int)[1:-1]
+                splits = np.searchsorted(nodes, nodes[even])
+                bounds = np.concatenate([[0], splits, [n_obs]])
+                chunks = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+                global _preSkyArgs
+                _preSkyArgs = (mjds, hpids, filterIdx, filterNames, mjd_step)
+                try:
+                    with multiprocessing.get_context('fork').Pool(n_processes) as pool:
+                        results = pool.map(_preSkyChunk, chunks)
+                finally:
+                    _preSkyArgs = None
+                skybrightness, sunAlt, moonAlt = [np.concatenate(r) for r in zip(*results)]
+            else:
+                skybrightness, sunAlt, moonAlt = _preSkyNodes(sm, mjds, hpids, filterIdx, filterNames,
+                                                              mjd_step)
+            observations['skybrightness'] = skybrightness
+            observations['sunAlt'] = np.degrees(sunAlt)
+            observations['moonAlt'] = np.degrees(moonAlt)
 
     # 5-sigma depth
     for fn in np.unique(observations['filter']):
@@ -190,7 +272,4 @@ def obs2sqlite(observations_in, location='LSST', outfile='observations.sqlite',
                                                            observations['exptime'][good],
                                                            observations['airmass'][good])
 
-    conn = sqlite3.connect(outfile)
-    df = pd.DataFrame(observations)
-    df.to_sql('observations', conn)
-
+    _writeObservations(observations, outfile, chunk_size=chunk_size)
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+import hashlib
+import multiprocessing
+import numpy as np
+import healpy as hp
+
+__all__ = ['PowerSpectrumCache', 'powerSpectrumCache', 'calcPowerSpectrum']
+
+
+def _anafast(args):
+    """Calculate the angular power spectrum of a healpix map (optionally after removing the dipole).
+
+    Takes a single tuple of arguments (mapValues, removeDipole, lmax), so it can be used with Pool.map.
+    """
+    mapValues, removeDipole, lmax = args
+    if removeDipole:
+        mapValues = hp.remove_dipole(mapValues, verbose=False)
+    return hp.anafast(mapValues, lmax=lmax)
+
+
+class PowerSpectrumCache(object):
+    """Cache of the angular power spectra (C_ell) of healpix maps.
+
+    The TotalPowerMetric summary metrics (often several, with different lmin/lmax) and the
+    HealpixPowerSpectrum plotter all calculate the power spectrum of the same metric values.
+    Calculating the power spectrum (hp.anafast) is expensive, so the spectra are cached here,
+    keyed by a checksum of the map values together with removeDipole and lmax. Keying on the
+    values (rather than the identity of the array) means a new array holding the same values
+    (such as the metric values filled with the mask value) finds the cached spectrum, while
+    metric values which have changed do not.
+
+    Parameters
+    ----------
+    maxSize : int, opt
+        The maximum number of power spectra kept in the cache; the least recently used spectra
+        are discarded first. Default 256.
+    """
+    def __init__(self, maxSize=256):
+        self.maxSize = maxSize
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, mapValues, removeDipole, lmax):
+        mapValues = np.ascontiguousarray(mapValues)
+        checksum = hashlib.sha1(mapValues.view(np.uint8)).hexdigest()
+        return (checksum, mapValues.dtype.str, mapValues.size, bool(removeDipole), lmax)
+
+    def _store(self, key, cl):
+        cl.flags.writeable = False
+        self._cache[key] = cl
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxSize:
+            self._cache.popitem(last=False)
+
+    def get(self, mapValues, removeDipole=True, lmax=None):
+        """Return the power spectrum of mapValues, calculating it only if it is not already cached.
+
+        Parameters
+        ----------
+        mapValues : numpy.ndarray
+            The healpix map (with masked values set to hp.UNSEEN).
+        removeDipole : bool, opt
+            Remove the monopole and dipole before calculating the power spectrum. Default True.
+        lmax : int, opt
+            The maximum ell of the power spectrum. Default None (3*nside-1).
+
+        Returns
+        -------
+        numpy.ndarray
+            The power spectrum C_ell. This array is shared, and so must be treated as read-only.
+        """
+        key = self._key(mapValues, removeDipole, lmax)
+        if key in self._cache:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        self.misses += 1
+        cl = _anafast((np.asarray(mapValues), removeDipole, lmax))
+        self._store(key, cl)
+        return cl
+
+    def precompute(self, maps, removeDipole=True, lmax=None, nProcesses=None):
+        """Calculate (and cache) the power spectra of many maps at once, using a pool of processes.
+
+        Parameters
+        ----------
+        maps : list of numpy.ndarray
+            The healpix maps (with masked values set to hp.UNSEEN).
+        removeDipole : bool, opt
+            Remove the monopole and dipole before calculating the power spectra. Default True.
+        lmax : int, opt
+            The maximum ell of the power spectra. Default None (3*nside-1).
+        nProcesses : int, opt
+            The number of worker processes. Default None, which uses the number of cpus.
+            With a single process (or a single map to calculate), no pool is started.
+        """
+        todo = OrderedDict()
+        for mapValues in maps:
+            key = self._key(mapValues, removeDipole, lmax)
+            if key not in self._cache and key not in todo:
+                todo[key] = np.asarray(mapValues)
+        if len(todo) == 0:
+            return
+        args = [(mapValues, removeDipole, lmax) for mapValues in todo.values()]
+        if nProcesses is None:
+            nProcesses = multiprocessing.cpu_count()
+        nProcesses = min(nProcesses, len(args))
+        if nProcesses > 1:
+            with multiprocessing.Pool(nProcesses) as pool:
+                cls = pool.map(_anafast, args)
+        else:
+            cls = [_anafast(a) for a in args]
+        self.misses += len(cls)
+        for key, cl in zip(todo, cls):
+            self._store(key, cl)
+
+    def clear(self):
+        """Remove all of the cached power spectra (and reset the hit/miss counts).
+        """
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+
+# The cache shared by the summary metrics and plotters.
+powerSpectrumCache = PowerSpectrumCache()
+
+
+def calcPowerSpectrum(mapValues, removeDipole=True, lmax=None):
+    """Return the angular power spectrum (C_ell) of a healpix map, using the shared powerSpectrumCache.
+
+    Parameters
+    ----------
+    mapValues : numpy.ndarray
+        The healpix map (with masked values set to hp.UNSEEN).
+    removeDipole : bool, opt
+        Remove the monopole and dipole before calculating the power spectrum. Default True.
+    lmax : int, opt
+        The maximum ell of the power spectrum. Default None (3*nside-1).
+
+    Returns
+    -------
+    numpy.ndarray
+        The power spectrum C_ell (read-only; shared with other users of the cache).
+    """
+    return powerSpectrumCache.get(mapValues, removeDipole=removeDipole, lmax=lmax)
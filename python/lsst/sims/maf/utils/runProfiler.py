@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # The resource module is not available on all platforms; peak memory is then not recorded.
+    resource = None
+
+__all__ = ['peakMemory', 'noStage', 'RunProfiler']
+
+
+def peakMemory():
+    """Return the peak memory (resident set size) used by this process so far, in MB.
+
+    Returns 0 if the peak memory is not available on this platform.
+    """
+    if resource is None:
+        return 0.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return maxrss / 1024. / 1024.
+    return maxrss / 1024.
+
+
+@contextmanager
+def noStage():
+    """Context manager which does nothing, used in place of RunProfiler.stage when not profiling.
+    """
+    yield
+
+
+class RunProfiler(object):
+    """Record the wall time, number of calls and peak memory of the stages of a MetricBundleGroup run.
+
+    Each record is identified by its stage (such as 'query', 'stacker', 'slicer', 'metric', 'reduce',
+    'summary', 'write' or 'plot') and a name: the fileRoot of the MetricBundle for the stages of a
+    single MetricBundle, or the constraint, stacker or slicer for the stages shared between MetricBundles.
+    The wall time and number of calls add up over all of the calls of each stage.
+    The peak memory is the largest peak memory of the process (see peakMemory) at the end of any of
+    the calls of the stage, so the stage which first reaches the peak memory of the run is the one
+    which used the memory.
+    """
+    columns = ['stage', 'name', 'wallTime', 'nCalls', 'peakMemory']
+
+    def __init__(self):
+        self._records = OrderedDict()
+
+    def addCall(self, stage, name, wallTime, nCalls=1):
+        """Add the time of nCalls calls of a stage (without measuring the memory, which is cheaper;
+        used for the calls of the metrics at each slicePoint).
+        """
+        record = self._records.get((stage, name))
+        if record is None:
+            record = [0., 0, 0.]
+            self._records[(stage, name)] = record
+        record[0] += wallTime
+        record[1] += nCalls
+        return record
+
+    def add(self, stage, name, wallTime, nCalls=1):
+        """Add the time of nCalls calls of a stage, and the peak memory at the end of them.
+        """
+        record = self.addCall(stage, name, wallTime, nCalls=nCalls)
+        record[2] = max(record[2], peakMemory())
+
+    @contextmanager
+    def stage(self, stage, name=None):
+        """Context manager recording the wall time and peak memory of a call of a stage.
+        """
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, name, time.time() - t0)
+
+    def records(self, sortBy='wallTime'):
+        """Return the records, as a list of dictionaries (with keys RunProfiler.columns).
+
+        Parameters
+        ----------
+        sortBy : str, opt
+            The column to sort the records by: wallTime, nCalls or peakMemory in decreasing order,
+            or stage or name in increasing order. None keeps the order the stages were first run in.
+            Default wallTime.
+        """
+        records = [dict(zip(self.columns, [stage, name] + values))
+                   for (stage, name), values in self._records.items()]
+        if sortBy in ('wallTime', 'nCalls', 'peakMemory'):
+            records.sort(key=lambda r: r[sortBy], reverse=True)
+        elif sortBy is not None:
+            records.sort(key=lambda r: str(r[sortBy]))
+        return records
+
+    def report(self, format='text', sortBy='wallTime'):
+        """Return a report of the records, as text (a table) or JSON.
+
+        Parameters
+        ----------
+        format : str, opt
+            'text' or 'json'. Default 'text'.
+        sortBy : str, opt
+            The column to sort the records by (see records). Default wallTime.
+
+        Returns
+        -------
+        str
+        """
+        records = self.records(sortBy=sortBy)
+        if format == 'json':
+            return json.dumps(records, indent=1)
+        if format != 'text':
+            raise ValueError('Unknown profile report format %s (use text or json).' % (format))
+        # The stages do not overlap, so their times add up to the (profiled) time of the run.
+        totalTime = sum(r['wallTime'] for r in records)
+        lines = ['%-8s %10s %8s %10s %10s  %s' % ('stage', 'wallTime', '%', 'nCalls', 'peakMem', 'name'),
+                 '%-8s %10s %8s %10s %10s' % ('', '(s)', '', '', '(MB)')]
+        for r in records:
+            percent = 100. * r['wallTime'] / totalTime if totalTime > 0 else 0.
+            lines.append('%-8s %10.3f %8.1f %10d %10.1f  %s' % (r['stage'], r['wallTime'], percent,
+                                                                r['nCalls'], r['peakMemory'], r['name']))
+        return '\n'.join(lines)
+
+    def writeResultsDb(self, resultsDb, bundles):
+        """Save the records in the profiles table of resultsDb.
+
+        The records of each MetricBundle are linked to its metricId (so the MetricBundles should
+        already have been written to the resultsDb); the other records have no metricId.
+
+        Parameters
+        ----------
+        resultsDb : ResultsDb
+            The results database.
+        bundles : list of MetricBundles
+            The MetricBundles which have been profiled.
+        """
+        bundles = {b.fileRoot: b for b in bundles}
+        profiles = []
+        for record in self.records():
+            record['metricId'] = None
+            b = bundles.get(record['name'])
+            if b is not None:
+                metricIds = resultsDb.getMetricId(b.metric.name, slicerName=b.slicer.slicerName,
+                                                  metricMetadata=b.metadata, simDataName=b.runName)
+                if len(metricIds) > 0:
+                    record['metricId'] = metricIds[0]
+            profiles.append(record)
+        resultsDb.updateProfiles(profiles)
+
+    def writeReport(self, filename, format='text', sortBy='wallTime'):
+        """Write the report of the records (see report) to filename.
+        """
+        with open(filename, 'w') as f:
+            f.write(self.report(format=format, sortBy=sortBy))
+            f.write('\n')
+
+    def clear(self):
+        """Remove all of the records.
+        """
+        self._records.clear()
+
+    def __len__(self):
+        return len(self._records)
@@ -0,0 +1,414 @@
+"""Vectorized operations on 'segmented' arrays.
+
+A segmented array is a flat array holding the values for many groups (segments) one after another,
+together with an array of offsets (as in a CSR sparse matrix): the values of segment i are
+values[offsets[i]:offsets[i+1]], so offsets has one more element than there are segments.
+These kernels let metrics operate on the visits at many slicePoints (or in many nights) at once.
+"""
+import numpy as np
+
+__all__ = ['segmentOffsets', 'segmentIds', 'segmentedArgsort', 'segmentedSort', 'segmentedSearchsorted',
+           'segmentedDiff', 'segmentedAllDiffs', 'segmentedHistogram', 'segmentedPairHistogram',
+           'segmentedCount', 'segmentedReduce', 'segmentedPercentile', 'runLengths', 'windowCounts']
+
+
+def segmentOffsets(lengths):
+    """Return the offsets for segments with the given lengths.
+
+    Parameters
+    ----------
+    lengths : numpy.ndarray
+        The number of elements in each segment.
+
+    Returns
+    -------
+    numpy.ndarray
+        The offsets (of length len(lengths) + 1).
+    """
+    offsets = np.zeros(len(lengths) + 1, dtype=int)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def segmentIds(offsets):
+    """Return the segment number of each element.
+    """
+    offsets = np.asarray(offsets)
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def _boundaries(offsets):
+    """Return a mask (of length n-1) which is True where consecutive elements are in different segments.
+    """
+    offsets = np.asarray(offsets)
+    nvalues = offsets[-1]
+    boundary = np.zeros(max(nvalues - 1, 0), dtype=bool)
+    starts = offsets[1:-1]
+    starts = starts[(starts > 0) & (starts < nvalues)]
+    boundary[starts - 1] = True
+    return boundary
+
+
+def segmentedArgsort(values, offsets):
+    """Return the indexes which sort values within each segment (the segments stay in place).
+
+    Returns None if the values are already sorted within each segment.
+    """
+    values = np.asarray(values)
+    if values.size < 2:
+        return None
+    decreasing = np.diff(values) < 0
+    if not np.any(decreasing & ~_boundaries(offsets)):
+        return None
+    # Sort by value, then (stably) by segment.
+    order = np.argsort(values)
+    return order[np.argsort(segmentIds(offsets)[order], kind='stable')]
+
+
+def segmentedSort(values, offsets):
+    """Return values sorted within each segment.
+    """
+    order = segmentedArgsort(values, offsets)
+    if order is None:
+        return values
+    return values[order]
+
+
+def segmentedSearchsorted(values, offsets, queries, ids, side='left'):
+    """Find where each query would be inserted into its segment of values, as numpy.searchsorted
+    on each segment.
+
+    With many short segments, this is a binary search of all of the segments at once;
+    with long segments, numpy.searchsorted is run on each segment in turn.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values, sorted within each segment.
+    offsets : numpy.ndarray
+        The segment offsets.
+    queries : numpy.ndarray
+        The values to find, with one row (a value, or a 1-d array of values) for each of ids.
+    ids : numpy.ndarray
+        The segment to search for each row of queries.
+    side : {'left', 'right'}, opt
+        As for numpy.searchsorted. Default 'left'.
+
+    Returns
+    -------
+    numpy.ndarray
+        The index into values of each query (between offsets[id] and offsets[id+1]),
+        with the shape of queries.
+    """
+    values = np.asarray(values)
+    offsets = np.asarray(offsets)
+    ids = np.asarray(ids)
+    queries = np.asarray(queries)
+    if len(offsets) > 1 and len(ids) > 0 and (len(offsets) - 1) * 64 < values.size:
+        result = np.empty(queries.shape, dtype=int)
+        if np.all(ids[1:] >= ids[:-1]):
+            queryOrder = None
+            queryOffsets = np.searchsorted(ids, np.arange(len(offsets)))
+        else:
+            queryOrder = np.argsort(ids, kind='stable')
+            queryOffsets = np.searchsorted(ids[queryOrder], np.arange(len(offsets)))
+        for i in np.flatnonzero(np.diff(queryOffsets)):
+            if queryOrder is None:
+                q = slice(queryOffsets[i], queryOffsets[i + 1])
+            else:
+                q = queryOrder[queryOffsets[i]:queryOffsets[i + 1]]
+            result[q] = offsets[i] + np.searchsorted(values[offsets[i]:offsets[i + 1]], queries[q], side=side)
+        return result
+    shape = (-1,) + (1,) * (queries.ndim - 1)
+    lo = np.broadcast_to(offsets[ids].reshape(shape), queries.shape)
+    hi = np.broadcast_to(offsets[ids + 1].reshape(shape), queries.shape)
+    if values.size == 0:
+        return lo.copy()
+    active = lo < hi
+    while np.any(active):
+        mid = (lo + hi) // 2
+        midValues = values[np.minimum(mid, values.size - 1)]
+        if side == 'left':
+            goRight = active & (midValues < queries)
+        else:
+            goRight = active & (midValues <= queries)
+        lo = np.where(goRight, mid + 1, lo)
+        hi = np.where(active & ~goRight, mid, hi)
+        active = lo < hi
+    return lo
+
+
+def segmentedDiff(values, offsets):
+    """Return the differences between consecutive values within each segment.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values (usually sorted within each segment).
+    offsets : numpy.ndarray
+        The segment offsets.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The differences, and their segment offsets (a segment of n values has n-1 differences).
+    """
+    offsets = np.asarray(offsets)
+    diffs = np.diff(values)[~_boundaries(offsets)]
+    return diffs, segmentOffsets(np.maximum(np.diff(offsets) - 1, 0))
+
+
+def segmentedAllDiffs(values, offsets):
+    """Return the differences between every pair of values (later - earlier) within each segment.
+
+    The number of differences grows as the square of the segment lengths; to histogram them,
+    segmentedPairHistogram is much cheaper.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The differences, and the segment number of each difference.
+    """
+    offsets = np.asarray(offsets)
+    values = np.asarray(values)
+    ids = segmentIds(offsets)
+    # The number of later values in the same segment, for each value.
+    nLater = offsets[1:][ids] - np.arange(values.size) - 1
+    first = np.repeat(np.arange(values.size), nLater)
+    pairOffsets = segmentOffsets(nLater)
+    second = first + 1 + np.arange(pairOffsets[-1]) - np.repeat(pairOffsets[:-1], nLater)
+    return values[second] - values[first], ids[first]
+
+
+def segmentedHistogram(values, offsets, bins, ids=None):
+    """Histogram the values in each segment (with the same edge conventions as numpy.histogram).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values.
+    offsets : numpy.ndarray
+        The segment offsets.
+    bins : numpy.ndarray
+        The bin edges.
+    ids : numpy.ndarray, opt
+        The segment number of each value, if values are not laid out according to offsets
+        (offsets then only sets the number of segments). Default None.
+
+    Returns
+    -------
+    numpy.ndarray
+        The counts in each bin, with shape (number of segments, number of bins).
+    """
+    bins = np.asarray(bins)
+    nbins = len(bins) - 1
+    nseg = len(offsets) - 1
+    if ids is None:
+        ids = segmentIds(offsets)
+    values = np.asarray(values)
+    binIdx = np.searchsorted(bins, values, side='right') - 1
+    # The last bin includes its right edge.
+    binIdx[values == bins[-1]] = nbins - 1
+    good = (binIdx >= 0) & (binIdx < nbins)
+    counts = np.bincount(ids[good] * nbins + binIdx[good], minlength=nseg * nbins)
+    return counts.reshape(nseg, nbins)
+
+
+def segmentedPairHistogram(values, offsets, bins):
+    """Histogram the differences between every pair of values (later - earlier) within each segment.
+
+    This is segmentedHistogram of segmentedAllDiffs. When there are more pairs than values times bin
+    edges (long segments), the pairs are not formed: for each value and bin edge, the number of later
+    values closer than the edge is found by a search of the segment, so the cost grows as the number of
+    values times the number of bins, rather than as the number of pairs.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values, sorted within each segment.
+    offsets : numpy.ndarray
+        The segment offsets.
+    bins : numpy.ndarray
+        The bin edges (as for numpy.histogram).
+
+    Returns
+    -------
+    numpy.ndarray
+        The counts in each bin, with shape (number of segments, number of bins).
+    """
+    values = np.asarray(values)
+    offsets = np.asarray(offsets)
+    bins = np.asarray(bins)
+    nseg = len(offsets) - 1
+    lengths = np.diff(offsets)
+    if np.sum(lengths * (lengths - 1) // 2) <= values.size * len(bins):
+        # With short segments, there are fewer pairs than searches: histogram the differences directly.
+        diffs, ids = segmentedAllDiffs(values, offsets)
+        return segmentedHistogram(diffs, offsets, bins, ids=ids)
+    ids = segmentIds(offsets)
+    position = np.arange(values.size)[:, np.newaxis]
+    # The number of pairs (in each segment) with a difference below each bin edge
+    # (or up to and including it, for the last edge), for a block of edges at a time to bound the memory.
+    cumulative = np.zeros((nseg, len(bins)), dtype=int)
+    blockSize = max(1, 10000000 // max(values.size, 1))
+    for start in range(0, len(bins), blockSize):
+        edges = bins[start:start + blockSize]
+        nLater = segmentedSearchsorted(values, offsets, values[:, np.newaxis] + edges, ids) - position - 1
+        if start + blockSize >= len(bins):
+            nLater[:, -1] = segmentedSearchsorted(values, offsets, values + edges[-1], ids,
+                                                  side='right') - position[:, 0] - 1
+        np.maximum(nLater, 0, out=nLater)
+        for k in range(len(edges)):
+            cumulative[:, start + k] = np.bincount(ids, weights=nLater[:, k], minlength=nseg)
+    return np.diff(cumulative, axis=1)
+
+
+def segmentedCount(mask, offsets):
+    """Return the number of True values of mask in each segment.
+    """
+    return np.bincount(segmentIds(offsets)[mask], minlength=len(offsets) - 1)
+
+
+def segmentedReduce(values, offsets, func, emptyValue=np.nan):
+    """Apply func (a reduction, such as numpy.median) to the values in each segment.
+
+    numpy.median, mean, sum, min and max are evaluated for all segments at once; other functions
+    are applied to each segment in turn.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values.
+    offsets : numpy.ndarray
+        The segment offsets.
+    func : callable
+        The reduction function.
+    emptyValue : float, opt
+        The value for empty segments. Default numpy.nan.
+
+    Returns
+    -------
+    numpy.ndarray
+        The reduced value of each segment.
+    """
+    offsets = np.asarray(offsets)
+    values = np.asarray(values)
+    lengths = np.diff(offsets)
+    nonEmpty = lengths > 0
+    result = np.zeros(len(lengths), dtype=float) + emptyValue
+    if not np.any(nonEmpty):
+        return result
+    starts = offsets[:-1][nonEmpty]
+    if func in (np.sum, np.add):
+        result[nonEmpty] = np.add.reduceat(values, starts)
+    elif func is np.mean:
+        result[nonEmpty] = np.add.reduceat(values, starts) / lengths[nonEmpty]
+    elif func in (np.min, np.amin):
+        result[nonEmpty] = np.minimum.reduceat(values, starts)
+    elif func in (np.max, np.amax):
+        result[nonEmpty] = np.maximum.reduceat(values, starts)
+    elif func is np.median:
+        order = segmentedArgsort(values, offsets)
+        if order is not None:
+            values = values[order]
+        lo = starts + (lengths[nonEmpty] - 1) // 2
+        hi = starts + lengths[nonEmpty] // 2
+        result[nonEmpty] = (values[lo] + values[hi]) / 2.0
+    else:
+        for i in np.where(nonEmpty)[0]:
+            result[i] = func(values[offsets[i]:offsets[i + 1]])
+    return result
+
+
+def segmentedPercentile(values, offsets, percentile, emptyValue=np.nan):
+    """Return the percentile of the values in each segment (as numpy.percentile, with linear interpolation).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values.
+    offsets : numpy.ndarray
+        The segment offsets.
+    percentile : float or sequence of floats
+        The percentile (or percentiles), between 0 and 100.
+    emptyValue : float, opt
+        The value for empty segments. Default numpy.nan.
+
+    Returns
+    -------
+    numpy.ndarray
+        The percentile of each segment (with shape (number of segments, number of percentiles)
+        if percentile is a sequence).
+    """
+    offsets = np.asarray(offsets)
+    values = segmentedSort(np.asarray(values), offsets)
+    lengths = np.diff(offsets)
+    nonEmpty = lengths > 0
+    q = np.asarray(percentile, dtype=float) / 100.
+    result = np.zeros((len(lengths),) + q.shape, dtype=float) + emptyValue
+    if not np.any(nonEmpty):
+        return result
+    starts = offsets[:-1][nonEmpty]
+    lengths = lengths[nonEmpty]
+    # The (fractional) position of the percentile in each segment.
+    position = np.multiply.outer(lengths - 1, q)
+    lo = np.floor(position).astype(int)
+    hi = np.minimum(lo + 1, (lengths - 1).reshape((-1,) + (1,) * q.ndim))
+    frac = position - lo
+    starts = starts.reshape((-1,) + (1,) * q.ndim)
+    low = values[starts + lo]
+    result[nonEmpty] = low + (values[starts + hi] - low) * frac
+    return result
+
+
+def runLengths(keys, offsets):
+    """Find the runs of equal (consecutive) keys within each segment, such as the visits in each night.
+
+    Parameters
+    ----------
+    keys : numpy.ndarray
+        The segmented keys (sorted, or at least grouped, within each segment).
+    offsets : numpy.ndarray
+        The segment offsets.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        The offsets of the runs (into keys; the runs are themselves segments of keys), and the segment
+        offsets of the runs (the runs of segment i are runs[runSegmentOffsets[i]:runSegmentOffsets[i+1]]).
+    """
+    offsets = np.asarray(offsets)
+    keys = np.asarray(keys)
+    newRun = np.ones(keys.size, dtype=bool)
+    if keys.size > 1:
+        newRun[1:] = (keys[1:] != keys[:-1]) | _boundaries(offsets)
+    starts = np.where(newRun)[0]
+    runOffsets = np.concatenate([starts, [keys.size]])
+    # The number of runs starting before each segment offset.
+    runSegmentOffsets = np.searchsorted(starts, offsets)
+    return runOffsets, runSegmentOffsets
+
+
+def windowCounts(values, offsets, low, high):
+    """Count, for each value, the values in the same segment within [value + low, value + high).
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The segmented values, sorted within each segment.
+    offsets : numpy.ndarray
+        The segment offsets.
+    low : float
+        The start of the window, relative to each value.
+    high : float
+        The end of the window, relative to each value.
+
+    Returns
+    -------
+    numpy.ndarray
+        The number of values within the window of each value.
+    """
+    values = np.asarray(values)
+    ids = segmentIds(offsets)
+    return (segmentedSearchsorted(values, offsets, values + high, ids)
+            - segmentedSearchsorted(values, offsets, values + low, ids))
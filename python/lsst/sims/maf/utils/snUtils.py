@@ -3,6 +3,44 @@ import matplotlib.pyplot as plt
 from scipy import interpolate
 import numpy.lib.recfunctions as rf
 
+# Reference files already read in this process, keyed by filename.
+_referenceFiles = {}
+
+
+def _loadReference(filename):
+    """Load a reference (numpy) file, reading each file only once per process."""
+    if filename not in _referenceFiles:
+        _referenceFiles[filename] = np.load(filename)
+    return _referenceFiles[filename]
+
+
+class LinearLookup:
+    """
+    Piecewise-linear lookup table (returning fill_value outside the table range)
+
+    Equivalent to scipy's interp1d(x, y, bounds_error=False, fill_value=fill_value),
+    but evaluated with np.interp on arrays of any shape, without per-call overhead.
+
+    Parameters
+    ---------------
+    x : array
+      x values of the table (need not be sorted)
+    y : array
+      y values of the table
+    fill_value : float, opt
+      value returned outside of the range of x
+      Default : 0.
+    """
+
+    def __init__(self, x, y, fill_value=0.):
+        order = np.argsort(x, kind='mergesort')
+        self.x = np.asarray(x, dtype=float)[order]
+        self.y = np.asarray(y, dtype=float)[order]
+        self.fill_value = fill_value
+
+    def __call__(self, x):
+        return np.interp(x, self.x, self.y, left=self.fill_value, right=self.fill_value)
+
 
 class Lims:
     """
@@ -37,9 +75,9 @@ class Lims:
         self.dt_range = dt_range
 
         for val in Li_files:
-            self.lims.append(self.get_lims(self.band, np.load(val), SNR))
+            self.lims.append(self.get_lims(self.band, _loadReference(val), SNR))
         for val in mag_to_flux_files:
-            self.mag_to_flux.append(np.load(val))
+            self.mag_to_flux.append(_loadReference(val))
         self.interp()
 
     def get_lims(self, band, tab, SNR):
@@ -153,6 +191,14 @@ class Lims:
 
         plt.close(figa)  # do not display
 
+        # Build the (cubic) interpolator of z in the (m5, cadence) plane once;
+        # this is the same interpolation that griddata(method='cubic') would rebuild on each call.
+        self.z_interp = None
+        if self.points_ref is not None:
+            self.z_interp = interpolate.CloughTocher2DInterpolator(
+                np.column_stack((self.points_ref['m5'], self.points_ref['cadence'])),
+                self.points_ref['z'])
+
     def interp_griddata(self, data):
         """
         Estimate metric interpolation for data (m5,cadence)
@@ -167,9 +213,7 @@ class Lims:
 
         """
 
-        ref_points = self.points_ref
-        res = interpolate.griddata((ref_points['m5'], ref_points['cadence']), ref_points['z'], (
-            data['m5_mean'], data['cadence_mean']), method='cubic')
+        res = self.z_interp(data['m5_mean'], data['cadence_mean'])
         return res
 
 
@@ -241,14 +285,21 @@ class GenerateFakeObservations:
                 m5_coadded = self.m5_coadd(m5[band],
                                            Nvisits[band],
                                            Exposure_Time[band])
-                myarr = np.array(mjd, dtype=[(self.mjdCol, 'f8')])
-                myarr = rf.append_fields(myarr, [self.RaCol, self.DecCol, self.filterCol], [
-                                         [Ra]*len(myarr), [Dec]*len(myarr), [band]*len(myarr)])
-                myarr = rf.append_fields(myarr, [self.m5Col, self.nexpCol, self.exptimeCol, self.seasonCol], [
-                                         [m5_coadded]*len(myarr), [Nvisits[band]]*len(myarr), [Nvisits[band]*Exposure_Time[band]]*len(myarr), [season]*len(myarr)])
+                myarr = np.zeros(len(mjd), dtype=[(self.mjdCol, 'f8'), (self.RaCol, 'f8'), (self.DecCol, 'f8'),
+                                                  (self.filterCol, 'U1'), (self.m5Col, 'f8'),
+                                                  (self.nexpCol, 'f8'), (self.exptimeCol, 'f8'),
+                                                  (self.seasonCol, 'f8')])
+                myarr[self.mjdCol] = mjd
+                myarr[self.RaCol] = Ra
+                myarr[self.DecCol] = Dec
+                myarr[self.filterCol] = band
+                myarr[self.m5Col] = m5_coadded
+                myarr[self.nexpCol] = Nvisits[band]
+                myarr[self.exptimeCol] = Nvisits[band]*Exposure_Time[band]
+                myarr[self.seasonCol] = season
                 rtot.append(myarr)
 
-        res = np.copy(np.concatenate(rtot))
+        res = np.concatenate(rtot)
         res.sort(order=self.mjdCol)
 
         self.Observations = res
@@ -279,6 +330,9 @@ class ReferenceData:
     """
     class to handle light curve of SN
 
+    The reference light curve and mag-to-flux tables are kept as compact lookup tables
+    (see LinearLookup), built once.
+
     Parameters
     ---------------
     Li_files : str
@@ -300,10 +354,10 @@ class ReferenceData:
 
         for val in Li_files:
             self.fluxes.append(self.interp_fluxes(
-                self.band, np.load(val), self.z))
+                self.band, _loadReference(val), self.z))
         for val in mag_to_flux_files:
             self.mag_to_flux.append(
-                self.interp_mag(self.band, np.load(val)))
+                self.interp_mag(self.band, _loadReference(val)))
 
     def interp_fluxes(self, band, tab, z):
         """
@@ -320,15 +374,12 @@ class ReferenceData:
 
         Returns
         -----
-        list (float) of interpolated fluxes (in e/sec)
+        LinearLookup of interpolated fluxes (in e/sec) as a function of time from DayMax
         """
-        lims = {}
         idx = (np.abs(tab['z'] - z) < 1.e-5) & (tab['band'] == 'LSST::'+band)
         sel = tab[idx]
-        selc = np.copy(sel)
         difftime = (sel['time']-sel['DayMax'])
-        selc = rf.append_fields(selc, 'deltaT', difftime)
-        return interpolate.interp1d(selc['deltaT'], selc['flux_e'], bounds_error=False, fill_value=0.)
+        return LinearLookup(difftime, sel['flux_e'], fill_value=0.)
 
     def interp_mag(self, band, tab):
         """
@@ -345,8 +396,8 @@ class ReferenceData:
 
         Returns
         -----
-        list (float) of interpolated fluxes (in e/sec)
+        LinearLookup of interpolated fluxes (in e/sec) as a function of m5
         """
         idx = tab['band'] == band
         sel = tab[idx]
-        return interpolate.interp1d(sel['m5'], sel['flux_e'], bounds_error=False, fill_value=0.)
+        return LinearLookup(sel['m5'], sel['flux_e'], fill_value=0.)
@@ -0,0 +1,49 @@
+"""Compare the time to draw HealpixSkyMaps with the cached Mollweide projection and with hp.mollview.
+
+Usage: python benchHealpixSkyMap.py [nMaps]
+"""
+import sys
+import time
+import numpy as np
+import numpy.ma as ma
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import healpy as hp
+import lsst.sims.maf.slicers as slicers
+import lsst.sims.maf.plots as plots
+
+nMaps = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+rng = np.random.RandomState(42)
+
+print('%6s %12s %12s %8s' % ('nside', 'mollview(s)', 'cached(s)', 'speedup'))
+for nside in [16, 64, 128, 256]:
+    slicer = slicers.HealpixSlicer(nside=nside, verbose=False)
+    npix = hp.nside2npix(nside)
+    metricValues = [ma.MaskedArray(rng.rand(npix), mask=rng.rand(npix) < 0.3, fill_value=slicer.badval)
+                    for i in range(nMaps)]
+    times = []
+    for useProjectionCache in [False, True]:
+        plotter = plots.HealpixSkyMap()
+        plotter.useProjectionCache = useProjectionCache
+        t0 = time.time()
+        for metricValue in metricValues:
+            fignum = plotter(metricValue, slicer, {})
+            plt.close(fignum)
+        times.append((time.time() - t0) / nMaps)
+    print('%6d %12.4f %12.4f %8.2f' % (nside, times[0], times[1], times[0] / times[1]))
+
+# The projection alone (without the rest of the figure): hp projector vs the cached lookup.
+nside = 128
+mapValues = rng.rand(hp.nside2npix(nside))
+proj = hp.projector.MollweideProj(rot=(0, 0, 0), coord='C', flipconv='astro', xsize=800)
+t0 = time.time()
+for i in range(nMaps):
+    img = proj.projmap(mapValues, lambda x, y, z: hp.vec2pix(nside, x, y, z), coord='C')
+tProj = (time.time() - t0) / nMaps
+t0 = time.time()
+for i in range(nMaps):
+    lookup = plots.mollweideLookup(nside, rot=(0, 0, 0), coord='C', xsize=800)
+    img = np.where(lookup >= 0, mapValues[lookup], -np.inf)
+tLookup = (time.time() - t0) / nMaps
+print('Projection only (nside=%d): projmap %.4fs, cached lookup %.4fs' % (nside, tProj, tLookup))
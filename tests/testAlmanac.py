@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import unittest
+import tempfile
+import shutil
+import ephem
+import lsst.sims.maf.utils as utils
+import lsst.utils.tests
+
+
+class TestAlmanac(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp(prefix='almanac')
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def testAlmanac(self):
+        """Test the almanac against direct pyephem calculations."""
+        almanac = utils.Almanac(mjdStart=59853, mjdEnd=59953, cacheDir=self.cacheDir)
+        doff = ephem.Date(0) - ephem.Date('1858/11/17')
+        obs = ephem.Observer()
+        obs.lat, obs.lon, obs.elevation = almanac.site.latitude_rad, almanac.site.longitude_rad, \
+            almanac.site.height
+        obs.horizon = '-12'
+        sun = ephem.Sun()
+        mjds = np.arange(59860.1, 59950, 7.3)
+        nights = almanac.getNights(mjds)
+        for mjd, night in zip(mjds, nights):
+            midnights = np.array([obs.previous_antitransit(sun, start=mjd - doff),
+                                  obs.next_antitransit(sun, start=mjd - doff)]) + doff
+            midnight = midnights[np.argmin(np.abs(midnights - mjd))]
+            self.assertAlmostEqual(night['midnight'], midnight, places=5)
+            rise = obs.next_rising(sun, start=midnight - doff, use_center=True) + doff
+            self.assertAlmostEqual(night['twi12_rise'], rise, places=5)
+        # Reading the almanac back from disk should give the same table.
+        almanac2 = utils.Almanac(mjdStart=59853, mjdEnd=59953, cacheDir=self.cacheDir)
+        np.testing.assert_array_equal(almanac.table, almanac2.table)
+        # And Almanac.get should reuse an almanac which covers the requested range.
+        almanac3 = utils.Almanac.get(mjdStart=59870, mjdEnd=59890, cacheDir=self.cacheDir)
+        self.assertIs(almanac3, utils.Almanac.get(mjdStart=59875, mjdEnd=59880, cacheDir=self.cacheDir))
+        # But not one with a different cacheDir, or one which does not cover the range.
+        self.assertIsNot(almanac3, utils.Almanac.get(mjdStart=59875, mjdEnd=59880))
+        self.assertIsNot(almanac3, utils.Almanac.get(mjdStart=59875, mjdEnd=60050, cacheDir=self.cacheDir))
+
+    def testNoDiskCache(self):
+        """Test the almanac writes nothing to disk without a cacheDir."""
+        home = tempfile.mkdtemp(prefix='almanacHome')
+        oldHome = os.environ.get('HOME')
+        os.environ['HOME'] = home
+        try:
+            almanac = utils.Almanac(mjdStart=59853, mjdEnd=59863)
+            self.assertIsNone(almanac.cacheDir)
+            self.assertEqual(os.listdir(home), [])
+        finally:
+            if oldHome is not None:
+                os.environ['HOME'] = oldHome
+            shutil.rmtree(home)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
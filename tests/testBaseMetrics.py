@@ -1,6 +1,7 @@
 import matplotlib
 matplotlib.use("Agg")
 import unittest
+import numpy as np
 import lsst.sims.maf.metrics as metrics
 import lsst.utils.tests
 
@@ -81,6 +82,45 @@ class TestBaseMetric(unittest.TestCase):
         testmetric = metrics.BaseMetric(cols)
         self.assertEqual(testmetric.units, 'arcsec arcsec')
 
+    def testSliceContext(self):
+        """Test the derived quantities of the SliceContext, and that it is shared through the slicePoint."""
+        data = np.zeros(6, dtype=list(zip(['observationStartMJD', 'night', 'filter'], [float, int, 'U1'])))
+        data['observationStartMJD'] = [59900.2, 59900.1, 59902.1, 59902.15, 59901.3, 60200.]
+        data['night'] = [1, 1, 3, 3, 2, 301]
+        data['filter'] = ['r', 'g', 'r', 'r', 'g', 'i']
+        context = metrics.SliceContext(data, {'ra': 0.})
+        self.assertFalse(context.isSorted('observationStartMJD'))
+        np.testing.assert_array_equal(context.sortedValues('observationStartMJD'),
+                                      np.sort(data['observationStartMJD']))
+        np.testing.assert_array_equal(context.diffs('observationStartMJD'),
+                                      np.diff(np.sort(data['observationStartMJD'])))
+        nights, offsets = context.uniqueNights('night')
+        np.testing.assert_array_equal(nights, [1, 2, 3, 301])
+        np.testing.assert_array_equal(offsets, [0, 2, 3, 5, 6])
+        np.testing.assert_array_equal(context.visitsPerNight('night'), [2, 1, 2, 1])
+        groups = context.filterGroups('filter')
+        np.testing.assert_array_equal(groups['r'], [0, 2, 3])
+        np.testing.assert_array_equal(groups['g'], [1, 4])
+        np.testing.assert_array_equal(context.seasons('observationStartMJD'), [0, 0, 0, 0, 0, 1])
+        # With ra=0, the season boundaries fall half a year after the equinox; put one at MJD 59901.
+        np.testing.assert_array_equal(context.seasons('observationStartMJD', equinox=59901. + 365.25 / 2.),
+                                      [0, 0, 1, 1, 1, 1])
+        # Memoized values are reused.
+        self.assertIs(context.order('night'), context.order('night'))
+        # A context passed in the slicePoint is used if it matches the dataSlice.
+        testmetric = metrics.BaseMetric('observationStartMJD')
+        self.assertIs(testmetric.getSliceContext(data, {'sliceContext': context}), context)
+        other = testmetric.getSliceContext(data[:3], {'sliceContext': context})
+        self.assertIsNot(other, context)
+        self.assertEqual(other.dataSlice.size, 3)
+        # A SliceContext is only created to share between more than one metric.
+        slicePoint = {'ra': 0.}
+        self.assertIs(metrics.SliceContext.share(data, slicePoint, 1), slicePoint)
+        shared = metrics.SliceContext.share(data, slicePoint, 2)
+        self.assertIs(shared['sliceContext'].dataSlice, data)
+        self.assertEqual(shared['ra'], 0.)
+        self.assertNotIn('sliceContext', slicePoint)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -17,31 +17,68 @@ class TestCadenceMetrics(unittest.TestCase):
         data = np.zeros(10, dtype=list(zip(['observationStartMJD'], [float])))
         data['observationStartMJD'] += np.arange(10)*.25
 
+        # The reduce functions take the metric values at many slicePoints (here, just one).
         pgm = metrics.PhaseGapMetric(nPeriods=1, periodMin=0.5, periodMax=0.5)
-        metricVal = pgm.run(data)
+        metricVal = np.array([pgm.run(data)])
 
         meanGap = pgm.reduceMeanGap(metricVal)
         medianGap = pgm.reduceMedianGap(metricVal)
         worstPeriod = pgm.reduceWorstPeriod(metricVal)
         largestGap = pgm.reduceLargestGap(metricVal)
 
-        self.assertEqual(meanGap, 0.5)
-        self.assertEqual(medianGap, 0.5)
-        self.assertEqual(worstPeriod, 0.5)
-        self.assertEqual(largestGap, 0.5)
+        np.testing.assert_array_equal(meanGap, [0.5])
+        np.testing.assert_array_equal(medianGap, [0.5])
+        np.testing.assert_array_equal(worstPeriod, [0.5])
+        np.testing.assert_array_equal(largestGap, [0.5])
 
         pgm = metrics.PhaseGapMetric(nPeriods=2, periodMin=0.25, periodMax=0.5)
-        metricVal = pgm.run(data)
+        metricVal = np.array([pgm.run(data)])
 
         meanGap = pgm.reduceMeanGap(metricVal)
         medianGap = pgm.reduceMedianGap(metricVal)
         worstPeriod = pgm.reduceWorstPeriod(metricVal)
         largestGap = pgm.reduceLargestGap(metricVal)
 
-        self.assertEqual(meanGap, 0.75)
-        self.assertEqual(medianGap, 0.75)
-        self.assertEqual(worstPeriod, 0.25)
-        self.assertEqual(largestGap, 1.)
+        np.testing.assert_array_equal(meanGap, [0.75])
+        np.testing.assert_array_equal(medianGap, [0.75])
+        np.testing.assert_array_equal(worstPeriod, [0.25])
+        np.testing.assert_array_equal(largestGap, [1.])
+
+        # Evaluating a dense period grid in chunks gives the same values.
+        pgm = metrics.PhaseGapMetric(nPeriods=200, periodMin=0.25, periodMax=0.5)
+        pgmChunked = metrics.PhaseGapMetric(nPeriods=200, periodMin=0.25, periodMax=0.5, maxArraySize=25)
+        np.testing.assert_array_equal(pgm.run(data), pgmChunked.run(data))
+        # The reduce functions give the reduced value at each of many slicePoints.
+        metricVals = np.array([pgm.run(data), pgm.run(data[:5])])
+        np.testing.assert_array_equal(pgm.reduceLargestGap(metricVals),
+                                      [pgm.reduceLargestGap(metricVals[:1])[0],
+                                       pgm.reduceLargestGap(metricVals[1:])[0]])
+        np.testing.assert_array_equal(pgm.reduceLargestGap(metricVals), metricVals.max(axis=1))
+
+    def testPeriodicDetectMetric(self):
+        """
+        Test the periodic detection metric
+        """
+        names = ['observationStartMJD', 'fiveSigmaDepth', 'filter']
+        data = np.zeros(60, dtype=list(zip(names, [float, float, '<U1'])))
+        data['observationStartMJD'] = np.arange(60) * 1.37
+        data['fiveSigmaDepth'] = 24.
+        data['filter'] = ['g', 'r', 'i'] * 20
+        # A large amplitude is detected, a tiny amplitude is not.
+        metric = metrics.PeriodicDetectMetric(periods=[2., 2.], amplitudes=[1., 0.0001], starMags=[20., 20.])
+        self.assertEqual(metric.run(data), 1)
+        # Evaluating the periods in chunks gives the same result.
+        periods = np.arange(1, 30, 0.5)
+        metric = metrics.PeriodicDetectMetric(periods=periods, amplitudes=0.05, starMags=21.)
+        metricChunked = metrics.PeriodicDetectMetric(periods=periods, amplitudes=0.05, starMags=21.,
+                                                     maxArraySize=100)
+        self.assertEqual(metric.run(data), metricChunked.run(data))
+        # The units count the period-amplitude-mag combinations after broadcasting.
+        metric = metrics.PeriodicDetectMetric(periods=2., amplitudes=[1., 0.5, 0.1], starMags=20.)
+        self.assertEqual(metric.units, 'N Detected (0, 3)')
+        # Arrays of different lengths can not be combined.
+        with self.assertRaises(ValueError):
+            metrics.PeriodicDetectMetric(periods=[2., 3.], amplitudes=[1., 0.5, 0.1], starMags=20.)
 
     def testTemplateExists(self):
         """
@@ -272,6 +309,19 @@ class TestCadenceMetrics(unittest.TestCase):
         metric = metrics.TransientMetric(nFilters=2, nPerLC=3, surveyDuration=ndata/365.25)
         self.assertEqual(metric.run(dataSlice), 1.)
 
+        # Check multiple phase shifts: the 10 light curves of the first phase and the 9 of each
+        # shifted phase which start and end within the survey are all detected.
+        metric = metrics.TransientMetric(nFilters=2, nPerLC=2, nPhaseCheck=5, surveyDuration=ndata/365.25)
+        self.assertEqual(metric.run(dataSlice), 1.)
+        # Without the second half of the survey, only the light curves in the first half are detected:
+        # 5 of 10 for the first phase and 4 of 9 for each shifted phase, plus the light curve of the
+        # last shift which spans days 42-52 (and has both filters in both of its halves before day 50).
+        dataSlice['fiveSigmaDepth'][50:] = 20
+        result = metric.run(dataSlice)
+        self.assertAlmostEqual(result, (5. + 4 * 4. + 1.) / 46.)
+        self.assertTrue(0 <= result <= 1)
+        dataSlice['fiveSigmaDepth'] = 25
+
     def testSeasonLengthMetric(self):
         times = np.arange(0, 3650, 10)
         data = np.zeros(len(times), dtype=list(zip(['observationStartMJD'], [float])))
@@ -298,6 +348,11 @@ class TestCadenceMetrics(unittest.TestCase):
         slicePoint = {'ra': 0}
         result = metric.run(data, slicePoint)
         self.assertEqual(result, 9)
+        # Changing the equinox moves the season boundaries (half a year after it, for ra=0)
+        # to 5 days after the first visit of each pair, so each pair is split between two seasons.
+        metric.Equinox = 5. + 365.25 / 2.
+        result = metric.run(data, slicePoint)
+        self.assertEqual(result, 10)
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -177,6 +177,48 @@ class TestCalibrationMetrics(unittest.TestCase):
         val = metric.run(data)
         assert(np.abs(val) < 0.2)
 
+    def testAstrometryBatch(self):
+        """
+        Test the astrometry metrics give the same values for many slicePoints at once (runBatch)
+        as for each slicePoint in turn.
+        """
+        names = ['observationStartMJD', 'finSeeing', 'fiveSigmaDepth', 'filter', 'ra_pi_amp', 'dec_pi_amp']
+        types = [float, float, float, '<U1', float, float]
+        rng = np.random.RandomState(42)
+        data = np.zeros(300, dtype=list(zip(names, types)))
+        data['observationStartMJD'] = np.arange(300) * 7.3 + 56762
+        data['finSeeing'] = rng.rand(300) * 0.5 + 0.6
+        data['fiveSigmaDepth'] = rng.rand(300) + 23.5
+        data['filter'] = rng.choice(['u', 'g', 'r', 'i', 'z', 'y'], 300)
+        data['ra_pi_amp'] = rng.rand(300) * 2 - 1
+        data['dec_pi_amp'] = rng.rand(300) * 2 - 1
+        data = stackers.FilterCodeStacker().run(data)
+        offsets = np.array([0, 1, 3, 50, 120, 300])
+        testMetrics = [metrics.ParallaxMetric(seeingCol='finSeeing'),
+                       metrics.ParallaxMetric(seeingCol='finSeeing', normalize=True),
+                       metrics.ProperMotionMetric(seeingCol='finSeeing'),
+                       metrics.ProperMotionMetric(seeingCol='finSeeing', normalize=True),
+                       metrics.ParallaxCoverageMetric(seeingCol='finSeeing'),
+                       metrics.ParallaxCoverageMetric(seeingCol='finSeeing', thetaRange=1.)]
+        for metric in testMetrics:
+            self.assertTrue(metric.hasBatch())
+            batch = metric.runBatch(data, offsets)
+            for i in range(len(offsets) - 1):
+                single = metric.run(data[offsets[i]:offsets[i + 1]])
+                np.testing.assert_allclose(batch[i], single, rtol=1e-7, err_msg=metric.name)
+        # Without the filterCode column, the metrics use (and require) their filterCol.
+        noCodes = np.zeros(300, dtype=list(zip(['observationStartMJD', 'finSeeing', 'fiveSigmaDepth', 'band',
+                                                 'ra_pi_amp', 'dec_pi_amp'], types)))
+        for name, col in zip(noCodes.dtype.names, names):
+            noCodes[name] = data[col]
+        for metric in [metrics.ParallaxMetric(seeingCol='finSeeing', filterCol='band'),
+                       metrics.ProperMotionMetric(seeingCol='finSeeing', filterCol='band'),
+                       metrics.ParallaxCoverageMetric(seeingCol='finSeeing', filterCol='band')]:
+            self.assertIn('band', metric.colNameArr)
+            self.assertNotIn('filterCode', metric.colNameArr)
+            single = metric.run(data)
+            np.testing.assert_allclose(metric.run(noCodes), single, rtol=1e-7, err_msg=metric.name)
+
     def testRadiusObsMetric(self):
         """
         Test the RadiusObsMetric
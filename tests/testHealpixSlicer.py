@@ -7,6 +7,7 @@ import numpy.ma as ma
 import unittest
 import healpy as hp
 from lsst.sims.maf.slicers.healpixSlicer import HealpixSlicer
+from lsst.sims.maf.slicers.adaptiveHealpixSlicer import AdaptiveHealpixSlicer
 import lsst.utils.tests
 
 
@@ -261,6 +262,46 @@ class TestHealpixSlicerPlotting(unittest.TestCase):
         self.testslicer = None
 
 
+class TestAdaptiveHealpixSlicer(unittest.TestCase):
+
+    def setUp(self):
+        self.slicer = AdaptiveHealpixSlicer(nside=64, minNside=16, verbose=False)
+
+    def tearDown(self):
+        del self.slicer
+        self.slicer = None
+
+    def _metric(self, sliceNums):
+        # A step in RA, with a slow variation in Dec, over a footprint which ends at Dec=0.3 radians.
+        ra = self.slicer.slicePoints['ra'][sliceNums]
+        dec = self.slicer.slicePoints['dec'][sliceNums]
+        return np.where(ra > np.pi, 2., 1.) + 0.001 * np.sin(dec), dec > 0.3
+
+    def testRefinement(self):
+        """Test the adaptive metric values match the values at every slicePoint."""
+        metricValues = ma.MaskedArray(data=np.zeros(self.slicer.nslice),
+                                      mask=np.zeros(self.slicer.nslice, bool))
+        sliceNums = self.slicer.startRefinement()
+        self.assertEqual(len(sliceNums), hp.nside2npix(16))
+        while len(sliceNums) > 0:
+            metricValues.data[sliceNums], metricValues.mask[sliceNums] = self._metric(sliceNums)
+            sliceNums = self.slicer.refine([metricValues])
+        self.slicer.expand(metricValues)
+        expected, expectedMask = self._metric(np.arange(self.slicer.nslice))
+        np.testing.assert_array_equal(metricValues.mask, expectedMask)
+        np.testing.assert_allclose(metricValues.compressed(), expected[~expectedMask], rtol=0.05)
+        self.assertLess(self.slicer.nEvaluated, self.slicer.nslice / 4)
+        self.assertEqual(self.slicer.nEvaluated + self.slicer.nSaved, self.slicer.nslice)
+
+    def testSlicerEquivalence(self):
+        """Test adaptive slicers are only equal to adaptive slicers with the same parameters."""
+        healpixSlicer = HealpixSlicer(nside=64, verbose=False)
+        self.assertNotEqual(self.slicer, healpixSlicer)
+        self.assertNotEqual(healpixSlicer, self.slicer)
+        self.assertEqual(self.slicer, AdaptiveHealpixSlicer(nside=64, minNside=16, verbose=False))
+        self.assertNotEqual(self.slicer, AdaptiveHealpixSlicer(nside=64, minNside=32, verbose=False))
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
@@ -3,9 +3,12 @@ from builtins import str
 import matplotlib
 matplotlib.use("Agg")
 import numpy as np
+import healpy as hp
 import unittest
 import warnings
 import os
+import shutil
+import tempfile
 import lsst.sims.maf.slicers as slicers
 import lsst.sims.maf.maps as maps
 import lsst.utils.tests
@@ -105,6 +108,65 @@ class TestMaps(unittest.TestCase):
             warnings.warn('Did not find stellar density map, skipping test.')
 
 
+    def testMapDataCache(self):
+        mapDir = tempfile.mkdtemp()
+        starDensity = np.random.RandomState(42).rand(48, 10)
+        bins = np.arange(10)
+        filename = os.path.join(mapDir, 'starDensity.npz')
+        np.savez(filename, starDensity=starDensity, bins=bins)
+        cache = maps.MapDataCache()
+        data = cache.load(filename)
+        np.testing.assert_array_equal(data['starDensity'], starDensity)
+        np.testing.assert_array_equal(data['bins'], bins)
+        self.assertFalse(data['starDensity'].flags.writeable)
+        # The file is only read once.
+        self.assertIs(cache.load(filename), data)
+        # Compressed files are read into memory.
+        compressed = os.path.join(mapDir, 'compressed.npz')
+        np.savez_compressed(compressed, starDensity=starDensity)
+        np.testing.assert_array_equal(cache.load(compressed)['starDensity'], starDensity)
+        # Derived structures are only calculated once.
+        tree = cache.derived((filename, 2), lambda: object())
+        self.assertIs(cache.derived((filename, 2), lambda: object()), tree)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 3)
+        self.assertEqual(stats['nFiles'], 2)
+        self.assertEqual(stats['nDerived'], 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        shutil.rmtree(mapDir)
+
+
+    def testMapResampler(self):
+        rng = np.random.RandomState(61)
+        nside = 16
+        starMap = rng.rand(hp.nside2npix(nside), 5)
+        resampler = maps.MapResampler()
+        # Arbitrary points.
+        slicePoints = {'ra': rng.rand(100) * 2.0 * np.pi, 'dec': np.arcsin(rng.rand(100) * 2.0 - 1.0)}
+        pixels = hp.ang2pix(nside, np.pi / 2.0 - slicePoints['dec'], slicePoints['ra'])
+        np.testing.assert_array_equal(resampler.resample(starMap, slicePoints), starMap[pixels])
+        interp = resampler.resample(starMap, slicePoints, interp=True)
+        expected = hp.get_interp_val(starMap[:, 2].copy(), np.pi / 2.0 - slicePoints['dec'],
+                                     slicePoints['ra'])
+        np.testing.assert_allclose(interp[:, 2], expected)
+        # A healpix grid with a different nside.
+        slicer = slicers.HealpixSlicer(nside=32, verbose=False)
+        pixels = hp.ang2pix(nside, np.pi / 2.0 - slicer.slicePoints['dec'], slicer.slicePoints['ra'])
+        np.testing.assert_array_equal(resampler.resample(starMap, slicer.slicePoints), starMap[pixels])
+        # Tables saved to disk give the same values.
+        cacheDir = tempfile.mkdtemp()
+        resampler = maps.MapResampler(cacheDir=cacheDir)
+        maps.mapDataCache.clear()
+        resampled = resampler.resample(starMap, slicePoints, interp=True)
+        self.assertEqual(len(os.listdir(cacheDir)), 1)
+        maps.mapDataCache.clear()
+        np.testing.assert_array_equal(resampler.resample(starMap, slicePoints, interp=True), resampled)
+        np.testing.assert_allclose(resampled, interp)
+        shutil.rmtree(cacheDir)
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
@@ -1,6 +1,8 @@
 import unittest
 import matplotlib
 matplotlib.use("Agg")
+import numpy as np
+import numpy.ma as ma
 
 import lsst.sims.maf.metrics as metrics
 import lsst.sims.maf.slicers as slicers
@@ -63,6 +65,191 @@ class TestMetricBundle(unittest.TestCase):
         assert(len(outPdf) == 3)
         assert(len(outNpz) == 1)
 
+    def testSummaryStats(self):
+        """
+        Check the summary statistics (which share one sorted copy of the metric values) match
+        the summary metrics run separately.
+        """
+        nside = 8
+        slicer = slicers.HealpixSlicer(nside=nside)
+        summaryMetrics = [metrics.MeanMetric(), metrics.MedianMetric(), metrics.RobustRmsMetric(),
+                          metrics.PercentileMetric(percentile=25, metricName='25th%ile'),
+                          metrics.AreaSummaryMetric(area=100), metrics.CountMetric()]
+        metricB = metricBundles.MetricBundle(metrics.MeanMetric(col='airmass'), slicer, '',
+                                             summaryMetrics=summaryMetrics)
+        rng = np.random.RandomState(42)
+        values = rng.rand(len(slicer))
+        mask = rng.rand(len(slicer)) < 0.3
+        metricB.metricValues = ma.MaskedArray(data=values, mask=mask, fill_value=slicer.badval)
+        metricB.computeSummaryStats()
+        unmasked = np.array(values[~mask], dtype=[('metricdata', float)])
+        filled = np.where(mask, np.nan, values).astype([('metricdata', float)])
+        for m in summaryMetrics:
+            summaryName = m.name.replace(' metricdata', '').replace(' None', '')
+            expected = m.run(filled if hasattr(m, 'maskVal') else unmasked)
+            self.assertEqual(metricB.summaryValues[summaryName], expected)
+
+    def testReduceMetric(self):
+        """
+        Check the reduce functions of vector metrics are called at each slicePoint in turn, unless the
+        metric sets vectorizedReduce.
+        """
+        class TwoValueMetric(metrics.BaseMetric):
+            def __init__(self, **kwargs):
+                super(TwoValueMetric, self).__init__(col='night', metricDtype='float', **kwargs)
+                self.shape = 2
+
+            def reduceSum(self, metricVal):
+                assert(np.shape(metricVal) == (2,))
+                return metricVal.sum()
+
+        slicer = slicers.HealpixSlicer(nside=2)
+        rng = np.random.RandomState(42)
+        values = rng.rand(len(slicer), 2)
+        mask = np.zeros((len(slicer), 2), bool)
+        mask[:5] = True
+        mask[5, 0] = True
+        metricB = metricBundles.MetricBundle(TwoValueMetric(), slicer, '')
+        metricB.metricValues = ma.MaskedArray(data=values, mask=mask, fill_value=slicer.badval)
+        reduced = metricB.reduceMetric(metricB.metric.reduceFuncs['Sum'])
+        np.testing.assert_array_equal(reduced.metricValues.mask, np.arange(len(slicer)) < 5)
+        np.testing.assert_array_equal(reduced.metricValues.data[5:], values[5:].sum(axis=1))
+        # PhaseGapMetric reduces the values at all of the slicePoints at once.
+        pgm = metrics.PhaseGapMetric(nPeriods=2)
+        metricB = metricBundles.MetricBundle(pgm, slicer, '')
+        metricB.metricValues = ma.MaskedArray(data=values, mask=mask, fill_value=slicer.badval)
+        reduced = metricB.reduceMetric(pgm.reduceFuncs['LargestGap'])
+        np.testing.assert_array_equal(reduced.metricValues.mask, np.arange(len(slicer)) < 5)
+        np.testing.assert_array_equal(reduced.metricValues.data[5:], values[5:].max(axis=1))
+
+    def testShards(self):
+        """
+        Check that metric values merged from shards of the visits match those calculated from all the visits.
+        """
+        rng = np.random.RandomState(42)
+        nVisits = 2000
+        names = ['night', 'fieldRA', 'fieldDec', 'fiveSigmaDepth', 'observationStartMJD']
+        simData = np.zeros(nVisits, dtype=list(zip(names, [int, float, float, float, float])))
+        simData['night'] = rng.randint(0, 100, nVisits)
+        simData['fieldRA'] = rng.rand(nVisits) * 360.
+        simData['fieldDec'] = np.degrees(np.arcsin(rng.rand(nVisits) * 2 - 1))
+        simData['fiveSigmaDepth'] = rng.normal(24, 0.5, nVisits)
+        simData['observationStartMJD'] = simData['night'] + rng.rand(nVisits) * 0.3
+        bundleMetrics = [metrics.CountMetric(col='night'), metrics.Coaddm5Metric(),
+                         metrics.RmsMetric(col='fiveSigmaDepth')]
+        nShards = 3
+
+        def makeBundles():
+            bundles = {}
+            for i, metric in enumerate(bundleMetrics):
+                bundles[i] = metricBundles.MetricBundle(metric, slicers.HealpixSlicer(nside=8), '')
+                bundles[i].stackerList = []
+            return bundles
+        sharded = makeBundles()
+        bgroup = metricBundles.MetricBundleGroup(sharded, None, outDir=self.outDir)
+        for shard in range(nShards):
+            bgroup.runShardCurrent('', shard, nShards, simData=simData)
+        bgroup.mergeShardsCurrent('', nShards)
+        full = makeBundles()
+        bgroup = metricBundles.MetricBundleGroup(full, None, saveEarly=False, outDir=self.outDir)
+        bgroup.runCurrent('', simData=simData)
+        for i in full:
+            np.testing.assert_array_equal(sharded[i].metricValues.mask, full[i].metricValues.mask)
+            good = ~full[i].metricValues.mask
+            np.testing.assert_allclose(sharded[i].metricValues.data[good], full[i].metricValues.data[good])
+
+    def testRunSharded(self):
+        """
+        Check that runSharded (with the shards run in worker processes) matches runAll.
+        """
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        bundleMetrics = [metrics.CountMetric(col='night'), metrics.Coaddm5Metric()]
+        constraints = ['night < 30', 'night < 30 and filter="r"']
+
+        def makeBundles():
+            bundles = {}
+            for i, metric in enumerate(bundleMetrics):
+                for j, sql in enumerate(constraints):
+                    bundles[(i, j)] = metricBundles.MetricBundle(metric, slicers.HealpixSlicer(nside=8), sql,
+                                                                 runName='shard%d%d' % (i, j))
+                    bundles[(i, j)].stackerList = []
+            return bundles
+        sharded = makeBundles()
+        bgroup = metricBundles.MetricBundleGroup(sharded, opsdb, outDir=self.outDir, saveEarly=False)
+        bgroup.runSharded(4, nProcesses=2)
+        full = makeBundles()
+        bgroup = metricBundles.MetricBundleGroup(full, opsdb, outDir=self.outDir, saveEarly=False)
+        bgroup.runAll()
+        opsdb.close()
+        for k in full:
+            np.testing.assert_array_equal(sharded[k].metricValues.mask, full[k].metricValues.mask)
+            good = ~full[k].metricValues.mask
+            np.testing.assert_allclose(sharded[k].metricValues.data[good], full[k].metricValues.data[good])
+
+    def testIncrementalMismatchedState(self):
+        """
+        Check that an incremental run with a saved state which does not match the slicer recalculates the
+        metric values from all of the visits (not only those after the last night of the saved state).
+        """
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        sql = 'night < 20'
+        metricB = metricBundles.MetricBundle(metrics.CountMetric(col='night'), slicers.HealpixSlicer(nside=8),
+                                             sql, runName='inc')
+        metricB.stackerList = []
+        # A saved state from a slicer with a different number of slicePoints.
+        metricB.writeState(self.outDir, lastNight=10, nVisits=np.zeros(12, int), states=np.zeros((12, 1)))
+        bgroup = metricBundles.MetricBundleGroup({0: metricB}, opsdb, outDir=self.outDir, saveEarly=False)
+        with self.assertWarns(UserWarning):
+            bgroup.runCurrent(sql, incremental=True)
+        full = metricBundles.MetricBundle(metrics.CountMetric(col='night'), slicers.HealpixSlicer(nside=8),
+                                          sql)
+        full.stackerList = []
+        bgroup = metricBundles.MetricBundleGroup({0: full}, opsdb, outDir=self.outDir, saveEarly=False)
+        bgroup.runCurrent(sql)
+        opsdb.close()
+        np.testing.assert_array_equal(metricB.metricValues.mask, full.metricValues.mask)
+        good = ~full.metricValues.mask
+        np.testing.assert_array_equal(metricB.metricValues.data[good], full.metricValues.data[good])
+        # The new state includes all of the visits.
+        self.assertEqual(metricB.readState(self.outDir)['nVisits'].sum(), full.metricValues.data[good].sum())
+
+    def testProfile(self):
+        """
+        Check that a profiled run records its stages in the profiles table of the resultsDb, and that an
+        unprofiled run records nothing.
+        """
+        database = os.path.join(getPackageDir('sims_data'), 'OpSimData', 'astro-lsst-01_2014.db')
+        opsdb = db.OpsimDatabaseV4(database=database)
+        sql = 'night < 10'
+        for profile in [True, False]:
+            outDir = os.path.join(self.outDir, str(profile))
+            resultsDb = db.ResultsDb(outDir=outDir)
+            metricB = metricBundles.MetricBundle(metrics.CountMetric(col='night'),
+                                                 slicers.HealpixSlicer(nside=8), sql, runName='prof')
+            metricB.stackerList = []
+            bgroup = metricBundles.MetricBundleGroup({0: metricB}, opsdb, outDir=outDir,
+                                                     resultsDb=resultsDb, profile=profile)
+            bgroup.runCurrent(sql)
+            bgroup.writeProfile()
+            profiles = resultsDb.getProfiles()
+            if not profile:
+                self.assertEqual(len(profiles), 0)
+                with self.assertRaises(ValueError):
+                    bgroup.profileReport()
+                continue
+            stages = set(profiles['stage'])
+            for stage in ['query', 'slicer', 'metric', 'write']:
+                self.assertIn(stage, stages)
+            # The stages of the MetricBundle are linked to its metricId, the shared stages to none.
+            metricId = resultsDb.getMetricId(metricB.metric.name)[0]
+            linked = profiles[profiles['metricId'] == metricId]
+            self.assertEqual(set(linked['stage']), {'metric', 'write'})
+            self.assertTrue({'query', 'slicer'} <= set(profiles['stage'][profiles['metricId'] == -1]))
+            self.assertGreater(linked['nCalls'][linked['stage'] == 'metric'][0], 0)
+        opsdb.close()
+
     def tearDown(self):
         if os.path.isdir(self.outDir):
             shutil.rmtree(self.outDir)
@@ -3,10 +3,17 @@ from builtins import zip
 import matplotlib
 matplotlib.use("Agg")
 import numpy as np
+import matplotlib.pyplot as plt
+import os
+import shutil
+import tempfile
 import warnings
 import unittest
 from lsst.sims.maf.slicers.movieSlicer import MovieSlicer
 from lsst.sims.maf.slicers.uniSlicer import UniSlicer
+from lsst.sims.maf.slicers.oneDSlicer import OneDSlicer
+import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.metricBundles as metricBundles
 import lsst.utils.tests
 
 
@@ -179,6 +186,89 @@ class TestMovieSlicerSetup(unittest.TestCase):
                 self.assertGreater(len(dataslice), 0)
 
 
+class TestStreamMovie(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='TMS')
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def testStreamMovie(self):
+        """Test frames rendered in parallel become a movie (or, without ffmpeg, numbered images)."""
+        dv = makeTimes(100, 0, 1, random=42)
+        movieslicer = MovieSlicer(sliceColName='times', bins=5, cumulative=True, forceNoFfmpeg=True)
+        movieslicer.setupSlicer(dv)
+
+        def renderFrame(frame):
+            fig = plt.figure()
+            plt.hist(frame)
+            return fig
+        frames = (dv['times'][s['idxs']] for s in movieslicer)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            movieslicer.streamMovie(frames, renderFrame, 'test', 'Hist', outDir=self.outDir,
+                                    figsize=(4, 3), dpi=50, nProcesses=2)
+        # With forceNoFfmpeg, the frames are written as images (even if ffmpeg is available).
+        outfiles = os.listdir(self.outDir)
+        self.assertEqual(sorted(outfiles), ['test_%d_Hist.png' % i for i in range(5)])
+        image = plt.imread(os.path.join(self.outDir, 'test_0_Hist.png'))
+        self.assertEqual(image.shape[:2], (150, 200))
+
+    def testStreamMovieLazyFrames(self):
+        """Test the frames are consumed as they are rendered, not all at once."""
+        dv = makeTimes(100, 0, 1, random=42)
+        movieslicer = MovieSlicer(sliceColName='times', bins=5, cumulative=True, forceNoFfmpeg=True)
+        movieslicer.setupSlicer(dv)
+        nFrames = 30
+
+        def frames():
+            for i in range(nFrames):
+                # Only a few frames are rendered (but not yet written) ahead of the movie.
+                self.assertGreaterEqual(len(os.listdir(self.outDir)), i - 10)
+                yield np.arange(i + 1)
+
+        def renderFrame(frame):
+            fig = plt.figure()
+            plt.plot(frame)
+            return fig
+        movieslicer.streamMovie(frames(), renderFrame, 'lazy', 'Plot', outDir=self.outDir,
+                                figsize=(2, 2), dpi=20, nProcesses=2, sliceformat='%02d')
+        self.assertEqual(len(os.listdir(self.outDir)), nFrames)
+
+
+class TestMovieBundleGroup(unittest.TestCase):
+
+    def testFrames(self):
+        """Test the metric values of each cumulative frame match those calculated from all visits so far."""
+        rng = np.random.RandomState(42)
+        nvalues = 500
+        dv = np.zeros(nvalues, dtype=[('times', float), ('field', int), ('m5', float)])
+        dv['times'] = rng.rand(nvalues) * 10.
+        dv['field'] = rng.randint(0, 10, nvalues)
+        dv['m5'] = rng.normal(24, 1, nvalues)
+        movieslicer = MovieSlicer(sliceColName='times', bins=20, cumulative=True, forceNoFfmpeg=True)
+        movieslicer.setupSlicer(dv)
+        slicer = OneDSlicer(sliceColName='field', bins=np.arange(-0.5, 10, 1))
+        bundleMetrics = [metrics.CountMetric('times'), metrics.MeanMetric('m5'), metrics.MedianMetric('m5')]
+        bundles = [metricBundles.MetricBundle(m, slicer, '') for m in bundleMetrics]
+        for b in bundles:
+            b.stackerList = []
+        moviegroup = metricBundles.MovieBundleGroup(bundles, movieslicer)
+        nframes = 0
+        for i, ms in moviegroup.runFrames(dv):
+            nframes += 1
+            frameData = dv[ms['idxs']]
+            for b in bundles:
+                for field in range(10):
+                    dataSlice = frameData[frameData['field'] == field]
+                    if len(dataSlice) == 0:
+                        self.assertTrue(b.metricValues.mask[field])
+                    else:
+                        self.assertAlmostEqual(b.metricValues[field], b.metric.run(dataSlice))
+        self.assertEqual(nframes, movieslicer.nslice)
+
+
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
 
@@ -236,6 +236,27 @@ class TestNDSlicerSlicing(unittest.TestCase):
             # and check that every data value was assigned somewhere.
             self.assertEqual(sum, nvalues)
 
+    def testSlicingUnevenBins(self):
+        """Test slicing with uneven bins, and data outside the bins."""
+        rng = np.random.RandomState(6623)
+        dv = makeDataValues(5000, self.dvmin, self.dvmax, self.nd, random=4401)
+        for name in self.dvlist:
+            dv[name] = rng.rand(len(dv)) * 1.2 - 0.1
+        binsList = [np.array([0, 0.1, 0.5, 0.6, 1.0]), np.arange(0, 1.01, 0.25), np.array([0.2, 0.3, 0.9])]
+        testslicer = NDSlicer(self.dvlist, binsList=binsList)
+        testslicer.setupSlicer(dv)
+        nslice = 0
+        for s in testslicer:
+            inBin = np.ones(len(dv), bool)
+            for name, bins, i in zip(self.dvlist, binsList, s['slicePoint']['binIdx']):
+                inBin &= dv[name] >= bins[i]
+                # The last bin includes everything above its left edge.
+                if i < len(bins) - 2:
+                    inBin &= dv[name] < bins[i + 1]
+            np.testing.assert_array_equal(np.sort(s['idxs']), np.where(inBin)[0])
+            nslice += 1
+        self.assertEqual(nslice, testslicer.nslice)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import unittest
+import tempfile
+import shutil
+import sqlite3
+import healpy as hp
+from lsst.sims.maf.utils.obs2sqlite import _preSkyNodes, _writeObservations
+import lsst.utils.tests
+
+
+class StubSkyModelPre(object):
+    """A SkyModelPre returning smoothly varying (analytic) sky maps and sun/moon altitudes."""
+    def __init__(self, npix=12, filterNames=('g', 'r')):
+        self.npix = npix
+        self.filterNames = filterNames
+        self.nCalls = 0
+
+    def returnMags(self, mjd):
+        self.nCalls += 1
+        hpids = np.arange(self.npix)
+        mags = {}
+        for i, f in enumerate(self.filterNames):
+            mags[f] = 20. + i + 0.5 * np.sin(2. * np.pi * mjd + hpids)
+            mags[f][0] = hp.UNSEEN
+        return mags
+
+    def returnSunMoon(self, mjd):
+        return {'sunAlt': -0.3 + 0.2 * np.sin(2. * np.pi * mjd), 'moonAlt': 0.1 * np.cos(2. * np.pi * mjd)}
+
+
+class TestObs2sqlite(unittest.TestCase):
+
+    def setUp(self):
+        self.outDir = tempfile.mkdtemp(prefix='obs2sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.outDir)
+
+    def testPreSkyNodes(self):
+        """Test the sky brightness interpolated between MJD nodes matches the sky maps at the nodes."""
+        sm = StubSkyModelPre()
+        mjd_step = 5. / 60. / 24.
+        nodes = np.arange(59853 / mjd_step, 59853 / mjd_step + 20).astype(int)
+        # Observations at the start and (just before) the end of each MJD step.
+        mjds = np.sort(np.concatenate([nodes * mjd_step, (nodes + 1) * mjd_step - 1e-7]))
+        rng = np.random.RandomState(42)
+        hpids = rng.randint(1, sm.npix, mjds.size)
+        filterIdx = rng.randint(0, 2, mjds.size)
+        skybrightness, sunAlt, moonAlt = _preSkyNodes(sm, mjds, hpids, filterIdx, sm.filterNames, mjd_step)
+        for i, mjd in enumerate(mjds):
+            mags = sm.returnMags(mjd)
+            sunMoon = sm.returnSunMoon(mjd)
+            self.assertAlmostEqual(skybrightness[i], mags[sm.filterNames[filterIdx[i]]][hpids[i]], places=4)
+            self.assertAlmostEqual(sunAlt[i], sunMoon['sunAlt'], places=4)
+            self.assertAlmostEqual(moonAlt[i], sunMoon['moonAlt'], places=4)
+        # Pixels without a sky brightness stay unseen.
+        skybrightness, sunAlt, moonAlt = _preSkyNodes(StubSkyModelPre(), mjds, np.zeros(mjds.size, int),
+                                                      filterIdx, sm.filterNames, mjd_step)
+        np.testing.assert_array_equal(skybrightness, hp.UNSEEN)
+        # The sky maps are fetched once for each node (and the node after the last).
+        sm = StubSkyModelPre()
+        _preSkyNodes(sm, mjds, hpids, filterIdx, sm.filterNames, mjd_step)
+        self.assertEqual(sm.nCalls, len(nodes) + 1)
+
+    def testWriteObservations(self):
+        """Test the observations table written (in chunks) to the sqlite file."""
+        names = ['filter', 'ra', 'dec', 'mjd', 'night']
+        observations = np.zeros(25, dtype=list(zip(names, ['|S1', float, float, float, float])))
+        observations['filter'] = np.array(list('ugrizy'))[np.arange(25) % 6]
+        observations['ra'] = np.arange(25) * 10.
+        observations['dec'] = -30.
+        observations['mjd'] = 59853.1 + np.arange(25) * 0.01
+        observations['night'] = 1
+        outfile = os.path.join(self.outDir, 'observations.sqlite')
+        _writeObservations(observations, outfile, chunk_size=10)
+        conn = sqlite3.connect(outfile)
+        columns = conn.execute('PRAGMA table_info(observations)').fetchall()
+        self.assertEqual([c[1] for c in columns], ['index'] + names)
+        self.assertEqual([c[2] for c in columns], ['INTEGER', 'TEXT', 'REAL', 'REAL', 'REAL', 'REAL'])
+        indexes = conn.execute('PRAGMA index_list(observations)').fetchall()
+        self.assertEqual([i[1] for i in indexes], ['ix_observations_index'])
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM observations').fetchone()[0], 25)
+        rows = conn.execute('SELECT "index", filter, ra, typeof(filter) FROM observations ORDER BY "index"')
+        rows = rows.fetchall()
+        conn.close()
+        self.assertEqual([r[0] for r in rows], list(range(25)))
+        self.assertEqual([r[1] for r in rows], [f.decode() for f in observations['filter']])
+        np.testing.assert_array_equal([r[2] for r in rows], observations['ra'])
+        self.assertEqual(set(r[3] for r in rows), {'text'})
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
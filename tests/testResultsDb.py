@@ -3,10 +3,12 @@ from builtins import range
 import matplotlib
 matplotlib.use("Agg")
 import os
+import json
 import warnings
 import unittest
 import numpy as np
 import lsst.sims.maf.db as db
+import lsst.sims.maf.utils as utils
 import shutil
 import tempfile
 import lsst.utils.tests
@@ -67,6 +69,11 @@ class TestResultsDb(unittest.TestCase):
         resultsDb.updateSummaryStat(metricId, self.summaryStatName2, self.summaryStatValue2)
         # Add something like tableFrac summary statistic.
         resultsDb.updateSummaryStat(metricId, self.summaryStatName3, self.summaryStatValue3)
+        # Add several summary statistics at once.
+        resultsDb.updateSummaryStats(metricId, {'Max': 30., 'Min': 2.})
+        stats = resultsDb.getSummaryStats(metricId)
+        self.assertEqual(len(stats), 2 + 10 + 2)
+        self.assertEqual(stats['summaryValue'][stats['summaryName'] == 'Max'][0], 30.)
         # Test get warning when try to add a non-conforming summary stat (not 'name' & 'value' cols).
         teststat = np.empty(10, dtype=[('col', '|S12'), ('value', float)])
         with warnings.catch_warnings(record=True) as w:
@@ -118,6 +125,32 @@ class TestUseResultsDb(unittest.TestCase):
     def testshowSummary(self):
         self.resultsDb.getSummaryStats()
 
+    def testProfiles(self):
+        profiler = utils.RunProfiler()
+        with profiler.stage('query', 'night < 10'):
+            pass
+        profiler.addCall('metric', 'testmetric', 2.0, nCalls=10)
+        profiler.addCall('metric', 'testmetric', 1.0, nCalls=5)
+        records = profiler.records()
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['name'], 'testmetric')
+        self.assertEqual(records[0]['nCalls'], 15)
+        self.assertAlmostEqual(records[0]['wallTime'], 3.0)
+        self.assertEqual(len(json.loads(profiler.report(format='json'))), 2)
+        self.assertIn('testmetric', profiler.report())
+        for r in records:
+            r['metricId'] = self.metricId if r['stage'] == 'metric' else None
+        self.resultsDb.updateProfiles(records)
+        # Updating the same stages replaces their rows.
+        self.resultsDb.updateProfiles(records)
+        profiles = self.resultsDb.getProfiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(profiles['metricId'][0], self.metricId)
+        self.assertEqual(profiles['nCalls'][0], 15)
+        self.assertEqual(profiles['metricId'][1], -1)
+        self.assertEqual(profiles['stageName'][1], 'night < 10')
+        self.assertEqual(len(self.resultsDb.getProfiles(self.metricId)), 1)
+
     def tearDown(self):
         self.resultsDb.close()
         shutil.rmtree(self.tempdir)
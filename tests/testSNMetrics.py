@@ -5,9 +5,10 @@ import numpy as np
 import unittest
 #import lsst.sims.maf.metrics as metrics
 import lsst.utils.tests
-from lsst.sims.maf.utils.snUtils import Lims, ReferenceData
+from lsst.sims.maf.utils.snUtils import Lims, ReferenceData, LinearLookup
+from scipy import interpolate
 from lsst.sims.maf.metrics.snCadenceMetric import SNCadenceMetric
-from lsst.sims.maf.metrics.snSNRMetric import SNSNRMetric
+from lsst.sims.maf.metrics.snSNRMetric import SNSNRMetric, segmentedArange
 from lsst.sims.maf.metrics.snSLMetric import SNSLMetric
 import os
 import warnings
@@ -116,6 +117,29 @@ class TestSNmetrics(unittest.TestCase):
             warnings.warn(
                 "skipping SN test because no SIMS_MAF_CONTRIB_DIR set")
 
+    def testLinearLookup(self):
+        """Test the lookup tables used for the SN reference data """
+        rng = np.random.RandomState(42)
+        x = rng.rand(100) * 60. - 20.
+        y = rng.rand(100)
+        lookup = LinearLookup(x, y, fill_value=0.)
+        check = interpolate.interp1d(x, y, bounds_error=False, fill_value=0.)
+        times = rng.rand(20, 30) * 100. - 40.
+        np.testing.assert_allclose(lookup(times), check(times))
+
+    def testSegmentedArange(self):
+        """Test the concatenated aranges used for the SN dates and fake observations """
+        starts = np.array([59948.31957176, 60310.5, 60700.25, 61000.])
+        stops = np.array([60075.96452546, 60311.5, 60700.25, 61100.])
+        steps = np.array([1., 0.3, 2., 3.7])
+        values, counts = segmentedArange(starts, stops, steps, return_counts=True)
+        check = [np.arange(start, stop, step) for start, stop, step in zip(starts, stops, steps)]
+        np.testing.assert_array_equal(counts, [len(c) for c in check])
+        np.testing.assert_array_equal(values, np.concatenate(check))
+        np.testing.assert_array_equal(segmentedArange(starts, stops, 1.),
+                                      np.concatenate([np.arange(start, stop, 1.)
+                                                      for start, stop in zip(starts, stops)]))
+
     def testSNSNRMetric(self):
         """Test the SN SNR metric """
 
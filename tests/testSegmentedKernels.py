@@ -0,0 +1,139 @@
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import unittest
+import lsst.sims.maf.utils as utils
+import lsst.sims.maf.metrics as metrics
+import lsst.utils.tests
+
+
+class TestSegmentedKernels(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.segments = [np.sort(rng.rand(n) * 10.) for n in [0, 1, 2, 7, 30]]
+        self.values = np.concatenate(self.segments)
+        self.offsets = utils.segmentOffsets([len(seg) for seg in self.segments])
+
+    def testOffsets(self):
+        """Test segment offsets and ids."""
+        np.testing.assert_array_equal(self.offsets, [0, 0, 1, 3, 10, 40])
+        ids = utils.segmentIds(self.offsets)
+        np.testing.assert_array_equal(np.bincount(ids), [0, 1, 2, 7, 30])
+
+    def testDiffAndHistogram(self):
+        """Test segmented diff and histogram against the per-segment numpy versions."""
+        diffs, diffOffsets = utils.segmentedDiff(self.values, self.offsets)
+        bins = np.arange(0, 5, 0.5)
+        hist = utils.segmentedHistogram(diffs, diffOffsets, bins)
+        for i, seg in enumerate(self.segments):
+            np.testing.assert_array_equal(diffs[diffOffsets[i]:diffOffsets[i + 1]], np.diff(seg))
+            np.testing.assert_array_equal(hist[i], np.histogram(np.diff(seg), bins)[0])
+        medians = utils.segmentedReduce(diffs, diffOffsets, np.median)
+        for i, seg in enumerate(self.segments):
+            if len(seg) < 2:
+                self.assertTrue(np.isnan(medians[i]))
+            else:
+                self.assertAlmostEqual(medians[i], np.median(np.diff(seg)))
+
+    def testSort(self):
+        """Test sorting within segments."""
+        shuffled = np.concatenate([seg[::-1] for seg in self.segments])
+        np.testing.assert_array_equal(utils.segmentedSort(shuffled, self.offsets), self.values)
+        self.assertIsNone(utils.segmentedArgsort(self.values, self.offsets))
+
+    def testPercentile(self):
+        """Test segmented percentiles against numpy.percentile on each segment."""
+        shuffled = np.concatenate([seg[::-1] for seg in self.segments])
+        for percentile in [0, 10, 50, 75, 100]:
+            values = utils.segmentedPercentile(shuffled, self.offsets, percentile)
+            for i, seg in enumerate(self.segments):
+                if len(seg) == 0:
+                    self.assertTrue(np.isnan(values[i]))
+                else:
+                    self.assertAlmostEqual(values[i], np.percentile(seg, percentile))
+        quartiles = utils.segmentedPercentile(shuffled, self.offsets, [25, 75])
+        self.assertEqual(quartiles.shape, (len(self.segments), 2))
+        np.testing.assert_allclose(quartiles[-1], np.percentile(self.segments[-1], [25, 75]))
+
+    def testRunLengths(self):
+        """Test finding runs of equal values within segments."""
+        keys = np.array([1, 1, 2, 2, 2, 3, 3, 5])
+        offsets = np.array([0, 4, 8])
+        runOffsets, runSegmentOffsets = utils.runLengths(keys, offsets)
+        np.testing.assert_array_equal(runOffsets, [0, 2, 4, 5, 7, 8])
+        np.testing.assert_array_equal(runSegmentOffsets, [0, 2, 5])
+
+    def testWindowCounts(self):
+        """Test counting values within a window, within each segment."""
+        counts = utils.windowCounts(self.values, self.offsets, 0.5, 2.)
+        for i, seg in enumerate(self.segments):
+            expected = np.searchsorted(seg, seg + 2.) - np.searchsorted(seg, seg + 0.5)
+            np.testing.assert_array_equal(counts[self.offsets[i]:self.offsets[i + 1]], expected)
+
+    def testSearchsorted(self):
+        """Test searching within segments, for short (binary search) and long (per segment) segments."""
+        rng = np.random.RandomState(43)
+        for segments in [self.segments, [np.sort(rng.rand(n) * 10.) for n in [300, 0, 100]]]:
+            values = np.concatenate(segments)
+            offsets = utils.segmentOffsets([len(seg) for seg in segments])
+            ids = utils.segmentIds(offsets)
+            queries = values[:, np.newaxis] + np.array([-1., 0., 0.5])
+            for side in ['left', 'right']:
+                found = utils.segmentedSearchsorted(values, offsets, queries, ids, side=side)
+                for i, seg in enumerate(segments):
+                    rows = slice(offsets[i], offsets[i + 1])
+                    np.testing.assert_array_equal(found[rows] - offsets[i],
+                                                  np.searchsorted(seg, queries[rows], side=side))
+
+    def testPairHistogram(self):
+        """Test the histogram of the differences between all pairs within segments."""
+        def pairDiffs(seg):
+            return (seg[np.newaxis, :] - seg[:, np.newaxis])[np.triu_indices(len(seg), 1)]
+        nights = np.floor(self.values)
+        for values, bins in [(self.values, np.arange(0, 5, 0.5)), (nights, np.arange(0, 10, 1))]:
+            diffs, ids = utils.segmentedAllDiffs(values, self.offsets)
+            hist = utils.segmentedPairHistogram(values, self.offsets, bins)
+            for i in range(len(self.segments)):
+                seg = values[self.offsets[i]:self.offsets[i + 1]]
+                np.testing.assert_array_equal(np.sort(diffs[ids == i]), np.sort(pairDiffs(seg)))
+                np.testing.assert_array_equal(hist[i], np.histogram(pairDiffs(seg), bins)[0])
+            # With a long segment, the pairs are counted without forming them.
+            values = np.sort(values)
+            hist = utils.segmentedPairHistogram(values, [0, len(values)], bins)
+            np.testing.assert_array_equal(hist[0], np.histogram(pairDiffs(values), bins)[0])
+
+    def testMetricBatch(self):
+        """Test the batch (runBatch) and single slicePoint (run) metric values agree."""
+        data = np.zeros(len(self.values), dtype=list(zip(['observationStartMJD', 'night'], [float, int])))
+        data['observationStartMJD'] = self.values
+        data['night'] = np.floor(self.values)
+        testMetrics = [metrics.TgapsMetric(bins=np.arange(0, 5, 0.25)), metrics.NightgapsMetric(),
+                       metrics.TgapsMetric(bins=np.arange(0, 5, 0.25), allGaps=True),
+                       metrics.NightgapsMetric(allGaps=True),
+                       metrics.NVisitsPerNightMetric(), metrics.MaxGapMetric(),
+                       metrics.InterNightGapsMetric(), metrics.IntraNightGapsMetric(),
+                       metrics.VisitGapMetric(), metrics.NRevisitsMetric(dT=600.),
+                       metrics.RapidRevisitMetric(minN1=1, minN2=1, dTpairs=0.5, dTmax=1.),
+                       metrics.PairFractionMetric(minGap=10., maxGap=1000.)]
+        for metric in testMetrics:
+            self.assertTrue(metric.hasBatch())
+            batch = metric.runBatch(data, self.offsets)
+            for i in range(len(self.segments)):
+                if self.offsets[i] == self.offsets[i + 1]:
+                    continue
+                single = metric.run(data[self.offsets[i]:self.offsets[i + 1]])
+                np.testing.assert_allclose(batch[i], single, err_msg=metric.name)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -165,6 +165,31 @@ class TestSimpleMetrics(unittest.TestCase):
         result = result
         self.assertGreater(result, 355)
 
+    def testSimpleMetricBatch(self):
+        """Test the batch (runBatch) and single slicePoint (run) values of the simple metrics agree."""
+        rng = np.random.RandomState(42)
+        lengths = [1, 2, 5, 40]
+        data = np.zeros(np.sum(lengths), dtype=[('testdata', 'float')])
+        data['testdata'] = np.round(rng.randn(len(data)) * 3.)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        testMetrics = [metrics.Coaddm5Metric('testdata'), metrics.MaxMetric('testdata'),
+                       metrics.AbsMaxMetric('testdata'), metrics.MeanMetric('testdata'),
+                       metrics.AbsMeanMetric('testdata'), metrics.MedianMetric('testdata'),
+                       metrics.AbsMedianMetric('testdata'), metrics.MinMetric('testdata'),
+                       metrics.FullRangeMetric('testdata'), metrics.RmsMetric('testdata'),
+                       metrics.SumMetric('testdata'), metrics.CountMetric('testdata'),
+                       metrics.CountRatioMetric('testdata', normVal=2.),
+                       metrics.CountSubsetMetric('testdata', subset=0), metrics.RobustRmsMetric('testdata'),
+                       metrics.BinaryMetric('testdata'), metrics.FracAboveMetric('testdata', cutoff=1.),
+                       metrics.FracBelowMetric('testdata', cutoff=1.),
+                       metrics.PercentileMetric('testdata', percentile=20)]
+        for metric in testMetrics:
+            self.assertTrue(metric.hasBatch())
+            batch = metric.runBatch(data, offsets)
+            for i in range(len(lengths)):
+                single = metric.run(data[offsets[i]:offsets[i + 1]])
+                np.testing.assert_allclose(batch[i], single, err_msg=metric.name)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
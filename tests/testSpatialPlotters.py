@@ -0,0 +1,136 @@
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import healpy as hp
+import matplotlib.pyplot as plt
+import unittest
+import lsst.sims.maf.plots as plots
+import lsst.utils.tests
+
+
+class FakeSlicer(object):
+    """The slicePoints of a spatial slicer."""
+    def __init__(self, ra, dec):
+        self.slicePoints = {'ra': ra, 'dec': dec}
+
+
+def renderSkyMap(plotter, metricValues, slicer, plotDict):
+    """Plot a sky map and return the axes limits and aspect, and the RGB image of the figure."""
+    fignum = plotter(metricValues, slicer, plotDict)
+    fig = plt.figure(fignum)
+    ax = fig.axes[0]
+    axesInfo = (ax.get_xlim(), ax.get_ylim(), ax.get_aspect(), ax.get_position().bounds)
+    fig.canvas.draw()
+    image = np.asarray(fig.canvas.buffer_rgba())[:, :, :3].astype(float)
+    plt.close(fig)
+    return axesInfo, image
+
+
+class TestBaseSkyMap(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.npoints = 200
+        self.slicer = FakeSlicer(rng.rand(self.npoints) * 2 * np.pi,
+                                 np.arcsin(rng.rand(self.npoints) * 2 - 1))
+        self.plotDict = {'mwZone': False, 'cbar': False, 'figsize': (6, 4)}
+        self.rng = rng
+
+    def testRaster(self):
+        """Test the rasterized sky map matches the map drawn with patches."""
+        metricValues = np.ma.MaskedArray(self.rng.rand(self.npoints), mask=self.rng.rand(self.npoints) < 0.1)
+        plotter = plots.BaseSkyMap()
+        self.plotDict['raster'] = False
+        patchAxes, patchImage = renderSkyMap(plotter, metricValues, self.slicer, self.plotDict)
+        self.plotDict['raster'] = True
+        rasterAxes, rasterImage = renderSkyMap(plotter, metricValues, self.slicer, self.plotDict)
+        # The image does not change the axes limits, aspect or position.
+        self.assertEqual(rasterAxes, patchAxes)
+        # Only the edges of the ellipses differ.
+        different = np.abs(rasterImage - patchImage).max(axis=2) > 60
+        self.assertLess(different.mean(), 0.01)
+
+    def testRasterColors(self):
+        """Test the rasterized sky map of colors matches the patches, including the highlighted point."""
+        metricValues = np.ma.MaskedArray(np.empty(self.npoints, dtype=object), mask=False)
+        for i in range(self.npoints):
+            metricValues.data[i] = tuple(self.rng.rand(3)) + (0.5,)
+        self.plotDict['metricIsColor'] = True
+        plotter = plots.BaseSkyMap()
+        self.plotDict['raster'] = True
+        _, plainImage = renderSkyMap(plotter, metricValues, self.slicer, self.plotDict)
+        # Highlight one point (alpha > 1): it is drawn opaque, with a black edge.
+        metricValues.data[7] = (1., 1., 1., 2.)
+        self.plotDict['raster'] = False
+        patchAxes, patchImage = renderSkyMap(plotter, metricValues, self.slicer, self.plotDict)
+        self.plotDict['raster'] = True
+        rasterAxes, rasterImage = renderSkyMap(plotter, metricValues, self.slicer, self.plotDict)
+        self.assertEqual(rasterAxes, patchAxes)
+        different = np.abs(rasterImage - patchImage).max(axis=2) > 60
+        self.assertLess(different.mean(), 0.01)
+        black = lambda image: np.sum(image.max(axis=2) < 30)
+        self.assertGreater(black(rasterImage), black(plainImage))
+
+
+class FakeHealpixSlicer(object):
+    """The slicer name and badval of a HealpixSlicer."""
+    slicerName = 'HealpixSlicer'
+    badval = hp.UNSEEN
+
+
+class TestHealpixSkyMap(unittest.TestCase):
+
+    def testProjectionCache(self):
+        """Test the sky map drawn with the cached projection matches hp.mollview."""
+        nside = 4
+        rng = np.random.RandomState(42)
+        metricValues = np.ma.MaskedArray(rng.rand(hp.nside2npix(nside)),
+                                         mask=rng.rand(hp.nside2npix(nside)) < 0.2)
+        for plotDict in [{}, {'rot': (30, 10, 0), 'coord': 'G'}, {'rot': (90, 90, 90), 'flip': 'geo'}]:
+            images = []
+            for useProjectionCache in [True, False]:
+                plotter = plots.HealpixSkyMap()
+                plotter.useProjectionCache = useProjectionCache
+                plotter.healpy_visufunc_params = {'xsize': 200}
+                fignum = plotter(metricValues, FakeHealpixSlicer(), plotDict)
+                image = plt.figure(fignum).axes[0].get_images()[0].get_array()
+                images.append((np.ma.getdata(image), np.ma.getmaskarray(image)))
+                plt.close(fignum)
+            np.testing.assert_array_equal(images[0][1], images[1][1])
+            good = ~images[0][1]
+            np.testing.assert_array_equal(images[0][0][good], images[1][0][good])
+
+    def testLookup(self):
+        """Test the projection lookup matches healpy's projection and depends on rot, coord and nest."""
+        nside = 4
+        npix = hp.nside2npix(nside)
+        lookups = {}
+        for rot, coord, nest in [(None, None, False), ((30, 10, 0), None, False), (None, 'G', False),
+                                 (None, ['C', 'G'], False), (None, None, True)]:
+            lookup = plots.mollweideLookup(nside, rot=rot, coord=coord, xsize=100, nest=nest)
+            # The pixel numbers, as projected by healpy (with -1 outside the projection).
+            check = hp.mollview(np.arange(npix, dtype=float), rot=rot, coord=coord, nest=nest, xsize=100,
+                                return_projected_map=True)
+            plt.close('all')
+            check = np.where(np.ma.getmaskarray(check) | ~np.isfinite(check.data), -1, check.data)
+            # (As the lookups are cached, this also checks each projection has its own cached lookup.)
+            np.testing.assert_array_equal(lookup, check)
+            self.assertIs(plots.mollweideLookup(nside, rot=rot, coord=coord, xsize=100, nest=nest), lookup)
+            lookups[(rot, str(coord), nest)] = lookup
+        # The rotation, coordinate conversion and ordering each change the lookup.
+        base = lookups[(None, 'None', False)]
+        for key in [((30, 10, 0), 'None', False), (None, "['C', 'G']", False), (None, 'None', True)]:
+            self.assertFalse(np.array_equal(lookups[key], base))
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -338,6 +338,27 @@ class TestStackerClasses(unittest.TestCase):
         check_pa = np.degrees(check_pa)
         np.testing.assert_array_almost_equal(data['PA'], check_pa, decimal=0)
 
+    def testSiteCoordinates(self):
+        """Test the SiteCoordinates alt/az calculation against raDec2AltAz."""
+        rng = np.random.RandomState(4251)
+        mjd = 59000 + rng.rand(500) * 100.
+        ra = rng.rand(500) * 2. * np.pi
+        dec = np.arcsin(rng.rand(500) * 2. - 1.)
+        lats = np.radians([-30.2, 19.8])
+        lons = np.radians([-70.7, -155.5])
+        offsets = np.array([0., 0.1, 0.25])
+        coords = stackers.SiteCoordinates(mjd, maxElements=100)
+        alt, az = coords.altAz(ra, dec, lats, lons, offsets)
+        self.assertEqual(alt.shape, (500, 2, 3))
+        for i in range(len(lats)):
+            for j in range(len(offsets)):
+                checkAlt, checkAz = stackers.raDec2AltAz(ra, dec, lats[i], lons[i], mjd + offsets[j])
+                np.testing.assert_allclose(alt[:, i, j], checkAlt, atol=1e-6)
+                dAz = np.angle(np.exp(1j * (az[:, i, j] - checkAz)))
+                np.testing.assert_allclose(dAz, 0, atol=1e-6)
+        # The same dataset should reuse the cached sidereal times.
+        self.assertIs(stackers.SiteCoordinates.fromMjd(mjd), stackers.SiteCoordinates.fromMjd(mjd))
+
     def testFilterColorStacker(self):
         """Test the filter color stacker."""
         data = np.zeros(60, dtype=list(zip(['filter'], ['<U1'])))
@@ -360,6 +381,16 @@ class TestStackerClasses(unittest.TestCase):
         data['filter'] = 'q'
         self.assertRaises(IndexError, stacker.run, data)
 
+    def testFilterCodeStacker(self):
+        """Test the filter code stacker."""
+        data = np.zeros(8, dtype=list(zip(['filter'], ['<U1'])))
+        data['filter'] = ['u', 'g', 'r', 'i', 'z', 'y', 'q', 'r']
+        data = stackers.FilterCodeStacker().run(data)
+        np.testing.assert_array_equal(data['filterCode'], [0, 1, 2, 3, 4, 5, -1, 2])
+        # Filters stored as bytes give the same codes.
+        codes = stackers.FilterCodeStacker.filterCodes(np.array([b'y', b'u']))
+        np.testing.assert_array_equal(codes, [5, 0])
+
     def testGalacticStacker(self):
         """
         Test the galactic coordinate stacker
@@ -437,6 +468,44 @@ class TestStackerClasses(unittest.TestCase):
 
         self.assertGreater(new_data['opsimFieldId'].max(), 0)
 
+    def testCoaddStacker(self):
+        """
+        Test the CoaddStacker against a per-group calculation.
+        """
+        rng = np.random.RandomState(42)
+        names = ['observationStartMJD', 'fieldRA', 'fieldDec', 'fiveSigmaDepth', 'filter', 'night',
+                 'numExposures', 'visitTime', 'visitExposureTime']
+        types = [float, float, float, float, '<U1', int, int, float, float]
+        nvisits = 500
+        data = np.zeros(nvisits, dtype=list(zip(names, types)))
+        fieldRA = rng.rand(4) * 360.
+        fieldDec = rng.rand(4) * -90.
+        fields = rng.randint(0, 4, nvisits)
+        data['fieldRA'] = fieldRA[fields]
+        data['fieldDec'] = fieldDec[fields]
+        data['filter'] = np.array(['g', 'r', 'i'])[rng.randint(0, 3, nvisits)]
+        data['night'] = rng.randint(0, 10, nvisits)
+        data['observationStartMJD'] = 59000 + data['night'] + rng.rand(nvisits) * 0.3
+        data['fiveSigmaDepth'] = 24. + rng.rand(nvisits)
+        data['numExposures'] = 2
+        data['visitTime'] = 34.
+        data['visitExposureTime'] = 30.
+        stacker = stackers.CoaddStacker()
+        coadd = stacker.run(data)
+        groups = np.unique(data[['fieldRA', 'fieldDec', 'filter', 'night']])
+        self.assertEqual(len(coadd), len(groups))
+        np.testing.assert_array_equal(coadd['coadd'], 1)
+        for i, group in enumerate(groups):
+            match = np.where((data['fieldRA'] == group['fieldRA']) & (data['fieldDec'] == group['fieldDec']) &
+                             (data['filter'] == group['filter']) & (data['night'] == group['night']))[0]
+            self.assertEqual(coadd['filter'][i], group['filter'])
+            self.assertEqual(coadd['night'][i], group['night'])
+            self.assertAlmostEqual(coadd['fiveSigmaDepth'][i],
+                                   stacker.m5_coadd(data['fiveSigmaDepth'][match]))
+            self.assertAlmostEqual(coadd['visitExposureTime'][i], data['visitExposureTime'][match].sum())
+            self.assertAlmostEqual(coadd['observationStartMJD'][i],
+                                   np.median(data['observationStartMJD'][match]))
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
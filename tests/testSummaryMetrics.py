@@ -5,6 +5,7 @@ import numpy as np
 import healpy as hp
 import unittest
 import lsst.sims.maf.metrics as metrics
+import lsst.sims.maf.utils as utils
 import lsst.utils.tests
 
 
@@ -100,6 +101,34 @@ class TestSummaryMetrics(unittest.TestCase):
         result = metric.run(data)
         np.testing.assert_equal(result, 0.0)
 
+    def testTotalPowerCache(self):
+        """Test the power spectrum is shared between TotalPowerMetrics with different ell ranges."""
+        nside = 16
+        rng = np.random.RandomState(42)
+        data = np.zeros(hp.nside2npix(nside), dtype=list(zip(['testcol'], ['float'])))
+        data['testcol'] = rng.rand(data.size)
+        data['testcol'][:100] = hp.UNSEEN
+        cl = hp.anafast(hp.remove_dipole(data['testcol'], verbose=False))
+        ell = np.arange(np.size(cl))
+        utils.powerSpectrumCache.clear()
+        for lmin, lmax in [(2, 10), (5, 40), (0, 100)]:
+            metric = metrics.TotalPowerMetric(col='testcol', lmin=lmin, lmax=lmax)
+            condition = (ell >= lmin) & (ell <= lmax)
+            self.assertAlmostEqual(metric.run(data), np.sum(cl[condition] * (2 * ell[condition] + 1)))
+        self.assertEqual(utils.powerSpectrumCache.misses, 1)
+        self.assertEqual(utils.powerSpectrumCache.hits, 2)
+        # Changing the values means the power spectrum must be recalculated.
+        data['testcol'][200] += 1
+        metric.run(data)
+        self.assertEqual(utils.powerSpectrumCache.misses, 2)
+        # Power spectra calculated (in advance) in a pool of processes are the same.
+        maps = [rng.rand(data.size) for i in range(3)]
+        utils.powerSpectrumCache.precompute(maps, nProcesses=2)
+        self.assertEqual(utils.powerSpectrumCache.misses, 5)
+        for m in maps:
+            np.testing.assert_allclose(utils.calcPowerSpectrum(m), hp.anafast(hp.remove_dipole(m, verbose=False)))
+        self.assertEqual(utils.powerSpectrumCache.misses, 5)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -2,6 +2,9 @@ from builtins import zip
 import matplotlib
 matplotlib.use("Agg")
 import numpy as np
+import os
+import shutil
+import tempfile
 import unittest
 import lsst.sims.maf.metrics as metrics
 import lsst.sims.maf.slicers as slicers
@@ -193,6 +196,35 @@ class Test2D(unittest.TestCase):
         result = metric.run(dataSlice)
         assert(np.max(result) >= 0.5-1./365.25)
 
+    def testIncrementalRun(self):
+        """Test that an incremental run, adding a night, matches a run over all of the visits."""
+        outDir = tempfile.mkdtemp(prefix='TMB')
+        try:
+            bundleMetrics = [metrics.AccumulateM5Metric(bins=[0.5, 1.5, 2.5]),
+                             metrics.HistogramMetric(col='fiveSigmaDepth', bins=[0.5, 1.5, 2.5],
+                                                     statistic='mean'),
+                             metrics.HistogramMetric(col='fiveSigmaDepth', bins=[0.5, 1.5, 2.5],
+                                                     statistic='median')]
+            bundles = {}
+            for i, metric in enumerate(bundleMetrics):
+                bundles[i] = metricBundle.MetricBundle(metric, slicers.HealpixSlicer(nside=16), '',
+                                                       runName='inc%d' % i)
+                bundles[i].stackerList = []
+            mbg = metricBundle.MetricBundleGroup(bundles, None, outDir=outDir, saveEarly=False)
+            night1 = self.simData[self.simData['night'] == 1]
+            mbg.runCurrent('', simData=night1, incremental=True)
+            mbg.runCurrent('', simData=self.simData, incremental=True)
+            for i, metric in enumerate(bundleMetrics):
+                mb = metricBundle.MetricBundle(metric, slicers.HealpixSlicer(nside=16), '')
+                mb.stackerList = []
+                mbgAll = metricBundle.MetricBundleGroup({0: mb}, None, saveEarly=False)
+                mbgAll.runCurrent('', simData=self.simData)
+                np.testing.assert_array_equal(bundles[i].metricValues.mask, mb.metricValues.mask)
+                good = ~mb.metricValues.mask
+                np.testing.assert_allclose(bundles[i].metricValues.data[good], mb.metricValues.data[good])
+        finally:
+            shutil.rmtree(outDir)
+
     def testRunRegularToo(self):
         """
         Test that a binned slicer and a regular slicer can run together